@@ -61,7 +61,11 @@ class Base:
             db_type = self.config['db']['type']
             db_name = self.config['db']['name']
 
-            _db = DB(db_type=db_type, db_name=db_name, logger=self.logger)
+            # Other entries of the db section are storage options
+            db_options = {k: v for k, v in self.config['db'].items()
+                          if k not in ('type', 'name')}
+            _db = DB(db_type=db_type, db_name=db_name, logger=self.logger,
+                     **db_options)
 
         self.db = _db
 
@@ -1,8 +1,9 @@
 # Generic
+from datetime import datetime
+from datetime import timezone
 import logging
 import os
 from threading import Event
-from threading import Thread
 
 # Astropy
 import astropy.units as u
@@ -13,6 +14,7 @@ import numpy as np
 # Local
 from Base.Base import Base
 from Imaging import fits as fits_utils
+from Imaging.ProcessingPool import get_shared_processing_pool
 from utils import error
 
 class AbstractCamera(Base):
@@ -38,11 +40,17 @@ class AbstractCamera(Base):
 
 
         self.camera_name = kwargs["camera_name"]
+        self.compress_fits = kwargs.get("compress_fits", False)
         self.filter_type = 'no-filter'
         self._file_extension = 'fits'
         self._serial_number = '0123456789'
 
         self._is_initialized = False
+        self.processing_pool = get_shared_processing_pool()
+
+        # Optional callable (start_time, end_time) -> dict, with unix timestamps,
+        # giving additional headers once an exposure is over (guiding statistics)
+        self.exposure_headers_provider = None
 
 ###############################################################################
 # Properties
@@ -68,6 +76,16 @@ class AbstractCamera(Base):
         """ bool: Has mount been initialized with connection """
         return self._is_initialized
 
+    @property
+    def acquisition_key(self):
+        """ Processing pool key serializing acquisitions of this camera """
+        return f"{self.camera_name}/acquisition"
+
+    @property
+    def processing_key(self):
+        """ Processing pool key serializing post-processing of this camera """
+        return f"{self.camera_name}/processing"
+
 ###############################################################################
 # Methods
 ###############################################################################
@@ -79,12 +97,12 @@ class AbstractCamera(Base):
         self.logger.debug(f"Unparking camera {self.camera_name}")
 
     def take_observation(self, observation, headers=None, filename=None,
-                         *args, **kwargs):
+                         *args, notifier=None, **kwargs):
         """Take an observation
 
         Gathers various header information, sets the file path, and calls
-            `take_exposure`. Also creates a `threading.Event` object and a
-            `threading.Thread` object. The Thread calls `process_exposure`
+            `take_exposure`. Also creates a `threading.Event` object and
+            submits `process_exposure` to the shared processing pool. It runs
             after the exposure had completed and the Event is set once
             `process_exposure` finishes.
 
@@ -96,6 +114,8 @@ class AbstractCamera(Base):
             filename (str, optional): pass a filename for the output FITS file 
                                       to overrride the default file naming
                                       system
+            notifier (utils.EventWaiter, optional): notified once the Event
+                                                    is set
             **kwargs (dict): Optional keyword arguments (`exp_time`)
 
         Returns:
@@ -115,6 +135,10 @@ class AbstractCamera(Base):
         kwargs["gain"] = gain
         kwargs["offset"] = offset
         kwargs["temperature"] = temperature
+        # Let the exposure thread finalize the FITS file in a single pass, see finalize_exposure
+        kwargs["fits_info"] = metadata
+        kwargs["make_thumbnail"] = True
+        kwargs["compress"] = self.compress_fits and not is_pointing
         exposure_event = self.take_exposure(
             exposure_time=exp_time,
             filename=file_path,
@@ -127,10 +151,11 @@ class AbstractCamera(Base):
             observation.pointing_list[image_id] = file_path
 
         # Process the exposure once readout is complete
-        t = Thread(target=self.process_exposure, args=(metadata,
-                   observation_event, exposure_event))
-        t.name = f"{self.camera_name}Thread"
-        t.start()
+        future = self.processing_pool.submit(self.processing_key, self.process_exposure,
+                                             metadata, observation_event, exposure_event,
+                                             observation=observation)
+        if notifier is not None:
+            future.add_done_callback(notifier.notify)
 
         return observation_event
 
@@ -224,6 +249,8 @@ class AbstractCamera(Base):
             filename=filename,
             *args, **kwargs)
  
+        kwargs["fits_info"] = metadata
+        kwargs["compress"] = self.compress_fits
         exposure_event = self.take_calibration_exposure(
             filename=file_path,
             temperature=temperature,
@@ -237,10 +264,8 @@ class AbstractCamera(Base):
             *args, **kwargs)
 
         # Process the exposure once readout is complete
-        t = Thread(target=self.process_calibration,
-                   args=(metadata, calib_event, exposure_event))
-        t.name = f"{self.camera_name}_Thread"
-        t.start()
+        self.processing_pool.submit(self.processing_key, self.process_calibration,
+                                    metadata, calib_event, exposure_event)
 
         return calib_event
 
@@ -376,7 +401,35 @@ class AbstractCamera(Base):
         """ Must be implemented"""
         return np.NaN
 
-    def process_exposure(self, info, observation_event, exposure_event=None):
+    def finalize_exposure(self, image, file_path, fits_info=None, make_thumbnail=False, compress=False, **kwargs):
+        """
+        Write the in-memory image received from the camera, in a single pass: headers
+        from fits_info are merged, the file is written once with an atomic rename,
+        the thumbnail is generated from the same array and the file is fpacked if requested.
+
+        When fits_info is given, it is marked as finalized, and its file_path updated,
+        so that process_exposure/process_calibration do not reopen the file.
+
+        Returns:
+            str: path of the written file
+        """
+        latest_path = f"{self._image_dir}/latest.jpg" if make_thumbnail else None
+        if fits_info is not None:
+            self._add_exposure_headers(fits_info)
+        with self.processing_pool.timed_stage(self.acquisition_key, "write"):
+            file_path = fits_utils.finalize_fits(
+                image,
+                file_path,
+                info=fits_info,
+                latest_path=latest_path,
+                compress=compress,
+                logger=self.logger)
+        if fits_info is not None:
+            fits_info['file_path'] = file_path
+            fits_info['fits_finalized'] = True
+        return file_path
+
+    def process_exposure(self, info, observation_event, exposure_event=None, observation=None):
         """
         Processes the exposure.
 
@@ -392,11 +445,14 @@ class AbstractCamera(Base):
                 signifying that the camera is done with this exposure
             exposure_event (threading.Event, optional): An event that should be
                 set when the exposure is complete, triggering the processing.
+            observation (Observation, optional): observation whose exposure list
+                is updated if the file has been renamed upon compression
         """
         # If passed an Event that signals the end of the exposure wait for it
         # to be set
         if exposure_event is not None:
-            exposure_event.wait()
+            with self.processing_pool.timed_stage(self.processing_key, "exposure"):
+                exposure_event.wait()
 
         image_id = info['image_id']
         observation_id = info['observation_id']
@@ -404,36 +460,43 @@ class AbstractCamera(Base):
         title = info['target_name']
         self.logger.debug(f"Processing {image_id}")
 
-        try:
-            latest_path = f"{self._image_dir}/latest.jpg"
-            fits_utils.update_thumbnail(file_path, latest_path)
-        except Exception as e:
-            self.logger.warning(f"Problem with extracting pretty image: {e}")
-
-        file_path = self._process_fits(file_path, info)
+        if info.pop('fits_finalized', False):
+            # headers and thumbnail have already been handled in finalize_exposure
+            if observation is not None and image_id in observation.exposure_list:
+                observation.exposure_list[image_id] = file_path
+        else:
+            try:
+                latest_path = f"{self._image_dir}/latest.jpg"
+                fits_utils.update_thumbnail(file_path, latest_path)
+            except Exception as e:
+                self.logger.warning(f"Problem with extracting pretty image: {e}")
+
+            self._add_exposure_headers(info)
+            file_path = self._process_fits(file_path, info)
         try:
             info['exp_time'] = info['exp_time'].to(u.second).value
         except Exception as e:
             self.logger.error(f"Problem getting exp_time information: {e}")
 
-        # if info['is_acquisition']:
-        #     self.logger.debug(f"Adding current observation to db: {image_id}")
-        #     try:
-        self.db.insert_current('observations', info, store_permanently=False)
-        #     except Exception as e:
-        #         self.logger.error(f"Problem adding observation to db: {e}")
-        #else:
-            #self.logger.debug(f"Compressing {file_path}")
-            #fits_utils.fpack(file_path)
-            #TODO TN I don't understand the rationale here.
-            #It generates an error when tryin to read pointing image
-
-        self.logger.debug(f"Adding image metadata to db: {image_id}")
-        self.db.insert('observations', {
-            'data': info,
-            'date': self.serv_time.get_utc(),
-            'observation_id': observation_id,
-        })
+        with self.processing_pool.timed_stage(self.processing_key, "db_insert"):
+            # if info['is_acquisition']:
+            #     self.logger.debug(f"Adding current observation to db: {image_id}")
+            #     try:
+            self.db.insert_current('observations', info, store_permanently=False)
+            #     except Exception as e:
+            #         self.logger.error(f"Problem adding observation to db: {e}")
+            #else:
+                #self.logger.debug(f"Compressing {file_path}")
+                #fits_utils.fpack(file_path)
+                #TODO TN I don't understand the rationale here.
+                #It generates an error when tryin to read pointing image
+
+            self.logger.debug(f"Adding image metadata to db: {image_id}")
+            self.db.insert('observations', {
+                'data': info,
+                'date': self.serv_time.get_utc(),
+                'observation_id': observation_id,
+            })
 
         # Mark the event as done
         observation_event.set()
@@ -457,7 +520,8 @@ class AbstractCamera(Base):
         del info['observation_ids']
         info['exp_time'] = info['exp_time']
         self.logger.debug(f"Processing {image_id}")
-        file_path = self._process_fits(file_path, info)
+        if not info.pop('fits_finalized', False):
+            file_path = self._process_fits(file_path, info)
 
         # if info['is_acquisition']:
         #     self.logger.debug(f"Adding current calibration to db: {image_id}")
@@ -486,10 +550,27 @@ class AbstractCamera(Base):
         # Mark the event as done
         observation_event.set()
 
+    def _add_exposure_headers(self, info):
+        """
+        Merge headers from exposure_headers_provider for the time span of the exposure
+        """
+        if self.exposure_headers_provider is None:
+            return
+        try:
+            start_time = datetime.strptime(info['start_time'], "%Y%m%dT%H%M%S")
+            start_time = start_time.replace(tzinfo=timezone.utc).timestamp()
+            exp_time = info['exp_time']
+            if isinstance(exp_time, u.Quantity):
+                exp_time = exp_time.to_value(u.second)
+            info.update(self.exposure_headers_provider(start_time, start_time + exp_time))
+        except Exception as e:
+            self.logger.warning(f"Problem getting exposure headers: {e}")
+
     def _process_fits(self, file_path, info):
         """
         Add FITS headers from info the same as images.cr2_to_fits()
         """
         self.logger.debug(f"Updating FITS headers: {file_path}")
-        fits_utils.update_headers(file_path, info)
+        with self.processing_pool.timed_stage(self.processing_key, "headers"):
+            fits_utils.update_headers(file_path, info)
         return file_path
\ No newline at end of file
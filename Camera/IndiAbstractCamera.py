@@ -51,36 +51,46 @@ class IndiAbstractCamera(IndiCamera, AbstractCamera):
         # If there is no external trigger, then we proceed to handle setup on our side
         external_trigger = kwargs.get("external_trigger", False)
         if not external_trigger:
-            # set frame type
-            frame_type = kwargs.get("frame_type", "FRAME_LIGHT")
-            self.set_frame_type(frame_type)
-            # set gain
-            gain = kwargs.get("gain", self.gain)
-            self.set_gain(gain)
-            # set offset
-            offset = kwargs.get("offset", self.offset)
-            self.set_offset(offset)
-            # set temperature
-            temperature = kwargs.get("temperature", None)
-            if temperature is not None:
-                self.set_cooling_on()
-                self.set_temperature(temperature)
+            # Settings that did not change since last frame are not sent again, and all
+            # acknowledgements are awaited together, see IndiDevice.batched_settings
+            with self.batched_settings():
+                # set frame type
+                frame_type = kwargs.get("frame_type", "FRAME_LIGHT")
+                self.set_frame_type(frame_type)
+                # set gain
+                gain = kwargs.get("gain", self.gain)
+                self.set_gain(gain)
+                # set offset
+                offset = kwargs.get("offset", self.offset)
+                self.set_offset(offset)
+                # set temperature
+                temperature = kwargs.get("temperature", None)
+                if temperature is not None:
+                    self.set_cooling_on()
+                    self.set_temperature(temperature)
             self.enable_blob()
             # Now shoot
             self.setExpTimeSec(exp_time_sec)
             self.logger.debug(f"Camera {self.camera_name}, about to shoot for {self.exp_time_sec}")
             self.shoot_async()
         # Wether trigger was internal or external, we rely on the last received blob
-        self.synchronize_with_image_reception()
+        with self.processing_pool.timed_stage(self.acquisition_key, "readout"):
+            self.synchronize_with_image_reception()
         self.logger.debug(f"Camera {self.camera_name}, done with image reception, external trigger {external_trigger}")
-        image = self.get_received_image()
         try:
-            with open(filename, "wb") as f:
-                image.writeto(f, overwrite=True)
+            with self.received_image() as image:
+                self.finalize_exposure(image, filename, **kwargs)
         except Exception as e:
             self.logger.error(f"Error while writing file {filename} : {e}")
         exposure_event.set()
 
+    def _shoot_task(self, exp_time_sec, filename, exposure_event, *args, **kwargs):
+        """ Processing pool task, makes sure that processing waiting for exposure_event is never stuck """
+        try:
+            self.shoot_asyncWithEvent(exp_time_sec, filename, exposure_event, *args, **kwargs)
+        finally:
+            exposure_event.set()
+
     def initialize_working_conditions(self):
         self.logger.debug(f"Camera {self.camera_name} initializing to be in working conditions")
         if self.working_temperature is not None:
@@ -99,13 +109,12 @@ class IndiAbstractCamera(IndiCamera, AbstractCamera):
         Should return an event
         """
         exposure_event = threading.Event()
-        w = threading.Thread(target=self.shoot_asyncWithEvent,
-                             args=(exposure_time.to(u.second).value,
-                                   filename,
-                                   exposure_event,
-                                   *args),
-                             kwargs=kwargs)
-        w.start()
+        self.processing_pool.submit(self.acquisition_key, self._shoot_task,
+                                    exposure_time.to(u.second).value,
+                                    filename,
+                                    exposure_event,
+                                    *args,
+                                    **kwargs)
         return exposure_event
 
     def autofocus(self, *args, **kwargs):
@@ -1,4 +1,5 @@
 # Basic stuff
+from contextlib import contextmanager
 import io
 import json
 import logging
@@ -175,17 +176,37 @@ class IndiCamera(IndiDevice):
             raise ImageAcquisitionError(f"Indi Camera Error in synchronize_with_image_reception: {e}")
 
     def get_received_image(self):
+        """
+        Returns the last received image as an HDUList whose data is a view on the
+        blob buffer. The buffer is never recycled, see received_image for that
+        """
         try:
             self.logger.debug(f"Indicamera {self.device_name} about to read blob")
             blob = self.get_last_incoming_blob_vector()
-            #image = fits.open(self.blob_queue.popleft()) # FIFO in "circular buffer" mode
             image = blob.get_fits()
-            #blob = await self.blob_queue.get() # FIFO in "circular buffer" mode
-            #image = fits.open(blob)
             return image
         except Exception as e:
             self.logger.error(f"Indi Camera Error in get_received_image: {e}")
 
+    @contextmanager
+    def received_image(self):
+        """
+        Same as get_received_image, but the blob buffer is given back to the indi
+        client ring buffer for reuse when leaving the context, so the image must
+        not be used afterwards
+        """
+        self.logger.debug(f"Indicamera {self.device_name} about to read blob")
+        blob = self.get_last_incoming_blob_vector()
+        image = blob.get_fits()
+        try:
+            yield image
+        finally:
+            # Drop our views on the blob buffer, so that it can be recycled
+            for hdu in image:
+                hdu.data = None
+            image.close()
+            blob.release()
+
     def shoot_async(self):
         try:
             # with self.indi_client.listener(self.device_name) as blob_listener:
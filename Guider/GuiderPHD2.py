@@ -1,9 +1,14 @@
 #Standard stuff
+import collections
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 import json
+import queue
 import time
-from transitions import Machine
+from transitions.extensions import LockedMachine
 import socket
 import subprocess
+import threading
 
 # Numerical tools
 import numpy as np
@@ -13,6 +18,7 @@ import astropy.units as u
 
 #local libs
 from Base.Base import Base
+from Guider.GuidingTelemetry import GuidingTelemetry
 from utils import Timeout
 from utils import error
 from utils.error import GuidingError
@@ -25,6 +31,9 @@ MAXIMUM_DITHER_TIMEOUT      = 45 * u.second
 MAXIMUM_PAUSING_TIMEOUT     = 30 * u.second
 STANDARD_TIMEOUT            = 120 * u.second
 SOCKET_TIMEOUT              = 120.0 #when launching set_connected sometimes response can take a lot of time
+RECV_CHUNK_SIZE             = 65536
+EVENT_HISTORY_SIZE          = 1000 # events kept for clients waiting on an event
+SUBSCRIBER_QUEUE_SIZE       = 1000 # events queued per subscriber before dropping the oldest
 
 class GuiderPHD2(Base):
     """
@@ -98,7 +107,7 @@ class GuiderPHD2(Base):
         self.process = None
         self.session = None
         self.sock = None
-        self.recv_buffer = ''
+        self.recv_buffer = bytearray()
         self.id = 1                                # message id
         self.do_calibration = config["do_calibration"]
         self.profile_id = None                     # yet to be defined
@@ -107,14 +116,38 @@ class GuiderPHD2(Base):
         self.settle = config["settle"]
         self.exposure_time_sec = config['exposure_time_sec']
 
+        # History of guide steps, for guiding quality statistics
+        self.telemetry = GuidingTelemetry(capacity=config.get("telemetry_size", 4096))
+
         # we broadcast data through a message queue style mecanism
         self.messaging = None
 
-        # Initialize the state machine
-        self.machine = Machine(model=self,
-                               states=GuiderPHD2.states,
-                               transitions=GuiderPHD2.transitions,
-                               initial=GuiderPHD2.states[0])
+        # Set each time the guider state changes, clients that need to react
+        # on guiding health can also be notified (see add_state_change_waiter)
+        self.state_change_event = threading.Event()
+        self._state_change_waiters = []
+        self._notified_state = None
+
+        # A background thread reads the socket: rpc responses are routed to
+        # the future of the corresponding request id, events are handled,
+        # kept in a short history for waiting clients, and published to
+        # subscribers. Everything below is protected by _event_condition
+        self._reader_thread = None
+        self._closing = False
+        self._event_condition = threading.Condition()
+        self._event_history = collections.deque(maxlen=EVENT_HISTORY_SIZE)
+        self._event_seq = 0
+        self._request_seq = 0
+        self._pending_requests = {}
+        self._subscribers = []
+
+        # Initialize the state machine, transitions are triggered from both
+        # client threads and the reader thread
+        self.machine = LockedMachine(model=self,
+                                     states=GuiderPHD2.states,
+                                     transitions=GuiderPHD2.transitions,
+                                     initial=GuiderPHD2.states[0],
+                                     after_state_change='_notify_state_change')
 
     # def __del__(self):
     #     self.terminate_server()
@@ -142,6 +175,9 @@ class GuiderPHD2(Base):
             # Connect to server and send data
             #self.session = requests.sessions.Session()
             self.sock.connect((self.host, self.port))
+            # The reader thread blocks on the socket until disconnection
+            self.sock.settimeout(None)
+            self._start_reader()
             self._receive({"Event": "AppState"}) # get state
         except Exception as e:
             msg = f"PHD2 error connecting: {e}"
@@ -193,14 +229,13 @@ class GuiderPHD2(Base):
         self.logger.info(f"Closing connection to server PHD2 {self.host}:{self.port}")
         if self.state != 'NotConnected':
             self.stop_capture()
-        if self.sock is not None:
-            self.sock.close()
+        self._stop_reader()
         self.disconnection_trig()
 
     def terminate_server(self):
         if self.state != 'NotConnected':
             self.shutdown()
-            self.sock.close()
+        self._stop_reader()
         self.disconnection_trig()
 
         if self.is_local_instance():
@@ -233,8 +268,43 @@ class GuiderPHD2(Base):
                  config=self.config["messaging_publisher"])
         self.messaging.send_message(channel, {"data": data})
 
-    def receive(self):
-        return self._receive()
+    def receive(self, timeout=STANDARD_TIMEOUT):
+        """ Wait for the next event sent by PHD2 and returns it
+
+            Events are read by a background thread, so this blocks until an
+            event is received after the call, up to timeout (120s by default),
+            then raises error.Timeout. Clients that must not block should
+            subscribe instead
+        """
+        with self._event_condition:
+            since = self._event_seq
+        return self._wait_event(since=since, timeout=timeout)
+
+    def subscribe(self, events=None, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        """
+            Returns a bounded queue.Queue, that will receive the PHD2 events
+            whose name is in events (all of them if None). When the queue is
+            full, the oldest event is dropped.
+        """
+        subscriber_queue = queue.Queue(maxsize=maxsize)
+        with self._event_condition:
+            self._subscribers.append((subscriber_queue, events))
+        return subscriber_queue
+
+    def unsubscribe(self, subscriber_queue):
+        with self._event_condition:
+            self._subscribers = [(q, events) for q, events in self._subscribers
+                                 if q is not subscriber_queue]
+
+    def add_state_change_waiter(self, waiter):
+        """ waiter (utils.EventWaiter) is notified each time the guider state changes """
+        with self._event_condition:
+            self._state_change_waiters.append(waiter)
+
+    def remove_state_change_waiter(self, waiter):
+        with self._event_condition:
+            self._state_change_waiters = [w for w in self._state_change_waiters
+                                          if w is not waiter]
 
     def wait_for_state(self, one_of_states, timeout=STANDARD_TIMEOUT):
         assert isinstance(one_of_states, list)
@@ -244,14 +314,13 @@ class GuiderPHD2(Base):
         self.wait_for_predicate(predicate=predicate, error_msg=error_msg, timeout=timeout)
 
     def wait_for_predicate(self, predicate, error_msg=None, timeout=STANDARD_TIMEOUT):
+        """ Wait for predicate to be true, it is checked after each event """
         tout = Timeout(timeout)
-        while not predicate():
-            try:
-                self._receive(loop_mode=True)
-            except error.Timeout as e:
-                pass
-            if tout.expired():
-                raise error.Timeout(f"Timeout while waiting for predicate: {error_msg}")
+        with self._event_condition:
+            while not predicate():
+                if tout.expired():
+                    raise error.Timeout(f"Timeout while waiting for predicate: {error_msg}")
+                self._event_condition.wait(tout.time_left())
 
 
     def set_settle(self, pixels, time, timeout):
@@ -869,87 +938,198 @@ class GuiderPHD2(Base):
 
     #### Some specific handle code for decoding messages ####
 
+    def _notify_state_change(self, *args, **kwargs):
+        # GuideStep self transitions are not state changes
+        if self.state != self._notified_state:
+            self._notified_state = self.state
+            self.state_change_event.set()
+            with self._event_condition:
+                waiters = list(self._state_change_waiters)
+            for waiter in waiters:
+                waiter.notify()
+
     def _receive(self, expected=None, loop_mode=False, timeout=STANDARD_TIMEOUT):
-        timeout = Timeout(timeout)
-        ret = None
-        while not ret:
-            ret = self._receive_from_socket(expected=expected, loop_mode=loop_mode)
-            if not ret:
-                self.logger.warning(f"Received {ret}, still waiting for "
-                                    f"expected {expected} while loop mode is "
-                                    f"{loop_mode}")
-            if timeout.expired():
-                raise error.Timeout(f"Timeout while waiting for reception of "
-                                    f"response from GuiderPHD2")
-        return ret
-
-    def _receive_from_socket(self, expected=None, loop_mode=False):
-        """
-
-        :param expected: dictionary of expected keys/values. Those keys/values
-                         are tested against each message
-        :param loop_mode: wether an answer is expected soon (might timeout if
-                          there is a problem) of if it should hand undefinitely
-        :return: the first message that complies with expected dictionary
-        """
-        # Receive data from the server
-        stop_receive = False
-        while not stop_receive:
-            try:
-                self.recv_buffer += self.sock.recv(1024).decode()
-            except socket.timeout:
-                if loop_mode:
-                    return
-                else:
-                    msg = f"PHD2 Timeout: No response from server"
-                    self.logger.error(msg)
-                    self.ConnectionLost()
-                    raise GuidingError(msg)
-            except Exception as e:
-                msg = f"PHD2 error {e}"
-                self.logger.error(msg)
-                raise GuidingError(msg)
-            # Check if we receive termination symbol
-            msgs = self.recv_buffer.split('\r\n')
-            if len(msgs) <= 1:
-                # no termination symbol has been received yet, continue
-                self.recv_buffer = msgs[0]
-            else:
-                # termination symbol has been received, now can proceed
-                stop_receive = True
-        # eventually store beginning of next message in the current buffer
-        # this is '' if only a single message has been received
-        self.recv_buffer = msgs[-1]
-        event = ""
-        expected_event = ""
-        expected_status = False
-        for msg in msgs[:-1]:
-            try:
-                event = json.loads(msg)
-                self.logger.debug(f"Received event: {event}")
-                valid_status = self._check_event(event, expected)
-                expected_status = (expected_status or valid_status)
-                self._handle_event(event)
-                if valid_status:
-                    expected_event = event
-            except Exception as e:
-                msg = f"PHD2 error on message {msg}:{e}"
-                self.logger.error(msg)
-                raise GuidingError(msg)
-        return expected_event
+        """
+        :param expected: {"id": request_id} to get the response to a request,
+                         otherwise dictionary of expected keys/values, or
+                         predicate, tested against each event received after
+                         the last request was sent
+        :param loop_mode: unused, kept for backward compatibility
+        :return: the response, or the first event that complies with expected
+        """
+        if isinstance(expected, dict) and list(expected.keys()) == ["id"]:
+            return self._wait_response(expected["id"], timeout=timeout)
+        return self._wait_event(expected, since=self._request_seq, timeout=timeout)
+
+    def _wait_response(self, request_id, timeout=STANDARD_TIMEOUT):
+        with self._event_condition:
+            future = self._pending_requests.get(request_id)
+        if future is None:
+            raise GuidingError(f"PHD2 no pending request with id {request_id}")
+        try:
+            return future.result(timeout=Timeout(timeout).duration)
+        except FutureTimeoutError:
+            msg = f"PHD2 Timeout: No response from server to request {request_id}"
+            self.logger.error(msg)
+            raise GuidingError(msg)
+        finally:
+            with self._event_condition:
+                self._pending_requests.pop(request_id, None)
+
+    def _wait_event(self, expected=None, since=0, timeout=STANDARD_TIMEOUT):
+        """ Wait for the first event with sequence number above since, that
+            complies with expected. Errors raised while handling events are
+            forwarded to the waiting client
+        """
+        tout = Timeout(timeout)
+        with self._event_condition:
+            while True:
+                new_events = []
+                for seq, event, error_msg in reversed(self._event_history):
+                    if seq <= since:
+                        break
+                    new_events.append((seq, event, error_msg))
+                for seq, event, error_msg in reversed(new_events):
+                    since = seq
+                    if error_msg is not None:
+                        raise GuidingError(error_msg)
+                    if self._check_event(event, expected):
+                        return event
+                if not self._is_reader_alive():
+                    raise GuidingError("PHD2 connection is closed")
+                if tout.expired():
+                    raise error.Timeout(f"Timeout while waiting for reception of "
+                                        f"response from GuiderPHD2")
+                self._event_condition.wait(tout.time_left())
 
     def _send_request(self, req):
         base = dict(jsonrpc="2.0")
         base.update(req)
         json_txt = json.dumps(base)+'\r\n'
         self.logger.debug(f"sending msg {json_txt[:-2]}")
+        with self._event_condition:
+            self._pending_requests[req["id"]] = Future()
+            # Events triggered by this request will come after this point
+            self._request_seq = self._event_seq
         try:
             self.sock.sendall(json_txt.encode())
         except Exception as e:
+            with self._event_condition:
+                self._pending_requests.pop(req["id"], None)
             msg = f"PHD2 error sending request: {e}"
             self.logger.error(msg)
             raise GuidingError(msg)
 
+    def _start_reader(self):
+        self.recv_buffer = bytearray()
+        self._closing = False
+        # Events of a previous connection are not relevant anymore
+        with self._event_condition:
+            self._event_history.clear()
+            self._event_seq = 0
+            self._request_seq = 0
+        self._reader_thread = threading.Thread(target=self._reader_loop,
+                                               name="GuiderPHD2Reader",
+                                               daemon=True)
+        self._reader_thread.start()
+
+    def _stop_reader(self):
+        self._closing = True
+        if self.sock is not None:
+            try:
+                # Wakes up the reader thread blocked in recv
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        if (self._reader_thread is not None and
+                self._reader_thread is not threading.current_thread()):
+            self._reader_thread.join()
+        self._reader_thread = None
+
+    def _is_reader_alive(self):
+        return self._reader_thread is not None and self._reader_thread.is_alive()
+
+    def _reader_loop(self):
+        # Only newly received bytes are scanned for the termination symbol
+        scan_from = 0
+        while True:
+            try:
+                chunk = self.sock.recv(RECV_CHUNK_SIZE)
+            except Exception as e:
+                self.logger.error(f"PHD2 error {e}")
+                break
+            if not chunk:
+                break
+            self.recv_buffer += chunk
+            line_start = 0
+            while True:
+                line_end = self.recv_buffer.find(b'\r\n', scan_from)
+                if line_end < 0:
+                    break
+                self._dispatch_message(self.recv_buffer[line_start:line_end])
+                line_start = scan_from = line_end + 2
+            # eventually keep beginning of next message in the buffer
+            del self.recv_buffer[:line_start]
+            scan_from = max(0, len(self.recv_buffer) - 1)
+        self._on_connection_closed()
+
+    def _on_connection_closed(self):
+        if not self._closing and self.state != 'NotConnected':
+            self.logger.warning(f"Connection to PHD2 server {self.host}:{self.port} closed")
+            self.ConnectionLost()
+        with self._event_condition:
+            pending_requests, self._pending_requests = self._pending_requests, {}
+            self._event_condition.notify_all()
+        for request_id, future in pending_requests.items():
+            future.set_exception(GuidingError(f"PHD2 connection closed before response to "
+                                              f"request {request_id}"))
+
+    def _dispatch_message(self, line):
+        try:
+            message = json.loads(line)
+        except ValueError as e:
+            self.logger.error(f"PHD2 error on message {line}:{e}")
+            return
+        self.logger.debug(f"Received event: {message}")
+        if "Event" not in message and "id" in message:
+            self._resolve_request(message)
+        else:
+            self._publish_event(message)
+
+    def _resolve_request(self, response):
+        if "error" in response:
+            self.logger.error(f"Received error msg: {response['error']}")
+        with self._event_condition:
+            future = self._pending_requests.get(response["id"])
+        if future is None or future.done():
+            self.logger.warning(f"PHD2 response to unknown request: {response}")
+        else:
+            future.set_result(response)
+
+    def _publish_event(self, event):
+        error_msg = None
+        try:
+            self._handle_event(event)
+        except Exception as e:
+            error_msg = f"PHD2 error on message {event}:{e}"
+            self.logger.error(error_msg)
+        with self._event_condition:
+            self._event_seq += 1
+            self._event_history.append((self._event_seq, event, error_msg))
+            for subscriber_queue, events in self._subscribers:
+                if events is not None and event.get("Event") not in events:
+                    continue
+                try:
+                    subscriber_queue.put_nowait(event)
+                except queue.Full:
+                    try:
+                        subscriber_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                    subscriber_queue.put_nowait(event)
+            self._event_condition.notify_all()
+
     def _check_event(self, event, expected=None):
         status = False
         # No check is expected
@@ -1287,6 +1467,7 @@ class GuiderPHD2(Base):
         self.logger.debug(f"Guiding frame {event['Frame']}, for mount "
             f"{event['Mount']} received. dx: {event['dx']}, dy: {event['dy']}, "
             f"StarMass: {event['StarMass']}, SNR: {event['SNR']}")
+        self.telemetry.append(event)
         self.GuideStep()
         self.send_message(self.status(), channel='GUIDING_STATUS')
         self.send_message(event, channel='GUIDING')
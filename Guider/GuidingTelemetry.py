@@ -0,0 +1,146 @@
+# Generic stuff
+import threading
+
+# Numerical stuff
+import numpy as np
+
+GUIDE_STEP_DTYPE = np.dtype([
+    ('timestamp', np.float64),
+    ('frame', np.int64),
+    ('ra_raw', np.float64),
+    ('dec_raw', np.float64),
+    ('star_mass', np.float64),
+    ('snr', np.float64)])
+
+# Running sums kept for each step, so that any window statistic is a difference
+_SUMS = ('ra2', 'dec2', 't', 't2', 'mass', 't_mass', 'snr')
+
+
+class GuidingTelemetry:
+    """
+    Fixed size ring buffer of PHD2 GuideStep events
+
+    Steps are stored in a NumPy structured array, along with running sums of
+    the squared errors, star mass and SNR. RMS errors, mean SNR and star mass
+    drift over any time span are then obtained in O(1) from two rows of the
+    running sums, and the span bounds are found by bisection. Only
+    percentiles need the samples of the window.
+
+    Distances are raw guide offsets in guider pixels.
+    """
+
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self._steps = np.zeros(capacity, dtype=GUIDE_STEP_DTYPE)
+        self._cumulative = np.zeros((capacity, len(_SUMS)), dtype=np.float64)
+        self._totals = np.zeros(len(_SUMS), dtype=np.float64)
+        # Times are offset by the first timestamp, to preserve precision
+        self._t0 = None
+        # Number of steps ever appended, the ring holds the last capacity ones
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, event):
+        """ Add a PHD2 GuideStep event """
+        timestamp = event['Timestamp']
+        ra = event.get('RADistanceRaw', 0.)
+        dec = event.get('DECDistanceRaw', 0.)
+        mass = event.get('StarMass', 0.)
+        snr = event.get('SNR', 0.)
+        with self._lock:
+            if self._t0 is None:
+                self._t0 = timestamp
+            t = timestamp - self._t0
+            index = self._count % self.capacity
+            self._steps[index] = (timestamp, event.get('Frame', -1), ra, dec, mass, snr)
+            self._totals += (ra**2, dec**2, t, t**2, mass, t*mass, snr)
+            self._cumulative[index] = self._totals
+            self._count += 1
+
+    def clear(self):
+        with self._lock:
+            self._count = 0
+            self._t0 = None
+            self._totals[:] = 0
+
+    def get_rolling_stats(self, window_sec=60):
+        """ Statistics of the steps received within the last window_sec """
+        with self._lock:
+            if self._count == 0:
+                return self._empty_stats()
+            last = self._steps[(self._count - 1) % self.capacity]['timestamp']
+        return self.get_stats(last - window_sec, last)
+
+    def get_stats(self, start_time, end_time, percentile=90):
+        """ Statistics of the steps with start_time <= timestamp <= end_time
+
+        Args:
+            start_time, end_time (float): unix timestamps, in seconds
+            percentile (float): percentile of the total error to report
+
+        Returns:
+            dict: nb_steps, rms_ra, rms_dec, rms_total, peak, percentile
+                  of the total error (pixels), snr mean value, star_mass mean
+                  value and star_mass_drift (relative change per hour)
+        """
+        with self._lock:
+            first, last = self._find_span(start_time, end_time)
+            if last < first:
+                return self._empty_stats()
+            n = last - first + 1
+            sums = self._cumulative[last % self.capacity].copy()
+            if first > 0:
+                sums -= self._cumulative[(first - 1) % self.capacity]
+            indices = np.arange(first, last + 1) % self.capacity
+            errors = np.hypot(self._steps['ra_raw'][indices], self._steps['dec_raw'][indices])
+
+        ra2, dec2, t, t2, mass, t_mass, snr = sums / n
+        mass_mean = mass
+        # least square slope of star mass against time
+        t_var = t2 - t**2
+        drift = 0.
+        if n > 2 and t_var > 0 and mass_mean > 0:
+            drift = (t_mass - t*mass) / t_var * 3600 / mass_mean
+        return dict(
+            nb_steps=int(n),
+            rms_ra=float(np.sqrt(ra2)),
+            rms_dec=float(np.sqrt(dec2)),
+            rms_total=float(np.sqrt(ra2 + dec2)),
+            peak=float(errors.max()),
+            percentile=float(np.percentile(errors, percentile)),
+            snr=float(snr),
+            star_mass=float(mass_mean),
+            star_mass_drift=float(drift))
+
+    def _find_span(self, start_time, end_time):
+        """ Logical indices of the first and last step within the time span """
+        oldest = max(0, self._count - self.capacity)
+        first = self._bisect(oldest, self._count, start_time, right=False)
+        last = self._bisect(oldest, self._count, end_time, right=True) - 1
+        # The running sums before the oldest step have been overwritten
+        if first == oldest and oldest > 0:
+            first = oldest + 1
+        return first, last
+
+    def _bisect(self, low, high, value, right):
+        """ Same as bisect.bisect_left/right on the timestamps of logical
+            indices [low, high[ of the ring
+        """
+        timestamps = self._steps['timestamp']
+        while low < high:
+            middle = (low + high) // 2
+            timestamp = timestamps[middle % self.capacity]
+            if timestamp < value or (right and timestamp == value):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @staticmethod
+    def _empty_stats():
+        return dict(nb_steps=0, rms_ra=np.nan, rms_dec=np.nan, rms_total=np.nan,
+                    peak=np.nan, percentile=np.nan, snr=np.nan, star_mass=np.nan,
+                    star_mass_drift=np.nan)
@@ -3,6 +3,9 @@ from collections import namedtuple
 import datetime
 import os
 
+# Numerical stuff
+import numpy as np
+
 # Astropy
 from astropy import units as u
 from astropy import wcs
@@ -16,6 +19,9 @@ from astropy.time import Time
 # Local stuff
 from Base.Base import Base
 from Imaging import fits as fits_utils
+from Imaging.PlateSolver import get_shared_plate_solver
+from Imaging import star_matching
+from utils import error
 
 OffsetError = namedtuple('OffsetError', ['delta_ra', 'delta_dec', 'magnitude'])
 class OffsetError:
@@ -97,6 +103,7 @@ class Image(Base):
         self._luminance = None
         self._pointing = None
         self._pointing_error = None
+        self._stars = None
 
     @property
     def wcs_file(self):
@@ -251,6 +258,9 @@ class Image(Base):
     def solve_field(self, **kwargs):
         """ Solve field and populate WCS information
             If you use basic catalog for astrometry.net, it is J2K!
+            Solving goes through the shared plate solver, that narrows the
+            search around the header pointing, with the scale and parity of
+            the previous image of the same camera.
         Args:
             **kwargs (dict): Options to be passed to `get_solve_field`
         """
@@ -261,8 +271,10 @@ class Image(Base):
             ))
             if "radius" not in kwargs:
                 kwargs["radius"] = 1
-        solve_info = fits_utils.get_solve_field(
+        solve_info = get_shared_plate_solver().solve(
             self.fits_file,
+            hint_key=self.header.get("INSTRUME", None) or "default",
+            position_hint=(self.header_pointing.ra.value, self.header_pointing.dec.value),
             config=self.config,
             **kwargs)
         self.wcs_file = solve_info['solved_fits_file']
@@ -277,6 +289,63 @@ class Image(Base):
 
         return solve_info
 
+    @property
+    def stars(self):
+        """Brightest stars detected in the image, see star_matching.detect_stars"""
+        if self._stars is None:
+            self._stars = star_matching.detect_stars(fits.getdata(self.fits_file))
+        return self._stars
+
+    def refine_wcs(self, reference_image, tolerance_px=3, search_radius_px=200,
+                   min_matches=8, max_rms_px=1.5):
+        """ Derive the WCS from the one of a previous, solved, image of the same camera
+
+        Much faster than solve_field for consecutive pointing frames: stars of
+        the reference image are projected where the header pointing predicts
+        them in this image, matched with the stars detected in this image, and
+        an affine transform fitted on the pairs corrects the prediction.
+        The WCS is written in the image file, as solve_field does.
+
+        Args:
+            reference_image (Image): image with a WCS, that shares scale and
+                orientation with this one
+            search_radius_px (float): maximum error of the header pointing
+        Returns:
+            dict: number of matched stars and rms residual, in pixels
+        Raises:
+            error.AstrometrySolverError: not enough stars could be matched,
+                solve_field should be used instead
+        """
+        if reference_image.wcs is None:
+            raise error.AstrometrySolverError(f"Reference image {reference_image.fits_file} has no WCS")
+        ref_stars = reference_image.stars
+        stars = self.stars
+        ref_ra, ref_dec = reference_image.wcs.all_pix2world(ref_stars['x'], ref_stars['y'], 0)
+        predicted = star_matching.predict_wcs(
+            reference_image.wcs, self.get_center_coordinates(),
+            (self.header_pointing.ra.value, self.header_pointing.dec.value))
+        ref_xy = np.column_stack(predicted.wcs_world2pix(ref_ra, ref_dec, 0))
+        xy = np.column_stack([stars['x'], stars['y']])
+        ref_index, index = star_matching.match_stars(
+            ref_xy, xy, tolerance_px=tolerance_px, search_radius_px=search_radius_px)
+        if len(index) < min_matches:
+            raise error.AstrometrySolverError(
+                f"Only {len(index)} stars of {self.fits_file} matched reference image "
+                f"{reference_image.fits_file}")
+        matrix, offset, rms, inliers = star_matching.fit_affine(xy[index], ref_xy[ref_index])
+        if np.count_nonzero(inliers) < min_matches or rms > max_rms_px:
+            raise error.AstrometrySolverError(
+                f"Cannot fit {self.fits_file} on reference image {reference_image.fits_file}: "
+                f"{np.count_nonzero(inliers)} stars, rms {rms:.2f}px")
+
+        self.wcs = star_matching.compose_affine(predicted, matrix, offset)
+        with fits.open(self.fits_file, 'update') as hdu:
+            hdu[0].header.update(self.wcs.to_header())
+        self._wcs_file = self.fits_file
+        self.get_wcs_pointing()
+        self._pointing_error = None
+        return dict(matched_stars=int(np.count_nonzero(inliers)), rms_px=float(rms))
+
     def compute_offset(self, ref_image):
         assert isinstance(ref_image, Image), self.logger.warning(
             "Must pass an Image class for reference")
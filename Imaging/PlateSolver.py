@@ -0,0 +1,284 @@
+# Basic stuff
+from collections import deque
+from concurrent.futures import Future
+import glob
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+# Numerical stuff
+import numpy as np
+
+# Astropy
+from astropy.wcs import WCS
+from astropy.wcs.utils import proj_plane_pixel_scales
+
+# Local
+from Base.Base import Base
+from Imaging import fits as fits_utils
+from utils import error
+
+ASTROMETRY_CONFIG = "/usr/local/astrometry/etc/astrometry.cfg"
+
+_shared_solver = None
+_shared_solver_lock = threading.Lock()
+
+
+def get_shared_plate_solver():
+    """ Returns the plate solver shared by every pointing of the process, created upon first call """
+    global _shared_solver
+    with _shared_solver_lock:
+        if _shared_solver is None:
+            _shared_solver = PlateSolver()
+        return _shared_solver
+
+
+class SolveFieldBackend:
+    """ astrometry.net solve-field, ran through scripts/solve_field.sh
+
+    Index files are memory mapped by each solve-field process: warm_up reads
+    them once in the page cache, so that the first solves of the night do not
+    pay for the disk. This is only worth it when the index files fit in
+    memory, so it has to be enabled with the warm_up configuration entry.
+    """
+
+    def __init__(self, config):
+        self.index_dirs = config.get("index_dirs", None)
+
+    def get_index_files(self):
+        index_dirs = self.index_dirs
+        if index_dirs is None:
+            index_dirs = []
+            try:
+                with open(ASTROMETRY_CONFIG) as f:
+                    for line in f:
+                        words = line.split()
+                        if len(words) == 2 and words[0] == "add_path":
+                            index_dirs.append(words[1])
+            except OSError:
+                pass
+        return sorted(f for d in index_dirs for f in glob.glob(os.path.join(d, "index-*.fits")))
+
+    def warm_up(self):
+        for index_file in self.get_index_files():
+            with open(index_file, "rb") as f:
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+
+    def solve(self, fname, scratch_dir, **kwargs):
+        return fits_utils.get_solve_field(fname, scratch_dir=scratch_dir, **kwargs)
+
+
+SOLVER_BACKENDS = {
+    "solve_field": SolveFieldBackend,
+}
+
+
+class PlateSolver(Base):
+    """
+    Pool of plate solving workers, fed through a job queue
+
+    Each job runs in its own scratch directory, removed once the job is over,
+    so that concurrent solves never see each other temporary files.
+
+    Unless the caller already constrained the search, jobs are narrowed with
+    hints: the mount position from the image header bounds the search
+    radius, and the last solution of the same camera gives pixel scale and
+    parity. If a hinted solve fails, it is tried again without hints.
+
+    Duration of each solve, and time spent waiting in the queue, are kept and
+    periodically stored into the "plate_solve" DB collection. Expected
+    configuration, all entries being optional:
+
+    plate_solver:
+        backend: solve_field
+        max_workers: 2
+        scratch_dir: /tmp
+        mount_hint_radius_deg: 5
+        blind_retry: True
+        warm_up: False
+        metrics_period_sec: 60
+        index_dirs: [/usr/local/astrometry/data]
+    """
+
+    def __init__(self, config=None, backend=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if config is None:
+            config = self.config.get("plate_solver", {})
+        self.max_workers = int(config.get("max_workers", 2))
+        self.scratch_dir = config.get("scratch_dir", None)
+        self.mount_hint_radius_deg = config.get("mount_hint_radius_deg", 5)
+        self.blind_retry = config.get("blind_retry", True)
+        self.metrics_period_sec = config.get("metrics_period_sec", 60)
+        if backend is None:
+            backend = SOLVER_BACKENDS[config.get("backend", "solve_field")](config)
+        self.backend = backend
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._solutions = {}  # hint_key -> dict(sampling_arcsec, parity)
+        self._history = deque(maxlen=100)
+        self._stats = dict(count=0, solved=0, hinted=0, retried=0,
+                           total_solve_sec=0., max_solve_sec=0., total_wait_sec=0.)
+        self._last_metrics_publication = time.monotonic()
+        self._workers = []
+        for i in range(self.max_workers):
+            worker = threading.Thread(target=self._worker_loop, name=f"PlateSolver-{i}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        if config.get("warm_up", False) and hasattr(self.backend, "warm_up"):
+            threading.Thread(target=self._warm_up, name="PlateSolver-warm-up", daemon=True).start()
+
+    @property
+    def queue_depth(self):
+        return self._jobs.qsize()
+
+    def _warm_up(self):
+        started = time.monotonic()
+        try:
+            self.backend.warm_up()
+            self.logger.debug(f"Plate solver warmed up in {time.monotonic() - started:.1f}s")
+        except Exception as e:
+            self.logger.warning(f"Cannot warm up plate solver: {e}")
+
+    def submit(self, fname, hint_key="default", position_hint=None, **kwargs):
+        """
+        Queue a plate solve of fname
+
+        Args:
+            fname (str): FITS file to be solved
+            hint_key (str): images sharing the same key (same camera) share
+                pixel scale and parity hints
+            position_hint (tuple): approximate (ra, dec) of the field center,
+                in degrees, typically from the mount
+            **kwargs: options of Imaging.fits.get_solve_field, those take
+                precedence over hints
+
+        Returns:
+            concurrent.futures.Future: result of get_solve_field
+        """
+        future = Future()
+        self._jobs.put((future, time.monotonic(), fname, hint_key, position_hint, kwargs))
+        return future
+
+    def solve(self, fname, hint_key="default", position_hint=None, timeout=None, **kwargs):
+        """ Same as submit, but waits for the result """
+        return self.submit(fname, hint_key=hint_key, position_hint=position_hint,
+                           **kwargs).result(timeout=timeout)
+
+    def _worker_loop(self):
+        while True:
+            future, submitted, fname, hint_key, position_hint, kwargs = self._jobs.get()
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self._run_job(submitted, fname, hint_key, position_hint, kwargs))
+                except BaseException as e:
+                    self.logger.error(f"Plate solving of {fname} failed: {e}")
+                    future.set_exception(e)
+            self._publish_metrics_if_needed()
+
+    def get_hints(self, hint_key="default", position_hint=None, **kwargs):
+        """ Options to add to kwargs in order to narrow the search """
+        hints = {}
+        if position_hint is not None and "ra" not in kwargs and "dec" not in kwargs:
+            hints["ra"], hints["dec"] = position_hint
+            hints["radius"] = self.mount_hint_radius_deg
+        with self._lock:
+            solution = self._solutions.get(hint_key, None)
+        if solution is not None:
+            if kwargs.get("sampling_arcsec", None) is None:
+                hints["sampling_arcsec"] = solution["sampling_arcsec"]
+            if "parity" not in kwargs:
+                hints["parity"] = solution["parity"]
+        return hints
+
+    def remember_solution(self, hint_key, wcs_file):
+        """ Keep pixel scale and parity of a solved image as hints for the next images of hint_key """
+        w = WCS(wcs_file)
+        if not w.has_celestial:
+            return
+        w = w.celestial
+        # Same convention as astrometry.net: a positive determinant is a flipped image
+        parity = "neg" if np.linalg.det(w.pixel_scale_matrix) >= 0 else "pos"
+        sampling_arcsec = float(np.mean(proj_plane_pixel_scales(w)) * 3600)
+        with self._lock:
+            self._solutions[hint_key] = dict(sampling_arcsec=sampling_arcsec, parity=parity)
+
+    def _solve_in_scratch_dir(self, fname, **kwargs):
+        scratch_dir = tempfile.mkdtemp(prefix="plate_solve_", dir=self.scratch_dir)
+        try:
+            return self.backend.solve(fname, scratch_dir, **kwargs)
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _run_job(self, submitted, fname, hint_key, position_hint, kwargs):
+        started = time.monotonic()
+        hints = self.get_hints(hint_key, position_hint, **kwargs)
+        retried = False
+        solved = False
+        try:
+            try:
+                # Hints never override options of the caller, unless those are unset
+                options = {key: value for key, value in kwargs.items()
+                           if not (value is None and key in hints)}
+                solve_info = self._solve_in_scratch_dir(fname, **{**hints, **options})
+            except error.AstrometrySolverError as e:
+                if not hints or not self.blind_retry:
+                    raise
+                self.logger.warning(f"Cannot solve {fname} with hints {hints}: {e}, trying without hints")
+                retried = True
+                solve_info = self._solve_in_scratch_dir(fname, **kwargs)
+            solved = True
+            try:
+                self.remember_solution(hint_key, solve_info["solved_fits_file"])
+            except Exception as e:
+                self.logger.warning(f"Cannot get hints from solution of {fname}: {e}")
+            return solve_info
+        finally:
+            self._record(dict(fname=fname, hint_key=hint_key, solved=solved,
+                              hints=sorted(hints), retried=retried,
+                              wait_sec=started - submitted,
+                              solve_sec=time.monotonic() - started))
+
+    def _record(self, entry):
+        self.logger.info(f"Plate solving of {entry['fname']}: solved={entry['solved']} in "
+                         f"{entry['solve_sec']:.1f}s (waited {entry['wait_sec']:.1f}s), "
+                         f"hints {entry['hints']}{', retried without hints' if entry['retried'] else ''}")
+        with self._lock:
+            self._history.append(entry)
+            stats = self._stats
+            stats["count"] += 1
+            stats["solved"] += entry["solved"]
+            stats["hinted"] += bool(entry["hints"])
+            stats["retried"] += entry["retried"]
+            stats["total_solve_sec"] += entry["solve_sec"]
+            stats["max_solve_sec"] = max(stats["max_solve_sec"], entry["solve_sec"])
+            stats["total_wait_sec"] += entry["wait_sec"]
+
+    def get_metrics(self):
+        with self._lock:
+            stats = dict(self._stats)
+            count = max(stats["count"], 1)
+            return dict(
+                queue_depth=self.queue_depth,
+                count=stats["count"],
+                solved=stats["solved"],
+                hinted=stats["hinted"],
+                retried=stats["retried"],
+                mean_solve_sec=stats["total_solve_sec"] / count,
+                max_solve_sec=stats["max_solve_sec"],
+                mean_wait_sec=stats["total_wait_sec"] / count,
+                last=list(self._history)[-10:])
+
+    def _publish_metrics_if_needed(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_metrics_publication < self.metrics_period_sec:
+                return
+            self._last_metrics_publication = now
+        try:
+            self.db.insert_current("plate_solve", self.get_metrics())
+        except Exception as e:
+            self.logger.warning(f"Cannot store plate solver metrics: {e}")
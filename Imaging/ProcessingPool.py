@@ -0,0 +1,176 @@
+# Basic stuff
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+import threading
+import time
+
+# Local
+from Base.Base import Base
+
+_shared_pool = None
+_shared_pool_lock = threading.Lock()
+
+
+def get_shared_processing_pool():
+    """ Returns the processing pool shared by every camera of the process, created upon first call """
+    global _shared_pool
+    with _shared_pool_lock:
+        if _shared_pool is None:
+            _shared_pool = ProcessingPool()
+        return _shared_pool
+
+
+class ProcessingPool(Base):
+    """
+    Bounded pool of worker threads for acquisition and post-processing of exposures
+
+    Tasks are submitted with a key (typically "<camera name>/acquisition" or
+    "<camera name>/processing"): tasks sharing the same key are run one at a time,
+    in submission order, whereas tasks with different keys run concurrently.
+    The total number of pending tasks is bounded: submit blocks when the pool is full,
+    which applies backpressure on acquisition when disk or DB fall behind.
+
+    As tasks of one key may wait for tasks of another key (processing waits for the end of
+    the corresponding acquisition), the pool never runs less workers than distinct keys,
+    since a key never uses more than one worker at a time, that guarantees progress.
+
+    The pool also gathers per-stage timing statistics (queue wait, readout, write,
+    headers, DB insert, ...) that are periodically stored into the "processing" DB
+    collection. Expected configuration, all entries being optional:
+
+    processing_pool:
+        max_workers: 4
+        max_queue_size: 16
+        submit_timeout_sec: 600
+        metrics_period_sec: 60
+    """
+
+    def __init__(self, config=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        if config is None:
+            config = self.config.get("processing_pool", {})
+        self.max_workers = int(config.get("max_workers", 4))
+        self.max_queue_size = int(config.get("max_queue_size", 16))
+        self.submit_timeout_sec = config.get("submit_timeout_sec", 600)
+        self.metrics_period_sec = config.get("metrics_period_sec", 60)
+
+        self._cond = threading.Condition()
+        self._tasks = {}  # key -> deque of pending tasks
+        self._ready_keys = deque()  # keys with pending tasks and no running task
+        self._running_keys = set()
+        self._nb_pending = 0
+        self._stage_stats = {}
+        self._last_metrics_publication = time.monotonic()
+        self._known_keys = set()
+        self._workers = []
+        with self._cond:
+            self._ensure_workers(self.max_workers)
+
+    def _ensure_workers(self, nb_workers):
+        """ Must be called with the condition held """
+        while len(self._workers) < nb_workers:
+            worker = threading.Thread(target=self._worker_loop, name=f"ProcessingPool-{len(self._workers)}",
+                                      daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @property
+    def queue_depth(self):
+        with self._cond:
+            return self._nb_pending
+
+    def submit(self, key, fn, *args, **kwargs):
+        """
+        Schedule fn(*args, **kwargs) after every task previously submitted with the same key.
+        Blocks while the pool already holds max_queue_size pending tasks.
+
+        Returns:
+            concurrent.futures.Future: result of fn
+        """
+        future = Future()
+        with self._cond:
+            if self._nb_pending >= self.max_queue_size:
+                self.logger.warning(f"Processing pool full with {self._nb_pending} pending tasks, "
+                                    f"submission of task {key} blocks")
+            if not self._cond.wait_for(lambda: self._nb_pending < self.max_queue_size,
+                                       timeout=self.submit_timeout_sec):
+                raise RuntimeError(f"Processing pool still full after {self.submit_timeout_sec}s, "
+                                   f"cannot submit task {key}")
+            if key not in self._known_keys:
+                self._known_keys.add(key)
+                self._ensure_workers(len(self._known_keys))
+            self._tasks.setdefault(key, deque()).append((future, time.monotonic(), fn, args, kwargs))
+            self._nb_pending += 1
+            if key not in self._running_keys and key not in self._ready_keys:
+                self._ready_keys.append(key)
+            self._cond.notify_all()
+        return future
+
+    def _worker_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._ready_keys) > 0)
+                key = self._ready_keys.popleft()
+                self._running_keys.add(key)
+                future, submitted, fn, args, kwargs = self._tasks[key].popleft()
+            self.record_stage(key, "wait", time.monotonic() - submitted)
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except BaseException as e:
+                    self.logger.error(f"Processing pool task {key} failed: {e}")
+                    future.set_exception(e)
+            with self._cond:
+                self._running_keys.discard(key)
+                self._nb_pending -= 1
+                if self._tasks[key]:
+                    self._ready_keys.append(key)
+                else:
+                    del self._tasks[key]
+                self._cond.notify_all()
+            self._publish_metrics_if_needed()
+
+    def record_stage(self, key, stage, duration_sec):
+        with self._cond:
+            stats = self._stage_stats.setdefault((key, stage), dict(count=0, total_sec=0., max_sec=0., last_sec=0.))
+            stats["count"] += 1
+            stats["total_sec"] += duration_sec
+            stats["max_sec"] = max(stats["max_sec"], duration_sec)
+            stats["last_sec"] = duration_sec
+
+    @contextmanager
+    def timed_stage(self, key, stage):
+        """ Context manager recording the time spent in its body as stage of key """
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record_stage(key, stage, time.monotonic() - started)
+
+    def get_metrics(self):
+        with self._cond:
+            stages = {}
+            for (key, stage), stats in self._stage_stats.items():
+                stages.setdefault(key, {})[stage] = dict(
+                    count=stats["count"],
+                    mean_sec=stats["total_sec"] / stats["count"],
+                    max_sec=stats["max_sec"],
+                    last_sec=stats["last_sec"])
+            return dict(
+                queue_depth=self._nb_pending,
+                max_queue_size=self.max_queue_size,
+                queue_depth_per_key={key: len(tasks) + (key in self._running_keys)
+                                     for key, tasks in self._tasks.items()},
+                stages=stages)
+
+    def _publish_metrics_if_needed(self):
+        now = time.monotonic()
+        with self._cond:
+            if now - self._last_metrics_publication < self.metrics_period_sec:
+                return
+            self._last_metrics_publication = now
+        try:
+            self.db.insert_current("processing", self.get_metrics())
+        except Exception as e:
+            self.logger.warning(f"Cannot store processing pool metrics: {e}")
@@ -2,6 +2,7 @@
 import os
 import shutil
 import subprocess
+import tempfile
 from warnings import warn
 
 # Numerical/image stugg
@@ -18,7 +19,7 @@ from astropy.wcs import WCS
 from utils import error
 
 
-def solve_field(fname, timeout=360, solve_opts=None, **kwargs):
+def solve_field(fname, timeout=360, solve_opts=None, scratch_dir=None, **kwargs):
     """ Plate solves an image.
 
     Args:
@@ -26,6 +27,8 @@ def solve_field(fname, timeout=360, solve_opts=None, **kwargs):
         timeout(int, optional):     Timeout for the solve-field command,
                                     defaults to 60 seconds.
         solve_opts(list, optional): List of options for solve-field.
+        scratch_dir(str, optional): Directory for the temporary files of
+                                    solve-field, instead of /tmp.
         verbose(bool, optional):    Show output, defaults to False.
     """
     verbose = kwargs.get('verbose', False)
@@ -65,6 +68,9 @@ def solve_field(fname, timeout=360, solve_opts=None, **kwargs):
         if 'radius' in kwargs:
             options.append('--radius')
             options.append(str(kwargs.get('radius')))
+        if kwargs.get('parity', None) in ('pos', 'neg'):
+            options.append('--parity')
+            options.append(kwargs.get('parity'))
         if 'sampling_arcsec' in kwargs:
             if kwargs["sampling_arcsec"] is not None:
                 options.append('--scale-low')
@@ -79,12 +85,15 @@ def solve_field(fname, timeout=360, solve_opts=None, **kwargs):
             options.append('--plot-scale')
             options.append(str(1/kwargs.get('downsample')))
 
+    # Temporary files of concurrent solves must not collide
+    if scratch_dir is not None:
+        options = options + ['--temp-dir', scratch_dir]
+
     cmd = [solve_field_script] + options + [fname]
     if verbose:
         print("Cmd:", cmd)
 
     try:
-        os.system('rm -f /tmp/*.wcs.*')
         proc = subprocess.Popen(cmd, universal_newlines=True,
                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
     except OSError as e:
@@ -100,7 +109,7 @@ def solve_field(fname, timeout=360, solve_opts=None, **kwargs):
     return proc
 
 
-def get_solve_field(fname, replace=True, remove_extras=True, **kwargs):
+def get_solve_field(fname, replace=True, remove_extras=True, scratch_dir=None, **kwargs):
     """Convenience function to wait for `solve_field` to finish.
 
     This function merely passes the `fname` of the image to be solved along to `solve_field`,
@@ -133,6 +142,8 @@ def get_solve_field(fname, replace=True, remove_extras=True, **kwargs):
         fname ({str}): Name of FITS file to be solved
         replace (bool, optional): Replace fname the solved file
         remove_extras (bool, optional): Remove the files generated by solver
+        scratch_dir (str, optional): Directory for the temporary files of the
+            solver, a new one is created and removed if not provided
         **kwargs ({dict}): Options to pass to `solve_field`
 
     Returns:
@@ -152,10 +163,15 @@ def get_solve_field(fname, replace=True, remove_extras=True, **kwargs):
     #     out_dict['solved_fits_file'] = fname
     #     return out_dict
 
+    if scratch_dir is None:
+        with tempfile.TemporaryDirectory(prefix="solve_field_") as scratch_dir:
+            return get_solve_field(fname, replace=replace, remove_extras=remove_extras,
+                                   scratch_dir=scratch_dir, **kwargs)
+
     if verbose:
         print("Entering get_solve_field:", fname)
 
-    proc = solve_field(fname, **kwargs)
+    proc = solve_field(fname, scratch_dir=scratch_dir, **kwargs)
     try:
         output, errs = proc.communicate(timeout=kwargs.get('timeout', 360))
     except subprocess.TimeoutExpired:
@@ -386,7 +402,7 @@ def update_thumbnail(file_path, latest_path):
     try:
         with fits.open(file_path, 'readonly') as f:
             hdu = f[0]
-            io.imsave(latest_path, hdu.data.astype(np.uint8))
+            io.imsave(latest_path, stretch_to_uint8(hdu.data), check_contrast=False)
     except Exception as e:
         warn(f"Exception while trying to save thumbnail: {e}")
 
@@ -406,24 +422,105 @@ def gen_hips(hips_dir, fits_path):
 
 def update_headers(file_path, info):
     with fits.open(file_path, 'update') as f:
-        hdu = f[0]
-        hdu.header.set('IMAGEID', info.get('image_id', ''))
-        hdu.header.set('SEQID', info.get('sequence_id', ''))
-        hdu.header.set('FIELD', info.get('field_name', ''))
-        hdu.header.set('RA-FIELD', info.get('field_ra', ''), 'Degrees')
-        hdu.header.set('RA-MNT', info.get('ra_mnt', ''), 'Degrees')
-        hdu.header.set('DEC-FIELD', info.get('field_dec', ''), 'Degrees')
-        hdu.header.set('DEC-MNT', info.get('dec_mnt', ''), 'Degrees')
-        hdu.header.set('EQUINOX', info.get('equinox', 2000.))  # Assume J2000
-        hdu.header.set('AIRMASS', info.get('airmass', ''), 'Sec(z)')
-        hdu.header.set('FILTER', info.get('filter', ''))
-        hdu.header.set('LAT-OBS', info.get('latitude', ''), 'Degrees')
-        hdu.header.set('LONG-OBS', info.get('longitude', ''), 'Degrees')
-        hdu.header.set('ELEV-OBS', info.get('elevation', ''), 'Meters')
-        hdu.header.set('MOONSEP', info.get('moon_separation', ''), 'Degrees')
-        hdu.header.set('MOONFRAC', info.get('moon_fraction', ''))
-        hdu.header.set('CREATOR', info.get('creator', ''), 'RemoteObservatory Software version')
-        hdu.header.set('INSTRUME', info.get('camera_uid', ''), 'Camera ID')
-        hdu.header.set('OBSERVER', info.get('observer', ''), 'Observer name')
-        hdu.header.set('ORIGIN', info.get('origin', ''))
-        hdu.header.set('RA-RATE', info.get('tracking_rate_ra', ''), 'RA Tracking Rate')
+        set_headers(f[0].header, info)
+
+
+def set_headers(header, info):
+    """ Merge observation metadata from info into header """
+    header.set('IMAGEID', info.get('image_id', ''))
+    header.set('SEQID', info.get('sequence_id', ''))
+    header.set('FIELD', info.get('field_name', ''))
+    header.set('RA-FIELD', info.get('field_ra', ''), 'Degrees')
+    header.set('RA-MNT', info.get('ra_mnt', ''), 'Degrees')
+    header.set('DEC-FIELD', info.get('field_dec', ''), 'Degrees')
+    header.set('DEC-MNT', info.get('dec_mnt', ''), 'Degrees')
+    header.set('EQUINOX', info.get('equinox', 2000.))  # Assume J2000
+    header.set('AIRMASS', info.get('airmass', ''), 'Sec(z)')
+    header.set('FILTER', info.get('filter', ''))
+    header.set('LAT-OBS', info.get('latitude', ''), 'Degrees')
+    header.set('LONG-OBS', info.get('longitude', ''), 'Degrees')
+    header.set('ELEV-OBS', info.get('elevation', ''), 'Meters')
+    header.set('MOONSEP', info.get('moon_separation', ''), 'Degrees')
+    header.set('MOONFRAC', info.get('moon_fraction', ''))
+    header.set('CREATOR', info.get('creator', ''), 'RemoteObservatory Software version')
+    header.set('INSTRUME', info.get('camera_uid', ''), 'Camera ID')
+    header.set('OBSERVER', info.get('observer', ''), 'Observer name')
+    header.set('ORIGIN', info.get('origin', ''))
+    header.set('RA-RATE', info.get('tracking_rate_ra', ''), 'RA Tracking Rate')
+    if 'guiding_nb_steps' in info:
+        header.set('GUIDSTEP', info['guiding_nb_steps'], 'Number of guide steps')
+        if info['guiding_nb_steps'] > 0:
+            header.set('GUIDRMS', info['guiding_rms_total'], 'Guiding RMS error (guider px)')
+            header.set('GUIDRMSR', info['guiding_rms_ra'], 'Guiding RA RMS error (guider px)')
+            header.set('GUIDRMSD', info['guiding_rms_dec'], 'Guiding Dec RMS error (guider px)')
+            header.set('GUIDPEAK', info['guiding_peak'], 'Guiding peak error (guider px)')
+            header.set('GUIDP90', info['guiding_percentile'], 'Guiding 90th percentile error (guider px)')
+            header.set('GUIDSNR', info['guiding_snr'], 'Guide star mean SNR')
+            header.set('GUIDMDRF', info['guiding_star_mass_drift'], 'Guide star mass drift (1/hour)')
+
+
+def finalize_fits(hdul, file_path, info=None, latest_path=None, compress=False, logger=None):
+    """
+    Single pass finalization of an in-memory image
+
+    Observation headers from info are merged into the primary header, the file is
+    written once (through a temporary file and an atomic rename, so that readers
+    never see a partial file), the thumbnail is built from the very same array
+    and the file is eventually fpack'ed.
+
+    Args:
+        hdul (HDUList): in-memory image, as returned by the camera
+        file_path (str): final FITS file path
+        info (dict, optional): observation metadata to be merged in headers
+        latest_path (str, optional): where to save the jpeg thumbnail
+        compress (bool, optional): fpack the file once written
+
+    Returns:
+        str: path of the written file, that has a .fz extension if compressed
+    """
+    hdu = hdul[0]
+    if info is not None:
+        set_headers(hdu.header, info)
+
+    # Create directories if required.
+    if os.path.dirname(file_path):
+        os.makedirs(os.path.dirname(file_path), mode=0o775, exist_ok=True)
+    tmp_path = f"{file_path}.part"
+    try:
+        hdul.writeto(tmp_path, overwrite=True)
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    if logger is not None:
+        logger.debug(f"Image written to {file_path}")
+
+    if latest_path is not None:
+        try:
+            io.imsave(latest_path, stretch_to_uint8(hdu.data), check_contrast=False)
+        except Exception as e:
+            warn(f"Exception while trying to save thumbnail: {e}")
+
+    if compress:
+        file_path = fpack(file_path)
+    return file_path
+
+
+def stretch_to_uint8(data, max_size=1024, low_percentile=0.5, high_percentile=99.5):
+    """
+    Linear percentile stretch of an image into a displayable uint8 array
+
+    The image is first subsampled with a stride, so that its largest side is
+    approximately max_size, which keeps it cheap on full frame images.
+    Color cubes (3, height, width) are returned as (height, width, 3).
+    """
+    data = np.asanyarray(data)
+    if data.ndim == 3:
+        data = np.moveaxis(data, 0, -1)
+    stride = max(1, int(np.ceil(max(data.shape[:2]) / max_size)))
+    thumb = data[::stride, ::stride].astype(np.float32)
+    low, high = np.nanpercentile(thumb, [low_percentile, high_percentile])
+    if not high > low:
+        high = low + 1
+    thumb = (thumb - low) * (255 / (high - low))
+    return np.nan_to_num(np.clip(thumb, 0, 255)).astype(np.uint8)
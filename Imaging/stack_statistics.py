@@ -0,0 +1,139 @@
+# Generic includes
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+# Numerical stuff
+import numpy as np
+
+# Astropy
+from astropy.io import fits
+
+
+def load_cube(file_names, memmap_path=None, dtype=np.float32, loader=None):
+    """ Read a list of images into a single (nb_images, height, width) cube
+
+    The cube is allocated once, from the shape of the first image, instead of
+    growing a stack image after image. If memmap_path is given, the cube is a
+    memory mapped file, so that a stack bigger than memory can be processed
+    tile by tile.
+
+    Args:
+        file_names(list, required): Image files, fits by default
+        memmap_path(str, optional): Path of the memory mapped cube
+        dtype(numpy.dtype, optional): Type of the cube
+        loader(callable, optional): function file_name -> 2D array, defaults
+            to reading the primary HDU of a fits file
+    """
+    if loader is None:
+        loader = lambda file_name: fits.getdata(file_name)
+    cube = None
+    for i, file_name in enumerate(file_names):
+        image = loader(file_name)
+        if cube is None:
+            shape = (len(file_names), *image.shape)
+            if memmap_path is None:
+                cube = np.empty(shape, dtype=dtype)
+            else:
+                cube = np.memmap(memmap_path, dtype=dtype, mode='w+', shape=shape)
+        cube[i] = image
+    return cube
+
+
+def row_tiles(height, tile_rows):
+    """ Generates (start, end) row indices of tiles covering height rows """
+    for start in range(0, height, tile_rows):
+        yield start, min(start + tile_rows, height)
+
+
+def tiled_apply(func, cube, tile_rows=32, nb_workers=None):
+    """ Apply func on row tiles of cube, in parallel
+
+    Numpy releases the GIL on large array operations, so that tiles are
+    processed concurrently on all cores, while memory stays bounded by
+    tile_rows (the cube itself can be a memory map).
+
+    Args:
+        func(callable, required): function taking a (depth, rows, width) tile
+            and returning a tuple of (rows, width) arrays
+        cube(numpy.ndarray, required): (depth, height, width) array
+        tile_rows(int, optional): number of image rows per tile
+        nb_workers(int, optional): number of threads, defaults to cpu count
+
+    Returns:
+        tuple: the (height, width) arrays returned by func, reassembled
+    """
+    height = cube.shape[1]
+    tiles = list(row_tiles(height, tile_rows))
+    outputs = None
+
+    def process(tile):
+        start, end = tile
+        return start, end, func(np.asarray(cube[:, start:end]))
+
+    with ThreadPoolExecutor(max_workers=nb_workers or os.cpu_count()) as executor:
+        for start, end, results in executor.map(process, tiles):
+            if outputs is None:
+                outputs = [np.empty((height, *result.shape[1:]), dtype=result.dtype) for result in results]
+            for output, result in zip(outputs, results):
+                output[start:end] = result
+    return tuple(outputs)
+
+
+def sigma_clipped_mean(data, low=5.0, high=5.0, max_iter=100):
+    """ Per pixel iterative sigma clipped mean of a (depth, height, width) stack
+
+    Same result as np.mean(scipy.stats.sigmaclip(data[:, i, j], low, high)[0])
+    for each pixel, but clipping iterates over the whole stack at once: at each
+    iteration, samples outside of [mean - low*std, mean + high*std] of the
+    samples kept so far are rejected, until no pixel changes anymore.
+
+    Returns:
+        tuple: (mean, number of kept samples) (height, width) arrays
+    """
+    data = np.asarray(data, dtype=np.float64)
+    keep = np.ones(data.shape, dtype=bool)
+    for _ in range(max_iter):
+        count = keep.sum(axis=0)
+        mean = np.where(keep, data, 0).sum(axis=0) / count
+        centered = np.where(keep, data - mean, 0)
+        std = np.sqrt((centered**2).sum(axis=0) / count)
+        new_keep = keep & (data >= mean - std*low) & (data <= mean + std*high)
+        if np.array_equal(new_keep, keep):
+            break
+        keep = new_keep
+    return mean, count
+
+
+def master_dark_tile(tile, low=5.0, high=5.0):
+    """ Master dark statistics of a tile: sigma clipped mean, and std of all
+        samples around that robust mean
+    """
+    mean, _ = sigma_clipped_mean(tile, low, high)
+    std = np.sqrt(np.mean((tile - mean)**2, axis=0))
+    return mean.astype(np.float32), std.astype(np.float32)
+
+
+def master_dark_stats(cube, low=5.0, high=5.0, tile_rows=32, nb_workers=None):
+    """ Sigma clipped mean and std maps of a (nb_images, height, width) dark cube, tile by tile """
+    return tiled_apply(lambda tile: master_dark_tile(tile, low, high), cube,
+                       tile_rows=tile_rows, nb_workers=nb_workers)
+
+
+def linear_regression_tile(tile, x):
+    """ Closed form least square fit of tile[k] = a * x[k] + b for every pixel
+
+    Returns:
+        tuple: (a, b) (rows, width) arrays
+    """
+    x = np.asarray(x, dtype=np.float64)
+    x_centered = (x - x.mean()).reshape(-1, 1, 1)
+    y_mean = np.mean(tile, axis=0, dtype=np.float64)
+    a = np.sum(x_centered * (tile - y_mean), axis=0) / np.sum(x_centered**2)
+    b = y_mean - a * x.mean()
+    return a, b
+
+
+def linear_regression_map(cube, x, tile_rows=32, nb_workers=None):
+    """ Per pixel affine regression of a (len(x), height, width) cube against x, tile by tile """
+    return tiled_apply(lambda tile: linear_regression_tile(tile, x), cube,
+                       tile_rows=tile_rows, nb_workers=nb_workers)
@@ -0,0 +1,170 @@
+# Numerical stuff
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+
+# Astropy
+from astropy.wcs import WCS
+
+# Local
+from utils import error
+
+STARS_DTYPE = np.dtype([
+    ('x', np.float64),
+    ('y', np.float64),
+    ('flux', np.float64),
+    ('npix', np.int32)])
+
+
+def detect_stars(data, threshold_sigma=5, max_stars=100, min_pixels=3, background_box=64):
+    """ Detects the brightest stars of an image
+
+    Background is the median of background_box x background_box tiles, noise
+    is estimated from the median absolute deviation of the background
+    subtracted image. Connected pixels above threshold_sigma times the noise
+    are a star if there are at least min_pixels of them.
+
+    Args:
+        data (2d array): image
+    Returns:
+        structured array of STARS_DTYPE, brightest first, pixel coordinates
+        are 0-based (x is the column)
+    """
+    data = np.asarray(data, dtype=np.float32)
+    h, w = data.shape
+    box = max(1, min(background_box, h, w))
+    nby, nbx = h // box, w // box
+    tiles = data[:nby * box, :nbx * box].reshape(nby, box, nbx, box)
+    background = np.median(tiles, axis=(1, 3))
+    background = np.repeat(np.repeat(background, box, axis=0), box, axis=1)
+    background = np.pad(background, ((0, h - background.shape[0]), (0, w - background.shape[1])),
+                        mode='edge')
+    residual = data - background
+    sigma = 1.4826 * np.median(np.abs(residual[::4, ::4]))
+    if sigma <= 0:
+        sigma = np.std(residual)
+    labels, nb_labels = ndimage.label(residual > threshold_sigma * sigma)
+    if nb_labels == 0:
+        return np.empty(0, dtype=STARS_DTYPE)
+    index = np.arange(1, nb_labels + 1)
+    npix = np.bincount(labels.ravel(), minlength=nb_labels + 1)[1:]
+    index = index[npix >= min_pixels]
+    flux = ndimage.sum_labels(residual, labels, index)
+    brightest = np.argsort(flux)[::-1][:max_stars]
+    index = index[brightest]
+    centroids = np.array(ndimage.center_of_mass(np.clip(residual, 0, None), labels, index)).reshape(-1, 2)
+
+    stars = np.empty(len(index), dtype=STARS_DTYPE)
+    stars['y'] = centroids[:, 0]
+    stars['x'] = centroids[:, 1]
+    stars['flux'] = flux[brightest]
+    stars['npix'] = npix[index - 1]
+    return stars
+
+
+def match_stars(ref_xy, xy, tolerance_px=3, search_radius_px=100):
+    """ Pairs two lists of star positions that differ by an unknown translation
+
+    The translation is first voted for, from the displacements between all
+    stars closer than search_radius_px, then stars are paired with their
+    mutual nearest neighbour, within tolerance_px once translated. Pairing
+    is done again through an affine transform fitted on those pairs, to
+    account for small rotation and scale differences.
+
+    Args:
+        ref_xy (Nx2 array): reference positions
+        xy (Mx2 array): positions to be matched
+    Returns:
+        ref_index, index: indices of the matched stars in ref_xy and xy
+    """
+    ref_xy = np.asarray(ref_xy, dtype=np.float64).reshape(-1, 2)
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    empty = np.empty(0, dtype=np.intp)
+    if len(ref_xy) == 0 or len(xy) == 0:
+        return empty, empty
+    tree = cKDTree(xy)
+    neighbours = tree.query_ball_point(ref_xy, r=search_radius_px)
+    displacements = [xy[n] - p for p, n in zip(ref_xy, neighbours) if n]
+    if not displacements:
+        return empty, empty
+    displacements = np.concatenate(displacements)
+    nb_bins = max(1, int(np.ceil(2 * search_radius_px / tolerance_px)))
+    counts, xedges, yedges = np.histogram2d(
+        displacements[:, 0], displacements[:, 1], bins=nb_bins,
+        range=[[-search_radius_px, search_radius_px]] * 2)
+    # Vote may be split between neighbour bins
+    counts = ndimage.uniform_filter(counts, size=2, mode='constant')
+    ix, iy = np.unravel_index(np.argmax(counts), counts.shape)
+    shift = np.array([xedges[ix], yedges[iy]])
+    voted = np.all(np.abs(displacements - shift) <= tolerance_px, axis=1)
+    if np.any(voted):
+        shift = np.median(displacements[voted], axis=0)
+
+    ref_index, index = _mutual_nearest(ref_xy + shift, xy, tree, tolerance_px)
+    if len(index) >= 3:
+        # Stars far from the center also see rotation and scale differences
+        matrix, offset, _, _ = fit_affine(ref_xy[ref_index], xy[index])
+        ref_index, index = _mutual_nearest(ref_xy @ matrix.T + offset, xy, tree, tolerance_px)
+    return ref_index, index
+
+
+def _mutual_nearest(ref_xy, xy, tree, tolerance_px):
+    distance, index = tree.query(ref_xy, distance_upper_bound=tolerance_px)
+    ref_index = np.flatnonzero(np.isfinite(distance))
+    index = index[ref_index]
+    _, back = cKDTree(ref_xy).query(xy[index])
+    mutual = back == ref_index
+    return ref_index[mutual], index[mutual]
+
+
+def fit_affine(src_xy, dst_xy, clip_sigma=3, iterations=3):
+    """ Least squares affine transform from src_xy to dst_xy, with outlier rejection
+
+    Returns:
+        matrix (2x2), offset (2,), rms residual of inliers, inliers mask,
+        such that dst = src @ matrix.T + offset
+    """
+    src_xy = np.asarray(src_xy, dtype=np.float64).reshape(-1, 2)
+    dst_xy = np.asarray(dst_xy, dtype=np.float64).reshape(-1, 2)
+    if len(src_xy) < 3:
+        raise error.AstrometrySolverError(f"Cannot fit an affine transform with {len(src_xy)} stars")
+    design = np.column_stack([src_xy, np.ones(len(src_xy))])
+    inliers = np.ones(len(src_xy), dtype=bool)
+    for _ in range(iterations):
+        params, *_ = np.linalg.lstsq(design[inliers], dst_xy[inliers], rcond=None)
+        residuals = np.hypot(*(design @ params - dst_xy).T)
+        rms = np.sqrt(np.mean(residuals[inliers] ** 2))
+        new_inliers = residuals <= max(clip_sigma * rms, 1e-6)
+        if np.count_nonzero(new_inliers) < 3 or np.array_equal(new_inliers, inliers):
+            break
+        inliers = new_inliers
+    params, *_ = np.linalg.lstsq(design[inliers], dst_xy[inliers], rcond=None)
+    rms = np.sqrt(np.mean(np.sum((design[inliers] @ params - dst_xy[inliers]) ** 2, axis=1)))
+    return params[:2].T, params[2], rms, inliers
+
+
+def predict_wcs(reference_wcs, center_xy, center_radec):
+    """ TAN WCS with the scale and orientation of reference_wcs, centered on center_radec
+
+    Args:
+        center_xy (tuple): 0-based pixel of the center
+        center_radec (tuple): position of the center, in degrees
+    """
+    predicted = WCS(naxis=2)
+    predicted.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    predicted.wcs.crpix = [center_xy[0] + 1, center_xy[1] + 1]
+    predicted.wcs.crval = list(center_radec)
+    predicted.wcs.cd = reference_wcs.celestial.pixel_scale_matrix
+    return predicted
+
+
+def compose_affine(tan_wcs, matrix, offset):
+    """ TAN WCS of pixels p such that tan_wcs sees them at matrix @ p + offset (0-based pixels) """
+    matrix = np.asarray(matrix, dtype=np.float64)
+    crpix = np.asarray(tan_wcs.wcs.crpix, dtype=np.float64)
+    composed = WCS(naxis=2)
+    composed.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    composed.wcs.crval = tan_wcs.wcs.crval
+    composed.wcs.cd = tan_wcs.pixel_scale_matrix @ matrix
+    composed.wcs.crpix = np.linalg.solve(matrix, crpix - 1 - offset) + 1
+    return composed
@@ -7,14 +7,9 @@ import os
 import time
 import traceback
 
-# Asynchronous stuff
-from threading import Event
-from threading import Thread
-
 # Astropy
 from astropy import units as u
 from astropy.coordinates import EarthLocation
-from astropy.coordinates import get_moon
 from astropy.coordinates import get_sun
 
 # Astroplan
@@ -22,6 +17,7 @@ from astroplan import Observer
 
 # Local stuff: Base
 from Base.Base import Base
+from ObservationPlanner.EphemerisCache import get_ephemeris_cache
 
 # Local stuff: IndiClient
 from helper.IndiClient import IndiClient
@@ -31,6 +27,7 @@ from helper.IndiClient import IndiClient
 # Local stuff: Utils
 from utils import error
 from utils.config import load_config
+from utils.lifecycle import LifecycleGraph
 #from pocs.utils import images as img_utils
 from utils import load_module
 
@@ -48,6 +45,8 @@ class Manager(Base):
         self.guider                = None
         self.independant_services  = None
         self.is_initialized        = False
+        self.last_park_report      = None
+        self.last_unpark_report    = None
         self.mount                 = None
         self.observatory           = None
         self.scheduler             = None
@@ -69,6 +68,10 @@ class Manager(Base):
     def earth_location(self):
         return self.observatory.getAstropyEarthLocation()
 
+    @property
+    def ephemeris(self):
+        return get_ephemeris_cache(self.observatory, self.serv_time)
+
     @property
     def is_dark(self):
         horizon = -18 * u.degree
@@ -163,22 +166,21 @@ class Manager(Base):
             if self.current_observation:
                 status['observation'] = self.current_observation.status()
 
-            evening_astro_time = self.observer.twilight_evening_astronomical(t,
-                                 which='next')
-            morning_astro_time = self.observer.twilight_morning_astronomical(t,
-                                 which='next')
+            # Events and moon of the current night (noon to noon), from cache
+            ephemeris = self.ephemeris
+            night_events = ephemeris.get_night_events(t)
 
             status['observer'] = {
                 'siderealtime': str(self.sidereal_time),
                 'utctime': t,
                 'localtime': local_time,
-                'local_evening_astro_time': evening_astro_time,
-                'local_morning_astro_time': morning_astro_time,
-                'local_sun_set_time': self.observer.sun_set_time(t),
-                'local_sun_rise_time': self.observer.sun_rise_time(t),
-                'local_moon_alt': self.observer.moon_altaz(t).alt,
-                'local_moon_illumination': self.observer.moon_illumination(t),
-                'local_moon_phase': self.observer.moon_phase(t),
+                'local_evening_astro_time': night_events['evening_astro_time'],
+                'local_morning_astro_time': night_events['morning_astro_time'],
+                'local_sun_set_time': night_events['sun_set_time'],
+                'local_sun_rise_time': night_events['sun_rise_time'],
+                'local_moon_alt': ephemeris.get_moon_alt(t) * u.deg,
+                'local_moon_illumination': ephemeris.get_moon_illumination(t),
+                'local_moon_phase': ephemeris.get_moon_phase(t) * u.rad,
             }
 
         except Exception as e:  # pragma: no cover
@@ -265,12 +267,15 @@ class Manager(Base):
         self.logger.warning("TODO TN SHOULD CLEANUP THE DATA HERE")
         self.scheduler.reset_calibrated_list()
 
-    def observe(self):
+    def observe(self, notifier=None):
         """Take individual images for the current observation
 
         This method gets the current observation and takes the next
         corresponding exposure.
 
+        Args:
+            notifier (utils.EventWaiter, optional): notified each time a
+                camera is done with its exposure
         """
         # Get observatory metadata
         headers = self.get_standard_headers()
@@ -287,7 +292,8 @@ class Manager(Base):
             try:
                 # Start the exposures
                 cam_event = camera.take_observation(
-                    observation=self.current_observation, headers=headers)
+                    observation=self.current_observation, headers=headers,
+                    notifier=notifier)
                 camera_events[cam_name] = cam_event
             except Exception as e:
                 self.logger.error(f"Problem waiting for images, {e}: {traceback.format_exc()}")
@@ -391,13 +397,29 @@ class Manager(Base):
             self.logger.error('Error while trying to initialize tracking')
             return False
 
-    def get_standard_headers(self, observation=None):
+    def get_guiding_headers(self, start_time, end_time):
+        """Guiding statistics over the time span of an exposure
+
+        Args:
+            start_time, end_time (float): unix timestamps of the exposure
+
+        Returns:
+            dict: guiding headers, empty if there is no guider
+        """
+        if self.guider is None or getattr(self.guider, 'telemetry', None) is None:
+            return {}
+        stats = self.guider.telemetry.get_stats(start_time, end_time)
+        return {f"guiding_{k}": v for k, v in stats.items()}
+
+    def get_standard_headers(self, observation=None, exposure_span=None):
         """Get a set of standard headers
 
         Args:
             observation (`~pocs.scheduler.observation.Observation`, optional): The
                 observation to use for header values. If None is given, use
                 the `current_observation`.
+            exposure_span (tuple, optional): (start, end) unix timestamps of an
+                exposure that is over, to add guiding statistics to the headers
 
         Returns:
             dict: The standard headers
@@ -412,19 +434,19 @@ class Manager(Base):
         self.logger.debug(f"Getting headers for : {observation}")
         target = observation.target
         t0 = self.serv_time.get_astropy_time_from_utc()
-        moon = get_moon(t0, self.observer.location)
+        ephemeris = self.ephemeris
         mnt_coord = self.mount.get_current_coordinates()
         guide_rate = self.mount.get_guide_rate()
 
         # Filling up header for the new image to be written
         headers = {
-            'airmass': self.observer.altaz(t0, target).secz.value,
+            'airmass': ephemeris.get_target_airmass(t0, target.coord),
             'creator': "RemoteObservatory_{}".format(self.__version__),
             'elevation': self.earth_location.height.value,
             'latitude': self.earth_location.lat.value,
             'longitude': self.earth_location.lon.value,
-            'moon_fraction': self.observer.moon_illumination(t0),
-            'moon_separation': target.coord.separation(moon).value,
+            'moon_fraction': ephemeris.get_moon_illumination(t0),
+            'moon_separation': ephemeris.get_moon_separation(t0, target.coord),
             'observer': self.config.get('name', ''),
             'ra_mnt': mnt_coord.ra.to(u.deg).value,
             'ha_mnt': mnt_coord.ra.to(u.hourangle).value,
@@ -444,6 +466,9 @@ class Manager(Base):
         except BaseException:
             equinox = 2000.  # We assume J2000
         headers['equinox'] = equinox
+
+        if exposure_span is not None:
+            headers.update(self.get_guiding_headers(*exposure_span))
         return headers
 
     def perform_cameras_autofocus(self, camera_list=None, coarse=False):
@@ -533,90 +558,71 @@ class Manager(Base):
             return False
 
     def unpark(self):
-        try:
-            # unpark the observatory
-            self.observatory.unpark()
+        """ Unpark everything, in parallel where dependencies allow it
 
-            # unpark the mount
-            self.mount.unpark()
-
-            # Mount and observatory are ready, we can vizualize
-            if self.vizualization_service:
-                self.logger.debug("About to start vizualization service")
-                self.vizualization_service.start()
+        Mount and cameras are powered by the observatory, the guider needs the
+        mount and the guiding camera. Nothing starts if what it depends on
+        failed.
 
-            # unpark cameras
+        Returns: True if everything was unparked
+        """
+        try:
+            graph = LifecycleGraph("unpark", continue_on_failure=False)
+            graph.add("observatory", self.observatory.unpark, timeout_s=200)
+            graph.add("mount", self.mount.unpark, depends_on=["observatory"], timeout_s=200)
+            camera_nodes = []
             for camera_name, camera in self.cameras.items():
-                self.logger.debug(f"About to unpark camera {camera_name}")
-                camera.unpark()
-
-            # Launch guider server
+                camera_nodes.append(f"camera_{camera_name}")
+                graph.add(camera_nodes[-1], camera.unpark, depends_on=["observatory"])
+            if self.vizualization_service:
+                # Mount and observatory are ready, we can vizualize
+                graph.add("vizualization", self.vizualization_service.start,
+                          depends_on=["observatory", "mount"])
             if self.guider is not None:
-                self.logger.debug("About to start guider")
-                self.guider.launch_server()
-                self.guider.connect_server()
-                # self.guider.connect_profile()
-
-            return True
+                def unpark_guider():
+                    self.guider.launch_server()
+                    self.guider.connect_server()
+                    # self.guider.connect_profile()
+                graph.add("guider", unpark_guider, depends_on=["mount"] + camera_nodes)
+            self.last_unpark_report = graph.run()
+            return self.last_unpark_report.succeeded
         except Exception as e:
             self.logger.error(f"Problem unparking: {e}")
             return False
+
     def power_down(self):
         self.logger.info("Powering down observatory")
 
     def park(self):
-        try:
-            park_events = []
-            def call_subroutine_with_event(subroutine, event):
-                subroutine()
-                event.set()
-            def run_park_subroutine(subroutine, timeout_s=60):
-                park_event = Event()
-                park_events.append(park_event)
-                try:
-                    # There's one local event for each subroutine that might never be set ontime by the thread
-                    # and another event
-                    event = Event()
-                    thread = Thread(target=call_subroutine_with_event, args=(subroutine, event))
-                    thread.start()
-                    assert event.wait(timeout=timeout_s), f"Timeout while waiting for subroutine {subroutine}"
-                except Exception as e:
-                    self.logger.error(f"There has been an error while trying to park with routine {subroutine}:{e}")
-                finally:
-                    park_event.set()
+        """ Park everything, in parallel where dependencies allow it
 
-            def park_guider():
-                # close running guider server and client
-                if self.guider is not None:
+        Guider, cameras, vizualization and mount park at the same time, the
+        observatory, that powers the mount and cameras, parks once they are
+        all over. A failed or timed out step does not prevent the others.
+
+        Returns: True if everything was parked
+        """
+        try:
+            graph = LifecycleGraph("park", continue_on_failure=True)
+            branches = []
+            if self.guider is not None:
+                def park_guider():
+                    # close running guider server and client
                     self.guider.disconnect_profile()
                     self.guider.disconnect_server()
-            run_park_subroutine(park_guider, timeout_s=60)
-
-            def park_camera(camera):
-                return lambda: camera.park()
+                graph.add("guider", park_guider, timeout_s=60)
+                branches.append("guider")
             for camera_name, camera in self.cameras.items():
-                run_park_subroutine(park_camera(camera), timeout_s=60)
-
-            def park_vizualization():
-                if self.vizualization_service:
-                    self.vizualization_service.stop()
-            run_park_subroutine(park_vizualization, timeout_s=60)
-
-            def park_mount():
-                self.mount.park()
-            run_park_subroutine(park_mount, timeout_s=200)
-
-            # Observatory is the only subroutine that should not be ran in parallel, to ensure dependency resolution
-            for e in park_events:
-                e.wait()
-            park_events = []
-            def park_observatory():
-                self.observatory.park()
-            run_park_subroutine(park_observatory, timeout_s=200)
-            for e in park_events:
-                e.wait()
-
-            return True
+                graph.add(f"camera_{camera_name}", camera.park, timeout_s=60)
+                branches.append(f"camera_{camera_name}")
+            if self.vizualization_service:
+                graph.add("vizualization", self.vizualization_service.stop, timeout_s=60)
+                branches.append("vizualization")
+            graph.add("mount", self.mount.park, timeout_s=200)
+            branches.append("mount")
+            graph.add("observatory", self.observatory.park, depends_on=branches, timeout_s=200)
+            self.last_park_report = graph.run()
+            return self.last_park_report.succeeded
         except Exception as e:
             self.logger.error(f"Problem parking: {e}")
             return False
@@ -781,6 +787,8 @@ class Manager(Base):
                         config=cam_config,
                         connect_on_create=False)
                     #cam.prepare_shoot()
+                    # Guiding statistics are only known once exposures are over
+                    cam.exposure_headers_provider = self.get_guiding_headers
                     self.cameras[cam.name] = cam
             except Exception as e:
                 raise RuntimeError(f"Problem setting up camera: {e}")
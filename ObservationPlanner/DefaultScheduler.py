@@ -15,9 +15,9 @@ from ObservationPlanner.LocalHorizonConstraint import LocalHorizonConstraint
 
 class DefaultScheduler(Scheduler):
 
-    def __init__(self, ntpServ, obs, config=None, path='.'):
+    def __init__(self, ntpServ, obs, config=None, path='.', name_cache=None):
         """ Inherit from the `Base Scheduler` """
-        super().__init__(ntpServ, obs, config=config, path=path)
+        super().__init__(ntpServ, obs, config=config, path=path, name_cache=name_cache)
 
 
 ##########################################################################
@@ -51,48 +51,13 @@ class DefaultScheduler(Scheduler):
         if time is None:
             time = self.serv_time.get_astropy_time_from_utc() #get_utc()
 
-        # dictionary where key is obs key and value is priority (aka merit)
-        # self.current_observation.exp_set_size
-        # self.current_observation.current_exp
-        # self.current_observation.number_exposures
-        # self.current_observation.observing_block
-        # if self.current_observation in self.observations.values()
-        # self.current_observation.observing_block.number_exposures
-        #valid_obs = {obs: 1.0 for obs in self.observations}
-        valid_obs = {obs: 1.0 for obs, obs_def in self.observations.items() if not obs_def.is_done}
-        best_obs = []
-        
         observer = self.obs.getAstroplanObserver()
 
-        for constraint in self.constraints:
-            self.logger.info(f"Checking Constraint: {constraint}")
-            for obs_key, observation in self.observations.items():
-                if obs_key in valid_obs:
-                    self.logger.debug(f"\tObservation: {obs_key}")
-                    score = constraint.compute_constraint(time, observer,
-                        observation.target.coord)
-                    # Check if the computed score is a boolean
-                    if isinstance(score, bool):
-                        self.logger.debug("\t\tVetoed if false: {}".format(score))
-                        # Log vetoed observations
-                        if not score:
-                            # if not valid, remove from valid_obs
-                            del valid_obs[obs_key]
-                    else:
-                        self.logger.debug('\t\tScore: {:.05f}'.format(score))
-                        # if valid, update valid_obs score (def start at 1)
-                        valid_obs[obs_key] += score
-
-        # Now add initial priority
-        for obs_key, score in valid_obs.items():
-            valid_obs[obs_key] = (score +
-                self.observations[obs_key].priority)
+        # Valid observations, along with their merit, sorted by decreasing merit
+        best_obs = self.rank_observations(time, observer)
 
         # if there are actually valid observation remaining
-        if len(valid_obs) > 0:
-            # Sort the list by highest score (reverse puts in correct order)
-            best_obs = sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
-
+        if len(best_obs) > 0:
             # Check new best against current_observation
             # if (self.current_observation is not None and
             #     best_obs[0][0] != self.current_observation.id):
@@ -0,0 +1,238 @@
+# Generic stuff
+from datetime import timedelta
+import threading
+
+# Numerical stuff
+import numpy as np
+
+# Astropy stuff
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import angular_separation
+from astropy.coordinates import get_body
+from astropy.time import Time
+
+# Astroplan stuff
+from astroplan import moon_illumination
+
+# Local stuff
+from Base.Base import Base
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_ephemeris_cache(obs, serv_time):
+    """ Returns the ephemeris cache shared by every user of the given observatory location
+
+    Args:
+        obs: the observatory, must provide getAstropyEarthLocation and getAstroplanObserver
+        serv_time: time service, used when the cache is built without a given time
+    """
+    location = obs.getAstropyEarthLocation()
+    key = (round(location.lat.to_value(u.deg), 6),
+           round(location.lon.to_value(u.deg), 6),
+           round(location.height.to_value(u.m), 1))
+    with _caches_lock:
+        if key not in _caches:
+            _caches[key] = EphemerisCache(obs, serv_time)
+        return _caches[key]
+
+
+class EphemerisCache(Base):
+    """
+    Nightly ephemeris precomputed on a time grid, for a given observatory
+
+    A night lasts from local noon to the next local noon. For the current night
+    the cache holds sun altitude, moon position, altitude, illumination and
+    phase, twilight and sun set/rise times as well as alt/az of every target
+    that has been registered with add_targets. Lookups between grid points are
+    linearly interpolated, so that they cost microseconds instead of a full
+    astropy transform. The whole cache is rebuilt (with the same targets) upon
+    the first lookup after local noon.
+    """
+
+    def __init__(self, obs, serv_time, time_resolution=5*u.minute, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.obs = obs
+        self.serv_time = serv_time
+        self.time_resolution = time_resolution
+        self._lock = threading.RLock()
+        self._night_start = None
+        self._night_end_jd = -np.inf
+        self._target_index = {}  # (ra, dec) in deg -> row in target arrays
+        self._target_alt = np.empty((0, 0))
+        self._target_az = np.empty((0, 0))
+
+    ##########################################################################
+    # Properties
+    ##########################################################################
+
+    @property
+    def night_start(self):
+        return self._night_start
+
+    ##########################################################################
+    # Methods
+    ##########################################################################
+
+    def is_valid(self, t):
+        return (self._night_start is not None and
+                self._night_start.jd <= t.jd < self._night_end_jd)
+
+    def refresh(self, t):
+        """ Rebuild the cache for the night (noon to noon) containing t, keeping registered targets """
+        with self._lock:
+            self._observer = self.obs.getAstroplanObserver()
+            self._night_start = self._get_local_noon(t)
+            self._night_end_jd = (self._night_start + 1*u.day).jd
+            nb_steps = int(np.ceil((1*u.day / self.time_resolution).decompose().value))
+            self._times = self._night_start + np.linspace(0, 1, nb_steps+1)*u.day
+            self._jd = self._times.jd
+            self.logger.debug(f"Building ephemeris cache for the night starting at {self._night_start.iso}")
+
+            # Sun and moon
+            self._sun_alt = self._observer.sun_altaz(self._times).alt.to_value(u.deg)
+            moon = get_body("moon", self._times, location=self._observer.location)
+            self._moon_ra = np.unwrap(moon.ra.to_value(u.rad))
+            self._moon_dec = moon.dec.to_value(u.rad)
+            self._moon_alt = self._observer.moon_altaz(self._times).alt.to_value(u.deg)
+            self._moon_illumination = np.asarray(moon_illumination(self._times))
+            self._moon_phase = self._observer.moon_phase(self._times).to_value(u.rad)
+
+            # Twilight and sun set/rise for this night
+            self._night_events = {
+                'evening_astro_time': self._observer.twilight_evening_astronomical(self._night_start, which='next'),
+                'morning_astro_time': self._observer.twilight_morning_astronomical(self._night_start, which='next'),
+                'sun_set_time': self._observer.sun_set_time(self._night_start, which='next'),
+                'sun_rise_time': self._observer.sun_rise_time(self._night_start, which='next')}
+
+            # Targets
+            keys = list(self._target_index)
+            self._target_index = {}
+            self._target_alt = np.empty((0, len(self._jd)))
+            self._target_az = np.empty((0, len(self._jd)))
+            if keys:
+                ra, dec = zip(*keys)
+                self._add_coords(SkyCoord(ra=ra*u.deg, dec=dec*u.deg, frame='icrs'))
+
+    def add_targets(self, targets):
+        """ Register targets (FixedTarget or SkyCoord, or a list of them), only new ones are computed """
+        if not isinstance(targets, (list, tuple)):
+            targets = [targets]
+        if len(targets) == 0:
+            return
+        coords = SkyCoord([getattr(target, 'coord', target) for target in targets])
+        with self._lock:
+            if self._night_start is None:
+                self.refresh(self.serv_time.get_astropy_time_from_utc())
+            self._add_coords(coords)
+
+    def get_night_events(self, t):
+        """ Twilight and sun set/rise times (astropy Time) of the night containing t """
+        with self._lock:
+            self._check_night(t)
+            return self._night_events
+
+    def get_sun_alt(self, t):
+        """ Sun altitude in degrees """
+        return self._interpolate(t, '_sun_alt')
+
+    def get_moon_alt(self, t):
+        """ Moon altitude in degrees """
+        return self._interpolate(t, '_moon_alt')
+
+    def get_moon_illumination(self, t):
+        return self._interpolate(t, '_moon_illumination')
+
+    def get_moon_phase(self, t):
+        """ Moon phase angle in radians """
+        return self._interpolate(t, '_moon_phase')
+
+    def get_moon_separation(self, t, coords):
+        """ Angular separation in degrees between the moon and coords (SkyCoord, possibly a vector) """
+        moon_ra = self._interpolate(t, '_moon_ra')
+        moon_dec = self._interpolate(t, '_moon_dec')
+        coords = self._to_icrs(coords)
+        return np.degrees(angular_separation(moon_ra, moon_dec,
+                                             coords.ra.to_value(u.rad), coords.dec.to_value(u.rad)))
+
+    def get_target_altaz(self, t, coords):
+        """ Altitude and azimuth in degrees of coords (SkyCoord, possibly a vector) at time t
+
+        Targets that have not been registered yet are added to the cache first.
+
+        Returns:
+            tuple: numpy arrays (alt, az), or floats for a scalar coords
+        """
+        icrs = self._to_icrs(coords)
+        keys = list(zip(np.atleast_1d(icrs.ra.to_value(u.deg)), np.atleast_1d(icrs.dec.to_value(u.deg))))
+        with self._lock:
+            self._check_night(t)
+            missing = [i for i, key in enumerate(keys) if key not in self._target_index]
+            if missing:
+                self._add_coords(icrs[missing] if not icrs.isscalar else icrs.reshape((1,)))
+            rows = [self._target_index[key] for key in keys]
+            index, frac = self._grid_position(t)
+            alt = self._target_alt[rows, index] * (1 - frac) + self._target_alt[rows, index + 1] * frac
+            az = (self._target_az[rows, index] * (1 - frac) + self._target_az[rows, index + 1] * frac) % 360
+        if icrs.isscalar:
+            return float(alt[0]), float(az[0])
+        return alt, az
+
+    def get_target_airmass(self, t, coords):
+        """ Airmass (sec z, as astropy would give) of coords at time t """
+        alt, _ = self.get_target_altaz(t, coords)
+        return 1 / np.sin(np.radians(alt))
+
+    ##########################################################################
+    # Private Methods
+    ##########################################################################
+
+    def _get_local_noon(self, t):
+        timezone = getattr(self._observer, 'timezone', None)
+        local = t.to_datetime(timezone=timezone) if timezone is not None else t.to_datetime()
+        noon = local.replace(hour=12, minute=0, second=0, microsecond=0)
+        if local < noon:
+            noon -= timedelta(days=1)
+        return Time(noon)
+
+    @staticmethod
+    def _to_icrs(coords):
+        return coords if coords.frame.name == 'icrs' else coords.icrs
+
+    def _check_night(self, t):
+        if not self.is_valid(t):
+            self.refresh(t)
+
+    def _grid_position(self, t):
+        pos = (t.jd - self._jd[0]) / (self._jd[1] - self._jd[0])
+        index = min(max(int(pos), 0), len(self._jd) - 2)
+        return index, pos - index
+
+    def _interpolate(self, t, name):
+        with self._lock:
+            self._check_night(t)
+            values = getattr(self, name)
+            index, frac = self._grid_position(t)
+            return float(values[index] * (1 - frac) + values[index + 1] * frac)
+
+    def _add_coords(self, coords):
+        """ Must be called with the lock held, coords is a vector SkyCoord """
+        icrs = coords.icrs
+        keys = list(zip(icrs.ra.to_value(u.deg), icrs.dec.to_value(u.deg)))
+        new_keys = {}
+        for i, key in enumerate(keys):
+            if key not in self._target_index and key not in new_keys:
+                new_keys[key] = i
+        if not new_keys:
+            return
+        icrs = icrs[list(new_keys.values())]
+        altaz = self._observer.altaz(self._times, icrs, grid_times_targets=True)
+        alt = np.atleast_2d(altaz.alt.to_value(u.deg))
+        # Unwrap azimuth along time, so that interpolation does not go through 180 at the north crossing
+        az = np.degrees(np.unwrap(np.atleast_2d(altaz.az.to_value(u.rad)), axis=1))
+        for key in new_keys:
+            self._target_index[key] = len(self._target_index)
+        self._target_alt = np.vstack((self._target_alt, alt))
+        self._target_az = np.vstack((self._target_az, az))
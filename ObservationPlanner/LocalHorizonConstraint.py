@@ -36,13 +36,14 @@ class LocalHorizonConstraint(Constraint):
     def altazs_to_horizon_alt(self, altazs):
         return self.horizon_interpolator(altazs.az.wrap_at(360*u.deg).value)*u.deg
 
-    def compute_constraint(self, times, observer, target):
-        # First defin the altaz frame for the current observer
-        altaz_frame = AltAz(obstime=times,
-                            location=observer.location)
-
-        # Then compute altaz for target
-        target_altaz = target.transform_to(altaz_frame)
+    def compute_constraint(self, times, observer, target, target_altaz=None):
+        """
+        target_altaz : optional AltAz coordinates of target at times, if the
+            caller already computed them
+        """
+        # Compute altaz for target, with refraction from observer pressure
+        if target_altaz is None:
+            target_altaz = observer.altaz(times, target)
 
         # Now compute the horizon for each target azimuth
         hor_alt = self.altazs_to_horizon_alt(target_altaz)
@@ -4,6 +4,9 @@ import json
 import logging
 import os
 
+# Numerical stuff
+import numpy as np
+
 # Astropy stuff
 from astropy import units as u
 from astropy.coordinates import SkyCoord
@@ -24,8 +27,10 @@ from ObservationPlanner.LocalHorizonConstraint import LocalHorizonConstraint
 
 # Local stuff
 from Base.Base import Base
+from ObservationPlanner.EphemerisCache import get_ephemeris_cache
 #from ObservationPlanner.ObservationPlanner import ObservationPlanner
 from ObservationPlanner.Observation import Observation
+from ObservationPlanner.TargetNameCache import TargetNameCache
 from utils import is_jsonable
 from utils.config import load_config
 from utils.config import save_config
@@ -36,7 +41,7 @@ class Scheduler(Base):
     # we split into smaller slots
     MaximumSlotDurationSec = 60 * 20 * u.second
 
-    def __init__(self, ntpServ, obs, config=None, path='.'):
+    def __init__(self, ntpServ, obs, config=None, path='.', name_cache=None):
         """Loads `~pocs.scheduler.field.Field`s from a field
 
         Note:
@@ -53,6 +58,8 @@ class Scheduler(Base):
             config_file (str): YAML file containing field parameters.
             constraints (list, optional): List of `Constraints` to apply to each
                 observation.
+            name_cache (TargetNameCache, optional): cache used to resolve
+                target names, defaults to a Sesame based cache.
             *args: Arguments to be passed to `PanBase`
             **kwargs: Keyword args to be passed to `PanBase`
 
@@ -77,6 +84,8 @@ class Scheduler(Base):
         self.observed_list = OrderedDict()
         self.calibrated_list = OrderedDict()
         self.constraints = []
+        self.ephemeris = get_ephemeris_cache(obs, ntpServ)
+        self.name_cache = TargetNameCache() if name_cache is None else name_cache
 
         if config is None:
             self.read_config()
@@ -184,6 +193,67 @@ class Scheduler(Base):
         if self.current_observation is not None:
             status['current_observation'] = self.current_observation.status()
 
+    def compute_scores(self, time, observer, obs_keys):
+        """Score all observations of obs_keys against every constraint at once
+
+        Coordinates of all targets are stacked into a single `SkyCoord`, so
+        that each constraint evaluates the whole set in one vectorized call.
+        Alt/az of the targets are computed once, and given to the local
+        horizon constraint.
+        Results are added to the score, that starts at 1, numpy booleans
+        counting as 0/1, and only a plain bool is a veto: this is what the
+        former per target evaluation did, as astroplan constraints return
+        numpy booleans.
+
+        Args:
+            time (astropy.time.Time): Time at which constraints are evaluated
+            observer (astroplan.Observer): Observer for the constraints
+            obs_keys (list): keys of `self.observations` to be scored
+
+        Returns:
+            tuple: (valid, scores) numpy arrays aligned with obs_keys
+        """
+        nb_obs = len(obs_keys)
+        valid = np.ones(nb_obs, dtype=bool)
+        scores = np.ones(nb_obs, dtype=np.float64)
+        if nb_obs == 0:
+            return valid, scores
+
+        targets = SkyCoord([self.observations[obs_key].target.coord
+                            for obs_key in obs_keys])
+        altaz = observer.altaz(time, targets)
+        for constraint in self.constraints:
+            self.logger.info(f"Checking Constraint: {constraint}")
+            if isinstance(constraint, LocalHorizonConstraint):
+                result = constraint.compute_constraint(time, observer, targets,
+                                                       target_altaz=altaz)
+            else:
+                result = constraint.compute_constraint(time, observer, targets)
+            if isinstance(result, bool):
+                self.logger.debug(f"\tVetoed if false: {result}")
+                valid &= result
+            else:
+                scores += np.broadcast_to(np.asanyarray(result, dtype=np.float64), (nb_obs,))
+        return valid, scores
+
+    def rank_observations(self, time, observer):
+        """Rank observations that are not done yet, best first
+
+        Returns:
+            list: (observation key, merit) tuples of valid observations,
+            sorted by decreasing merit
+        """
+        obs_keys = [obs_key for obs_key, obs_def in self.observations.items()
+                    if not obs_def.is_done]
+        valid, scores = self.compute_scores(time, observer, obs_keys)
+
+        # Now add initial priority
+        valid_obs = {obs_key: float(score) + self.observations[obs_key].priority
+                     for obs_key, is_valid, score in zip(obs_keys, valid, scores)
+                     if is_valid}
+        # Sort the list by highest score (reverse puts in correct order)
+        return sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
+
     def reset_observed_list(self):
         """Reset the observed list """
         self.logger.debug('Resetting observed list')
@@ -266,24 +336,37 @@ class Scheduler(Base):
         except Exception as e:
             self.logger.warning(f"Cannot add horizon constraint: {e}")
 
+    @staticmethod
+    def parse_target_coordinates(target_name):
+        """ Coordinates if target_name is a coordinate string, None otherwise
+
+        "5h12m43.2s +31d12m43s" is perfectly valid and does not need to be
+        resolved
+        """
+        try:
+            return SkyCoord(target_name, frame='icrs', equinox='J2000.0')
+        except Exception:
+            return None
+
+    def prefetch_target_names(self):
+        """ Resolve all target names of the config at once, before defining targets """
+        names = [target_name for target_name in self.config.get('targets', {})
+                 if self.parse_target_coordinates(target_name) is None]
+        unresolved = self.name_cache.prefetch(names)
+        if unresolved:
+            self.logger.warning(f"Cannot resolve targets {unresolved}")
+
     def define_target(self, target_name):
+        coord = self.parse_target_coordinates(target_name)
+        if coord is not None:
+            return FixedTarget(name=target_name.replace(" ", ""), coord=coord)
         try:
             target = FixedTarget(
                 name=target_name,
-                coord=SkyCoord(
-                    SkyCoord.from_name(target_name,
-                                       frame="icrs"),
-                    equinox=Time('J2000')))
-        except:
-            try:
-                #"5h12m43.2s +31d12m43s" is perfectly valid
-                target = FixedTarget(name=target_name.replace(" ", ""),
-                                     coord=SkyCoord(
-                                         target_name,
-                                         frame='icrs',
-                                         equinox='J2000.0'))
-            except:
-                raise RuntimeError(f"Scheduler: did not managed to define target {target_name}")
+                coord=SkyCoord(self.name_cache.get_coord(target_name),
+                               equinox=Time('J2000')))
+        except Exception as e:
+            raise RuntimeError(f"Scheduler: did not managed to define target {target_name}: {e}")
         return target
 
     def initialize_target_list(self):
@@ -297,6 +380,9 @@ class Scheduler(Base):
             self.logger.warning('Target list seems to be empty')
             return
 
+        # Resolve all names at once (served from the on-disk cache if fresh)
+        self.prefetch_target_names()
+
         #TODO TN readout time, get that info from camera
         camera_time = 1*u.second
         for target_name, filter_config in self.config['targets'].items():
@@ -338,6 +424,9 @@ class Scheduler(Base):
                     except AssertionError as e:
                         self.logger.debug(f"Error while adding target : {e}")
 
+        # Precompute ephemeris of all targets for the night
+        self.ephemeris.add_targets([obs.target for obs in self.observations.values()])
+
 ##########################################################################
 # Utility Methods
 ##########################################################################
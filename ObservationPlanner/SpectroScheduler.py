@@ -7,9 +7,6 @@ from astropy.time import Time
 from astropy import units as u
 from astropy.coordinates import SkyCoord
 
-# Astrophysical informations
-from astroquery.simbad import Simbad
-
 # Astroplan stuff
 from astroplan import FixedTarget
 from astroplan import ObservingBlock
@@ -17,8 +14,9 @@ from astroplan import ObservingBlock
 # Local stuff
 from ObservationPlanner.Scheduler import Scheduler
 from ObservationPlanner.SpectralObservation import SpectralObservation
+from ObservationPlanner.TargetNameCache import SimbadResolver
+from ObservationPlanner.TargetNameCache import TargetNameCache
 from utils import listify
-from Spectro.OTypes import otypes
 from Spectro.ReferenceStarFinder import best_references
 
 # Locally defined constraints
@@ -27,9 +25,17 @@ from ObservationPlanner.LocalHorizonConstraint import LocalHorizonConstraint
 
 class SpectroScheduler(Scheduler):
 
-    def __init__(self, ntpServ, obs, config=None, path='.'):
-        """ Inherit from the `Base Scheduler` """
-        super().__init__(ntpServ, obs, config=config, path=path)
+    def __init__(self, ntpServ, obs, config=None, path='.', name_cache=None,
+                 spectral_name_cache=None):
+        """ Inherit from the `Base Scheduler`
+
+        spectral_name_cache (TargetNameCache, optional): cache used to resolve
+            target names along with spectral informations, defaults to a
+            SIMBAD based cache.
+        """
+        self.spectral_name_cache = (TargetNameCache(resolver=SimbadResolver())
+                                    if spectral_name_cache is None else spectral_name_cache)
+        super().__init__(ntpServ, obs, config=config, path=path, name_cache=name_cache)
 
     ##########################################################################
     # Properties
@@ -39,116 +45,38 @@ class SpectroScheduler(Scheduler):
     # Methods
     ##########################################################################
     def define_target(self, target_name):
-        target = None
         spinfo = {}
+        coord = self.parse_target_coordinates(target_name)
+        if coord is not None:
+            return FixedTarget(name=target_name.replace(" ", ""), coord=coord), spinfo
         try:
-            simbad = Simbad()
-            # standard name of the object type
-            simbad.add_votable_fields('otype')
-            # list of (secondary) object types for one object
-            simbad.add_votable_fields('otypes')
-            # spectral type value
-            simbad.add_votable_fields('sp')
-            # spectral type nature ('s'pectroscopic, 'a'bsorbtion, 'e'mmission
-            simbad.add_votable_fields('sp_nature')
-            # spectral type quality (A: best, .., E: worst)
-            simbad.add_votable_fields('sp_qual')
-            # all fields related with the spectral type
-            simbad.add_votable_fields('sptype')
-            # all fields related with radial velocity and redshift
-            simbad.add_votable_fields('velocity')
-            # all fields related with the proper motions
-            simbad.add_votable_fields('propermotions')
-            CDS = simbad.query_object(target_name)
-        except:
-            CDS = None
-
-        if CDS is not None:  # Object found in SIMBAD, along with all info
-            # overview of keywords with the previous votable fields
-            # CDS.colnames
-            # ['MAIN_ID',
-            # 'RA',
-            # 'DEC',
-            # 'RA_PREC',
-            # 'DEC_PREC',
-            # 'COO_ERR_MAJA',
-            # 'COO_ERR_MINA',
-            # 'COO_ERR_ANGLE',
-            # 'COO_QUAL',
-            # 'COO_WAVELENGTH',
-            # 'COO_BIBCODE',
-            # 'OTYPE',
-            # 'OTYPES',
-            # 'RVZ_TYPE',
-            # 'RVZ_RADVEL',
-            # 'RVZ_ERROR',
-            # 'RVZ_QUAL',
-            # 'RVZ_WAVELENGTH',
-            # 'RVZ_BIBCODE',
-            # 'SP_TYPE',
-            # 'SP_QUAL',
-            # 'SP_TYPE_2',
-            # 'SP_QUAL_2',
-            # 'SP_BIBCODE',
-            # 'OTYPE_2',
-            # 'PMRA',
-            # 'PMDEC',
-            # 'PMRA_PREC',
-            # 'PMDEC_PREC',
-            # 'PM_ERR_MAJA',
-            # 'PM_ERR_MINA',
-            # 'PM_ERR_ANGLE',
-            # 'PM_QUAL',
-            # 'PM_BIBCODE']
-            # for sptypes, check 
-            # http://simbad.u-strasbg.fr/simbad/sim-display?data=sptypes
-            # eventually CDS["SP_TYPE"][0] returns 'B8.5Ib-II'
-            ra_h_m_s = np.array([*map(float, CDS['RA'][0].split(" "))])
-            dec_d_m_s = np.array([*map(float, CDS['DEC'][0].split(" "))])
-
-            # Right ascension
-            # 1 hourangle is 1/24 of a circle
-            # 1 minute of RA is 1/60 of an hourangle
-            # 1 second of RA is 1/3600 of an hourangle
-            # Declination
-            # 1 degree is 1/360 of a circle
-            # 1 arcminute is 1/60 of a degree
-            # 1 arcsecond is 1/3600 of a degree
-            coord = SkyCoord(
-                ra=np.dot(ra_h_m_s, np.array([u.hourangle, u.hourangle / 60, u.hourangle / 3600])).to(u.degree),
-                dec=np.dot(dec_d_m_s, np.array([u.degree, u.arcminute, u.arcsecond])),
-                frame='icrs',
-                equinox='J2000.0')
-            target = FixedTarget(name=target_name.replace(" ", ""),
-                                 coord=coord)
-            spinfo["MAIN_ID"] = CDS['MAIN_ID'][0]
-            spinfo["OTYPE"] = CDS['OTYPE'][0]
-            spinfo["OTYPES"] = CDS['OTYPES'][0]
-            try:
-                spinfo["OTYPE_COMMENT"] = otypes[spinfo["OTYPE"]]
-            except KeyError:
-                spinfo["OTYPE_COMMENT"] = ""
-            spinfo["SP_TYPE"] = CDS['SP_TYPE'][0]
-            spinfo["RVZ_RADVEL"] = float(CDS['RVZ_RADVEL'][0])
-            spinfo["RVZ_TYPE"] = str(CDS['RVZ_TYPE'][0])
-        if CDS is None:
+            # Object found in SIMBAD, along with all info
+            entry = self.spectral_name_cache.get(target_name)
+            coord = SkyCoord(ra=entry["ra"]*u.deg,
+                             dec=entry["dec"]*u.deg,
+                             frame='icrs',
+                             equinox='J2000.0')
+            spinfo = entry["spinfo"]
+        except Exception as e:
+            self.logger.warning(f"Spectral target {target_name} not found in CDS ({e}), trying astropy engine")
             try:
-                self.logger.warning(f"Spectral target {target_name} not found in CDS, trying astropy engine")
-                coord = SkyCoord(SkyCoord.from_name(target_name, parse=True, frame="icrs"), equinox=Time('J2000'))
-                target = FixedTarget(name=target_name.replace(" ", ""),
-                                     coord=coord)
-            except:
-                try:
-                    # "5h12m43.2s +31d12m43s" is perfectly valid
-                    coord = SkyCoord(target_name,
-                                     frame='icrs',
-                                     equinox='J2000.0')
-                    target = FixedTarget(name=target_name.replace(" ", ""),
-                                         coord=coord)
-                except:
-                    raise RuntimeError(f"SpectroScheduler: did not managed to define target {target_name}")
+                coord = SkyCoord(self.name_cache.get_coord(target_name), equinox=Time('J2000'))
+            except Exception as e:
+                raise RuntimeError(f"SpectroScheduler: did not managed to define target {target_name}: {e}")
+        target = FixedTarget(name=target_name.replace(" ", ""), coord=coord)
         return target, spinfo
 
+    def prefetch_target_names(self):
+        """ Resolve all target names of the config at once, before defining targets """
+        names = [target_name for target_name in self.config.get('targets', {})
+                 if self.parse_target_coordinates(target_name) is None]
+        unresolved = self.spectral_name_cache.prefetch(names)
+        if unresolved:
+            self.logger.warning(f"Cannot resolve targets {unresolved} in CDS, trying astropy engine")
+            unresolved = self.name_cache.prefetch(unresolved)
+        if unresolved:
+            self.logger.warning(f"Cannot resolve targets {unresolved}")
+
     def get_best_reference_target(self, observation):
         ob = observation.observing_block
         maxseparation = 15 * u.deg
@@ -208,6 +136,9 @@ class SpectroScheduler(Scheduler):
             self.logger.warning('Target list seems to be empty')
             return
 
+        # Resolve all names at once (served from the on-disk cache if fresh)
+        self.prefetch_target_names()
+
         # TODO TN readout time, get that info from camera
         camera_time = 1 * u.second
         for target_name, config in self.config['targets'].items():
@@ -248,6 +179,9 @@ class SpectroScheduler(Scheduler):
                 except AssertionError as e:
                     self.logger.debug(f"Error while adding target : {e}")
 
+        # Precompute ephemeris of all targets for the night
+        self.ephemeris.add_targets([obs.target for obs in self.observations.values()])
+
     def add_observation(self, observing_block, exp_set_size=None,
                         is_reference_observation=False):
         """Adds an `Observation` to the scheduler
@@ -304,41 +238,13 @@ class SpectroScheduler(Scheduler):
         if time is None:
             time = self.serv_time.get_astropy_time_from_utc()  # get_utc()
 
-        # dictionary where key is obs key and value is priority (aka merit)
-        valid_obs = {obs: 1.0 for obs, obs_def in self.observations.items() if not obs_def.is_done}
-        best_obs = []
-
         observer = self.obs.getAstroplanObserver()
 
-        for constraint in self.constraints:
-            self.logger.info(f"Checking Constraint: {constraint}")
-            for obs_key, observation in self.observations.items():
-                if obs_key in valid_obs:
-                    self.logger.debug(f"\tObservation: {obs_key}")
-                    score = constraint.compute_constraint(time, observer,
-                                                          observation.target.coord)
-                    # Check if the computed score is a boolean
-                    if isinstance(score, bool):
-                        self.logger.debug(f"\t\tVetoed if false: {score}")
-                        # Log vetoed observations
-                        if not score:
-                            # if not valid, remove from valid_obs
-                            del valid_obs[obs_key]
-                    else:
-                        self.logger.debug('\t\tScore: {:.05f}'.format(score))
-                        # if valid, update valid_obs score (def start at 1)
-                        valid_obs[obs_key] += score
-
-        # Now add initial priority
-        for obs_key, score in valid_obs.items():
-            valid_obs[obs_key] = (score +
-                                  self.observations[obs_key].priority)
+        # Valid observations, along with their merit, sorted by decreasing merit
+        best_obs = self.rank_observations(time, observer)
 
         # if there are actually valid observation remaining
-        if len(valid_obs) > 0:
-            # Sort the list by highest score (reverse puts in correct order)
-            best_obs = sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
-
+        if len(best_obs) > 0:
             # # Check new best against current_observation
             # if (self.current_observation is not None and
             #         best_obs[0][0] != self.current_observation.id):
@@ -0,0 +1,235 @@
+# Generic stuff
+import json
+import os
+import threading
+import time
+
+# Numerical stuff
+import numpy as np
+
+# Astropy stuff
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+
+# Local stuff
+from Base.Base import Base
+from Spectro.OTypes import otypes
+
+
+class TargetResolver:
+    """
+    Interface of a target name resolver, used by `TargetNameCache`
+
+    resolve returns a dict with at least ra and dec (ICRS, degrees), and
+    possibly additional information (spinfo), or raises LookupError if the
+    target cannot be resolved. Any other exception (network, ...) is
+    considered a transient failure.
+    """
+    name = "resolver"
+
+    def resolve(self, target_name):
+        raise NotImplementedError
+
+
+class SesameResolver(TargetResolver):
+    """ Resolves names through astropy `SkyCoord.from_name` (CDS Sesame)
+
+    astropy raises NameResolveError both for unknown names and when no Sesame
+    mirror can be reached: only the former is a LookupError.
+    """
+    name = "sesame"
+
+    def resolve(self, target_name):
+        from astropy.coordinates.name_resolve import NameResolveError
+        try:
+            coord = SkyCoord.from_name(target_name, frame="icrs")
+        except NameResolveError as e:
+            if str(e).startswith("Unable to find coordinates"):
+                raise LookupError(f"Cannot resolve {target_name}: {e}")
+            raise ConnectionError(f"Sesame query for {target_name} failed: {e}")
+        return dict(ra=coord.ra.to_value(u.deg), dec=coord.dec.to_value(u.deg))
+
+
+class SimbadResolver(TargetResolver):
+    """ Resolves names through a SIMBAD query, along with spectral informations """
+    name = "simbad"
+
+    def resolve(self, target_name):
+        # Astrophysical informations
+        from astroquery.simbad import Simbad
+
+        simbad = Simbad()
+        # standard name of the object type
+        simbad.add_votable_fields('otype')
+        # list of (secondary) object types for one object
+        simbad.add_votable_fields('otypes')
+        # spectral type value
+        simbad.add_votable_fields('sp')
+        # spectral type nature ('s'pectroscopic, 'a'bsorbtion, 'e'mmission
+        simbad.add_votable_fields('sp_nature')
+        # spectral type quality (A: best, .., E: worst)
+        simbad.add_votable_fields('sp_qual')
+        # all fields related with the spectral type
+        simbad.add_votable_fields('sptype')
+        # all fields related with radial velocity and redshift
+        simbad.add_votable_fields('velocity')
+        # all fields related with the proper motions
+        simbad.add_votable_fields('propermotions')
+        CDS = simbad.query_object(target_name)
+        if CDS is None:
+            raise LookupError(f"Target {target_name} not found in SIMBAD")
+
+        # for sptypes, check
+        # http://simbad.u-strasbg.fr/simbad/sim-display?data=sptypes
+        # eventually CDS["SP_TYPE"][0] returns 'B8.5Ib-II'
+        ra_h_m_s = np.array([*map(float, CDS['RA'][0].split(" "))])
+        dec_d_m_s = np.array([*map(float, CDS['DEC'][0].split(" "))])
+
+        # Right ascension
+        # 1 hourangle is 1/24 of a circle
+        # 1 minute of RA is 1/60 of an hourangle
+        # 1 second of RA is 1/3600 of an hourangle
+        # Declination
+        # 1 degree is 1/360 of a circle
+        # 1 arcminute is 1/60 of a degree
+        # 1 arcsecond is 1/3600 of a degree
+        ra = np.dot(ra_h_m_s, np.array([u.hourangle, u.hourangle / 60, u.hourangle / 3600])).to(u.degree)
+        dec = np.dot(dec_d_m_s, np.array([u.degree, u.arcminute, u.arcsecond])).to(u.degree)
+        spinfo = dict()
+        spinfo["MAIN_ID"] = str(CDS['MAIN_ID'][0])
+        spinfo["OTYPE"] = str(CDS['OTYPE'][0])
+        spinfo["OTYPES"] = str(CDS['OTYPES'][0])
+        try:
+            spinfo["OTYPE_COMMENT"] = otypes[spinfo["OTYPE"]]
+        except KeyError:
+            spinfo["OTYPE_COMMENT"] = ""
+        spinfo["SP_TYPE"] = str(CDS['SP_TYPE'][0])
+        spinfo["RVZ_RADVEL"] = float(CDS['RVZ_RADVEL'][0])
+        spinfo["RVZ_TYPE"] = str(CDS['RVZ_TYPE'][0])
+        return dict(ra=ra.value, dec=dec.value, spinfo=spinfo)
+
+
+class TargetNameCache(Base):
+    """
+    Persistent target name -> coordinates (and spectral information) cache
+
+    Entries are stored in a json file, one per resolver, and are served
+    without any network access as long as they are younger than ttl_days.
+    Expired entries are resolved again, but still served if the resolver
+    fails (site offline). Names that the resolver does not know are cached
+    as well, so that they are not queried again before expiration, but an
+    entry that was resolved once is never replaced by a not found one.
+
+    Expected configuration, all entries being optional:
+
+    scheduler:
+        name_cache_directory: /opt/RemoteObservatory/resources
+        name_cache_ttl_days: 30
+    """
+
+    def __init__(self, resolver=None, cache_file=None, ttl_days=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolver = SesameResolver() if resolver is None else resolver
+        scheduler_config = self.config.get("scheduler", {})
+        if cache_file is None:
+            cache_directory = scheduler_config.get(
+                "name_cache_directory",
+                self.config.get("directories", {}).get("resources", "."))
+            cache_file = os.path.join(cache_directory, f"target_names_{self.resolver.name}.json")
+        self.cache_file = cache_file
+        if ttl_days is None:
+            ttl_days = scheduler_config.get("name_cache_ttl_days", 30)
+        self.ttl_sec = ttl_days * 86400
+        self._lock = threading.Lock()
+        self._entries = self._load()
+
+    ##########################################################################
+    # Methods
+    ##########################################################################
+
+    def get(self, target_name):
+        """ Returns a dict with ra, dec (ICRS degrees) and possibly spinfo
+
+        Raises:
+            LookupError: if the target cannot be resolved
+        """
+        entry = self._get_entries([target_name])[target_name]
+        if entry.get("not_found", False):
+            raise LookupError(f"Target {target_name} cannot be resolved by {self.resolver.name}")
+        return entry
+
+    def get_coord(self, target_name):
+        entry = self.get(target_name)
+        return SkyCoord(ra=entry["ra"]*u.deg, dec=entry["dec"]*u.deg, frame="icrs")
+
+    def prefetch(self, target_names, force=False):
+        """ Resolve all names that are not fresh in cache (or all of them if force), save the cache once
+
+        Returns:
+            list: names that could not be resolved
+        """
+        entries = self._get_entries(target_names, force=force, raise_on_failure=False)
+        return [name for name, entry in entries.items()
+                if entry is None or entry.get("not_found", False)]
+
+    ##########################################################################
+    # Private Methods
+    ##########################################################################
+
+    def _is_fresh(self, entry, now):
+        return entry is not None and (now - entry["resolved"]) < self.ttl_sec
+
+    def _get_entries(self, target_names, force=False, raise_on_failure=True):
+        now = time.time()
+        with self._lock:
+            entries = {name: self._entries.get(name) for name in target_names}
+        to_resolve = [name for name, entry in entries.items() if force or not self._is_fresh(entry, now)]
+        if not to_resolve:
+            return entries
+
+        for name in to_resolve:
+            try:
+                entry = self.resolver.resolve(name)
+            except LookupError as e:
+                if entries[name] is not None and not entries[name].get("not_found", False):
+                    self.logger.warning(f"{self.resolver.name} cannot resolve target {name} anymore ({e}), "
+                                        f"using expired cache entry")
+                    continue
+                self.logger.warning(f"{self.resolver.name} cannot resolve target {name}: {e}")
+                entry = dict(not_found=True)
+            except Exception as e:
+                if entries[name] is not None:
+                    self.logger.warning(f"{self.resolver.name} failed to resolve {name} ({e}), using "
+                                        f"expired cache entry")
+                    continue
+                if raise_on_failure:
+                    raise RuntimeError(f"{self.resolver.name} failed to resolve {name}: {e}")
+                self.logger.warning(f"{self.resolver.name} failed to resolve {name}: {e}")
+                continue
+            entry["resolved"] = now
+            entries[name] = entry
+            with self._lock:
+                self._entries[name] = entry
+        self._save()
+        return entries
+
+    def _load(self):
+        try:
+            with open(self.cache_file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.warning(f"Cannot read target name cache {self.cache_file}: {e}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.cache_file}.part"
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            with self._lock:
+                with open(tmp_path, "w") as f:
+                    json.dump(self._entries, f, indent=1)
+            os.replace(tmp_path, self.cache_file)
+        except Exception as e:
+            self.logger.warning(f"Cannot save target name cache {self.cache_file}: {e}")
@@ -1,6 +1,8 @@
 # Basic stuff
 import json
 import logging
+import os
+import socket
 import time
 
 # Local
@@ -8,6 +10,7 @@ from Base.Base import Base
 from helper.IndiDevice import IndiDevice
 from utils.error import ScopeControllerError
 from utils.error import IndiClientPredicateTimeoutError
+from utils.lifecycle import LifecycleGraph
 
 class UPBV2(IndiDevice, Base):
     """
@@ -632,79 +635,97 @@ class AggregatedCustomScopeController(Base):
     #     self.start_upbv2_driver()
     #     self.upbv2.initialize() # This force to put to zero power and usb usually before an indiserver reset
 
-    def unpark(self):
+    @staticmethod
+    def is_local_indi_host(indi_host):
+        return indi_host in ("localhost", "127.0.0.1", "::1", socket.gethostname(), socket.getfqdn())
 
+    def unpark(self):
+        """
+        Power sequence, as a dependency graph: once the upbv2 outputs are
+        switched on, the arduino driver is connected as soon as its serial
+        port shows up (after the driver delay if the INDI server is remote), while acquisition instruments wait for their own
+        delay before being powered.
+        upbv2 switches are only set from one step at a time, as they share
+        the same vectors.
+        """
         self.logger.debug("About to unpark in a reset-like manner")
         self.park()
 
         # Now actually start unparking
-        self.upbv2.unpark()
-        # self.logger.debug(f'1#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-
-        # Power servo controller
-        self.upbv2.power_on_arduino_control_box()
-        # self.logger.debug(f'2#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-
-        # power-on USB for the arduino
-        self.upbv2.switch_on_arduino_control_box_usb()
-        # self.logger.debug(f'3#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-        # self.logger.debug(f'3.5#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-
-        # Power acquisition instruments: this is a very specific case, see https://github.com/indilib/indi-3rdparty/issues/822
-        self.upbv2.switch_on_acquisition_equipments_usb()
-        # self.logger.debug(f'4#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-
-        # Power mount
-        self.switch_on_mount()
-        # self.logger.debug(f'5#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-
-        # Wait for the os serial port to be created, and stuff like that
-        time.sleep(self._indi_driver_connect_delay_s)
-
-        # Power acquisition instruments: this is a very specific case, see https://github.com/indilib/indi-3rdparty/issues/822
-        self.upbv2.power_on_acquisition_equipments()
-        # self.logger.debug(f'6#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-        # time.sleep(self._indi_driver_connect_delay_s)
-
-        # # start or restart drivers if needed
-        # self.start_all_drivers()
-        # Now we need to wait a bit before trying to connect driver
-        # but _indi_driver_connect_delay_s was already waited for at previous step
-        # for driver_name, device_name in self._indi_resetable_instruments_driver_map.items():
-        #     if not self.probe_device_driver_connection(driver_name=driver_name, device_name=device_name):
-        #         self.logger.debug(f"Device {device_name} doesn't seems to have its driver properly started - restarting")
-        #         self.restart_driver(driver_name)
-        # Now we need to wait a bit before trying to connect driver
-        # if not self.probe_device_driver_connection(driver_name=self._indi_mount_driver_name,
-        #                                            device_name=self._indi_mount_device_name):
-        #     self.restart_driver(self._indi_mount_driver_name)
-
+        graph = LifecycleGraph("scope_controller_unpark", continue_on_failure=False)
+        graph.add("upbv2", self.upbv2.unpark)
+
+        def switch_on_outputs():
+            # Power servo controller, and its USB
+            self.upbv2.power_on_arduino_control_box()
+            self.upbv2.switch_on_arduino_control_box_usb()
+            # Power acquisition instruments: this is a very specific case, see
+            # https://github.com/indilib/indi-3rdparty/issues/822
+            self.upbv2.switch_on_acquisition_equipments_usb()
+            # Power mount
+            self.switch_on_mount()
+        graph.add("upbv2_outputs", switch_on_outputs, depends_on=["upbv2"])
+
+        # Wait for the os serial port to be created, and stuff like that.
+        # The port only shows up on the machine that runs the INDI server
+        if self.is_local_indi_host(self.arduino_servo_controller.indi_client_config["indi_host"]):
+            graph.add("arduino_serial_port", lambda: None, depends_on=["upbv2_outputs"],
+                      ready=lambda: os.path.exists(self.arduino_servo_controller.device_port),
+                      timeout_s=self._indi_driver_connect_delay_s + 60)
+        else:
+            graph.add("arduino_serial_port",
+                      lambda: time.sleep(self._indi_driver_connect_delay_s),
+                      depends_on=["upbv2_outputs"],
+                      timeout_s=self._indi_driver_connect_delay_s + 60)
         # Initialize dependent device
-        # self.logger.debug(f'7#################################### {self.upbv2.get_switch("USB_PORT_CONTROL")["PORT_4"]}')
-        self.arduino_servo_controller.unpark()
+        graph.add("arduino_servo_controller", self.arduino_servo_controller.unpark,
+                  depends_on=["arduino_serial_port"])
+
+        def power_on_acquisition_equipments():
+            # USB must be up for a while before power is applied, see
+            # https://github.com/indilib/indi-3rdparty/issues/822
+            # there is no device we could check for this
+            time.sleep(self._indi_driver_connect_delay_s)
+            self.upbv2.power_on_acquisition_equipments()
+        graph.add("acquisition_equipments", power_on_acquisition_equipments,
+                  depends_on=["upbv2_outputs"], timeout_s=self._indi_driver_connect_delay_s + 60)
+
+        report = graph.run()
+        if not report.succeeded:
+            raise ScopeControllerError(f"Cannot unpark, failed steps: {report.failed_steps}")
 
         self.is_initialized = True
         self.logger.debug("Successfully unparked")
 
     def park(self):
         """
+        Acquisition instruments and arduino servo are switched off in
+        parallel, then the upbv2 that powers them
         :return:
         """
         self.logger.debug("Parking")
 
-        # Power acquisition instruments: this is a very specific case, see https://github.com/indilib/indi-3rdparty/issues/822
+        graph = LifecycleGraph("scope_controller_park", continue_on_failure=True)
         if self.is_initialized:
-            self.upbv2.power_off_acquisition_equipments()
-            time.sleep(1)
-            self.upbv2.switch_off_acquisition_equipments_usb()
-
+            def power_off_acquisition_equipments():
+                # Power acquisition instruments: this is a very specific case, see
+                # https://github.com/indilib/indi-3rdparty/issues/822
+                self.upbv2.power_off_acquisition_equipments()
+                time.sleep(1)
+                self.upbv2.switch_off_acquisition_equipments_usb()
+            graph.add("acquisition_equipments", power_off_acquisition_equipments)
             # Deinitialize arduino servo first (as it relies on upb power)
-            self.arduino_servo_controller.park()
+            graph.add("arduino_servo_controller", self.arduino_servo_controller.park)
 
         # Deinitialize upbv2
-        self.upbv2.park()
+        graph.add("upbv2", self.upbv2.park,
+                  depends_on=["acquisition_equipments", "arduino_servo_controller"]
+                  if self.is_initialized else [])
+        report = graph.run()
 
         self.is_initialized = False
+        if not report.succeeded:
+            raise ScopeControllerError(f"Cannot park, failed steps: {report.failed_steps}")
         self.logger.debug("Successfully parked")
 
     def open(self):
@@ -1,6 +1,7 @@
 # Generic
 from time import sleep
 import threading
+import time
 import traceback
 
 # Numerical stuff
@@ -32,6 +33,10 @@ class IterativeSync(Base):
         self.timeout_seconds = config["timeout_seconds"]
         self.max_iterations  = config["max_iterations"]
         self.max_pointing_error = OffsetError(*(config["max_pointing_error_seconds"]*u.arcsec,)*3)
+        # Iterations after the first one match stars with the last solved
+        # image, instead of solving, see Image.refine_wcs for parameters
+        self.refine_with_previous_wcs = config.get("refine_with_previous_wcs", True)
+        self.refine_params = config.get("refine_params", {})
 
     def points(self, mount, camera, observation, fits_headers):
         pointing_event = threading.Event()
@@ -52,6 +57,8 @@ class IterativeSync(Base):
             img_num = 0
             pointing_error = OffsetError(*(np.inf * u.arcsec,) * 3)
             pointing_error_stack = {}
+            # Last image that went through a full astrometric solve
+            reference_image = None
 
             while (img_num < self.max_iterations and pointing_error.magnitude > self.max_pointing_error.magnitude):
 
@@ -87,14 +94,27 @@ class IterativeSync(Base):
                     observation.last_pointing)
                 pointing_image = Image(pointing_path)
 
-                solve_params = dict(
-                    verbose=True,
-                    gen_hips=self.gen_hips,
-                    sampling_arcsec=camera.sampling_arcsec,
-                    downsample=camera.subsample_astrometry)
-                if img_num > 0:
-                    solve_params["use_header_position"] = True
-                pointing_image.solve_field(**solve_params)
+                astrometry_start = time.monotonic()
+                refined = False
+                if self.refine_with_previous_wcs and reference_image is not None:
+                    try:
+                        refinement = pointing_image.refine_wcs(reference_image, **self.refine_params)
+                        refined = True
+                        self.logger.info(f"Pointing image WCS refined from previous image in "
+                                         f"{time.monotonic() - astrometry_start:.2f}s: {refinement}")
+                    except Exception as e:
+                        self.logger.warning(f"Cannot refine WCS from previous image, solving instead: {e}")
+                if not refined:
+                    solve_params = dict(
+                        verbose=True,
+                        gen_hips=self.gen_hips,
+                        sampling_arcsec=camera.sampling_arcsec,
+                        downsample=camera.subsample_astrometry)
+                    if img_num > 0:
+                        solve_params["use_header_position"] = True
+                    pointing_image.solve_field(**solve_params)
+                    reference_image = pointing_image
+                    self.logger.info(f"Pointing image solved in {time.monotonic() - astrometry_start:.2f}s")
                 observation.pointing_image = pointing_image
                 self.logger.debug(f"Pointing file: {pointing_image}")
                 pointing_error = pointing_image.pointing_error()
@@ -1,6 +1,10 @@
 # basic stuff
-import numpy as np
 import gzip
+import logging
+import os
+
+# Numerical stuff
+import numpy as np
 
 BSC_FIELDS = {'hr': (1,4, int),
               'rahour':(76,2, int), 'ramin':(78,2,int), 'rasec':(80,4,float),
@@ -8,53 +12,96 @@ BSC_FIELDS = {'hr': (1,4, int),
               'desec': (89,2, int), 'vmag':(103,5,float)
               }
 
-def load_bright_star_5(filename, verbose=False):
-    #f=open(filename)
-    f=gzip.GzipFile(filename)
-    l=f.readline()
-    linecount=1
-    starcount=0
-    starerr=0
-    catalog=[]
-    while l != b'':
-        #print(l)
-        skipstar=False
-        bscstar=dict()
-        for fdesc, fuple in BSC_FIELDS.items():
-            try:
-                bscstar[fdesc]=fuple[2](l[fuple[0]-1:fuple[0]+fuple[1]-1])
-            except:
-                if verbose:
-                    print("Error importing "+fdesc+"("+str(fuple[2])+") for "
-                          "star "+str(linecount))
-                skipstar = True
-                starerr+=1
-        # valid id for this star
-        if not(skipstar) and bscstar['hr'] != None and bscstar['hr'] != '    ':
-            # copy fields
-            star=dict()
-            star['nom'] = 'HR'+str(bscstar['hr'])
-            star['mag'] = bscstar['vmag']
-            star['ra_degres'] = bscstar['rahour']*15.0 + (
-                (bscstar['ramin']*60.0+bscstar['rasec'])*15.0) / 3600.0
-            star['de_degres'] = bscstar['dedeg'] + (
-                (bscstar['demin']*60.0 + bscstar['desec'])/3600.0)
-            if bscstar['design']==b'-':
-                star['de_degres']=-star['de_degres']
-            star['ra'] = np.deg2rad(star['ra_degres'])
-            # pour que (0,0) soit au centre de la carte, il faut décaler les
-            # points de l'intervalle ]+pi, +2*pi] vers l'intervalle ]-pi, 0.0]
-            if star['ra'] > np.pi:
-                star['ra'] = star['ra'] - 2.0 * np.pi
-            star['de'] = np.deg2rad(star['de_degres'])
-            catalog.append(star)
-            starcount+=1
-        else:
-            if verbose:
-                print("Not a valid id for star at line "+str(linecount))
-        l=f.readline()
-        linecount+=1
-    f.close()
-    print("Bright Star 5 catalog: read "+str(linecount)+" lines, " +
-          "found "+str(starcount)+" stars ("+str(starerr)+" errors)")
+BSC_DTYPE = np.dtype([
+    ('hr', np.int32),
+    ('ra_degres', np.float64),
+    ('de_degres', np.float64),
+    ('mag', np.float32)])
+
+# Bump when the cached array layout changes
+BSC_CACHE_VERSION = 1
+
+
+def _parse_bright_star_5(filename):
+    """ Fixed width parsing of all catalog lines at once
+
+    Returns:
+        structured array of BSC_DTYPE, number of lines
+    """
+    with gzip.GzipFile(filename) as f:
+        lines = f.read().splitlines()
+    width = max(start + length - 1 for start, length, _ in BSC_FIELDS.values())
+    lines = np.array([line[:width].ljust(width) for line in lines],
+                     dtype=f'S{width}')
+    chars = lines.view('S1').reshape(len(lines), width)
+
+    def field(name):
+        start, length, _ = BSC_FIELDS[name]
+        column = np.ascontiguousarray(chars[:, start - 1:start - 1 + length])
+        return np.char.strip(column.view(f'S{length}').ravel())
+
+    columns = {name: field(name) for name in BSC_FIELDS if name != 'design'}
+    # Stars with a missing field (novae, removed entries) are skipped
+    valid = np.logical_and.reduce([c != b'' for c in columns.values()])
+    values = {name: np.where(valid, column, b'0').astype(np.float64)
+              for name, column in columns.items()}
+    ra = (values['rahour'] * 15.0 +
+          (values['ramin'] * 60.0 + values['rasec']) * 15.0 / 3600.0)
+    de = values['dedeg'] + (values['demin'] * 60.0 + values['desec']) / 3600.0
+    de = np.where(field('design') == b'-', -de, de)
+
+    catalog = np.empty(np.count_nonzero(valid), dtype=BSC_DTYPE)
+    catalog['hr'] = values['hr'][valid]
+    catalog['ra_degres'] = ra[valid]
+    catalog['de_degres'] = de[valid]
+    catalog['mag'] = values['vmag'][valid]
+    return catalog, len(lines)
+
+
+def load_bright_star_5_array(filename, cache=True):
+    """ Load the Bright Star 5 catalog as a structured array of BSC_DTYPE
+
+    The parsed catalog is cached in a .npy file next to the catalog, and
+    reloaded as long as the catalog file does not change. If the cache
+    cannot be written, the catalog is parsed each time.
+    """
+    logger = logging.getLogger(__name__)
+    stat = os.stat(filename)
+    key = np.array([BSC_CACHE_VERSION, stat.st_size, stat.st_mtime_ns],
+                   dtype=np.int64)
+    cache_path = f"{filename}.npy"
+    if cache:
+        try:
+            with open(cache_path, 'rb') as f:
+                if np.array_equal(np.load(f), key):
+                    return np.load(f)
+        except (OSError, ValueError):
+            pass
+
+    catalog, nb_lines = _parse_bright_star_5(filename)
+    logger.info(f"Bright Star 5 catalog: read {nb_lines} lines, found "
+                f"{len(catalog)} stars ({nb_lines - len(catalog)} skipped)")
+    if cache:
+        try:
+            with open(cache_path + '.part', 'wb') as f:
+                np.save(f, key)
+                np.save(f, catalog)
+            os.replace(cache_path + '.part', cache_path)
+        except OSError as e:
+            logger.warning(f"Cannot cache catalog to {cache_path}: {e}")
     return catalog
+
+
+def load_bright_star_5(filename, verbose=False):
+    """ Same catalog as load_bright_star_5_array, as a list of star dicts """
+    catalog = load_bright_star_5_array(filename)
+    ra = np.deg2rad(catalog['ra_degres'])
+    # pour que (0,0) soit au centre de la carte, il faut décaler les
+    # points de l'intervalle ]+pi, +2*pi] vers l'intervalle ]-pi, 0.0]
+    ra = np.where(ra > np.pi, ra - 2.0 * np.pi, ra)
+    de = np.deg2rad(catalog['de_degres'])
+    return [{'nom': f"HR{hr}", 'mag': float(mag), 'ra_degres': float(ra_deg),
+             'de_degres': float(de_deg), 'ra': float(r), 'de': float(d)}
+            for hr, mag, ra_deg, de_deg, r, d in zip(
+                catalog['hr'], catalog['mag'], catalog['ra_degres'],
+                catalog['de_degres'], ra, de)]
@@ -1,6 +1,5 @@
 # Common stuff
 import logging
-from multiprocessing.pool import ThreadPool
 
 # Numerical stuff
 import numpy as np
@@ -20,7 +19,7 @@ from meshcat.geometry import Sphere
 import meshcat.transformations as tf
 
 # Local stuff
-from ScopeSimulator.Catalogs import load_bright_star_5
+from ScopeSimulator.Catalogs import load_bright_star_5_array
 
 class Circle(Geometry):
     """
@@ -103,6 +102,7 @@ class World3D:
     # sky is considered as a sphere centered on origin (assuming topocentric)
     sky_radius = 50.0        #50m
     sky_nb_segment = 1000
+    star_catalog_path = 'ScopeSimulator/data/bsc5.dat.gz'
 
     # altaz grid
     altaz_grid_lw = 0.2
@@ -504,10 +504,14 @@ class World3D:
            - south cardinal is 180 deg RA
            - zenith cardinal is +90deg Dec
            - nadir cardinal is -90 deg Dec
+
+           Stars are grouped by magnitude, each group being a single point
+           cloud whose point size depends on the magnitude. As they are
+           attached to the sky node, time updates only transform that node.
         """
         # Loads star catalog and render on the sky parent object
-        stars = load_bright_star_5('ScopeSimulator/data/bsc5.dat.gz', True)
-        stars = self.j2k_to_jnow(stars)
+        catalog = load_bright_star_5_array(self.star_catalog_path)
+        ra, de = self.j2k_to_jnow(catalog['ra_degres'], catalog['de_degres'])
         radius_mag = [.25, .14, .10, .08, .05, .03, .02]
         mag_to_radius = scipy.interpolate.interp1d(
             range(1, 8),
@@ -517,38 +521,34 @@ class World3D:
             fill_value=(max(radius_mag), min(radius_mag)),
             bounds_error=False,
             assume_sorted=False)
-        for star in stars:
-            star_id = str(hash(star["nom"]))
-            self.view3D["sky_jnow"][star_id].set_object(
-                g.Sphere(float(mag_to_radius(float(star['mag'])))),
-                g.MeshLambertMaterial(
-                    color=0xfafbd7,
-                    reflectivity=0.8))
-            #We first apply rotation to expected position
-            tr = tf.rotation_matrix(star['ra'], [0, 0, 1])
-            tr = tr.dot(tf.rotation_matrix(star['de'], [0, -1, 0]))
-            # Then we compose with translation on sky sphere
-            tr = tr.dot(tf.translation_matrix([self.sky_radius*0.99, 0, 0]))
-            # Now we apply transform
-            self.view3D["sky_jnow"][star_id].set_transform(tr)
-
-    def j2k_to_jnow(self, coords):
-        now = self.serv_time.get_astropy_time_from_utc()
+        radius = self.sky_radius*0.99
+        positions = np.stack([radius*np.cos(de)*np.cos(ra),
+                              radius*np.cos(de)*np.sin(ra),
+                              radius*np.sin(de)])
+        color = np.array([[0xfa], [0xfb], [0xd7]], dtype=np.float32)/255
+        mag_bins = np.digitize(catalog['mag'], np.arange(1, 8))
+        for mag_bin in np.unique(mag_bins):
+            in_bin = mag_bins == mag_bin
+            size = 2*float(mag_to_radius(np.mean(catalog['mag'][in_bin])))
+            self.view3D["sky_jnow"]["stars"][f"mag{mag_bin}"].set_object(
+                g.PointCloud(positions[:, in_bin],
+                             np.repeat(color, np.count_nonzero(in_bin), axis=1),
+                             size=size))
+        logging.info(f"{len(catalog)} stars drawn in {len(np.unique(mag_bins))} point clouds")
+
+    def j2k_to_jnow(self, ra_deg, de_deg):
+        """
+        Transform J2000 coordinates to the equinox of now, in a single call
+        for all the stars
 
-        def convert_from_j2k_to_jnow(coord):
-            coord_j2k = SkyCoord(ra=coord['ra_degres'] * u.degree,
-                                 dec=coord['de_degres'] * u.degree,
-                                 frame='icrs',
-                                 equinox='J2000.0')
-            fk5_now = FK5(equinox=now)
-            coord_jnow = coord_j2k.transform_to(fk5_now)
-            coord['ra'] = coord_jnow.ra.radian
-            coord['de'] = coord_jnow.dec.radian
-            coord['ra_degres'] = coord_jnow.ra.degree
-            coord['de_degres'] = coord_jnow.dec.degree
-            return coord
-
-        with ThreadPool(4) as p:
-            p.map(convert_from_j2k_to_jnow, coords)
-
-        return coords
+        :param ra_deg: array of J2000 right ascensions in degrees
+        :param de_deg: array of J2000 declinations in degrees
+        :return: arrays of JNow right ascensions and declinations in radians
+        """
+        now = self.serv_time.get_astropy_time_from_utc()
+        coord_j2k = SkyCoord(ra=ra_deg * u.degree,
+                             dec=de_deg * u.degree,
+                             frame='icrs',
+                             equinox='J2000.0')
+        coord_jnow = coord_j2k.transform_to(FK5(equinox=now))
+        return coord_jnow.ra.radian, coord_jnow.dec.radian
@@ -18,6 +18,9 @@ class BaseService():
         self.logger = logger or logging.getLogger(self.__class__.__name__)
         if _config is None:
             _config = load_config()
+        # Update with run-time config
+        if config is not None:
+            _config.update(config)
         self.config = _config
 
 
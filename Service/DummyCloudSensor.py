@@ -19,6 +19,7 @@ from Base.Base import Base
 from Service.NTPTimeService import NTPTimeService
 from utils.config import load_config
 from Service.PanMessaging import PanMessaging
+from Service.WeatherHistory import WeatherHistory
 
 class DummyCloudSensor(Base):
 
@@ -28,7 +29,7 @@ class DummyCloudSensor(Base):
         self.name = 'Random weather generator'
         self.safe_dict = None
         self.serv_time = NTPTimeService()
-        self.weather_entries = []
+        self.weather_history = WeatherHistory()
         self.safety_delay = 60
         self.store_result = store_result
         self.messaging = None
@@ -68,12 +69,7 @@ class DummyCloudSensor(Base):
 
         # Store current weather
         data['date'] = self.serv_time.get_utc()
-        self.weather_entries.append(data)
-
-        # If we get over a certain amount of entries, trim the earliest
-        # TODO TN URGENT: use deque you idiot
-        if len(self.weather_entries) > int(self.safety_delay):
-            del self.weather_entries[:1]
+        self.weather_history.append(data)
 
         if send_message:
             self.send_message({'data': data}, channel='weather')
@@ -83,3 +79,8 @@ class DummyCloudSensor(Base):
 
         return data
 
+    def is_weather_safe(self, stale=180):
+        """ Whether the last sample is safe and at most stale seconds old """
+        return self.weather_history.is_safe(stale_sec=stale,
+                                            now=self.serv_time.get_utc())
+
@@ -1,5 +1,4 @@
 # Generic stuff
-from collections import deque
 import json
 import logging
 import threading
@@ -15,6 +14,7 @@ import astropy.units as u
 from Base.Base import Base
 from helper.IndiDevice import IndiDevice
 from Service.PanMessaging import PanMessaging
+from Service.WeatherHistory import WeatherHistory
 
 
 class IndiAAGCloudWatcher(threading.Thread, IndiDevice):
@@ -59,8 +59,9 @@ class IndiAAGCloudWatcher(threading.Thread, IndiDevice):
         self.store_result = True
         self._do_run = True
         self._delay_sec = config["delay_sec"]
-        # we store the last 10 entries
-        self.weather_entries = deque([], 3)
+        # Recent samples and their per minute/hour aggregates, in memory
+        self.weather_history = WeatherHistory(
+            capacity=config.get("history_size", 4096))
 
         # Actual threshold for safety alerts
         self.limits = config["limits"]
@@ -95,7 +96,7 @@ class IndiAAGCloudWatcher(threading.Thread, IndiDevice):
         data = self._fill_in_weather_data()
         data['weather_sensor_name'] = self.device_name
         data['date'] = self.serv_time.get_utc()
-        self.weather_entries.append(data)
+        self.weather_history.append(data)
 
         if send_message:
             self.send_message({'data': data}, channel='WEATHER')
@@ -105,6 +106,11 @@ class IndiAAGCloudWatcher(threading.Thread, IndiDevice):
 
         return data
 
+    def is_weather_safe(self, stale=180):
+        """ Whether the last sample is safe and at most stale seconds old """
+        return self.weather_history.is_safe(stale_sec=stale,
+                                            now=self.serv_time.get_utc())
+
     def serve(self):
         """
         Continuously generates weather reports
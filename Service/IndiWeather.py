@@ -1,5 +1,4 @@
 # Generic stuff
-from collections import deque
 import json
 import logging
 import threading
@@ -13,6 +12,7 @@ import astropy.units as u
 
 #Local stuff
 from helper.IndiDevice import IndiDevice
+from Service.WeatherHistory import WeatherHistory
 from utils import load_module
 
 class IndiWeather(threading.Thread, IndiDevice):
@@ -62,8 +62,9 @@ class IndiWeather(threading.Thread, IndiDevice):
         self.store_result = True
         self._do_run = True
         self._delay_sec = config["delay_sec"]
-        # we store the last 10 entries
-        self.weather_entries = deque([], 3)
+        # Recent samples and their per minute/hour aggregates, in memory
+        self.weather_history = WeatherHistory(
+            capacity=config.get("history_size", 4096))
 
         # Actual threshold for safety alerts
         self.limits = config["limits"]
@@ -109,7 +110,7 @@ class IndiWeather(threading.Thread, IndiDevice):
         data = self._fill_in_weather_data()
         data['weather_sensor_name'] = self.device_name
         data['date'] = self.serv_time.get_utc()
-        self.weather_entries.append(data)
+        self.weather_history.append(data)
 
         if send_message:
             self.send_message({'data': data}, channel='WEATHER')
@@ -119,6 +120,11 @@ class IndiWeather(threading.Thread, IndiDevice):
 
         return data
 
+    def is_weather_safe(self, stale=180):
+        """ Whether the last sample is safe and at most stale seconds old """
+        return self.weather_history.is_safe(stale_sec=stale,
+                                            now=self.serv_time.get_utc())
+
     def serve(self):
         """
         Continuously generates weather reports
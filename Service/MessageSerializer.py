@@ -0,0 +1,208 @@
+# General stuff
+from bson import ObjectId
+import datetime
+import json
+import threading
+
+# Numerical stuff
+import numpy as np
+
+# Astropy
+from astropy import units as u
+from astropy.time import Time
+
+# Optional fast back-ends
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+FLOAT_DIGITS = 3
+
+################################################################################
+# Encoders
+################################################################################
+
+# type -> function converting an object of that type into json-able values.
+# Exact types are looked up first, subclasses are resolved once through the MRO
+# and cached in the same table
+_encoders = {}
+_encoders_lock = threading.Lock()
+
+
+def register_encoder(obj_type, encoder):
+    """ Register the function used to scrub objects of type obj_type
+
+    The encoder gets the object and returns a message friendly value, that is
+    scrubbed again (a Quantity returns its value, that might be an array).
+    """
+    with _encoders_lock:
+        # Drop the cached subclass resolutions, they might now be wrong
+        for cached_type in [t for t, (_, exact) in _encoders.items() if not exact]:
+            del _encoders[cached_type]
+        _encoders[obj_type] = (encoder, True)
+
+
+def _get_encoder(obj_type):
+    try:
+        return _encoders[obj_type][0]
+    except KeyError:
+        pass
+    encoder = None
+    for base in obj_type.__mro__[1:]:
+        if base in _encoders:
+            encoder = _encoders[base][0]
+            break
+    with _encoders_lock:
+        _encoders[obj_type] = (encoder, False)
+    return encoder
+
+
+def _round_float(value):
+    return round(value, FLOAT_DIGITS)
+
+
+def _time_to_str(value):
+    if value.isscalar:
+        return value.isot.split('.')[0].replace('T', ' ')
+    return [t.split('.')[0].replace('T', ' ') for t in value.isot.ravel()]
+
+
+register_encoder(float, _round_float)
+register_encoder(u.Quantity, lambda value: value.value)
+register_encoder(datetime.datetime, lambda value: value.isoformat())
+register_encoder(datetime.date, lambda value: value.isoformat())
+register_encoder(ObjectId, str)
+register_encoder(Time, _time_to_str)
+register_encoder(np.generic, lambda value: value.item())
+register_encoder(np.ndarray, lambda value: value.tolist())
+register_encoder(set, list)
+
+# Immutable types that go on the wire unchanged
+_PASSTHROUGH = frozenset((str, int, bool, type(None)))
+_KEY_TYPES = (str, int, float, bool, type(None))
+
+
+def scrub(obj):
+    """ Return a copy of obj that only contains message friendly values
+
+    The input is left untouched. Values are converted with the registered
+    encoders, floats are rounded to FLOAT_DIGITS, and values whose key ends
+    with '_time' only keep their last space separated part (the time of
+    'YYYY-MM-DD HH:MM:SS'). Keys that cannot be serialized are skipped, and
+    objects without encoder are kept as they are.
+    """
+    obj_type = type(obj)
+    if obj_type in _PASSTHROUGH:
+        return obj
+    if obj_type is dict:
+        return _scrub_dict(obj)
+    if obj_type is list or obj_type is tuple:
+        return [scrub(value) for value in obj]
+    encoder = _get_encoder(obj_type)
+    if encoder is None:
+        if isinstance(obj, dict):
+            return _scrub_dict(obj)
+        if isinstance(obj, (list, tuple)):
+            return [scrub(value) for value in obj]
+        return obj
+    value = encoder(obj)
+    if type(value) is obj_type:
+        return value
+    return scrub(value)
+
+
+def _scrub_dict(obj):
+    scrubbed = {}
+    for key, value in obj.items():
+        if not isinstance(key, _KEY_TYPES):
+            continue
+        value = scrub(value)
+        if isinstance(key, str) and key.endswith('_time'):
+            value = str(value).split(' ')[-1]
+        scrubbed[key] = value
+    return scrubbed
+
+################################################################################
+# Wire formats
+################################################################################
+
+
+class WireFormat:
+    """ Turns scrubbed messages into bytes and back """
+    name = None
+
+    def dumps(self, message):
+        raise NotImplementedError()
+
+    def loads(self, payload):
+        raise NotImplementedError()
+
+
+class JsonWireFormat(WireFormat):
+    """ Standard library json, readable by any client """
+    name = 'json'
+
+    def dumps(self, message):
+        return json.dumps(message, skipkeys=True).encode()
+
+    def loads(self, payload):
+        return json.loads(payload)
+
+
+class OrjsonWireFormat(JsonWireFormat):
+    """ Same wire content as json, with the orjson back-end
+
+    Note that orjson writes NaN and infinite floats as null.
+    """
+    name = 'orjson'
+
+    def dumps(self, message):
+        return orjson.dumps(message, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, payload):
+        return orjson.loads(payload)
+
+
+class MsgpackWireFormat(WireFormat):
+    """ Compact binary format, every client needs the msgpack format as well """
+    name = 'msgpack'
+
+    def dumps(self, message):
+        return msgpack.packb(message, use_bin_type=True)
+
+    def loads(self, payload):
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+
+_wire_formats = {
+    'json': (JsonWireFormat, json),
+    'orjson': (OrjsonWireFormat, orjson),
+    'msgpack': (MsgpackWireFormat, msgpack)}
+
+
+def register_wire_format(wire_format_class, module=True):
+    """ Make a WireFormat subclass available by its name """
+    _wire_formats[wire_format_class.name] = (wire_format_class, module)
+
+
+def get_wire_format(name='json'):
+    """ Instantiate the wire format called name
+
+    Raises:
+        ValueError if the format is unknown
+        RuntimeError if its back-end is not installed
+    """
+    if name is None:
+        name = 'json'
+    try:
+        wire_format_class, module = _wire_formats[name]
+    except KeyError:
+        raise ValueError(f"Unknown message wire format {name}, should be one of {list(_wire_formats)}")
+    if module is None:
+        raise RuntimeError(f"Message wire format {name} needs module {name}, that is not installed")
+    return wire_format_class()
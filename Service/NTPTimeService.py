@@ -2,15 +2,20 @@
 import copy
 import json
 import logging
+import threading
+import time
 import traceback
 
 # Time stuff
 from datetime import datetime
-from datetime import timedelta 
+from datetime import timedelta
 import ntplib
 import pytz
 from tzwhere import tzwhere
 
+# Numerical stuff
+import numpy as np
+
 # Astropy stuff
 from astropy import units as u
 from astropy.time import Time as ATime
@@ -23,7 +28,27 @@ class NTPTimeService(HostTimeService):
         from Base, because Base needs a time service. That would generate a
         circular dependency.
         Just in case, we designed a BaseService for this purpose
+
+        get_utc does not query the NTP server: a background thread samples
+        the offset between the local clock and the server every
+        sync_period_sec, and get_utc returns the local clock corrected by
+        the offset (and drift) estimated from the last samples. If the server
+        becomes unreachable, the last estimate keeps being used.
+
+        Expected configuration, all entries but ntpserver being optional:
+
+        ntp:
+            ntpserver: time.google.com
+            port: 123
+            timeout_sec: 5
+            sync_period_sec: 64
+            nb_samples: 8
     """
+    # Maximum frequency error of a sane local clock, as in the NTP protocol
+    MAX_DRIFT = 500e-6
+    # Samples further than this number of median absolute deviations from
+    # the median offset are considered as outliers
+    OUTLIER_MAD_FACTOR = 5
 
     def __init__(self, config=None, tz=None):
         """ tz can be obtained by obs.get_time_zone()
@@ -35,25 +60,136 @@ class NTPTimeService(HostTimeService):
         cfg = self.config['ntp']
         self.logger.debug('NTPTimeservice config: {}'.format(cfg))
         self.ntpserver = cfg['ntpserver']
+        self.port = cfg.get('port', 'ntp')
+        self.timeout_sec = cfg.get('timeout_sec', 5)
+        self.sync_period_sec = cfg.get('sync_period_sec', 64)
+        self.nb_samples = cfg.get('nb_samples', 8)
+
+        # Clock discipline state, protected by _clock_lock
+        self._clock_lock = threading.Lock()
+        self._samples = []
+        self._offset = 0.0
+        self._drift = 0.0
+        self._reference_time = time.time()
+        self._jitter = None
+        self._delay = None
+        self._last_sync = None
+        self._nb_failures = 0
+        self._last_error = None
+
+        # Sampling thread
+        self._stop_event = threading.Event()
+        self._sync_thread = threading.Thread(target=self._sync_loop,
+                                             name="NTPTimeServiceSync",
+                                             daemon=True)
+        self._sync_thread.start()
 
         # Finished configuring
         self.logger.debug('Configured NTP Time Service successfully')
 
     def get_time_stamp_from_ntp(self):
         cli = ntplib.NTPClient()
-        res = cli.request(self.ntpserver, version=3, timeout=5)
+        res = cli.request(self.ntpserver, version=3, port=self.port,
+                          timeout=self.timeout_sec)
         return res.tx_time
 
     def get_utc(self):
+        """
+        return: UTC from local computer clock, corrected with the offset
+                to the NTP server
+        """
+        now = time.time()
+        with self._clock_lock:
+            offset = self._offset + self._drift*(now - self._reference_time)
+        utc = datetime.utcfromtimestamp(now + offset)
+        return pytz.utc.localize(utc, is_dst=None)
+
+    def get_clock_status(self):
+        """ Health metrics of the clock discipline
+
+            synchronized: a sample was obtained within the last
+                          4*sync_period_sec
+            last_sync: local timestamp of the last successful sample
+            offset_sec: current offset to the server (server - local)
+            drift_ppm: estimated local clock frequency error
+            jitter_sec: dispersion of the offset of the kept samples
+            delay_sec: round trip delay of the last sample
+        """
+        now = time.time()
+        with self._clock_lock:
+            synchronized = (self._last_sync is not None and
+                            now - self._last_sync < 4*self.sync_period_sec)
+            return dict(
+                server=self.ntpserver,
+                synchronized=synchronized,
+                last_sync=self._last_sync,
+                offset_sec=self._offset + self._drift*(now - self._reference_time),
+                drift_ppm=self._drift*1e6,
+                jitter_sec=self._jitter,
+                delay_sec=self._delay,
+                nb_samples=len(self._samples),
+                nb_failures=self._nb_failures,
+                last_error=self._last_error)
+
+    def sync(self):
+        """ Sample the NTP server once, and update the clock estimate
+
+            return: True if the server answered
+        """
         try:
-            res = self.get_time_stamp_from_ntp()
-            utc = datetime.utcfromtimestamp(res)
-            self.logger.debug('NTP Time Service got UTC from server {} : {}'
-                              .format(self.ntpserver,utc))
-            return pytz.utc.localize(utc, is_dst=None)
+            cli = ntplib.NTPClient()
+            res = cli.request(self.ntpserver, version=3, port=self.port,
+                              timeout=self.timeout_sec)
         except Exception as e:
-            utc = super().get_utc()
-            self.logger.error(f"NTP Time Service cannot get UTC from server "
-                              f"{self.ntpserver}, because of error : {e}, got "
-                              f"UTC from local clock instead: {utc}")
-            return utc
+            with self._clock_lock:
+                self._nb_failures += 1
+                self._last_error = str(e)
+            self.logger.warning(f"NTP Time Service cannot get time from server "
+                                f"{self.ntpserver}, because of error : {e}, "
+                                f"keep on using last clock estimate")
+            return False
+        self._add_sample(ntplib.ntp_to_system_time(res.dest_timestamp),
+                         res.offset, res.delay)
+        self.logger.debug(f"NTP Time Service got offset {res.offset:.4f}s from "
+                          f"server {self.ntpserver}, delay {res.delay:.4f}s")
+        return True
+
+    def stop(self):
+        """ Stop the background synchronization """
+        self._stop_event.set()
+        self._sync_thread.join()
+
+    def _sync_loop(self):
+        while not self._stop_event.is_set():
+            self.sync()
+            self._stop_event.wait(self.sync_period_sec)
+
+    def _add_sample(self, local_time, offset, delay):
+        with self._clock_lock:
+            self._samples.append((local_time, offset, delay))
+            self._samples = self._samples[-self.nb_samples:]
+            samples = np.array(self._samples)
+            self._last_sync = local_time
+            self._delay = delay
+            self._last_error = None
+
+            # Reject samples that are too far from the median offset
+            offsets = samples[:, 1]
+            median = np.median(offsets)
+            mad = np.median(np.abs(offsets - median))
+            # Never reject below the round trip delay, that bounds the error
+            tolerance = max(self.OUTLIER_MAD_FACTOR*mad, np.min(samples[:, 2]))
+            kept = samples[np.abs(offsets - median) <= tolerance]
+
+            # Offset and drift from a linear fit over the kept samples
+            reference_time = kept[-1, 0]
+            times = kept[:, 0] - reference_time
+            if len(kept) >= 3 and np.ptp(times) > 0:
+                drift, offset = np.polyfit(times, kept[:, 1], 1)
+                drift = float(np.clip(drift, -self.MAX_DRIFT, self.MAX_DRIFT))
+                offset = float(np.mean(kept[:, 1] - drift*times))
+            else:
+                drift, offset = 0.0, float(np.mean(kept[:, 1]))
+            self._jitter = float(np.std(kept[:, 1] - drift*times))
+            self._offset, self._drift = offset, drift
+            self._reference_time = reference_time
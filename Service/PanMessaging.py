@@ -1,16 +1,9 @@
 # General stuff
-from bson import ObjectId
-import datetime
-import json
 import logging
-import random
 import yaml
 
-# Astropy
-from astropy import units as u
-from astropy.time import Time
-
 # Local
+from Service import MessageSerializer
 from Service.NTPTimeService import HostTimeService
 
 class PanMessaging:
@@ -18,8 +11,10 @@ class PanMessaging:
     """
     logger = logging.getLogger('PanMessaging')
 
-    def __init__(self, **kwargs):
+    def __init__(self, config={}, **kwargs):
         self.serv_time = HostTimeService()
+        # json (default), orjson or msgpack, must be the same for all clients
+        self.wire_format = MessageSerializer.get_wire_format(config.get("wire_format", "json"))
 
     def send_message(self, channel, message):
         """ Responsible for actually sending message across a channel
@@ -33,22 +28,32 @@ class PanMessaging:
         raise NotImplementedError()
 
     def scrub_message(self, message):
-        for k, v in message.items():
-            if isinstance(v, dict):
-                v = self.scrub_message(v)
-            if isinstance(v, u.Quantity):
-                v = v.value
-            if isinstance(v, datetime.datetime):
-                v = v.isoformat()
-            if isinstance(v, ObjectId):
-                v = str(v)
-            if isinstance(v, Time):
-                v = str(v.isot).split('.')[0].replace('T', ' ')
-            # Hmmmm
-            if k.endswith('_time'):
-                v = str(v).split(' ')[-1]
-            if isinstance(v, float):
-                v = round(v, 3)
-            message[k] = v
-        return message
+        """ Return a message friendly copy of message, that is left untouched
+
+        See Service.MessageSerializer.scrub for the conversion rules, and
+        MessageSerializer.register_encoder to support new types.
+        """
+        return MessageSerializer.scrub(message)
 
+    def encode_message(self, message):
+        """ Serialize a message to bytes with the configured wire format
+
+        A str message is wrapped in a dict along with the current timestamp.
+        """
+        if isinstance(message, str):
+            current_time = self.serv_time.get_utc()
+            message = {
+                'message': message,
+                'timestamp': current_time.isoformat().replace('T', ' ').split('.')[0]}
+        else:
+            message = self.scrub_message(message)
+        return self.wire_format.dumps(message)
+
+    def decode_message(self, payload):
+        """ Deserialize a message payload, json payloads fall back on yaml """
+        try:
+            return self.wire_format.loads(payload)
+        except ValueError:
+            if not isinstance(self.wire_format, MessageSerializer.JsonWireFormat):
+                raise
+            return yaml.safe_load(payload)
@@ -2,6 +2,7 @@
 import datetime
 import json
 import logging
+import queue
 import random
 import ssl
 import yaml
@@ -12,7 +13,6 @@ from astropy.time import Time
 
 # MQTT
 import paho.mqtt.client as mqtt
-import paho.mqtt.subscribe as mqttsubscribe
 from paho.mqtt.properties import Properties
 from paho.mqtt.packettypes import PacketTypes
 
@@ -29,11 +29,22 @@ class PanMessagingMQTT(PanMessaging):
     mosquitto_sub -v -t 'test/topic'
     Publish test message with the command line publisher:
     mosquitto_pub -t 'test/topic' -m 'helloWorld'
+
+    The client is connected once, and reconnects automatically with an
+    exponential backoff. Messages of the default topic that are not handled by
+    a callback registered with register_callback are put in a bounded queue,
+    read by receive_message. When the queue is full, the oldest message is
+    dropped.
+
+    Optional configuration entries:
+        receive_queue_size: 1000
+        reconnect_min_delay_sec: 1
+        reconnect_max_delay_sec: 60
     """
     logger = logging.getLogger('PanMessaging')
 
     def __init__(self, config={}, **kwargs):
-        super().__init__(**kwargs)
+        super().__init__(config=config, **kwargs)
 
         # Create helper objects
         self.default_topic = "observatory"
@@ -43,6 +54,11 @@ class PanMessagingMQTT(PanMessaging):
         self.client_id = None
         self.mqtt_host = config["mqtt_host"]
         self.mqtt_port = config["mqtt_port"]
+        self.reconnect_min_delay_sec = config.get("reconnect_min_delay_sec", 1)
+        self.reconnect_max_delay_sec = config.get("reconnect_max_delay_sec", 60)
+        self._receive_queue = queue.Queue(maxsize=config.get("receive_queue_size", 1000))
+        self._is_receiving = False
+        self.nb_dropped_messages = 0
         if config.get("com_mode", None) == "subscriber":
             self.create_client(connect=True, is_subscriber=True)
         elif config.get("com_mode", None) == "publisher":
@@ -59,6 +75,33 @@ class PanMessagingMQTT(PanMessaging):
     def publisher_on_connect_callback(self, client, userdata, flags, reason_codes, properties):
         self.default_on_connect_callback(client=client, userdata=userdata, flags=flags, reason_codes=reason_codes,
                                          properties=properties)
+        # A publisher might have started receiving messages as well
+        if self._is_receiving:
+            client.subscribe(f"{self.default_topic}/#")
+
+    def default_on_disconnect_callback(self, client, userdata, reason_codes, properties=None):
+        if reason_codes == 0:
+            self.logger.debug(f"MQTT Disconnected from {self.mqtt_host}:{self.mqtt_port}")
+        else:
+            self.logger.warning(f"MQTT Disconnected with result code {reason_codes} from {self.mqtt_host}:"
+                                f"{self.mqtt_port}, will reconnect")
+
+    def on_message_callback(self, client, userdata, message):
+        """ Queue messages that are not handled by a registered callback """
+        try:
+            msg = self.parse_msg(message)
+        except Exception as e:
+            self.logger.error(f"MQTT error while handling message on topic {message.topic}: {e}")
+            return
+        try:
+            self._receive_queue.put_nowait(msg)
+        except queue.Full:
+            try:
+                self._receive_queue.get_nowait()
+                self.nb_dropped_messages += 1
+            except queue.Empty:
+                pass
+            self._receive_queue.put_nowait(msg)
 
     def create_client(self, connect=True, is_subscriber=False, version="5", transport="tcp"):
         """ Create a publisher
@@ -133,23 +176,30 @@ class PanMessagingMQTT(PanMessaging):
             # Subscribing in on_connect() means that if we lose the connection and
             # reconnect then subscriptions will be renewed.
             client.on_connect = self.subscriber_on_connect_callback
+            self._is_receiving = True
         else:
             client.on_connect = self.publisher_on_connect_callback
+        client.on_disconnect = self.default_on_disconnect_callback
+        client.on_message = self.on_message_callback
+        # The network loop reconnects with an exponential backoff
+        client.reconnect_delay_set(min_delay=self.reconnect_min_delay_sec,
+                                   max_delay=self.reconnect_max_delay_sec)
 
         if connect:
+            connect_kwargs = dict(host=self.broker["host"],
+                                  port=self.broker["port"],
+                                  keepalive=60)
             if version == '5':
                 properties = Properties(PacketTypes.CONNECT)
                 properties.SessionExpiryInterval = 30 * 60  # in seconds
-                client.connect(host=self.broker["host"],
-                               port=self.broker["port"],
-                               clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
-                               properties=properties,
-                               keepalive=60)
-            if version == '3':
-                client.connect(host=self.broker["host"],
-                               port=self.broker["port"],
-                               keepalive=60);
-            client.connect(**self.broker)
+                connect_kwargs.update(clean_start=mqtt.MQTT_CLEAN_START_FIRST_ONLY,
+                                      properties=properties)
+            try:
+                client.connect(**connect_kwargs)
+            except Exception as e:
+                self.logger.warning(f"MQTT cannot connect to {self.mqtt_host}:{self.mqtt_port} ({e}), will "
+                                    f"retry in background")
+                client.connect_async(**connect_kwargs)
             client.loop_start()
         self.client = client
 
@@ -161,15 +211,7 @@ class PanMessagingMQTT(PanMessaging):
         """
         assert channel > '', "Cannot send blank channel"
 
-        if isinstance(message, str):
-            current_time = self.serv_time.get_utc()
-            message = {
-                'message': message,
-                'timestamp': current_time.isoformat().replace('T', ' ').split('.')[0]}
-        else:
-            message = self.scrub_message(message)
-
-        msg_object = json.dumps(message, skipkeys=True)
+        msg_object = self.encode_message(message)
         # self.logger.debug(f"PanMessaging - sending - {channel}: {message}")
 
         # Send the message
@@ -199,26 +241,32 @@ class PanMessagingMQTT(PanMessaging):
         self.client.message_callback_add(f"{self.default_topic}/{cmd_type}", on_message_callback)
         self.client.loop_start()
 
-    def receive_message(self, blocking=True):
+    def receive_message(self, blocking=True, timeout=None):
         """Receive a message
 
         Receives a message for the current subscriber. Blocks by default
 
         Args:
             blocking (bool, optional): expected behaviour
+            timeout (float, optional): maximum blocking time in seconds
 
         Returns:
-            tuple(str, dict): Tuple containing the channel and a dict
+            tuple(str, dict): Tuple containing the channel and a dict, or
+                (None, None) if no message has been received
         """
-        topic = f"{self.default_topic}/#"
+        self._start_receiving()
         try:
-            msg = mqttsubscribe.simple(
-                topics=topic, qos=0, msg_count=1, retained=False,
-                hostname=self.broker["host"], port=self.broker["port"], client_id=self.client_id)
-            msg_type, msg_data = self.parse_msg(msg)
-        except Exception as e:
-            self.logger.error(f"MQTT error while handling cmd message: {e}")
-        return msg_type, msg_data
+            return self._receive_queue.get(block=blocking, timeout=timeout)
+        except queue.Empty:
+            return None, None
+
+    def _start_receiving(self):
+        """ Subscribe to the default topic, if not done yet (publisher) """
+        if self._is_receiving:
+            return
+        self._is_receiving = True
+        if self.client.is_connected():
+            self.client.subscribe(f"{self.default_topic}/#")
 
     def split_msg(self, msg):
         msg_type, msg_payload = msg.topic.split(f"{self.default_topic}/")[1], msg.payload
@@ -226,12 +274,7 @@ class PanMessagingMQTT(PanMessaging):
 
     def parse_msg(self, msg):
         msg_type, msg_payload = self.split_msg(msg)
-        try:
-            msg_data = json.loads(msg_payload)
-        except json.decoder.JSONDecodeError as e:
-            msg_data = yaml.safe_load(msg_payload)
-        except Exception as e:
-            print(f"MQTT error while handling cmd message: {e}")
+        msg_data = self.decode_message(msg_payload)
         return msg_type, msg_data
 
     def close_connection(self):
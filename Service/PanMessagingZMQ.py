@@ -61,7 +61,7 @@ class PanMessagingZMQ(PanMessaging):
     logger = logging.getLogger('PanMessaging')
 
     def __init__(self, config={}, **kwargs):
-        super().__init__(**kwargs)
+        super().__init__(config=config, **kwargs)
         self.serv_time = HostTimeService()
         # Create a new context
         self.context = zmq.Context()
@@ -171,21 +171,10 @@ class PanMessagingZMQ(PanMessaging):
 
         """
         assert channel > '', self.logger.warning("Cannot send blank channel")
-        if isinstance(message, str):
-            current_time = self.serv_time.get_utc()
-            message = {
-                'message': message,
-                'timestamp': current_time.isoformat().replace(
-                    'T',
-                    ' ').split('.')[0]}
-        else:
-            message = self.scrub_message(message)
-
-        msg_object = json.dumps(message, skipkeys=True)
-        full_message = f"{channel} {msg_object}"
+        full_message = channel.encode() + b" " + self.encode_message(message)
         # self.logger.debug(f"PanMessaging - sending - {channel}: {message}")
         # Send the message
-        self.socket.send_string(full_message, flags=zmq.NOBLOCK)
+        self.socket.send(full_message, flags=zmq.NOBLOCK)
 
     def receive_message(self, blocking=True):
         """Receive a message
@@ -205,15 +194,13 @@ class PanMessagingZMQ(PanMessaging):
         if not blocking:
             flags = flags | zmq.NOBLOCK
         try:
-            message = self.socket.recv_string(flags=flags)
+            message = self.socket.recv(flags=flags)
         except Exception as e:
             pass
         else:
-            msg_type, msg = message.split(' ', maxsplit=1)
-            try:
-                msg_obj = json.loads(msg)
-            except Exception:
-                msg_obj = yaml.safe_load(msg)
+            msg_type, msg = message.split(b' ', maxsplit=1)
+            msg_type = msg_type.decode()
+            msg_obj = self.decode_message(msg)
         return msg_type, msg_obj
 
     def close(self):
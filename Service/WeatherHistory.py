@@ -0,0 +1,255 @@
+# Generic stuff
+import datetime
+import numbers
+import threading
+
+# Numerical stuff
+import numpy as np
+
+# Astropy stuff
+from astropy.table import Table
+
+
+def to_timestamp(date):
+    """ Unix timestamp of a datetime (naive is UTC) or of a number
+
+    Time services return either naive UTC or aware datetimes, dates are
+    compared through this in order not to mix both kinds.
+    """
+    if date is None or isinstance(date, numbers.Real):
+        return date
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return date.timestamp()
+
+
+def _to_datetime(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+
+
+def _is_number(value):
+    return isinstance(value, (numbers.Real, np.bool_)) and not isinstance(value, np.datetime64)
+
+
+class _Aggregates:
+    """ Min, max and mean of each numeric feature over fixed periods, kept in
+        a ring of capacity periods
+    """
+
+    def __init__(self, period_sec, capacity):
+        self.period_sec = period_sec
+        self.capacity = capacity
+        self._starts = np.zeros(capacity, dtype=np.float64)
+        # feature -> (count, min, max, sum) arrays
+        self._stats = {}
+        self._count = 0
+
+    def append(self, timestamp, values):
+        start = np.floor(timestamp / self.period_sec) * self.period_sec
+        last = self._count - 1
+        if self._count == 0 or start > self._starts[last % self.capacity]:
+            index = self._count % self.capacity
+            self._starts[index] = start
+            for count, minimum, maximum, total in self._stats.values():
+                count[index], minimum[index], maximum[index], total[index] = 0, np.nan, np.nan, 0.
+            self._count += 1
+        else:
+            # Late sample, only kept if its period is still in the ring
+            oldest = max(0, self._count - self.capacity)
+            while last >= oldest and self._starts[last % self.capacity] > start:
+                last -= 1
+            if last < oldest or self._starts[last % self.capacity] != start:
+                return
+            index = last % self.capacity
+        for feature, value in values.items():
+            if feature not in self._stats:
+                self._stats[feature] = (np.zeros(self.capacity, dtype=np.int64),
+                                        np.full(self.capacity, np.nan),
+                                        np.full(self.capacity, np.nan),
+                                        np.zeros(self.capacity, dtype=np.float64))
+            if np.isnan(value):
+                continue
+            count, minimum, maximum, total = self._stats[feature]
+            if count[index] == 0:
+                minimum[index] = maximum[index] = value
+            else:
+                minimum[index] = min(minimum[index], value)
+                maximum[index] = max(maximum[index], value)
+            count[index] += 1
+            total[index] += value
+
+    def query(self, start=None, end=None):
+        indices = _span_indices(self._starts, self._count, self.capacity, start, end)
+        result = {'date': self._starts[indices].copy()}
+        for feature, (count, minimum, maximum, total) in self._stats.items():
+            n = count[indices]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result[f'{feature}_mean'] = np.where(n > 0, total[indices] / n, np.nan)
+            result[f'{feature}_min'] = minimum[indices].copy()
+            result[f'{feature}_max'] = maximum[indices].copy()
+            result[f'{feature}_count'] = n.copy()
+        return result
+
+    @property
+    def nbytes(self):
+        return self._starts.nbytes + sum(a.nbytes for s in self._stats.values() for a in s)
+
+
+def _span_indices(times, count, capacity, start=None, end=None):
+    """ Ring indices, in chronological order, of the entries with
+        start <= time <= end, times being sorted in logical order
+    """
+    oldest = max(0, count - capacity)
+    logical = np.arange(oldest, count)
+    indices = logical % capacity
+    ordered = times[indices]
+    first = 0 if start is None else np.searchsorted(ordered, start, side='left')
+    last = len(ordered) if end is None else np.searchsorted(ordered, end, side='right')
+    return indices[first:last]
+
+
+class WeatherHistory:
+    """
+    Bounded, columnar history of weather samples
+
+    The last capacity samples are kept in one NumPy array per feature, and
+    min/max/mean of the numeric features (booleans count as 0/1, so the mean
+    of 'safe' is the fraction of safe samples) are aggregated per minute and
+    per hour in rings of minute_capacity and hour_capacity periods. Memory
+    is allocated when a feature is first seen, and does not grow afterwards.
+
+    Samples are dicts, as built by the weather services, with a 'date'
+    datetime. Queries take datetimes or unix timestamps, and return dates as
+    unix timestamps.
+    """
+
+    RESOLUTIONS = {'minute': 60, 'hour': 3600}
+
+    def __init__(self, capacity=4096, minute_capacity=7 * 24 * 60,
+                 hour_capacity=366 * 24):
+        self.capacity = capacity
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._columns = {}
+        self._count = 0
+        self._aggregates = {
+            'minute': _Aggregates(self.RESOLUTIONS['minute'], minute_capacity),
+            'hour': _Aggregates(self.RESOLUTIONS['hour'], hour_capacity)}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.capacity)
+
+    def append(self, sample):
+        """ Add a weather sample, older samples are dropped when full """
+        timestamp = to_timestamp(sample['date'])
+        numeric = {}
+        with self._lock:
+            if self._count and timestamp < self._times[(self._count - 1) % self.capacity]:
+                # Raw samples must stay sorted, late ones only go to aggregates
+                index = None
+            else:
+                index = self._count % self.capacity
+                self._times[index] = timestamp
+                for column in self._columns.values():
+                    column[index] = np.nan if column.dtype.kind == 'f' else None
+                self._count += 1
+            for feature, value in sample.items():
+                if feature == 'date':
+                    continue
+                is_number = _is_number(value)
+                if is_number:
+                    value = float(value)
+                    numeric[feature] = value
+                if index is None:
+                    continue
+                column = self._columns.get(feature)
+                if column is None:
+                    if is_number:
+                        column = np.full(self.capacity, np.nan)
+                    else:
+                        column = np.full(self.capacity, None, dtype=object)
+                    self._columns[feature] = column
+                if column.dtype.kind == 'f':
+                    column[index] = value if is_number else np.nan
+                else:
+                    column[index] = value
+            for aggregates in self._aggregates.values():
+                aggregates.append(timestamp, numeric)
+
+    def latest(self):
+        """ Last sample as a dict, with a datetime 'date', or None """
+        with self._lock:
+            if self._count == 0:
+                return None
+            index = (self._count - 1) % self.capacity
+            sample = {'date': _to_datetime(self._times[index])}
+            for feature, column in self._columns.items():
+                value = column[index]
+                if column.dtype.kind == 'f':
+                    if np.isnan(value):
+                        continue
+                    value = float(value)
+                elif value is None:
+                    continue
+                sample[feature] = value
+        if 'safe' in sample:
+            sample['safe'] = bool(sample['safe'])
+        return sample
+
+    def is_safe(self, stale_sec=180, now=None):
+        """ Whether the last sample is safe, and not older than stale_sec """
+        sample = self.latest()
+        if sample is None or not sample.get('safe', False):
+            return False
+        now = to_timestamp(now) if now is not None else datetime.datetime.now(
+            datetime.timezone.utc).timestamp()
+        return now - to_timestamp(sample['date']) <= stale_sec
+
+    def get_samples(self, start=None, end=None, features=None):
+        """ Raw samples with start <= date <= end
+
+        Returns:
+            dict: 'date' and each feature (or only those in features) mapped
+                to arrays in chronological order
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        with self._lock:
+            indices = _span_indices(self._times, self._count, self.capacity, start, end)
+            result = {'date': self._times[indices]}
+            for feature, column in self._columns.items():
+                if features is None or feature in features:
+                    result[feature] = column[indices]
+        return result
+
+    def get_aggregates(self, resolution='minute', start=None, end=None):
+        """ Per period statistics of the numeric features
+
+        Args:
+            resolution (str): 'minute' or 'hour'
+
+        Returns:
+            dict: 'date' (period start) and, for each numeric feature,
+                <feature>_min, <feature>_max, <feature>_mean and
+                <feature>_count arrays in chronological order
+        """
+        start, end = to_timestamp(start), to_timestamp(end)
+        with self._lock:
+            return self._aggregates[resolution].query(start, end)
+
+    def as_table(self, start=None, end=None, resolution=None):
+        """ Raw samples, or aggregates at resolution, as an astropy Table
+            whose 'date' column holds datetimes
+        """
+        if resolution is None:
+            columns = self.get_samples(start, end)
+        else:
+            columns = self.get_aggregates(resolution, start, end)
+        columns['date'] = np.array([_to_datetime(t) for t in columns['date']], dtype=object)
+        return Table(columns)
+
+    @property
+    def nbytes(self):
+        """ Memory used by the arrays """
+        with self._lock:
+            return (self._times.nbytes + sum(c.nbytes for c in self._columns.values()) +
+                    sum(a.nbytes for a in self._aggregates.values()))
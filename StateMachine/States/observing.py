@@ -7,12 +7,14 @@ from astropy import units as u
 
 # Local
 from utils import error
+from utils import EventWaiter
 from utils import Timeout
 
 SLEEP_SECONDS = 1.0
 STATUS_INTERVAL = 10. * u.second
-GUIDER_STATUS_INTERVAL = 5. * u.second
 WAITING_MSG_INTERVAL = 5. * u.second
+# Commands are queued by another process, that cannot wake us up
+CHECK_MESSAGES_INTERVAL = 1. * u.second
 MAX_EXTRA_TIME = (100+SLEEP_SECONDS) * u.second
 
 def on_enter(event_data):
@@ -20,8 +22,8 @@ def on_enter(event_data):
     #event_data.model.manager.guider = None
     """Wait for camera exposures to complete.
 
-    Frequently check for the exposures to complete, the observation to be
-    interrupted, messages to be received. Periodically post to the STATUS
+    Block until the exposures complete, the observation is interrupted or the
+    guider state changes. Periodically check messages, post to the STATUS
     channel and to the debug log.
     """
 
@@ -43,42 +45,53 @@ def on_enter(event_data):
         # Now manage actual acquisition
         maximum_duration = (model.manager.current_observation.time_per_exposure
                             + MAX_EXTRA_TIME)
-        start_time = model.manager.serv_time.get_astropy_time_from_utc()
-        camera_events = model.manager.observe()
-
-        timeout = Timeout(maximum_duration)
-        next_status_time = start_time + STATUS_INTERVAL
-        next_guider_status_time = start_time + GUIDER_STATUS_INTERVAL
-        next_msg_time = start_time + WAITING_MSG_INTERVAL
-
-        while not all([event.is_set() for event in
-                       camera_events.values()]):
-            # check for important message in mq
-            model.check_messages()
-            if model.interrupted:
-                model.say("Observation interrupted!")
-                break
-
-            now = model.manager.serv_time.get_astropy_time_from_utc()
-            if now >= next_msg_time:
-                elapsed_secs = (now - start_time).to(u.second).value
-                model.logger.debug(f"State: observing, waiting for images: {round(elapsed_secs)}")
-                next_msg_time += WAITING_MSG_INTERVAL
-                now = model.manager.serv_time.get_astropy_time_from_utc()
-
-            if (now >= next_guider_status_time and
-                    model.manager.guider is not None):
-                model.manager.guider.receive()
-                assert(model.manager.guider.is_guiding_ok())
-                next_guider_status_time += GUIDER_STATUS_INTERVAL
-                now = model.manager.serv_time.get_astropy_time_from_utc()
-
-            if now >= next_status_time:
-                model.status()
-                next_status_time += STATUS_INTERVAL
-
-        if timeout.expired():
-            raise error.Timeout
+        start_time = time.monotonic()
+        # Wake up only when an exposure completes, the guider state changes
+        # (pushed by the PHD2 reader thread), or one of the timers expires
+        waiter = EventWaiter()
+        guider = model.manager.guider
+        if guider is not None:
+            guider.add_state_change_waiter(waiter)
+        try:
+            camera_events = model.manager.observe(notifier=waiter)
+
+            timeout = Timeout(maximum_duration)
+            next_status_time = start_time + STATUS_INTERVAL.to_value(u.second)
+            next_msg_time = start_time + WAITING_MSG_INTERVAL.to_value(u.second)
+            next_check_time = start_time
+            while not all([event.is_set() for event in
+                           camera_events.values()]):
+                # check for important message in mq
+                now = time.monotonic()
+                if now >= next_check_time:
+                    model.check_messages()
+                    next_check_time = now + CHECK_MESSAGES_INTERVAL.to_value(u.second)
+                if model.interrupted:
+                    model.say("Observation interrupted!")
+                    break
+
+                if timeout.expired():
+                    raise error.Timeout
+
+                now = time.monotonic()
+                if now >= next_msg_time:
+                    elapsed_secs = now - start_time
+                    model.logger.debug(f"State: observing, waiting for images: {round(elapsed_secs)}")
+                    next_msg_time += WAITING_MSG_INTERVAL.to_value(u.second)
+
+                if guider is not None and not guider.is_guiding_ok():
+                    raise error.GuidingError(f"Guider is not guiding anymore, "
+                                             f"state is {guider.state}")
+
+                if now >= next_status_time:
+                    model.status()
+                    next_status_time += STATUS_INTERVAL.to_value(u.second)
+
+                next_wake_up = min(next_check_time, next_msg_time, next_status_time) - time.monotonic()
+                waiter.wait(timeout=min(next_wake_up, timeout.time_left()))
+        finally:
+            if guider is not None:
+                guider.remove_state_change_waiter(waiter)
 
         # Sleep for a little bit.
         time.sleep(SLEEP_SECONDS)
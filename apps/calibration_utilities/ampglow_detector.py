@@ -49,7 +49,50 @@ def variance_test(global_variance, local_vector):
     q_value = ((n-1)*local_vector.var())/global_variance
     return sist.chi2.sf(q_value, n-1)
 
-def multiscale_variance_analysis(image):
+def variance_test_map(global_variance, local_variance, n):
+    """
+        Same as variance_test, for arrays of patch variances (ddof=0) over
+        patches of n samples, in a single vectorized call
+    """
+    q_value = ((n-1)*local_variance)/global_variance
+    return sist.chi2.sf(q_value, n-1)
+
+def dyadic_bounds(size, min_ok_size):
+    """
+        Bounds of the segments generated by dyadic_index_generator, as a
+        single array: segment k is [bounds[k], bounds[k+1]]
+    """
+    starts = [start for start, end in dyadic_index_generator(0, size, min_ok_size)]
+    return np.array(starts+[size])
+
+def patch_variances(image, x_bounds, y_bounds):
+    """
+        Variance (ddof=0) and number of pixels of every patch of the grid
+        defined by x_bounds and y_bounds, all at once
+    """
+    # Work on centered data to avoid cancellation in the sum of squares
+    centered = image.astype(np.float64)-image.mean()
+    sums = np.add.reduceat(np.add.reduceat(centered, x_bounds[:-1], axis=0),
+                           y_bounds[:-1], axis=1)
+    squares = np.add.reduceat(np.add.reduceat(centered**2, x_bounds[:-1], axis=0),
+                              y_bounds[:-1], axis=1)
+    n = np.outer(np.diff(x_bounds), np.diff(y_bounds))
+    return (squares-sums**2/n)/n, n
+
+def ampglow_heatmap(image):
+    """
+        Multiscale variance analysis of a (master) dark: at each dyadic scale,
+        down to 4x4 pixels patches, the variance of each patch is compared to
+        the global image variance with a chi2 test.
+
+        Returns:
+            heatmap: per pixel p-value, averaged over scales. Low values show
+                areas where local variance does not match global variance,
+                typical of amplifier glow.
+            histogram_patch_size: patch size (in pixels) of each scale
+            histogram_freq_problem: for each scale, ratio of patches that fail
+                the test at 5%
+    """
     # The very first task is to check the global image variance
     global_variance = image.var()
 
@@ -59,35 +102,30 @@ def multiscale_variance_analysis(image):
     shape = image.shape
     histogram_patch_size = []
     histogram_freq_problem = []
-    max_freq = 0
     max_freq_image = np.zeros_like(image, dtype=np.float32)
     total_nb_image = 0
     while min(shape)>=4:
-        image_to_show = image.astype(np.float32)
         min_ok_size = min(shape)
         histogram_patch_size.append(min_ok_size)
-        histogram_freq_problem.append(0)
-        total_nb_patch = 0
-        for idx in patch_index_generator(image.shape, min_ok_size):
-            patch = image[idx[0]:idx[1],idx[2]:idx[3]]
-            p_value = variance_test(global_variance, patch.flatten())
-            #image_to_show[idx[0]:idx[1],idx[2]:idx[3]] *= max(0.5, p_value>0.05)
-            #image_to_show[idx[0]:idx[1],idx[2]:idx[3]] *= (1.5-p_value)
-            max_freq_image[idx[0]:idx[1],idx[2]:idx[3]] += p_value
-            if p_value < 0.05:
-                histogram_freq_problem[-1]+=1
-            total_nb_patch += 1
-        histogram_freq_problem[-1]/=total_nb_patch
-        if histogram_freq_problem[-1]>max_freq:
-            max_freq=histogram_freq_problem[-1]
-            #max_freq_image = image_to_show
+        x_bounds = dyadic_bounds(image.shape[0], min_ok_size)
+        y_bounds = dyadic_bounds(image.shape[1], min_ok_size)
+        local_variance, n = patch_variances(image, x_bounds, y_bounds)
+        p_value = variance_test_map(global_variance, local_variance, n)
+        # Spread each patch p-value over its pixels
+        max_freq_image += np.repeat(np.repeat(p_value, np.diff(x_bounds), axis=0),
+                                    np.diff(y_bounds), axis=1).astype(np.float32)
+        histogram_freq_problem.append(np.mean(p_value < 0.05))
         shape = tuple(np.array(shape)//2)
         total_nb_image += 1
+    return max_freq_image/total_nb_image, histogram_patch_size, histogram_freq_problem
+
+def multiscale_variance_analysis(image):
+    heatmap, _, _ = ampglow_heatmap(image)
 
     fig, ax = plt.subplots(1,2, figsize=(16,9))
-    ax[0].imshow((1.25-(max_freq_image/total_nb_image))*image)
+    ax[0].imshow((1.25-heatmap)*image)
     ax[0].axis('off')
-    heatmap = ax[1].imshow(max_freq_image/total_nb_image, cmap='jet')
+    heatmap = ax[1].imshow(heatmap, cmap='jet')
     divider = make_axes_locatable(ax[1])
     cax = divider.append_axes("right", size="5%", pad=0.05)
     plt.colorbar(heatmap, format=FormatStrFormatter('%.2e'), cax=cax)
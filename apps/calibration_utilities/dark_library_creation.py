@@ -6,13 +6,13 @@
 # Basic stuff
 import argparse
 import collections
+import itertools
 import logging
 import os
 from time import sleep
 
 # Numerical stuff
 import numpy as np
-import scipy.stats as scs
 
 # Viz stuff
 import matplotlib.pyplot as plt
@@ -28,13 +28,16 @@ import astropy.units as u
 
 # Local stuff
 from helper.IndiClient import IndiClient
+from Imaging.stack_statistics import linear_regression_map
+from Imaging.stack_statistics import load_cube
+from Imaging.stack_statistics import master_dark_stats
 from Service.NTPTimeService import NTPTimeService
 from utils import load_module
 
 class DarkLibraryBuilder():
 
     def __init__(self, camera, exp_time_list, gain_list, offset_list, temp_list=[np.NaN],
-                 outdir=None, nb_image=100):
+                 outdir=None, nb_image=100, tile_rows=32, nb_workers=None, use_memmap=False):
         #super(self).__init__()
         
         #attributes
@@ -47,6 +50,12 @@ class DarkLibraryBuilder():
         self.nb_image = nb_image
         self.show_plot = False
         self.plot_sampling = 65536 #8192
+        # Statistics are computed on tiles of tile_rows image rows, in parallel
+        # on nb_workers threads. With use_memmap, image stacks are memory
+        # mapped next to the images instead of loaded in memory
+        self.tile_rows = tile_rows
+        self.nb_workers = nb_workers
+        self.use_memmap = use_memmap
 
     def set_temperature(self, temperature):
         if temperature is np.NaN :
@@ -74,7 +83,7 @@ class DarkLibraryBuilder():
                          gain
                   ))
     def gen_calib_basedirname(self, temperature, gain, offset, exp_time):
-        return ("{}/calibration/{}/camera_{}/temperature_{}/gain_{}/exp_time_{}"
+        return ("{}/calibration/{}/camera_{}/temperature_{}/gain_{}/offset_{}/exp_time_{}"
                "".format(self.outdir,
                          'dark',
                          self.cam.name,
@@ -115,9 +124,10 @@ class DarkLibraryBuilder():
         regression = os.path.join(base_dir, 'NLF_regression.png')
         return conv_check, regression
 
-    def gen_defectmap_name(self, temperature, gain):
+    def gen_defectmap_name(self, temperature, gain, offset):
         tbase_dir = self.gen_report_temp_basedirname(temperature)
-        base_dir = self.gen_report_gain_basedirname(temperature, gain)
+        base_dir = os.path.join(self.gen_report_gain_basedirname(temperature, gain),
+                                "offset_{}".format(offset))
         os.makedirs(base_dir, exist_ok=True)
         defectmap_filename = os.path.join(base_dir, 'defectmap.tif')
         mainregparpcfname = os.path.join(tbase_dir,
@@ -132,22 +142,22 @@ class DarkLibraryBuilder():
                     regparam_a_name=regparam_a_name,
                     regparam_b_name=regparam_b_name)
 
-    def gen_therm_sig_figname(self, temperature):
+    def gen_therm_sig_figname(self, temperature, offset):
         image_dir = self.gen_report_temp_basedirname(temperature)
         os.makedirs(image_dir, exist_ok=True)
-        basename = os.path.join(image_dir, 'thermal_signal_map')
+        basename = os.path.join(image_dir, 'thermal_signal_map_offset_{}'.format(offset))
         return basename+'.png', basename+'.tif'
 
-    def gen_therm_std_figname(self, temperature):
+    def gen_therm_std_figname(self, temperature, offset):
         image_dir = self.gen_report_temp_basedirname(temperature)
         os.makedirs(image_dir, exist_ok=True)
-        basename = os.path.join(image_dir, 'thermal_std_map')
+        basename = os.path.join(image_dir, 'thermal_std_map_offset_{}'.format(offset))
         return basename+'.png', basename+'.tif'
 
-    def gen_therm_psnr_figname(self, temperature):
+    def gen_therm_psnr_figname(self, temperature, offset):
         image_dir = self.gen_report_temp_basedirname(temperature)
         os.makedirs(image_dir, exist_ok=True)
-        basename = os.path.join(image_dir, 'thermal_psnr_map')
+        basename = os.path.join(image_dir, 'thermal_psnr_map_offset_{}'.format(offset))
         return basename+'.png', basename+'.tif'
 
     def draw_NLF(self, mean, var, regfigname, nlffigname, order=1):
@@ -261,15 +271,14 @@ class DarkLibraryBuilder():
 
     def compute_master_dark_stat(self, stack):
         """ Implemented a more robust mean (denoised) estimator by removing
-            samples that are farther than 3 sigma from the initial mean estimate
+            samples that are farther than 5 sigma from the mean estimate,
+            iteratively, on the whole (nb_image, height, width) stack at once.
             Heuristic for maximum probability of possibly leptokurtic distr.
         """
-        mean = np.apply_along_axis(lambda x:
-            np.mean(scs.sigmaclip(x, low=5.0, high=5.0)[0],
-                    dtype=np.float32),
-            2, stack)
-        var = stack-mean.reshape((*mean.shape, 1))
-        var = np.mean(var**2, axis=2, dtype=np.float32)
+        mean, std = master_dark_stats(stack, low=5.0, high=5.0,
+                                      tile_rows=self.tile_rows,
+                                      nb_workers=self.nb_workers)
+        var = std**2
 
         # better safe than sorry
         psnr = np.divide(self.cam.dynamic**2, var,
@@ -317,31 +326,36 @@ class DarkLibraryBuilder():
             or homoskedastic
         """
         for temperature in self.temp_list:
-            for gi, gain in enumerate(self.gain_list):
-                for ei, exp_time in enumerate(self.exp_time_list):
-                    regfigname, nlffigname = self.gen_NLF_figname(temperature,
-                                                                  gain,
-                                                                  exp_time)
-                    if not (os.path.exists(regfigname) and os.path.exists(
-                            nlffigname)):
-                        # TODO might be worth excluding defect map
-                        master_name = self.gen_calib_mastername(
-                            temperature, gain, exp_time)
-                        mean = io.imread(master_name)
-                        master_std_name = self.gen_calib_masterstdname(
-                            temperature, gain, exp_time)
-                        std = io.imread(master_std_name)
-                        self.draw_NLF(mean, std**2, regfigname, nlffigname,
-                                      order=2)
+            for gain, offset, exp_time in itertools.product(
+                    self.gain_list, self.offset_list, self.exp_time_list):
+                regfigname, nlffigname = self.gen_NLF_figname(temperature,
+                                                              gain,
+                                                              offset,
+                                                              exp_time)
+                if not (os.path.exists(regfigname) and os.path.exists(
+                        nlffigname)):
+                    # TODO might be worth excluding defect map
+                    master_name = self.gen_calib_mastername(
+                        temperature, gain, offset, exp_time)
+                    mean = io.imread(master_name)
+                    master_std_name = self.gen_calib_masterstdname(
+                        temperature, gain, offset, exp_time)
+                    std = io.imread(master_std_name)
+                    self.draw_NLF(mean, std**2, regfigname, nlffigname,
+                                  order=2)
 
     def compute_thermal_signal_map(self):
-        """ 2D map of thermal signal: x-axis is time, y-axis is gain
-            and z axis is mean value expressed in % of full dynamic
+        """ 2D map of thermal signal, for each offset: x-axis is time, y-axis
+            is gain and z axis is mean value expressed in % of full dynamic
         """
-        for temperature in self.temp_list:
-            sigfigname, sigfilename = self.gen_therm_sig_figname(temperature)
-            stdfigname, stdfilename = self.gen_therm_std_figname(temperature)
-            psnrfigname, psnrfilename = self.gen_therm_psnr_figname(temperature)
+        for temperature, offset in itertools.product(self.temp_list,
+                                                     self.offset_list):
+            sigfigname, sigfilename = self.gen_therm_sig_figname(temperature,
+                                                                 offset)
+            stdfigname, stdfilename = self.gen_therm_std_figname(temperature,
+                                                                 offset)
+            psnrfigname, psnrfilename = self.gen_therm_psnr_figname(
+                temperature, offset)
             if not (os.path.exists(sigfigname) and os.path.exists(stdfigname)
                 and os.path.exists(psnrfigname)):
                 map_shape = (len(self.gain_list), len(self.exp_time_list))
@@ -353,32 +367,36 @@ class DarkLibraryBuilder():
 
                         # TODO might be worth excluding defect map
                         master_name = self.gen_calib_mastername(
-                            temperature, gain, exp_time)
+                            temperature, gain, offset, exp_time)
                         image = io.imread(master_name)
                         thermal_signal_map[gi, ei] = image.mean()
 
                         master_std_name = self.gen_calib_masterstdname(
-                            temperature, gain, exp_time)
+                            temperature, gain, offset, exp_time)
                         image = io.imread(master_std_name)
                         thermal_std_map[gi, ei] = image.mean()
 
                         master_psnr_name = self.gen_calib_masterpsnrname(
-                            temperature, gain, exp_time)
+                            temperature, gain, offset, exp_time)
                         image = io.imread(master_psnr_name)
                         thermal_psnr_map[gi, ei] = image.mean()
 
                 # Now draw and print thermal signal map with a nice heatmap
                 # notice that we save ADU values but show in % of dynamic
+                title_suffix = ' (offset {})'.format(offset)
                 self.draw_gain_exp_heatmap(temperature,
                     thermal_signal_map/self.cam.dynamic,
-                    'Mean thermal signal \n in % of dynamic', sigfigname)
+                    'Mean thermal signal \n in % of dynamic'+title_suffix,
+                    sigfigname)
                 io.imsave(sigfilename, thermal_signal_map)
                 self.draw_gain_exp_heatmap(temperature,
                     thermal_std_map/self.cam.dynamic,
-                    'Mean thermal noise std \n in % of dynamic', stdfigname)
+                    'Mean thermal noise std \n in % of dynamic'+title_suffix,
+                    stdfigname)
                 io.imsave(stdfilename, thermal_std_map)
                 self.draw_gain_exp_heatmap(temperature, thermal_psnr_map,
-                    'Mean thermal signal \n PSNR in dB', psnrfigname)
+                    'Mean thermal signal \n PSNR in dB'+title_suffix,
+                    psnrfigname)
                 io.imsave(psnrfilename, thermal_psnr_map)
 
     def compute_defect_map(self):
@@ -401,29 +419,20 @@ class DarkLibraryBuilder():
             cm = plt.get_cmap('gist_rainbow')
             colors = [cm(1.*i/len(self.gain_list)) for i in
                       range(len(self.gain_list))]
-            for gi, gain in enumerate(self.gain_list):
-                dark_signal = None
-                names = self.gen_defectmap_name(temperature, gain)
+            for (gi, gain), offset in itertools.product(
+                    enumerate(self.gain_list), self.offset_list):
+                names = self.gen_defectmap_name(temperature, gain, offset)
                 if not all(map(lambda x:os.path.exists(x), names.values())):
-                    for ei, exp_time in enumerate(self.exp_time_list):
-                        master_name = self.gen_calib_mastername(
-                            temperature, gain, exp_time)
-                        im = io.imread(master_name)
-                        if dark_signal is None:
-                            dark_signal = im
-                        else:
-                            dark_signal = np.dstack((dark_signal, im))
+                    master_names = [self.gen_calib_mastername(
+                        temperature, gain, offset, exp_time)
+                        for exp_time in self.exp_time_list]
+                    dark_signal = load_cube(master_names, loader=io.imread)
                     # Now perform the regression a*exp_time+b for each pixel
-                    amap = np.zeros(dark_signal.shape[:2])
-                    bmap = np.zeros(dark_signal.shape[:2])
-                    for i in range(dark_signal.shape[0]):
-                        for j in range(dark_signal.shape[1]):
-                            x = self.exp_time_list
-                            y = dark_signal[i,j]
-                            M = np.concatenate((y.reshape(-1,1),
-                                np.ones_like(y).reshape(-1,1)), axis=1)
-                            # use Moore-penrose pseudo inverse to solve ls
-                            amap[i,j],bmap[i,j] = np.linalg.lstsq(M,x)[0]
+                    # closed form least square, on all pixels at once
+                    x = u.Quantity(self.exp_time_list, u.second).value
+                    amap, bmap = linear_regression_map(
+                        dark_signal, x, tile_rows=self.tile_rows,
+                        nb_workers=self.nb_workers)
                     # Now write output
                     io.imsave(names['regparam_a_name'],amap)
                     io.imsave(names['regparam_b_name'],bmap)
@@ -559,33 +568,33 @@ class DarkLibraryBuilder():
     def compute_master_dark(self):
         # first: compute master
         for temperature in self.temp_list:
-            for gain in self.gain_list:
-                for exp_time in self.exp_time_list:
-                    master_name = self.gen_calib_mastername(temperature,
-                                                            gain, exp_time)
-                    master_std_name = self.gen_calib_masterstdname(temperature,
-                                                            gain, exp_time)
-                    master_psnr_name = self.gen_calib_masterpsnrname(temperature,
-                                                            gain, exp_time)
-                    if not (os.path.exists(master_name) and
-                            os.path.exists(master_std_name)):
-                        master = None
-                        for i in range(self.nb_image):
-                            #open file and stack content
-                            fname = self.gen_calib_filename(temperature, gain,
-                                                            exp_time, i)
-                            f = fits.open(fname)
-                            header, im = f[0].header, f[0].data
-                            if master is None:
-                                master = im
-                            else:
-                                master = np.dstack((master, im))
-                        #Now perform statistics (ie denoise, using
-                        # mean+sigma clipping)
-                        mean, std, psnr = self.compute_master_dark_stat(master)
-                        io.imsave(master_name, mean)
-                        io.imsave(master_std_name, std)
-                        io.imsave(master_psnr_name, psnr)
+            for gain, offset, exp_time in itertools.product(
+                    self.gain_list, self.offset_list, self.exp_time_list):
+                master_name = self.gen_calib_mastername(temperature,
+                    gain, offset, exp_time)
+                master_std_name = self.gen_calib_masterstdname(temperature,
+                    gain, offset, exp_time)
+                master_psnr_name = self.gen_calib_masterpsnrname(temperature,
+                    gain, offset, exp_time)
+                if not (os.path.exists(master_name) and
+                        os.path.exists(master_std_name)):
+                    # open files and stack content in a single cube
+                    fnames = [self.gen_calib_filename(temperature, gain,
+                                                      offset, exp_time, i)
+                              for i in range(self.nb_image)]
+                    memmap_path = (os.path.join(os.path.dirname(master_name),
+                                                'stack.dat')
+                                   if self.use_memmap else None)
+                    master = load_cube(fnames, memmap_path=memmap_path)
+                    #Now perform statistics (ie denoise, using
+                    # mean+sigma clipping)
+                    mean, std, psnr = self.compute_master_dark_stat(master)
+                    io.imsave(master_name, mean)
+                    io.imsave(master_std_name, std)
+                    io.imsave(master_psnr_name, psnr)
+                    del master
+                    if memmap_path is not None:
+                        os.remove(memmap_path)
 
 
     def build(self):
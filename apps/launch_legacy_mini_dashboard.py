@@ -1,7 +1,6 @@
 # Generic python stuff
 import base64
-import bson.json_util as json_util
-from collections import deque
+import datetime
 import time
 
 # UI/Dash stuff
@@ -25,7 +24,7 @@ import pandas as pd
 import numpy as np
 
 # Local stuff
-from utils.database import DB, FileDB, MongoDB
+from utils.database import DB
 
 #######################
 # Data Analysis / Model
@@ -37,14 +36,18 @@ def retrieve_obd_values():
     global db
     df = None
 
-    if isinstance(db, FileDB):
-        with open(db.get_file(collection='weather')) as f:
-            d = deque(f.readlines(), maxlen=max_length)
-        l = [json_util.loads(d[i])['data'] for i in range(len(d))]
-        # build a dataframe now
-        lindex = [i['date'] for i in l]
-        ldata = [dict([(i,j) for i,j in el.items() if i != 'date']) for el in l]
-        df = pd.DataFrame(ldata, index=lindex)
+    # Only read the records of the last 24 hours before latest measurement,
+    # through the collection index
+    latest = db.get_current('weather')
+    if latest is not None:
+        end = latest['date']
+        records = db.find_range('weather', end - datetime.timedelta(days=1), end)
+        l = [record['data'] for record in records[-max_length:]]
+        if len(l) > 0:
+            # build a dataframe now
+            lindex = [i['date'] for i in l]
+            ldata = [dict([(i,j) for i,j in el.items() if i != 'date']) for el in l]
+            df = pd.DataFrame(ldata, index=lindex)
 
     if df is not None:
         # Only keep data from the last 24 hours before latest measurment
@@ -17,6 +17,7 @@ from transitions import MachineError
 # Local
 from Base.Base import Base
 from Manager.Manager import Manager
+from Service.WeatherHistory import to_timestamp
 from StateMachine.StateMachine import StateMachine
 from utils import get_free_space
 from utils import load_module
@@ -361,11 +362,20 @@ class RemoteObservatoryFSM(StateMachine, Base):
         record = {'safe': False}
 
         try:
-            record = self.db.get_current('weather')
-            is_safe = record['data'].get('safe', False)
+            # Weather service running in this process keeps recent samples
+            # in memory, otherwise read the last one stored by the service
+            history = getattr(self.manager.serv_weather, 'weather_history',
+                              None)
+            if history is not None and len(history) > 0:
+                record = history.latest()
+                is_safe = record.get('safe', False)
+            else:
+                record = self.db.get_current('weather')
+                is_safe = record['data'].get('safe', False)
             timestamp = record['date']
-            age = (self.manager.serv_time.get_utc() -
-                   timestamp).total_seconds()
+            # History dates are aware, time services may return naive UTC
+            age = (to_timestamp(self.manager.serv_time.get_utc()) -
+                   to_timestamp(timestamp))
             self.logger.debug(f"Weather Safety: {is_safe} [{age:.0f} sec old "
                               f"- {timestamp}]")
         except (TypeError, KeyError) as e:
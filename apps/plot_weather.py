@@ -37,12 +37,17 @@ def label_pos(lim, pos=0.85):
 
 class WeatherPlotter(object):
 
-    """ Plot weather information for a given time span """
+    """ Plot weather information for a given time span
+
+    Data comes from a csv `data_file`, the in-memory `weather_history`
+    (Service.WeatherHistory) of a running weather service, or the database.
+    """
 
     def __init__(self, date_string=None, data_file=None, *args, **kwargs):
         super(WeatherPlotter, self).__init__()
         self.args = args
         self.kwargs = kwargs
+        self.weather_history = kwargs.get('weather_history', None)
 
         config = load_config(config_files=['peas'])
         self.config = config
@@ -122,7 +127,8 @@ class WeatherPlotter(object):
     def get_table_data(self, data_file):
         """ Get the table data
 
-        If a `data_file` (csv) is passed, read from that, otherwise use mongo
+        If a `data_file` (csv) is passed, read from that, otherwise use the
+        weather history if any, or the database
 
         """
         table = None
@@ -141,14 +147,21 @@ class WeatherPlotter(object):
 
         if data_file is not None:
             table = Table.from_pandas(pd.read_csv(data_file, parse_dates=True))
+        elif self.weather_history is not None:
+            # Columns are already there, no need to go through disk
+            table = self.weather_history.as_table(self.start, self.end)
+            if len(table) == 0:
+                return None
         else:
             from utils.database import DB, FileDB
 
             db = DB()
             if isinstance(db, FileDB):
-                with open(db.get_file(collection='weather')) as f:
-                    d = deque(f.readlines(), maxlen=10000)
-                l = [json_util.loads(d[i])['data'] for i in range(len(d))]
+                # Indexed time range scan of the collection
+                l = [e['data'] for e in db.find_range('weather', self.start,
+                                                      self.end)]
+                if not l:
+                    return None
                 # build a dataframe now
                 df = pd.DataFrame(l)
                 #lindex = [i['date'] for i in l]
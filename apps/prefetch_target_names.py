@@ -0,0 +1,43 @@
+# launch with
+# PYTHONPATH=. python ./apps/prefetch_target_names.py --target-file spectral_targets.yaml --simbad
+# Generic import
+import logging
+
+# Local
+from ObservationPlanner.Scheduler import Scheduler
+from ObservationPlanner.TargetNameCache import SesameResolver
+from ObservationPlanner.TargetNameCache import SimbadResolver
+from ObservationPlanner.TargetNameCache import TargetNameCache
+from utils.config import load_config
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+if __name__ == '__main__':
+    import argparse
+
+    # Get the command line option
+    parser = argparse.ArgumentParser(
+        description="Resolve all target names of a target file into the local name cache, so that the "
+                    "scheduler can start without network access.")
+
+    parser.add_argument("-t", "--target-file", dest="target_file", default=None,
+                        help="Target file, defaults to the one of the scheduler configuration")
+    parser.add_argument('--simbad', action='store_true', default=False,
+                        help="Also query SIMBAD for spectral informations (SpectroScheduler)")
+    parser.add_argument('--force', action='store_true', default=False,
+                        help="Resolve again names that are still fresh in cache")
+    args = parser.parse_args()
+
+    target_file = args.target_file
+    if target_file is None:
+        target_file = load_config()['scheduler']['target_file']
+    names = [target_name for target_name in load_config(config_files=[target_file]).get('targets', {})
+             if Scheduler.parse_target_coordinates(target_name) is None]
+
+    unresolved = names
+    if args.simbad:
+        unresolved = TargetNameCache(resolver=SimbadResolver()).prefetch(unresolved, force=args.force)
+    unresolved = TargetNameCache(resolver=SesameResolver()).prefetch(unresolved, force=args.force)
+    logging.info(f"{len(names) - len(unresolved)}/{len(names)} target names resolved")
+    if unresolved:
+        logging.warning(f"Could not resolve: {unresolved}")
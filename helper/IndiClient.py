@@ -1,17 +1,21 @@
 # Basic stuff
+from collections import deque
 from contextlib import contextmanager
+import ctypes
 import io
 import json
 import logging
-import multiprocessing
-import queue
 import threading
+import time
 #from transitions.extensions import LockedMachine
 #import weakref
 
 # Indi stuff
 import PyIndi
 
+# Numerical stuff
+import numpy as np
+
 # Imaging and Fits stuff
 from astropy.io import fits
 
@@ -24,41 +28,259 @@ logger = logging.getLogger(__name__)
 
 defaultTimeout = 30
 
+FITS_BLOCK_SIZE = 2880
+FITS_CARD_SIZE = 80
+FITS_BITPIX_DTYPE = {
+    8: 'u1',
+    16: '>i2',
+    32: '>i4',
+    64: '>i8',
+    -32: '>f4',
+    -64: '>f8'}
+# signed integer storage with this BZERO actually encodes unsigned integers
+FITS_UNSIGNED_BZERO = {
+    16: (2**15, '>u2', 0x8000),
+    32: (2**31, '>u4', 0x80000000)}
+
+
+def hdulist_from_buffer(buffer, converted=False):
+    """
+    Build a single HDU FITS HDUList whose data array is a view on buffer
+
+    This is what INDI CCD drivers send us: a primary HDU with an image. Unsigned
+    integer data (BZERO=2**15 or 2**31) is converted in place by flipping the
+    sign bit, so that no copy of the frame is ever done. The buffer then no
+    longer holds valid FITS data: callers that build the HDUList again from the
+    same buffer must pass converted=True, so that the sign bit is not flipped
+    back. Returns None if the content cannot be handled this way (scaled data,
+    compressed content, ...), caller should then fall back to a regular fits.open.
+    """
+    header_end = None
+    for block_start in range(0, len(buffer), FITS_BLOCK_SIZE):
+        block = bytes(buffer[block_start:block_start+FITS_BLOCK_SIZE])
+        for card_start in range(0, len(block), FITS_CARD_SIZE):
+            if block[card_start:card_start+FITS_CARD_SIZE].rstrip() == b'END':
+                header_end = block_start + FITS_BLOCK_SIZE
+                break
+        if header_end is not None:
+            break
+    if header_end is None:
+        return None
+    header = fits.Header.fromstring(bytes(buffer[:header_end]))
+    bitpix = header.get('BITPIX')
+    naxis = header.get('NAXIS', 0)
+    if bitpix not in FITS_BITPIX_DTYPE or naxis == 0 or header.get('BSCALE', 1) != 1:
+        return None
+    shape = tuple(header[f"NAXIS{i}"] for i in range(naxis, 0, -1))
+    count = int(np.prod(shape))
+    dtype = np.dtype(FITS_BITPIX_DTYPE[bitpix])
+    if header_end + count * dtype.itemsize > len(buffer):
+        return None
+    bzero = header.get('BZERO', 0)
+    if bzero != 0:
+        if bitpix not in FITS_UNSIGNED_BZERO or FITS_UNSIGNED_BZERO[bitpix][0] != bzero:
+            return None
+        _, unsigned_dtype, sign_bit = FITS_UNSIGNED_BZERO[bitpix]
+        data = np.frombuffer(buffer, dtype=unsigned_dtype, count=count, offset=header_end)
+        if not converted:
+            data ^= sign_bit
+        header.remove('BZERO')
+        header.remove('BSCALE', ignore_missing=True)
+    else:
+        data = np.frombuffer(buffer, dtype=dtype, count=count, offset=header_end)
+    return fits.HDUList([fits.PrimaryHDU(data=data.reshape(shape), header=header)])
+
+
+def copy_blob_data(bp, buffer):
+    """
+    Copy the content of the indi blob bp into the bytearray buffer, resizing it if needed.
+
+    We directly memmove from the C++ memory handled by the indi client library,
+    so that we do not go through an intermediate python bytes object
+    """
+    blob_len = bp.bloblen
+    if len(buffer) < blob_len:
+        buffer.extend(bytes(blob_len - len(buffer)))
+    try:
+        src = int(bp.blob)
+        dst = ctypes.addressof(ctypes.c_char.from_buffer(buffer))
+        ctypes.memmove(dst, src, blob_len)
+    except (AttributeError, TypeError):
+        buffer[:blob_len] = bp.getblobdata()
+    return blob_len
+
+
 class BLOB:
-    def __init__(self, bp):
-        self.name = bp.name
-        self.label = bp.label
-        self.format = bp.format
-        self.blob_len = bp.bloblen
-        self.size = bp.size
-        self.data = bp.getblobdata()
+    """
+    Zero-copy view on a blob received from the indi server
+
+    data is a memoryview on a buffer owned by a BLOBListener, that buffer is given
+    back to the listener for reuse when release is called. Never call release
+    while the data, or an HDU built with get_fits, is still in use.
+    """
+    def __init__(self, name, label, format, blob_len, size, buffer, listener=None, received_time=None):
+        self.name = name
+        self.label = label
+        self.format = format
+        self.blob_len = blob_len
+        self.size = size
+        self._buffer = buffer
+        self.data = memoryview(buffer)[:blob_len]
+        # Whether get_fits converted unsigned pixels in place, see hdulist_from_buffer
+        self._converted = False
+        self._listener = listener
+        self.received_time = time.monotonic() if received_time is None else received_time
 
     def get_fits(self):
-        return fits.open(io.BytesIO(self.data))
+        hdul = None
+        if self.format.startswith('.fits') and not self.format.endswith('.fz'):
+            try:
+                hdul = hdulist_from_buffer(self.data, converted=self._converted)
+                if hdul is not None and hdul[0].data.dtype.kind == 'u':
+                    self._converted = True
+            except Exception as e:
+                logger.warning(f"Cannot map blob {self.name} as fits without copy, falling back to a copy: {e}")
+        if hdul is None:
+            hdul = fits.open(io.BytesIO(self.data))
+        return hdul
 
     def save(self, filename):
+        if self._converted:
+            # Raw content is not valid FITS anymore
+            self.get_fits().writeto(filename, overwrite=True)
+            return
         with open(filename, 'wb') as file:
             file.write(self.data)
 
+    def release(self):
+        """Give the underlying buffer back to the listener ring buffer"""
+        if self._listener is not None:
+            try:
+                self.data.release()
+            except BufferError:
+                # Someone still holds a view on the data, the buffer cannot be reused safely
+                logger.warning(f"Blob {self.name} data still in use, its buffer will not be recycled")
+            else:
+                self._listener.release_buffer(self._buffer)
+        self._buffer = None
+        self._listener = None
+
+
 class BLOBListener(Base):
-    def __init__(self, device_name, queue_size=1):
+    """
+    Per-device, thread-safe ring buffer of received blobs
+
+    Buffers are preallocated bytearrays that get reused once consumers release
+    the BLOB they got from get. When the ring is full, the policy decides what to do:
+    * drop_oldest: the oldest blob not yet consumed is dropped
+    * block: the indi client thread waits up to put_timeout seconds for a consumer
+      to make room (backpressure), then drops the incoming blob
+    """
+    DROP_OLDEST = 'drop_oldest'
+    BLOCK = 'block'
+
+    def __init__(self, device_name, queue_size=1, policy=DROP_OLDEST, put_timeout=5, slot_size=None):
         # Init "our" Base class
         Base.__init__(self)
+        if policy not in (self.DROP_OLDEST, self.BLOCK):
+            raise ValueError(f"Unknown blob ring buffer policy {policy}")
         self.device_name = device_name
-        self.queue = multiprocessing.Queue(maxsize=queue_size)
+        self.queue_size = max(1, int(queue_size))
+        self.policy = policy
+        self.put_timeout = put_timeout
+        self._ready = deque()
+        self._free_buffers = []
+        self._max_free_buffers = self.queue_size + 1
+        self._cond = threading.Condition()
+        if slot_size:
+            self._free_buffers = [bytearray(int(slot_size)) for _ in range(self._max_free_buffers)]
+        # counters
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.allocated = len(self._free_buffers)
+        self.last_latency_sec = 0.
+        self.max_latency_sec = 0.
+        self._total_latency_sec = 0.
+
+    def _acquire_buffer(self, size):
+        """Must be called with the condition held"""
+        if self._free_buffers:
+            return self._free_buffers.pop()
+        self.allocated += 1
+        return bytearray(size)
+
+    def release_buffer(self, buffer):
+        with self._cond:
+            if len(self._free_buffers) < self._max_free_buffers:
+                self._free_buffers.append(buffer)
+
+    def _recycle(self, blob):
+        """Must be called with the condition held, blob has never been handed to a consumer"""
+        blob.data.release()
+        if len(self._free_buffers) < self._max_free_buffers:
+            self._free_buffers.append(blob._buffer)
+
+    def put(self, bp):
+        """Called by the indi client thread, copy bp into a ring slot"""
+        with self._cond:
+            self.received += 1
+            if len(self._ready) >= self.queue_size:
+                if self.policy == self.BLOCK:
+                    if not self._cond.wait_for(lambda: len(self._ready) < self.queue_size,
+                                               timeout=self.put_timeout):
+                        self.dropped += 1
+                        logger.warning(f"{self}: ring buffer full for {self.put_timeout}s, dropping incoming blob")
+                        return False
+                else:
+                    self._recycle(self._ready.popleft())
+                    self.dropped += 1
+            buffer = self._acquire_buffer(bp.bloblen)
+        # Copy outside of the lock, consumers may keep reading meanwhile
+        blob_len = copy_blob_data(bp, buffer)
+        blob = BLOB(name=bp.name, label=bp.label, format=bp.format, blob_len=blob_len, size=bp.size,
+                    buffer=buffer, listener=self)
+        with self._cond:
+            self._ready.append(blob)
+            self._cond.notify_all()
+        return True
 
     def get(self, timeout=300):
-        try:
-            # logger.debug(f"BLOBListener[{self.device_name}]: waiting for blob, timeout={timeout}")
-            blob = self.queue.get(True, timeout)
-            # logger.debug(f"BLOBListener[{self.device_name}]: blob received name={blob.name}, label={blob.label}, "
-            #     f"size={blob.size}, queue size: {self.queue.qsize()} (isEmpty: {self.queue.empty()}")
-            return blob
-        except queue.Empty:
-            raise BLOBError(f"Timeout while waiting for BLOB on {self.device.name}")
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._ready) > 0, timeout=timeout):
+                raise BLOBError(f"Timeout while waiting for BLOB on {self.device_name}")
+            blob = self._ready.popleft()
+            self.delivered += 1
+            self.last_latency_sec = time.monotonic() - blob.received_time
+            self.max_latency_sec = max(self.max_latency_sec, self.last_latency_sec)
+            self._total_latency_sec += self.last_latency_sec
+            self._cond.notify_all()
+        return blob
+
+    def qsize(self):
+        with self._cond:
+            return len(self._ready)
+
+    def clear(self):
+        with self._cond:
+            while self._ready:
+                self._recycle(self._ready.popleft())
+            self._cond.notify_all()
+
+    def get_stats(self):
+        with self._cond:
+            return dict(
+                received=self.received,
+                delivered=self.delivered,
+                dropped=self.dropped,
+                allocated=self.allocated,
+                pending=len(self._ready),
+                last_latency_sec=self.last_latency_sec,
+                max_latency_sec=self.max_latency_sec,
+                mean_latency_sec=self._total_latency_sec / self.delivered if self.delivered else 0.)
 
     def __str__(self):
-        return f"BLOBListener(device={self.device_name}"
+        return f"BLOBListener(device={self.device_name})"
 
     def __repr__(self):
         return self.__str__()
@@ -120,9 +342,18 @@ class IndiClient(SingletonIndiClientHolder, PyIndi.BaseClient, Base):
         # Blob related attributes
         self.blob_event = threading.Event() #TODO TN THIS IS NOT USED ANYMORE
         self.__blob_listeners = []
+        self.__blob_listeners_lock = threading.Lock()
         self.queue_size = config.get('queue_size', 1)
+        self.blob_policy = config.get('blob_policy', BLOBListener.DROP_OLDEST)
+        self.blob_put_timeout = config.get('blob_put_timeout', 5)
+        self.blob_slot_size = config.get('blob_slot_size', None)
         self.__pv_handlers = {}
 
+        # Property waiting related attributes: one condition per (device, property), all sharing the same lock
+        self.__property_lock = threading.Lock()
+        self.__property_conditions = {}
+        self.property_wait_fallback_sec = config.get('property_wait_fallback_sec', 1)
+
         # Finished configuring
         logger.debug('Configured Indi Client successfully')
 
@@ -132,14 +363,17 @@ class IndiClient(SingletonIndiClientHolder, PyIndi.BaseClient, Base):
     def newDevice(self, d):
         '''Emmited when a new device is created from INDI server.'''
         logger.info(f"new device {d.getDeviceName()}")
+        self.notify_property(d.getDeviceName())
 
     def removeDevice(self, d):
         '''Emmited when a device is deleted from INDI server.'''
         logger.info(f"remove device {d.getDeviceName()}")
+        self.notify_property(d.getDeviceName())
 
     def newProperty(self, p):
         '''Emmited when a new property is created for an INDI driver.'''
         logger.info(f"new property {p.getName()} as {p.getTypeAsString()} for device {p.getDeviceName()}")
+        self.notify_property(p.getDeviceName(), p.getName())
 
     def updateProperty(self, p):
         '''Emmited when a new property value arrives from INDI server.'''
@@ -158,6 +392,7 @@ class IndiClient(SingletonIndiClientHolder, PyIndi.BaseClient, Base):
             self.process_blob_handlers(PyIndi.PropertyBlob(p)[0])
         else:
             self.process_generic_handlers(p)
+        self.notify_property(p.getDeviceName(), p.getName())
 
     def removeProperty(self, p):
         '''Emmited when a property is deleted for an INDI driver.'''
@@ -258,21 +493,61 @@ class IndiClient(SingletonIndiClientHolder, PyIndi.BaseClient, Base):
     def device_names(self):
         return [d.getDeviceName() for d in self.getDevices()]
 
+    def _get_property_condition(self, device_name, property_name=None):
+        """Must be called with the property lock held"""
+        key = (device_name, property_name)
+        if key not in self.__property_conditions:
+            self.__property_conditions[key] = [threading.Condition(self.__property_lock), 0]
+        return self.__property_conditions[key]
+
+    def notify_property(self, device_name, property_name=None):
+        """
+        Wake up every thread waiting on device_name.property_name, as well as threads
+        waiting on any change of device_name (property_name=None)
+        """
+        with self.__property_lock:
+            for key in {(device_name, property_name), (device_name, None)}:
+                entry = self.__property_conditions.get(key, None)
+                if entry is not None:
+                    entry[1] += 1
+                    entry[0].notify_all()
+
+    def wait_for_property(self, device_name, property_name, predicate, timeout=defaultTimeout):
+        """
+        Block until predicate() returns True, re-evaluating it each time the server notifies
+        us about device_name.property_name (or about any property of device_name if
+        property_name is None).
+        predicate is evaluated without holding our lock, as it usually calls into the indi
+        library, that may itself be locked by the thread that notifies us. A notification
+        counter makes sure no update is missed in between.
+        As a safety net, predicate is also re-evaluated every property_wait_fallback_sec.
+        timeout <= 0 or None means wait forever.
+        Returns True if predicate was fulfilled, False on timeout
+        """
+        deadline = None if (timeout is None or timeout <= 0) else time.monotonic() + timeout
+        while True:
+            with self.__property_lock:
+                entry = self._get_property_condition(device_name, property_name)
+                version = entry[1]
+            if predicate():
+                return True
+            wait_time = self.property_wait_fallback_sec
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            with self.__property_lock:
+                if entry[1] == version:
+                    entry[0].wait(wait_time)
+
     def process_blob_handlers(self, bp):
         # this threading.Event is used for sync purpose in other part of the code
         logger.debug(f"new BLOB received: {bp.name}")
-        #self.blob_event.set()
-        for listener in self.__blob_listeners:
-            if bp.bvp.device == listener.device_name:
-                blob=BLOB(bp)
-                # TODO TN, there doesn't seems to be a super reliable multiprocessing ringbuffer in python
-                # Hence we implemented the ring bugger in the worse possible way...
-                try:
-                    listener.queue.put_nowait(blob)
-                except queue.Full:
-                    listener.queue.get_nowait()
-                    listener.queue.put_nowait(blob)
-        #del bp # This was pure madness
+        with self.__blob_listeners_lock:
+            listeners = [listener for listener in self.__blob_listeners if bp.bvp.device == listener.device_name]
+        for listener in listeners:
+            listener.put(bp)
 
     def process_generic_handlers(self, pv):
         try:
@@ -298,17 +573,24 @@ class IndiClient(SingletonIndiClientHolder, PyIndi.BaseClient, Base):
 
     def reset_blob_listener(self, device_name, queue_size=None):
         queue_size = self.queue_size if queue_size is None else queue_size
-        # TODO TN you should use proper singleton pattern instead of this...
-        # And any part manipulating __blob_listeners should be protected against concurrent access...
-        #blob_listener = next((el for el in self.__blob_listeners if el.device_name == device_name), None)
-        self.remove_blob_listener(device_name)
-        #if blob_listener is None:
-        blob_listener = BLOBListener(device_name, queue_size)
-        self.__blob_listeners.append(blob_listener)
+        blob_listener = BLOBListener(device_name,
+                                     queue_size=queue_size,
+                                     policy=self.blob_policy,
+                                     put_timeout=self.blob_put_timeout,
+                                     slot_size=self.blob_slot_size)
+        with self.__blob_listeners_lock:
+            self.__blob_listeners[:] = [el for el in self.__blob_listeners if el.device_name != device_name]
+            self.__blob_listeners.append(blob_listener)
         return blob_listener
 
     def remove_blob_listener(self, device_name):
-        self.__blob_listeners[:] = [el for el in self.__blob_listeners if el.device_name != device_name]
+        with self.__blob_listeners_lock:
+            self.__blob_listeners[:] = [el for el in self.__blob_listeners if el.device_name != device_name]
+
+    def get_blob_listener_stats(self):
+        with self.__blob_listeners_lock:
+            listeners = list(self.__blob_listeners)
+        return {listener.device_name: listener.get_stats() for listener in listeners}
 
     def add_pv_handler(self, device_name, pv_name, handler_name, pv_handler):
         if device_name not in self.__pv_handlers:
@@ -96,6 +96,8 @@ class IndiClient(SingletonIndiClientHolder, INDIClient, Base):
     def stop(self):
         # Inform the task running in the ioloop (itself ran by self.thread) that they can stop looping
         self.running = False
+        # and wake up the writer task, that waits for data to send
+        self.ioloop.call_soon_threadsafe(self.stop_writing)
         # Now wait until the main connection loop (also running in ioloop) is over
         #self.communication_over_event.wait()
 
@@ -196,8 +198,7 @@ class IndiClient(SingletonIndiClientHolder, INDIClient, Base):
         put the xml argument in the
         to_indiQ.
         """
-        asyncio.run_coroutine_threadsafe(self.to_indiQ.put(xml), self.ioloop)
-        #self.ioloop.call_soon_threadsafe(self.to_indiQ.put_nowait, xml.encode())
+        self.ioloop.call_soon_threadsafe(self.to_indiQ.put_nowait, xml)
 
     async def xml_from_indiserver(self, data):
         """
@@ -207,9 +208,9 @@ class IndiClient(SingletonIndiClientHolder, INDIClient, Base):
         """
         # This is way too verbose, even in debug mode
         # print(f"IndiClient just received data {data}")
-        for sub in self.device_subscriptions.values():
-            asyncio.run_coroutine_threadsafe(sub(data), self.ioloop)
-        await asyncio.sleep(0.01)
+        # Each device parses the chunk in turn, before the next chunk is read
+        for sub in list(self.device_subscriptions.values()):
+            await sub(data)
 
     def __str__(self):
         return f"INDI client connected to {self.host}:{self.port}"
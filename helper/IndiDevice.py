@@ -1,10 +1,10 @@
 # Basic stuff
 import asyncio
 from collections import deque
+from contextlib import contextmanager
 import ctypes
 import logging
-import queue
-import time
+import threading
 
 # Indi stuff
 import PyIndi
@@ -114,6 +114,11 @@ class IndiDevice(Base):
         self.indi_driver_name = indi_driver_name
         # self.debug = debug
 
+        # Last acknowledged value of vectors set within batched_settings, see there
+        self._settings_cache = {}
+        self._settings_cache_lock = threading.Lock()
+        self._settings_batch = threading.local()
+
     @property
     def is_connected(self):
         return self.device.isConnected()
@@ -142,14 +147,14 @@ class IndiDevice(Base):
             self._setup_indi_client()
         if self.device is None or not self.device.isValid():
             self.device = None
-            started = time.time()
-            while not self.device:
+
+            def device_found():
                 self.device = self.indi_client.getDevice(self.device_name)
-                if 0 < self.timeout < time.time() - started:
-                    msg = f"IndiDevice: Timeout while waiting for device {self.device_name}"
-                    self.logger.error(msg)
-                    raise RuntimeError(msg)
-                time.sleep(0.01)
+                return bool(self.device)
+            if not self.indi_client.wait_for_property(self.device_name, None, device_found, timeout=self.timeout):
+                msg = f"IndiDevice: Timeout while waiting for device {self.device_name}"
+                self.logger.error(msg)
+                raise RuntimeError(msg)
             self.logger.debug(f"Indi Device: indi_client has found device "
                               f"{self.device_name}")
         else:
@@ -216,21 +221,18 @@ class IndiDevice(Base):
             else:
                 return
         self.logger.info(f"Connecting to device {self.device_name}")
+        self.invalidate_settings_cache()
         # setup available list of interfaces
         self._setup_interfaces()
         # set the corresponding switch to on
         self.set_switch('CONNECTION', ['CONNECT'])
-        #     time.sleep(0.1)
-        started = time.time()
         if timeout is None:
             timeout = self.timeout
-        while not self.device.isConnected():
-            self.logger.debug(f"Device {self.device_name} is valid ? {self.device.isValid()}")
-            if 0 < timeout < time.time() - started:
-                msg = f"IndiDevice: Timeout while waiting for connection to device {self.device_name} with timeout {timeout}"
-                self.logger.debug(msg)
-                raise RuntimeError(msg)
-            time.sleep(0.01)
+        if not self.indi_client.wait_for_property(self.device_name, 'CONNECTION', self.device.isConnected,
+                                                  timeout=timeout):
+            msg = f"IndiDevice: Timeout while waiting for connection to device {self.device_name} with timeout {timeout}"
+            self.logger.debug(msg)
+            raise RuntimeError(msg)
 
 
     def connect(self, connect_device=True):
@@ -246,6 +248,7 @@ class IndiDevice(Base):
 
     def disconnect(self):
         self.logger.info(f"Disconnecting from device {self.device_name}")
+        self.invalidate_settings_cache()
         if self.indi_client is not None:
             self.indi_client.disconnectDevice(deviceName=self.device_name)
             self.disable_blob()
@@ -310,14 +313,20 @@ class IndiDevice(Base):
 
     def set_text(self, text_name, value_vector, sync=True, timeout=None):
         pv = self.get_prop(text_name, "text")
+        if self._skip_cached_setting(text_name, value_vector):
+            return pv
         for property_name, index in self.__get_prop_vect_indices_having_values(
                 pv, value_vector.keys()).items():
             pv[index].text = value_vector[property_name]
         self.indi_client.sendNewText(pv)
         if sync:
+            alert_msg = f"Indi alert upon set_text, {text_name} : {value_vector}"
+            if self._defer_setting_ack(pv, value_vector, [PyIndi.IPS_ALERT, PyIndi.IPS_OK, PyIndi.IPS_IDLE],
+                                       timeout, alert_msg):
+                return pv
             ret = self.__wait_prop_status(pv, statuses=[PyIndi.IPS_ALERT, PyIndi.IPS_OK, PyIndi.IPS_IDLE], timeout=timeout)
             if ret == PyIndi.IPS_ALERT:
-                raise RuntimeError(f"Indi alert upon set_text, {text_name} : {value_vector}")
+                raise RuntimeError(alert_msg)
         return pv
 
     def get_number(self, name, ctl=None):
@@ -340,14 +349,19 @@ class IndiDevice(Base):
 
     def set_number(self, number_name, value_vector, sync=True, timeout=None):
         pv = self.get_prop(number_name, "number")
+        if self._skip_cached_setting(number_name, value_vector):
+            return pv
         for property_name, index in self.__get_prop_vect_indices_having_values(
                 pv, value_vector.keys()).items():
             pv[index].value = value_vector[property_name]
         self.indi_client.sendNewNumber(pv)
         if sync:
+            alert_msg = f"Indi alert upon set_number {number_name}: {value_vector}"
+            if self._defer_setting_ack(pv, value_vector, [PyIndi.IPS_ALERT, PyIndi.IPS_OK], timeout, alert_msg):
+                return pv
             ret = self.__wait_prop_status(pv, statuses=[PyIndi.IPS_ALERT, PyIndi.IPS_OK], timeout=timeout)
             if ret == PyIndi.IPS_ALERT:
-                raise RuntimeError(f"Indi alert upon set_number {number_name}: {value_vector}")
+                raise RuntimeError(alert_msg)
         return pv
 
     def get_switch(self, name, ctl=None):
@@ -374,6 +388,9 @@ class IndiDevice(Base):
         if is_exclusive:
             on_switches = on_switches[0:1]
             off_switches = [s.getName() for s in pv if s.getName() not in on_switches]
+        switch_vector = {**{s: False for s in off_switches}, **{s: True for s in on_switches}}
+        if self._skip_cached_setting(name, switch_vector):
+            return pv
         for index in range(0, len(pv)):
             current_state = pv[index].getState()
             new_state = current_state
@@ -384,9 +401,114 @@ class IndiDevice(Base):
             pv[index].setState(new_state)
         self.indi_client.sendNewSwitch(pv)
         if sync:
+            if self._defer_setting_ack(pv, switch_vector, [PyIndi.IPS_IDLE, PyIndi.IPS_OK], timeout):
+                return pv
             self.__wait_prop_status(pv, statuses=[PyIndi.IPS_IDLE, PyIndi.IPS_OK], timeout=timeout)
         return pv
 
+    @contextmanager
+    def batched_settings(self):
+        """
+        Within this context, set_number/set_switch/set_text calls made by the current thread:
+        * are not sent at all if the vector is already known to hold the requested value, ie
+          if that value has been acknowledged by the driver in a previous batch, and the driver
+          did not report any change of the vector since then
+        * do not wait for the driver acknowledgement: every vector is sent first, and all
+          acknowledgements are awaited when leaving the context, so that they overlap.
+        Acknowledged values are cached for the next batches.
+        Outside of a batch, setting a cached vector invalidates its cache entry, as the
+        value it would be set to is not tracked.
+        """
+        if getattr(self._settings_batch, "pending", None) is not None:
+            # nested batch: the outermost one waits
+            yield
+            return
+        self._settings_batch.pending = []
+        try:
+            yield
+            pending = self._settings_batch.pending
+        finally:
+            self._settings_batch.pending = None
+        for pv, value_vector, statuses, timeout, alert_msg in pending:
+            name = pv.getName()
+            ret = self.__wait_prop_status(pv, statuses=statuses, timeout=timeout)
+            if ret == PyIndi.IPS_ALERT:
+                self.invalidate_settings_cache(name)
+                raise RuntimeError(alert_msg)
+            self._cache_setting(name, value_vector)
+
+    def _defer_setting_ack(self, pv, value_vector, statuses, timeout, alert_msg=None):
+        """ Returns True if the acknowledgement of pv will be awaited at the end of the current batch """
+        pending = getattr(self._settings_batch, "pending", None)
+        if pending is None:
+            return False
+        pending.append((pv, value_vector, statuses, timeout, alert_msg))
+        return True
+
+    def _skip_cached_setting(self, name, value_vector):
+        """ Returns True if we are in a batch and name is already known to hold value_vector """
+        in_batch = getattr(self._settings_batch, "pending", None) is not None
+        with self._settings_cache_lock:
+            if not in_batch:
+                self._settings_cache.pop(name, None)
+                return False
+            cached = self._settings_cache.get(name, None)
+            if cached is not None:
+                if self._setting_matches(cached, value_vector):
+                    self.logger.debug(f"Device {self.device_name}: skipping {name} = {value_vector}, already set")
+                    return True
+                # Those values are about to change, and will be cached again once acknowledged
+                for key in value_vector:
+                    cached.pop(key, None)
+        return False
+
+    @staticmethod
+    def _setting_matches(reference, value_vector):
+        for key, value in value_vector.items():
+            if key not in reference:
+                return False
+            ref = reference[key]
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                if abs(ref - value) > 1e-6 * max(1., abs(value)):
+                    return False
+            elif ref != value:
+                return False
+        return True
+
+    def _cache_setting(self, name, value_vector):
+        with self._settings_cache_lock:
+            self._settings_cache.setdefault(name, {}).update(value_vector)
+        self.register_vector_handler_to_client(name, "settings_cache", self._on_cached_vector_update)
+
+    def invalidate_settings_cache(self, name=None):
+        with self._settings_cache_lock:
+            if name is None:
+                self._settings_cache.clear()
+            else:
+                self._settings_cache.pop(name, None)
+
+    def _on_cached_vector_update(self, p):
+        """ Called by the indi client thread whenever the driver updates a cached vector """
+        name = p.getName()
+        with self._settings_cache_lock:
+            cached = self._settings_cache.get(name, None)
+        if cached is None:
+            return
+        prop_type = IndiDevice.__type_str.get(p.getType(), 'unknown')
+        if p.getState() == PyIndi.IPS_ALERT or prop_type not in ('number', 'switch', 'text'):
+            self.invalidate_settings_cache(name)
+            return
+        pv = IndiDevice.__prop_caster[prop_type](p)
+        if prop_type == 'number':
+            current = {e.getName(): e.getValue() for e in pv}
+        elif prop_type == 'switch':
+            current = {e.getName(): e.getState() == PyIndi.ISS_ON for e in pv}
+        else:
+            current = {e.getName(): e.getText() for e in pv}
+        if not self._setting_matches(current, cached):
+            self.logger.debug(f"Device {self.device_name}: driver changed {name}, invalidating settings cache")
+            self.invalidate_settings_cache(name)
+
     def get_light(self, name, ctl=None):
         pv = self.get_prop(name, "light")
         return {p.getName():p.getStateAsString() for p in pv} # p.getState()==PyIndi.IPS_OK
@@ -408,15 +530,13 @@ class IndiDevice(Base):
     def __wait_prop_status(self, prop, statuses=[PyIndi.IPS_OK, PyIndi.IPS_IDLE],
                            timeout=None):
         """Wait for the specified property to take one of the status in param"""
-        started = time.time()
         if timeout is None:
             timeout = self.timeout
-        while prop.getState() not in statuses:
-            if 0 < timeout < time.time() - started:
-                self.logger.debug(f"IndiDevice: Timeout while waiting for property status {prop.getName()} for device "
-                                  f"{self.device_name} with timeout {timeout}")
-                raise RuntimeError(f"Timeout error while changing property {prop.getName()}")
-            time.sleep(0.01)
+        if not self.indi_client.wait_for_property(self.device_name, prop.getName(),
+                                                  lambda: prop.getState() in statuses, timeout=timeout):
+            self.logger.debug(f"IndiDevice: Timeout while waiting for property status {prop.getName()} for device "
+                              f"{self.device_name} with timeout {timeout}")
+            raise RuntimeError(f"Timeout error while changing property {prop.getName()}")
         return prop.getState()
 
     def __get_prop_vect_indices_having_values(self, property_vector, values):
@@ -434,14 +554,15 @@ class IndiDevice(Base):
         if timeout is None:
             timeout = self.timeout
         prop = self.device.getProperty(prop_name)
-        started = time.time()
-        while not prop.isValid():
-            prop = self.device.getProperty(prop_name)
-            if not prop.isValid() and 0 < timeout < time.time() - started:
+        if not prop.isValid():
+            def property_defined():
+                nonlocal prop
+                prop = self.device.getProperty(prop_name)
+                return prop.isValid()
+            if not self.indi_client.wait_for_property(self.device_name, prop_name, property_defined, timeout=timeout):
                 msg = f"Timeout while waiting for property {prop_name} of type {prop_type}  for device {self.device_name}"
                 logger.error(msg)
                 raise RuntimeError(msg)
-            time.sleep(0.01)
         # logger.debug(f"Property {prop_name} of expected type {prop_type} but detected type {prop.getTypeAsString()} has status {prop.isValid()}")
         prop = IndiDevice.__prop_caster[prop_type](prop)
         return prop
@@ -687,9 +808,8 @@ class IndiDevice(Base):
         self.indi_client.indi_webmanager_client.start_server(device_name=self.device_name)
 
     def start_indi_driver(self):
-        self.indi_client.indi_webmanager_client.start_driver(
-            driver_name=self.indi_driver_name,
-            check_started=True)
+        # Returns once the web manager lists the driver as running
+        self.indi_client.indi_webmanager_client.ensure_drivers([self.indi_driver_name])
 #
 #     def get_switch(self, name):
 #         return self.get_vector_dict(name)
@@ -733,17 +853,11 @@ class IndiDevice(Base):
 #         return
 
     def wait_for_incoming_blob_vector(self, blob_vector_name=None, timeout=None):
-        #blob_checker = lambda: self.check_blob_vector(blob_vector_name)
-        #self.indi_client.sync_with_predicate(blob_checker, timeout=timeout)
-        #return
-        try:
-            logger.debug(f"BLOBListener[{self.device_name}]: waiting for blob, timeout={timeout}")
-            blob = self.blob_listener.queue.get(block=True, timeout=timeout)
-            logger.debug(f"BLOBListener[{self.device_name}]: blob received name={blob.name}, label={blob.label}, "
-                f"size={blob.size}, queue size: {self.blob_listener.queue.qsize()} (isEmpty: {self.blob_listener.queue.empty()})")
-            self.blob_queue.append(blob)
-        except queue.Empty:
-            raise BLOBError(f"Timeout while waiting for BLOB on {self.device.name}")
+        logger.debug(f"BLOBListener[{self.device_name}]: waiting for blob, timeout={timeout}")
+        blob = self.blob_listener.get(timeout=timeout)
+        logger.debug(f"BLOBListener[{self.device_name}]: blob received name={blob.name}, label={blob.label}, "
+                     f"size={blob.size}, stats: {self.blob_listener.get_stats()}")
+        self.blob_queue.append(blob)
 
     def get_last_incoming_blob_vector(self):
         blob = self.blob_queue.pop() # deque Append + pop = LIFO
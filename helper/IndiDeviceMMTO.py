@@ -225,9 +225,8 @@ class IndiDevice(Base, device):
         self.indi_client.indi_webmanager_client.start_server(device_name=self.device_name)
 
     def start_indi_driver(self):
-        self.indi_client.indi_webmanager_client.start_driver(
-            driver_name=self.indi_driver_name,
-            check_started=True)
+        # Returns once the web manager lists the driver as running
+        self.indi_client.indi_webmanager_client.ensure_drivers([self.indi_driver_name])
 
     def get_switch(self, name):
         return self.get_vector_dict(name)
@@ -1,10 +1,44 @@
 # Generic imports
+from concurrent.futures import ThreadPoolExecutor
 import json
 import logging
-import requests
+import socket
+import threading
 import time
 import urllib.parse
 
+# Network stuff
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Local
+from utils.lifecycle import wait_until
+
+_shared_session = None
+_shared_session_lock = threading.Lock()
+
+
+def get_shared_session():
+    """ Returns the keep-alive HTTP session shared by all web manager clients of the process
+
+    Connections are pooled per host. Failed connections are retried with
+    backoff, as well as idempotent requests answered with a gateway error, but
+    a POST that reached the server is never sent twice.
+    """
+    global _shared_session
+    with _shared_session_lock:
+        if _shared_session is None:
+            retry = Retry(total=3, connect=3, read=1, status=2, backoff_factor=0.2,
+                          status_forcelist=(502, 503, 504), raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _shared_session = session
+        return _shared_session
+
+
 class IndiWebManagerDummy:
     def __init__(self, config=None, indi_config=None):
         pass
@@ -26,10 +60,26 @@ class IndiWebManagerDummy:
         pass
     def start_driver(self, driver_name, check_started=True, master=False):
         pass
+    def ensure_drivers(self, driver_names, master=False, timeout_s=None):
+        pass
     def stop_driver(self, driver_name, master=False):
         pass
 
 class IndiWebManagerClient:
+    """
+    Client of the indi web manager HTTP API, see https://github.com/knro/indiwebmanager
+
+    Requests go through a shared keep-alive session. The list of running
+    drivers is cached for driver_list_ttl_s, and invalidated each time we
+    start or stop something. Optional configuration entries:
+
+    indi_webmanager:
+        http_timeout_s: 10
+        driver_list_ttl_s: 1
+        server_start_timeout_s: 30
+        driver_start_timeout_s: 30
+        max_parallel_starts: 8
+    """
 
     def __init__(self, config, indi_config=None):
         self.logger = logging.getLogger(__name__)
@@ -47,12 +97,36 @@ class IndiWebManagerClient:
         self.host = config["host"]
         self.port = config["port"]
         self.profile_name = config["profile_name"]
+        self.http_timeout_s = config.get("http_timeout_s", 10)
+        self.driver_list_ttl_s = config.get("driver_list_ttl_s", 1)
+        self.server_start_timeout_s = config.get("server_start_timeout_s", 30)
+        self.driver_start_timeout_s = config.get("driver_start_timeout_s", 30)
+        self.max_parallel_starts = config.get("max_parallel_starts", 8)
         # Indi config
         self.indi_config = indi_config
 
+        self.session = get_shared_session()
+        # master: (monotonic time of the query, list of running drivers)
+        self._running_driver_cache = {}
+        self._running_driver_cache_lock = threading.Lock()
+
     def build_remote_driver_name(self, device_name):
         return f'"{device_name}"@{self.indi_config["indi_host"]}:{self.indi_config["indi_port"]}'
 
+    def _base_url(self, master=False):
+        if master:
+            return f"http://{self.master_host}:{self.master_port}"
+        return f"http://{self.host}:{self.port}"
+
+    def _request(self, method, req):
+        response = self.session.request(method, req, timeout=self.http_timeout_s)
+        self.logger.debug(f"{method} {req} - code {response.status_code} - response:{response.text}")
+        return response
+
+    def _invalidate_running_driver(self, master=False):
+        with self._running_driver_cache_lock:
+            self._running_driver_cache.pop(master, None)
+
     def reset_server(self, device_name=None):
         status, profile = self._get_server_status()
         if status:
@@ -65,10 +139,7 @@ class IndiWebManagerClient:
         :return: 
         """
         try:
-            base_url = f"http://{self.host}:{self.port}"
-            req = f"{base_url}/api/server/status"
-            response = requests.get(req)
-            self.logger.debug(f"_get_server_status - url {req} - code {response.status_code} - response:{response.text}")
+            response = self._request("GET", f"{self._base_url()}/api/server/status")
             assert response.status_code == 200
             server_status = json.loads(response.text)
         except json.JSONDecodeError as e:
@@ -80,19 +151,31 @@ class IndiWebManagerClient:
             self.logger.error(msg)
             raise RuntimeError(msg)
         else:
-            status = [stat["status"] for stat in server_status][0] == "True"
-            profile = [stat["active_profile"] for stat in server_status][0]
+            status = [stat["status"] for stat in server_status if "status" in stat][0] == "True"
+            profile = [stat["active_profile"] for stat in server_status if "active_profile" in stat][0]
             return status, profile
 
+    def _is_server_ready(self):
+        """ Server reported as started by the web manager, and accepting indi clients """
+        if not self._get_server_status()[0]:
+            return False
+        if self.indi_config is None:
+            return True
+        try:
+            with socket.create_connection((self.indi_config["indi_host"], int(self.indi_config["indi_port"])),
+                                          timeout=self.http_timeout_s):
+                return True
+        except OSError:
+            return False
+
     def start_server(self, device_name=None):
         try:
-            base_url = f"http://{self.host}:{self.port}"
-            req = f"{base_url}/api/server/start/{self.profile_name}"
-            response = requests.post(req)
-            self.logger.debug(f"start_server - url {req} - code {response.status_code} - response:{response.text}")
+            response = self._request("POST", f"{self._base_url()}/api/server/start/{self.profile_name}")
             assert response.status_code == 200
+            self._invalidate_running_driver()
             if self.master_host and self.master_port and device_name:
-                time.sleep(5)
+                # Master will connect to our server, it has to be up
+                wait_until(self._is_server_ready, self.server_start_timeout_s)
                 self.logger.debug(
                     f"We are also going to start driver on master server {self.master_host}:{self.master_port}")
                 self.restart_driver(driver_name=self.build_remote_driver_name(device_name), master=True)
@@ -112,10 +195,8 @@ class IndiWebManagerClient:
                   f"{self.master_port}. But still going to proceed with actual server stop. Error: {e}"
             self.logger.error(msg)
         try:
-            base_url = f"http://{self.host}:{self.port}"
-            req = f"{base_url}/api/server/stop"
-            response = requests.post(req)
-            self.logger.debug(f"stop_server - url {req} - code {response.status_code} - response:{response.text}")
+            response = self._request("POST", f"{self._base_url()}/api/server/stop")
+            self._invalidate_running_driver()
             assert response.status_code in [200, 500] # It's ok to stop an already stopped server
         except Exception as e:
             msg = f"Cannot start server: {e}"
@@ -123,35 +204,27 @@ class IndiWebManagerClient:
             raise RuntimeError(msg)
 
     def is_driver_started(self, driver_name, master=False):
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
         return driver_name in self.get_running_driver_list(master=master)
 
-    def get_running_driver_list(self, master=False):
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
-        running_driver_list = self.get_running_driver(master=master)
+    def get_running_driver_list(self, master=False, max_age_s=None):
+        running_driver_list = self.get_running_driver(master=master, max_age_s=max_age_s)
         return [driver["name"] for driver in running_driver_list]
 
-    def get_running_driver(self, master=False):
+    def get_running_driver(self, master=False, max_age_s=None):
         """
             See documentation for the API here: https://github.com/knro/indiwebmanager
-        :param driver_name:
+        :param master: query the master web manager instead of ours
+        :param max_age_s: accept a cached list up to that old, driver_list_ttl_s by default
         :return:
         """
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
+        max_age_s = self.driver_list_ttl_s if max_age_s is None else max_age_s
+        with self._running_driver_cache_lock:
+            cached = self._running_driver_cache.get(master, None)
+        if cached is not None and time.monotonic() - cached[0] < max_age_s:
+            return cached[1]
         try:
-            base_url = f"http://{host}:{port}"
-            req = f"{base_url}/api/server/drivers"
-            response = requests.get(req)
-            self.logger.debug(f"get_running_driver - url {req} - code {response.status_code} - response :{response.text}")
+            query_time = time.monotonic()
+            response = self._request("GET", f"{self._base_url(master)}/api/server/drivers")
             assert response.status_code == 200
             running_driver_list = json.loads(response.text)
         except json.JSONDecodeError as e:
@@ -163,6 +236,8 @@ class IndiWebManagerClient:
             self.logger.error(msg)
             raise RuntimeError(msg)
         else:
+            with self._running_driver_cache_lock:
+                self._running_driver_cache[master] = (query_time, running_driver_list)
             return running_driver_list
 
     def restart_driver(self, driver_name, master=False):
@@ -171,17 +246,11 @@ class IndiWebManagerClient:
         :param driver_name:
         :return:
         """
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
         if self.is_driver_started(driver_name, master=master):
             try:
-                base_url = f"http://{host}:{port}"
-                req = f"{base_url}/api/drivers/restart/{urllib.parse.quote(driver_name)}"
-                response = requests.post(req)
-                self.logger.debug(
-                    f"restart_driver {driver_name} - url {req} - code {response.status_code} - response:{response.text}")
+                response = self._request(
+                    "POST", f"{self._base_url(master)}/api/drivers/restart/{urllib.parse.quote(driver_name)}")
+                self._invalidate_running_driver(master)
                 assert response.status_code == 200
             except Exception as e:
                 msg = f"Cannot restart indi driver : {e}"
@@ -196,40 +265,60 @@ class IndiWebManagerClient:
         :param driver_name:
         :return:
         """
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
         if driver_name is None:
             self.logger.debug(f"In start_driver, no driver name provided, assuming webmanager has auto-start enabled")
             return
         if check_started and self.is_driver_started(driver_name, master=master):
             return
         try:
-            base_url = f"http://{host}:{port}"
-            if master:
-                req = f"{base_url}/api/drivers/start_remote/{urllib.parse.quote(driver_name)}"
-            else:
-                req = f"{base_url}/api/drivers/start/{urllib.parse.quote(driver_name)}"
-            response = requests.post(req)
-            self.logger.debug(
-                f"start_driver {driver_name} - url {req} - code {response.status_code} - response:{response.text}")
+            action = "start_remote" if master else "start"
+            response = self._request(
+                "POST", f"{self._base_url(master)}/api/drivers/{action}/{urllib.parse.quote(driver_name)}")
+            self._invalidate_running_driver(master)
             assert response.status_code == 200
         except Exception as e:
             msg = f"Cannot start indi driver : {e}"
             self.logger.error(msg)
             raise RuntimeError(msg)
 
+    def ensure_drivers(self, driver_names, master=False, timeout_s=None):
+        """
+        Start all drivers that are not running yet, concurrently, then wait
+        until the web manager lists all of them as running
+        :param driver_names: iterable of driver names, None entries are ignored
+        :param timeout_s: driver_start_timeout_s by default
+        :return: list of the drivers that had to be started
+        Raises:
+            RuntimeError: a driver could not be started
+            error.Timeout: drivers are still not running after timeout_s
+        """
+        timeout_s = self.driver_start_timeout_s if timeout_s is None else timeout_s
+        wanted = list(dict.fromkeys(name for name in driver_names if name is not None))
+        running = set(self.get_running_driver_list(master=master, max_age_s=0))
+        missing = [name for name in wanted if name not in running]
+        if not missing:
+            return []
+        self.logger.debug(f"Starting drivers {missing} on {self._base_url(master)}")
+        with ThreadPoolExecutor(max_workers=min(len(missing), self.max_parallel_starts),
+                                thread_name_prefix="indi_webmanager") as executor:
+            futures = [executor.submit(self.start_driver, name, check_started=False, master=master)
+                       for name in missing]
+            # Raise the first error, once all requests are over
+            for future in futures:
+                future.result()
+
+        def all_running():
+            running = set(self.get_running_driver_list(master=master, max_age_s=0))
+            return all(name in running for name in missing)
+        wait_until(all_running, timeout_s, poll_interval_s=0.05)
+        return missing
+
     def stop_driver(self, driver_name, master=False):
         """
             See documentation for the API here: https://github.com/knro/indiwebmanager
         :param driver_name:
         :return:
         """
-        if master:
-            host, port = self.master_host, self.master_port
-        else:
-            host, port = self.host, self.port
         # No need to stop a driver that is not started
         if not self.is_driver_started(driver_name, master=master):
             self.logger.debug(f"No need to stop driver {driver_name} because it doesn't seems to be started")
@@ -237,16 +326,12 @@ class IndiWebManagerClient:
         try:
             # if driver_name not in ["ZWO CCD"]: #"Shelyak SPOX", "Arduino telescope controller", "ASI EAF", "Altair", "ZWO CCD"
             #    return
-            base_url = f"http://{host}:{port}"
-            if master:
-                req = f"{base_url}/api/drivers/stop_remote/{urllib.parse.quote(driver_name)}"
-            else:
-                req = f"{base_url}/api/drivers/stop/{urllib.parse.quote(driver_name)}"
+            action = "stop_remote" if master else "stop"
             # self.logger.setLevel("DEBUG")
             # self.logger.warning(f"stop_driver {driver_name} DISABLED for now as it was randomly breaking indiserver")
-            response = requests.post(req)
-            self.logger.debug(
-                f"stop_driver {driver_name} - url {req} - code {response.status_code} - response: {response.text}")
+            response = self._request(
+                "POST", f"{self._base_url(master)}/api/drivers/{action}/{urllib.parse.quote(driver_name)}")
+            self._invalidate_running_driver(master)
             assert response.status_code == 200
         except Exception as e:
             msg = f"Cannot stop indi driver : {e}"
@@ -47,7 +47,8 @@ class INDIClient:
         self.client_connecting = False
         self.reader = None
         self.writer = False
-        self.to_indiQ = asyncio.Queue() # Not threadsafe, use janus or aioprocessing if you want to use it directly
+        # Not threadsafe, from other threads use loop.call_soon_threadsafe(self.to_indiQ.put_nowait, xml)
+        self.to_indiQ = asyncio.Queue()
         self.port = port
         self.host = host
         self.read_width = read_width
@@ -104,7 +105,7 @@ class INDIClient:
         while self.running:
             try:
                 if self.reader.at_eof():
-                    raise Exception("INDI server closed")
+                    raise ConnectionResetError("INDI server closed")
                 # Read data from indiserver with a timeout, so that we don't block loop
                 data = await asyncio.wait_for(self.read_from_stream(), timeout=timeout)
             except asyncio.TimeoutError:
@@ -114,32 +115,53 @@ class INDIClient:
             except Exception as err:
                 self.running = False
                 logger.error(f"Could not read from INDI server {err}")
+                # Wake up write_to_indiserver, so that we can reconnect
+                self.to_indiQ.put_nowait(None)
                 raise
             else:
                 # Makes the data available for the application, and wait for it to be consumed
-                await self.xml_from_indiserver(data)
+                # before reading more, so that a slow consumer slows down the server
+                if data:
+                    await self.xml_from_indiserver(data)
         logger.info(f"Finishing read_from_indiserver task")
 
     async def write_to_indiserver(self, timeout):
         """Collect INDI data from the from the to_indiQ.
         and send it on its way to the indiserver. 
+        Waits on the queue without polling, everything already queued is sent
+        in a single write, and drain applies the socket backpressure. A None
+        item, see stop_writing, wakes the task up so that it can stop.
         """
         while self.running:
+            to_indi = await self.to_indiQ.get()
+            batch = []
+            while to_indi is not None:
+                batch.append(to_indi.encode() if isinstance(to_indi, str) else to_indi)
+                try:
+                    to_indi = self.to_indiQ.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
             try:
-                # Read from queue with a timeout, so that we don't block loop
-                #to_indi = await asyncio.wait_for(self.to_indiQ.get(), timeout=0.1) #This was preventing subsequent call ?
-                to_indi = self.to_indiQ.get_nowait()
-            # except asyncio.TimeoutError:
-            #     continue
-            except asyncio.queues.QueueEmpty:
-                await asyncio.sleep(0.001)
-                continue
-            try:
-                self.writer.write(to_indi.encode())
-                await asyncio.wait_for(self.writer.drain(), timeout=timeout)
+                if batch:
+                    self.writer.write(b"".join(batch))
+                    await asyncio.wait_for(self.writer.drain(), timeout=timeout)
             except Exception as err:
                 self.running = False
                 logger.error(f"Could not write to INDI server {err}")
+            # A None left from a former connection does not stop us, as
+            # the loop only ends if self.running was reset
+        # Closing the stream also ends read_from_indiserver, with an eof
         self.writer.close()
-        await self.writer.wait_closed()
-        logger.debug("Finishing write_to_indiserver task")
\ No newline at end of file
+        try:
+            await self.writer.wait_closed()
+        except Exception as err:
+            logger.debug(f"Error while closing connection to INDI server {err}")
+        logger.debug("Finishing write_to_indiserver task")
+
+    def stop_writing(self):
+        """Wake up and end write_to_indiserver, must be called from the
+        event loop, use loop.call_soon_threadsafe(client.stop_writing)
+        from another thread.
+        """
+        self.running = False
+        self.to_indiQ.put_nowait(None)
@@ -3,6 +3,7 @@ import queue
 from abc import ABC
 import asyncio
 import base64
+import binascii
 import copy
 import functools
 import io
@@ -899,15 +900,99 @@ class indiswitch(indielement):
             self._set_value("Off")
 
 
+class _indiblobdecoder:
+    """
+    Incremental decoder of the base64 text of a BLOB, that is zlib
+    decompressed as well for C{.z} formats. Decoded data is written in a
+    single buffer, preallocated from the C{size} attribute of the BLOB, that
+    is the size of the decoded and uncompressed data.
+    """
+    _whitespaces = b" \t\r\n"
+
+    def __init__(self, size, compressed):
+        self.buffer = bytearray(size)
+        self.nbytes = 0
+        self.encoded_len = 0
+        self._pending = b""
+        self._decompressor = zlib.decompressobj() if compressed else None
+
+    def _write(self, data):
+        # Slice assignment grows the buffer if size was not right
+        self.buffer[self.nbytes:self.nbytes + len(data)] = data
+        self.nbytes += len(data)
+
+    def feed(self, text):
+        data = text.encode("ascii").translate(None, self._whitespaces)
+        self.encoded_len += len(data)
+        if self._pending:
+            data = self._pending + data
+        # base64 decodes 4 characters at a time, the rest waits for next chunk
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            try:
+                decoded = binascii.a2b_base64(data[:usable])
+                if self._decompressor is not None:
+                    decoded = self._decompressor.decompress(decoded)
+            except (binascii.Error, zlib.error) as e:
+                # Raising here would break the parser for the whole stream
+                logging.error(f"Cannot decode BLOB data, {usable} characters dropped: {e}")
+                return
+            self._write(decoded)
+
+    def finish(self):
+        """
+        @return: a memoryview on the decoded data
+        @rtype: memoryview
+        """
+        if self._pending:
+            logging.error(f"Truncated base64 BLOB data, {len(self._pending)} characters dropped")
+        if self._decompressor is not None:
+            try:
+                self._write(self._decompressor.flush())
+            except zlib.error as e:
+                logging.error(f"Cannot decompress BLOB data: {e}")
+        return memoryview(self.buffer)[:self.nbytes]
+
+
 class indiblob(indielement):
     """
     @ivar format : A string describing the file-format/-extension (e.g C{.fits})
     @type format : StringType
+    @ivar size : size of the decoded and uncompressed data, as announced by the server
+    @type size : IntType
     """
 
     def __init__(self, attrs, tag):
         indielement.__init__(self, attrs, tag)
         self.format = attrs.get('format', "").strip()
+        try:
+            self.size = int(attrs.get('size', 0))
+        except ValueError:
+            self.size = 0
+        self._decoder = None
+        self._decoded = None
+        self._encoded_len = 0
+
+    def _is_compressed(self):
+        return self.format.endswith(".z")
+
+    def start_decoding(self):
+        """
+        Called by the parser when the BLOB data is about to be received, the
+        data then goes through L{feed} and L{finish_decoding} instead of
+        L{_value}
+        """
+        self._decoder = _indiblobdecoder(self.size, self._is_compressed())
+        self._decoded = None
+
+    def feed(self, text):
+        self._decoder.feed(text)
+
+    def finish_decoding(self):
+        self._decoded = self._decoder.finish()
+        self._encoded_len = self._decoder.encoded_len
+        self._decoder = None
 
     def _get_decoded_value(self):
         """
@@ -915,16 +1000,14 @@ class indiblob(indielement):
         zlib decompression is done only if the current L{format} string ends with C{.z}.
         base64 decoding is always done.
         @return: the decoded version of value
-        @rtype: StringType
+        @rtype: memoryview
         """
-        value = self._value.encode("utf8")
-        if len(self.format) >= 2:
-            if self.format[len(self.format) - 2] + self.format[len(self.format) - 1] == ".z":
-                return zlib.decompress(base64.decodestring(value))
-            else:
-                return base64.decodestring(value)
-        else:
-            return base64.decodestring(value)
+        if self._decoded is not None:
+            return self._decoded
+        value = base64.b64decode(self._value)
+        if self._is_compressed():
+            value = zlib.decompress(value)
+        return memoryview(value)
 
     def _encode_and_set_value(self, value, format):
         """
@@ -939,13 +1022,13 @@ class indiblob(indielement):
         @rtype: NoneType
         """
         self.format = format
-        if len(self.format) >= 2:
-            if self.format[len(self.format) - 2] + self.format[len(self.format) - 1] == ".z":
-                self._set_value(base64.encodestring(zlib.compress(value)))
-            else:
-                self._set_value(base64.encodestring(value))
-        else:
-            self._set_value(base64.encodestring(value))
+        if isinstance(value, str):
+            value = value.encode("utf8")
+        self.size = len(value)
+        if self._is_compressed():
+            value = zlib.compress(value)
+        self._decoded = None
+        self._set_value(base64.b64encode(value).decode("ascii"))
 
     def get_plain_format(self):
         """
@@ -962,8 +1045,8 @@ class indiblob(indielement):
 
     def get_data(self):
         """
-        @return: the plain binary version of its data
-        @rtype: StringType
+        @return: the plain binary version of its data, without copy
+        @rtype: memoryview
         """
         return self._get_decoded_value()
 
@@ -983,9 +1066,8 @@ class indiblob(indielement):
         @return: B{None}
         @rtype: NoneType
         """
-        in_file = open(filename, "r")
-        text = in_file.read()
-        in_file.close()
+        with open(filename, "rb") as in_file:
+            text = in_file.read()
         (root, ext) = os.path.splitext(filename)
         self._encode_and_set_value(text, ext)
 
@@ -996,8 +1078,10 @@ class indiblob(indielement):
         """
         @return: size of the xml representation of the data. This is usually not equal to the size of the
         string object returned by L{get_data}. Because blobs are base64 encoded and can be compressed.
-        @rtype: StringType
+        @rtype: IntType
         """
+        if self._decoded is not None:
+            return self._encoded_len
         return len(self._value)
 
     def set_from_string(self, text, format):
@@ -1026,6 +1110,10 @@ class indiblob(indielement):
     def updateByElement(self, element):
         self._set_value(element._value)
         self.format = element.format
+        self.size = element.size
+        self._decoded = element._decoded
+        if element._decoded is not None:
+            self._encoded_len = element._encoded_len
 
 
 class indivector(indinamedobject):
@@ -1483,6 +1571,9 @@ class device(ABC):
         self.expat.StartElementHandler = self._start_element
         self.expat.EndElementHandler = self._end_element
         self.expat.CharacterDataHandler = self._char_data
+        # Contiguous character data comes in a single call, up to buffer_size
+        self.expat.buffer_text = True
+        self.expat.buffer_size = 1024 * 1024
         self.expat.Parse('<?xml version="1.5" encoding="UTF-8"?> <doc>', 0)
         self.current_vector = None
         self.current_element = None
@@ -1569,8 +1660,8 @@ class device(ABC):
         # blob_vector.tell() # Too verbose
         blob = blob_vector.get_first_element()
         if blob.get_plain_format() == ".fits":
-            #await self.blob_queue.put(io.BytesIO(blob.get_data()))
-            self.blob_queue.append(io.BytesIO(blob.get_data()))
+            # memoryview on the decoded data, use io.BytesIO on it if a file is needed
+            self.blob_queue.append(blob.get_data())
             self.blob_event.set()
 
     def _default_def_handler(self, vector, indi):
@@ -1699,7 +1790,12 @@ class device(ABC):
             return None
         if self.current_vector is None:
             return None
-        self.current_xml_str += data
+        if isinstance(self.current_element, indiblob):
+            # BLOB data is decoded as it comes, instead of being kept as text
+            self.current_element.feed(data)
+            return None
+        # Joined once the element is over
+        self.current_xml_str.append(data)
 
     def _end_element(self, name):
         """End of XML element handler for expat parser. For details (see
@@ -1715,8 +1811,11 @@ class device(ABC):
         self.current_vector.port = self.indi_client.port
         if self.current_element is not None:
             if self.current_element.tag.get_initial_tag() == name:
-                string_currentData = "".join(self.current_xml_str).replace('\\n', '').strip()
-                self.current_element._set_value(string_currentData)
+                if isinstance(self.current_element, indiblob):
+                    self.current_element.finish_decoding()
+                else:
+                    string_currentData = "".join(self.current_xml_str).replace('\\n', '').strip()
+                    self.current_element._set_value(string_currentData)
                 self.current_vector.elements.append(self.current_element)
                 self.current_element = None
                 self.current_xml_str = None
@@ -1749,14 +1848,17 @@ class device(ABC):
             if obj.tag.is_element():
                 if self.current_vector.tag.get_transfertype() in (inditransfertypes.idef, inditransfertypes.iset):
                     self.current_element = obj
+                    if isinstance(obj, indiblob):
+                        obj.start_decoding()
         self.current_xml_str = []
 
     async def parse_xml_str(self, xml_str):
         """
-        Build properties from a skeleton File.. 
+        Feed a chunk of the indiserver stream to the incremental parser.
+        Vectors are processed as soon as their closing tag is parsed, the
+        rest is kept by the parser until the next chunk.
         args:
-            skelfile: string path to skeleton
-            file.
+            xml_str: bytes or string, as read from the socket
         """
         if len(xml_str) > 0:
             # This is just too verbose, even for debug
@@ -1765,8 +1867,7 @@ class device(ABC):
             try:
                 self.expat.Parse(xml_str, 0)
             except ExpatError as e:
-                logging.error(f"Parsing error with {e}, xml string was {xml_str}")
-        await asyncio.sleep(0.1)
+                logging.error(f"Parsing error with {e}, xml string was {xml_str[:1000]}")
 
     def send_vector(self, vector):
         """
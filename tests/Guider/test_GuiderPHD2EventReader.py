@@ -0,0 +1,174 @@
+# Generic imports
+import json
+import logging
+import queue
+import random
+import socket
+import threading
+import time
+
+# Local code
+from Guider.GuiderPHD2 import GuiderPHD2
+from utils import EventWaiter
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+
+config = {
+    "host": "127.0.0.1",
+    "port": 0,
+    "do_calibration": False,
+    "profile_name": "Simulator",
+    "exposure_time_sec": 2,
+    "settle": {
+        "pixels": 1.5,
+        "time": 10,
+        "timeout": 60},
+    "dither": {
+        "pixels": 3.0,
+        "ra_only": False}
+    }
+
+NB_GUIDE_STEPS = 5000
+
+
+def guide_step(frame):
+    return {"Event": "GuideStep", "Timestamp": 1745440443.266 + frame, "Host": "fake", "Inst": 1,
+            "Frame": frame, "Time": 2.0 * frame, "Mount": "Simulator", "dx": 0.1, "dy": -0.2,
+            "RADistanceRaw": 0.15, "DECDistanceRaw": -0.05, "RADistanceGuide": 0.1,
+            "DECDistanceGuide": 0.0, "StarMass": 5000, "SNR": 40.2, "AvgDist": 0.2}
+
+
+class FakePHD2Server:
+    """ Local stand-in for the PHD2 event server: answers rpc requests, and
+        replays a recorded guiding event stream at high rate when asked to
+        guide, split in random chunks
+    """
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.results = {"get_pixel_scale": 1.5, "get_app_state": "Stopped"}
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _send(self, conn, messages):
+        data = b"".join(json.dumps(m).encode() + b"\r\n" for m in messages)
+        position = 0
+        while position < len(data):
+            size = random.randint(1, 4096)
+            conn.sendall(data[position:position + size])
+            position += size
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                break
+            self._serve_connection(conn)
+
+    def _serve_connection(self, conn):
+        self._send(conn, [
+            {"Event": "Version", "PHDVersion": "2.6.11", "PHDSubver": "", "MsgVersion": 1},
+            {"Event": "AppState", "State": "Stopped"}])
+        buffer = b""
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            buffer += data
+            while b"\r\n" in buffer:
+                line, buffer = buffer.split(b"\r\n", 1)
+                request = json.loads(line)
+                method = request["method"]
+                response = {"jsonrpc": "2.0", "result": self.results.get(method, 0), "id": request["id"]}
+                if method == "guide":
+                    # Events are received before and after the response
+                    events = [{"Event": "StartGuiding"}, {"Event": "SettleBegin"}]
+                    events += [guide_step(i) for i in range(NB_GUIDE_STEPS // 2)]
+                    events.append(response)
+                    events += [guide_step(i) for i in range(NB_GUIDE_STEPS // 2, NB_GUIDE_STEPS)]
+                    events.append({"Event": "SettleDone", "Status": 0, "TotalFrames": NB_GUIDE_STEPS,
+                                   "DroppedFrames": 0})
+                    self._send(conn, events)
+                elif method == "stop_capture":
+                    self._send(conn, [response, {"Event": "GuidingStopped"},
+                                      {"Event": "LoopingExposuresStopped"}])
+                else:
+                    self._send(conn, [response])
+        conn.close()
+
+    def close(self):
+        self.server.close()
+
+
+class _Messaging:
+    def send_message(self, channel, msg):
+        pass
+
+
+def test_event_reader():
+    server = FakePHD2Server()
+    guider = GuiderPHD2(config=dict(config, port=server.port))
+    guider.messaging = _Messaging()
+    try:
+        guider.connect_server()
+        assert guider.state == "Stopped"
+        steps = guider.subscribe(events=["GuideStep"], maxsize=NB_GUIDE_STEPS)
+        bounded = guider.subscribe(maxsize=10)
+        waiter = EventWaiter()
+        guider.add_state_change_waiter(waiter)
+
+        start = time.perf_counter()
+        guider.guide()
+        elapsed = time.perf_counter() - start
+        logging.info(f"Processed {NB_GUIDE_STEPS} guiding events in {elapsed:.3f}s")
+        assert guider.state == "SteadyGuiding"
+        assert guider.state_change_event.is_set()
+        assert waiter.wait(timeout=0)
+        guider.remove_state_change_waiter(waiter)
+        assert guider.telemetry.get_rolling_stats(window_sec=60)["nb_steps"] == 61
+
+        # rpc responses are not confused with the event stream
+        assert guider.get_pixel_scale() == 1.5
+        assert guider.get_app_state() == "Stopped"
+
+        frames = []
+        while True:
+            try:
+                frames.append(steps.get_nowait()["Frame"])
+            except queue.Empty:
+                break
+        assert frames == list(range(NB_GUIDE_STEPS))
+        # Slow subscribers only keep the most recent events
+        assert bounded.qsize() == 10
+        assert bounded.queue[-1]["Event"] == "SettleDone"
+
+        guider.stop_capture()
+        assert guider.state == "Stopped"
+    finally:
+        guider.disconnect_server()
+        server.close()
+    assert guider.state == "NotConnected"
+
+
+def test_reconnect():
+    server = FakePHD2Server()
+    guider = GuiderPHD2(config=dict(config, port=server.port))
+    guider.messaging = _Messaging()
+    try:
+        guider.connect_server()
+        guider.guide()
+        guider.disconnect_server()
+        assert guider.state == "NotConnected"
+
+        # Only events of the new connection are kept
+        guider.connect_server()
+        assert guider.state == "Stopped"
+        assert [event["Event"] for _, event, _ in guider._event_history] == ["Version", "AppState"]
+        assert guider._event_seq == 2
+        assert guider.get_app_state() == "Stopped"
+    finally:
+        guider.disconnect_server()
+        server.close()
@@ -0,0 +1,72 @@
+# Generic imports
+import logging
+import time
+
+# Numerical tools
+import numpy as np
+import pytest
+
+# Local code
+from Guider.GuidingTelemetry import GuidingTelemetry
+
+logging.basicConfig(level=logging.INFO, format='%(levelname)s:%(message)s')
+
+
+def make_steps(n, t0=1745440443.0, period=2.0, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{"Event": "GuideStep", "Timestamp": t0 + i * period, "Frame": i + 1,
+             "RADistanceRaw": rng.normal(0, 0.3), "DECDistanceRaw": rng.normal(0, 0.2),
+             "StarMass": 5000. * (1 - 1e-4 * i), "SNR": 40 + rng.normal()}
+            for i in range(n)]
+
+
+def reference_stats(steps, start_time, end_time):
+    window = [s for s in steps if start_time <= s["Timestamp"] <= end_time]
+    ra = np.array([s["RADistanceRaw"] for s in window])
+    dec = np.array([s["DECDistanceRaw"] for s in window])
+    t = np.array([s["Timestamp"] for s in window])
+    mass = np.array([s["StarMass"] for s in window])
+    errors = np.hypot(ra, dec)
+    return dict(
+        nb_steps=len(window),
+        rms_ra=np.sqrt(np.mean(ra**2)),
+        rms_dec=np.sqrt(np.mean(dec**2)),
+        rms_total=np.sqrt(np.mean(errors**2)),
+        peak=errors.max(),
+        percentile=np.percentile(errors, 90),
+        snr=np.mean([s["SNR"] for s in window]),
+        star_mass=mass.mean(),
+        star_mass_drift=np.polyfit(t, mass, 1)[0] * 3600 / mass.mean())
+
+
+def test_guiding_telemetry():
+    steps = make_steps(3000)
+    telemetry = GuidingTelemetry(capacity=1024)
+    for step in steps:
+        telemetry.append(step)
+    assert len(telemetry) == 1024
+
+    # Exposure of 5 minutes, within the ring
+    start_time = steps[2500]["Timestamp"] - 0.5
+    end_time = start_time + 300
+    stats = telemetry.get_stats(start_time, end_time)
+    reference = reference_stats(steps, start_time, end_time)
+    assert stats["nb_steps"] == 150
+    for key, value in reference.items():
+        assert stats[key] == pytest.approx(value, rel=1e-6), key
+
+    # Exposure partially out of the ring: only kept steps are used
+    stats = telemetry.get_stats(steps[0]["Timestamp"], steps[-1]["Timestamp"])
+    assert stats["nb_steps"] == 1023
+    assert stats["rms_ra"] == pytest.approx(reference_stats(steps[-1023:], 0, np.inf)["rms_ra"])
+
+    # No guiding during the exposure
+    assert telemetry.get_stats(0, 10)["nb_steps"] == 0
+
+    rolling = telemetry.get_rolling_stats(window_sec=60)
+    assert rolling["nb_steps"] == 31
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        telemetry.get_stats(start_time, end_time)
+    logging.info(f"Exposure statistics query: {(time.perf_counter() - start) * 1e3:.1f}us")
@@ -0,0 +1,169 @@
+# Basic stuff
+import logging
+import os
+import threading
+import time
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Astropy
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Local stuff
+from Imaging import fits as fits_utils
+from Imaging.PlateSolver import PlateSolver
+from utils import error
+from utils.database import DB
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class FakeSolveBackend:
+    """ Writes a WCS with 1.5 arcsec pixels into solved images, records calls """
+    def __init__(self, delay_s=0.05, fails=lambda kwargs: False):
+        self.delay_s = delay_s
+        self.fails = fails
+        self.calls = []
+        self.scratch_dirs = []
+        self.lock = threading.Lock()
+        self.nb_running = 0
+        self.max_running = 0
+
+    def solve(self, fname, scratch_dir, **kwargs):
+        # Each job starts with its own empty scratch directory
+        assert os.path.isdir(scratch_dir) and not os.listdir(scratch_dir)
+        with open(os.path.join(scratch_dir, "tmp.wcs.abcd"), "w"):
+            pass
+        with self.lock:
+            self.calls.append(kwargs)
+            self.scratch_dirs.append(scratch_dir)
+            self.nb_running += 1
+            self.max_running = max(self.max_running, self.nb_running)
+        time.sleep(self.delay_s)
+        with self.lock:
+            self.nb_running -= 1
+        if self.fails(kwargs):
+            raise error.AstrometrySolverError("Field not solved")
+        w = WCS(naxis=2)
+        w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+        w.wcs.crval = [kwargs.get("ra", 10.), kwargs.get("dec", 20.)]
+        w.wcs.crpix = [32, 32]
+        w.wcs.cdelt = [-1.5 / 3600, 1.5 / 3600]
+        fits.writeto(fname, np.zeros((64, 64), dtype=np.uint16), w.to_header(), overwrite=True)
+        return dict(solved_fits_file=fname)
+
+
+def make_images(tmp_path, nb):
+    fnames = []
+    for i in range(nb):
+        fnames.append(str(tmp_path / f"pointing{i:02d}.fits"))
+        fits.writeto(fnames[-1], np.zeros((64, 64), dtype=np.uint16))
+    return fnames
+
+
+def make_solver(backend, **config):
+    return PlateSolver(config=dict(warm_up=False, **config), backend=backend)
+
+
+def test_pool_and_scratch_dirs(tmp_path):
+    backend = FakeSolveBackend(delay_s=0.2)
+    solver = make_solver(backend, max_workers=2, scratch_dir=str(tmp_path))
+    fnames = make_images(tmp_path, 4)
+    futures = [solver.submit(fname, hint_key=f"camera{i}") for i, fname in enumerate(fnames)]
+    for fname, future in zip(fnames, futures):
+        assert future.result(timeout=5)["solved_fits_file"] == fname
+    assert backend.max_running == 2
+    assert len(set(backend.scratch_dirs)) == 4
+    assert not any(os.path.exists(d) for d in backend.scratch_dirs)
+    metrics = solver.get_metrics()
+    assert metrics["count"] == metrics["solved"] == 4
+    assert metrics["mean_solve_sec"] >= 0.2
+    # Two jobs had to wait for a free worker
+    assert metrics["mean_wait_sec"] > 0.05
+
+
+def test_hints(tmp_path):
+    backend = FakeSolveBackend()
+    solver = make_solver(backend, mount_hint_radius_deg=3)
+    fnames = make_images(tmp_path, 3)
+    solver.solve(fnames[0], hint_key="main", position_hint=(150., 30.))
+    assert backend.calls[0] == dict(ra=150., dec=30., radius=3)
+    # Scale and parity come from the previous image of the same camera
+    solver.solve(fnames[1], hint_key="main", position_hint=(151., 31.))
+    assert backend.calls[1]["parity"] == "pos"
+    assert backend.calls[1]["sampling_arcsec"] == pytest.approx(1.5)
+    # Explicit options take precedence over hints
+    solver.solve(fnames[2], hint_key="main", position_hint=(151., 31.),
+                 ra=152., dec=32., radius=1, sampling_arcsec=2., parity="neg")
+    assert backend.calls[2] == dict(ra=152., dec=32., radius=1, sampling_arcsec=2., parity="neg")
+    solver.solve(fnames[2], hint_key="other")
+    assert backend.calls[3] == {}
+    assert solver.get_metrics()["hinted"] == 2
+    # Unset scale is hinted
+    solver.solve(fnames[2], hint_key="main", sampling_arcsec=None)
+    assert backend.calls[4]["sampling_arcsec"] == pytest.approx(1.5)
+
+
+def test_hints_never_override_options(tmp_path, monkeypatch):
+    backend = FakeSolveBackend()
+    solver = make_solver(backend)
+    fname = make_images(tmp_path, 1)[0]
+    monkeypatch.setattr(solver, "get_hints", lambda *args, **kwargs: dict(ra=1., dec=2., radius=5))
+    solver.solve(fname, ra=150., dec=30.)
+    assert backend.calls[0] == dict(ra=150., dec=30., radius=5)
+
+
+def test_warm_up_is_opt_in(tmp_path):
+    class WarmUpBackend(FakeSolveBackend):
+        def warm_up(self):
+            self.warmed_up.set()
+
+    backend = WarmUpBackend()
+    backend.warmed_up = threading.Event()
+    PlateSolver(config={}, backend=backend)
+    assert not backend.warmed_up.wait(timeout=0.2)
+    PlateSolver(config=dict(warm_up=True), backend=backend)
+    assert backend.warmed_up.wait(timeout=5)
+
+
+def test_metrics_publication(tmp_path):
+    db = DB(db_type='memory', db_name='test_plate_solver')
+    solver = PlateSolver(config=dict(warm_up=False, metrics_period_sec=0), backend=FakeSolveBackend(), db=db)
+    solver.solve(make_images(tmp_path, 1)[0], timeout=5)
+    end = time.monotonic() + 5
+    while db.get_current("plate_solve") is None:
+        assert time.monotonic() < end, "Plate solver metrics never published"
+        time.sleep(0.01)
+    assert db.get_current("plate_solve")["data"]["solved"] == 1
+
+
+def test_blind_retry(tmp_path):
+    # Wrong mount position: a hinted solve fails
+    backend = FakeSolveBackend(fails=lambda kwargs: "radius" in kwargs)
+    solver = make_solver(backend)
+    fname = make_images(tmp_path, 1)[0]
+    solver.solve(fname, position_hint=(150., 30.))
+    assert backend.calls == [dict(ra=150., dec=30., radius=5), {}]
+    assert backend.scratch_dirs[0] != backend.scratch_dirs[1]
+    assert solver.get_metrics()["retried"] == 1
+
+    solver = make_solver(backend, blind_retry=False)
+    with pytest.raises(error.AstrometrySolverError):
+        solver.solve(fname, position_hint=(150., 30.))
+    metrics = solver.get_metrics()
+    assert metrics["count"] == 1 and metrics["solved"] == 0
+
+
+def test_solve_field_scratch_dir(tmp_path):
+    fname = make_images(tmp_path, 1)[0]
+    # Another solve's temporary file is left alone
+    other_tmp = tmp_path / "other.wcs.abcd"
+    other_tmp.touch()
+    proc = fits_utils.solve_field(fname, scratch_dir=str(tmp_path), parity="pos", radius=2)
+    proc.communicate(timeout=10)
+    assert proc.args[-4:] == ["pos", "--temp-dir", str(tmp_path), fname]
+    assert "--parity" in proc.args
+    assert other_tmp.exists()
@@ -0,0 +1,112 @@
+# Basic stuff
+import logging
+import threading
+import time
+
+# Numerical stuff
+import pytest
+
+# Local stuff
+from Imaging.ProcessingPool import ProcessingPool
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def make_pool(**config):
+    return ProcessingPool(config=dict(dict(metrics_period_sec=3600), **config))
+
+
+def test_per_key_serialization():
+    pool = make_pool(max_workers=4)
+    lock = threading.Lock()
+    running = {}
+    max_running = {}
+    order = {}
+
+    def task(key, index):
+        with lock:
+            running[key] = running.get(key, 0) + 1
+            max_running[key] = max(max_running.get(key, 0), running[key])
+            order.setdefault(key, []).append(index)
+        time.sleep(0.02)
+        with lock:
+            running[key] -= 1
+        return index
+
+    keys = ["cam1/acquisition", "cam1/processing", "cam2/acquisition"]
+    start = time.monotonic()
+    futures = [(key, i, pool.submit(key, task, key, i)) for i in range(5) for key in keys]
+    for key, i, future in futures:
+        assert future.result(timeout=5) == i
+    duration = time.monotonic() - start
+    # Tasks of a key run one at a time, in submission order
+    assert max_running == {key: 1 for key in keys}
+    assert order == {key: list(range(5)) for key in keys}
+    # Different keys run concurrently
+    assert duration < 3 * 5 * 0.02
+    assert pool.queue_depth == 0
+
+
+def test_bounded_queue(caplog):
+    pool = make_pool(max_workers=1, max_queue_size=3)
+    release = threading.Event()
+    futures = [pool.submit("cam1/processing", release.wait, 5) for _ in range(3)]
+    assert pool.queue_depth == 3
+
+    # The pool is full: submit blocks until a task is over
+    submitted = []
+    with caplog.at_level(logging.WARNING):
+        thread = threading.Thread(target=lambda: submitted.append(
+            pool.submit("cam1/processing", lambda: "last")))
+        thread.start()
+        time.sleep(0.1)
+        assert thread.is_alive() and not submitted
+        assert pool.queue_depth == 3
+        release.set()
+        thread.join(timeout=5)
+    assert submitted[0].result(timeout=5) == "last"
+    assert all(future.result(timeout=5) for future in futures)
+    assert "submission of task cam1/processing blocks" in caplog.text
+    assert pool.queue_depth == 0
+
+
+def test_submit_timeout():
+    pool = make_pool(max_workers=1, max_queue_size=1, submit_timeout_sec=0.1)
+    release = threading.Event()
+    future = pool.submit("cam1/processing", release.wait, 5)
+    start = time.monotonic()
+    with pytest.raises(RuntimeError):
+        pool.submit("cam1/processing", lambda: None)
+    assert time.monotonic() - start >= 0.1
+    release.set()
+    assert future.result(timeout=5)
+    # Room again
+    assert pool.submit("cam1/processing", lambda: 42).result(timeout=5) == 42
+
+
+def test_timed_stage_metrics():
+    pool = make_pool()
+
+    def task():
+        with pool.timed_stage("cam1/processing", "write"):
+            time.sleep(0.05)
+        with pool.timed_stage("cam1/processing", "db_insert"):
+            pass
+
+    for _ in range(3):
+        pool.submit("cam1/processing", task).result(timeout=5)
+    # Failing stages are timed too
+    with pytest.raises(ValueError):
+        with pool.timed_stage("cam1/processing", "headers"):
+            raise ValueError("bad header")
+
+    stages = pool.get_metrics()["stages"]["cam1/processing"]
+    assert stages["wait"]["count"] == 3
+    assert stages["write"]["count"] == 3
+    assert 0.05 <= stages["write"]["mean_sec"] <= stages["write"]["max_sec"]
+    assert stages["db_insert"]["count"] == 3
+    assert stages["db_insert"]["max_sec"] < stages["write"]["mean_sec"]
+    assert stages["headers"]["count"] == 1
+    metrics = pool.get_metrics()
+    assert metrics["queue_depth"] == 0
+    assert metrics["max_queue_size"] == 16
@@ -0,0 +1,50 @@
+# Basic stuff
+import logging
+import time
+
+# Numerical stuff
+import numpy as np
+import scipy.stats as scs
+
+# Local stuff
+from Imaging.stack_statistics import linear_regression_map
+from Imaging.stack_statistics import load_cube
+from Imaging.stack_statistics import master_dark_stats
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def test_master_dark_stats(tmp_path):
+    rng = np.random.default_rng(0)
+    frames = rng.normal(1000, 20, (19, 100, 80)).astype(np.uint16)
+    frames[3, 5, 5] = 60000  # cosmic ray
+    frames[::4, 7, 7] = 0  # glitches
+    cube = load_cube(list(range(len(frames))), memmap_path=str(tmp_path / "stack.dat"),
+                     loader=lambda i: frames[i])
+
+    start = time.perf_counter()
+    stack = np.moveaxis(frames, 0, 2)
+    ref_mean = np.apply_along_axis(
+        lambda x: np.mean(scs.sigmaclip(x, low=5.0, high=5.0)[0], dtype=np.float32), 2, stack)
+    ref_std = np.sqrt(np.mean((stack - ref_mean[..., np.newaxis])**2, axis=2, dtype=np.float32))
+    reference_sec = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mean, std = master_dark_stats(cube, tile_rows=16)
+    vectorized_sec = time.perf_counter() - start
+    logging.info(f"Master dark: per pixel {reference_sec:.3f}s, vectorized {vectorized_sec:.3f}s")
+
+    assert np.allclose(mean, ref_mean, atol=1e-3)
+    assert np.allclose(std, ref_std, rtol=1e-4)
+
+
+def test_linear_regression_map():
+    rng = np.random.default_rng(1)
+    exp_time = np.array([1, 5, 10, 30, 60, 120.])
+    a = 2 + rng.random((50, 40))
+    b = 500 + rng.random((50, 40))
+    cube = a * exp_time.reshape(-1, 1, 1) + b + rng.normal(0, 1, (len(exp_time), 50, 40))
+    amap, bmap = linear_regression_map(cube, exp_time, tile_rows=7)
+    for i, j in [(0, 0), (13, 27), (49, 39)]:
+        ref_a, ref_b = np.polyfit(exp_time, cube[:, i, j], 1)
+        assert np.isclose(amap[i, j], ref_a) and np.isclose(bmap[i, j], ref_b)
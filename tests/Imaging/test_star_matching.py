@@ -0,0 +1,145 @@
+# Basic stuff
+import logging
+import time
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Astropy
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Local stuff
+from Imaging import star_matching
+from Imaging.Image import Image
+from utils import error
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+SHAPE = (1024, 1536)
+SAMPLING_ARCSEC = 1.5
+LOCATION = EarthLocation(lat=45 * u.deg, lon=5 * u.deg, height=300 * u.m)
+
+
+def make_wcs(ra, dec, rotation_deg=0., shape=SHAPE):
+    w = WCS(naxis=2)
+    w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    w.wcs.crpix = [shape[1] / 2 + 0.5, shape[0] / 2 + 0.5]
+    w.wcs.crval = [ra, dec]
+    theta = np.deg2rad(rotation_deg)
+    scale = SAMPLING_ARCSEC / 3600
+    w.wcs.cd = scale * np.array([[-np.cos(theta), np.sin(theta)],
+                                 [np.sin(theta), np.cos(theta)]])
+    return w
+
+
+def make_sky(rng, ra=150., dec=30., nb_stars=300, radius_deg=0.6):
+    return dict(ra=ra + rng.uniform(-radius_deg, radius_deg, nb_stars) / np.cos(np.deg2rad(dec)),
+                dec=dec + rng.uniform(-radius_deg, radius_deg, nb_stars),
+                flux=rng.lognormal(9, 1, nb_stars))
+
+
+def render(w, sky, rng, shape=SHAPE, psf_sigma=1.5):
+    """ Gaussian stars over a sloped background, returns image and star pixel positions """
+    data = 1000 + 0.05 * np.arange(shape[1])[np.newaxis, :] + rng.normal(0, 10, shape)
+    x, y = w.all_world2pix(sky["ra"], sky["dec"], 0)
+    half = 8
+    yy, xx = np.mgrid[-half:half + 1, -half:half + 1]
+    for sx, sy, flux in zip(x, y, sky["flux"]):
+        ix, iy = int(round(sx)), int(round(sy))
+        if not (half <= ix < shape[1] - half and half <= iy < shape[0] - half):
+            continue
+        psf = np.exp(-((xx + ix - sx) ** 2 + (yy + iy - sy) ** 2) / (2 * psf_sigma ** 2))
+        data[iy - half:iy + half + 1, ix - half:ix + half + 1] += flux * psf / psf.sum()
+    return data.astype(np.float32), np.column_stack([x, y])
+
+
+def write_frame(path, data, header_ra, header_dec, w=None):
+    header = w.to_header() if w is not None else fits.Header()
+    header['DATE-OBS'] = '2024-04-23T21:34:03'
+    header['EXPTIME'] = 5.
+    header['RA-FIELD'] = header_ra
+    header['DEC-FIELD'] = header_dec
+    fits.writeto(path, data.astype(np.uint16), header, overwrite=True)
+    return str(path)
+
+
+def test_detect_stars():
+    rng = np.random.default_rng(0)
+    sky = make_sky(rng)
+    data, true_xy = render(make_wcs(150., 30.), sky, rng)
+    stars = star_matching.detect_stars(data, max_stars=50)
+    assert len(stars) == 50
+    assert np.all(np.diff(stars['flux']) <= 0)
+    distance = np.min(np.hypot(stars['x'][:, np.newaxis] - true_xy[:, 0],
+                               stars['y'][:, np.newaxis] - true_xy[:, 1]), axis=1)
+    assert np.median(distance) < 0.1
+    assert len(star_matching.detect_stars(rng.normal(1000, 10, SHAPE))) == 0
+
+
+def test_match_and_fit():
+    rng = np.random.default_rng(1)
+    ref_xy = rng.uniform(0, 1000, (100, 2))
+    theta = np.deg2rad(0.3)
+    matrix = np.array([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]]) * 1.001
+    offset = np.array([57.3, -33.1])
+    xy = ref_xy @ matrix.T + offset + rng.normal(0, 0.1, ref_xy.shape)
+    # Some stars are missing, others are spurious
+    xy = np.concatenate([xy[20:], rng.uniform(0, 1000, (15, 2))])
+    ref_index, index = star_matching.match_stars(ref_xy, xy, tolerance_px=3, search_radius_px=100)
+    assert len(index) >= 75
+    assert np.all(index == ref_index - 20)
+    fitted_matrix, fitted_offset, rms, inliers = star_matching.fit_affine(ref_xy[ref_index], xy[index])
+    assert np.allclose(fitted_matrix, matrix, atol=1e-3)
+    assert np.allclose(fitted_offset, offset, atol=0.2)
+    assert rms < 0.3
+
+    # A wrong pair is rejected
+    dst = ref_xy @ matrix.T + offset
+    dst[0] += 30
+    _, _, rms, inliers = star_matching.fit_affine(ref_xy, dst)
+    assert not inliers[0] and np.all(inliers[1:])
+    assert rms < 1e-6
+
+    with pytest.raises(error.AstrometrySolverError):
+        star_matching.fit_affine(ref_xy[:2], dst[:2])
+
+
+def test_refine_wcs(tmp_path):
+    rng = np.random.default_rng(2)
+    sky = make_sky(rng)
+    ref_wcs = make_wcs(150., 30.)
+    data, _ = render(ref_wcs, sky, rng)
+    reference = Image(write_frame(tmp_path / "pointing00.fits", data, 149.9, 29.95, ref_wcs),
+                      location=LOCATION)
+    # Mount, synced on the first image, went to 150.05, 30.02, but is 40" off
+    true_wcs = make_wcs(150.05 + 30 / 3600 / np.cos(np.deg2rad(30)), 30.02 - 25 / 3600,
+                        rotation_deg=0.05)
+    data, _ = render(true_wcs, sky, rng)
+    image = Image(write_frame(tmp_path / "pointing01.fits", data, 150.05, 30.02), location=LOCATION)
+    assert image.wcs is None
+
+    start = time.monotonic()
+    refinement = image.refine_wcs(reference)
+    duration = time.monotonic() - start
+    logging.info(f"WCS refined in {duration:.3f}s: {refinement}")
+    assert refinement["matched_stars"] >= 30
+    assert refinement["rms_px"] < 0.3
+    true_center = SkyCoord(*true_wcs.all_pix2world(*image.get_center_coordinates(), 0), unit='deg')
+    assert image.pointing.separation(true_center) < 0.5 * u.arcsec
+    x, y = rng.uniform(0, SHAPE[1], 10), rng.uniform(0, SHAPE[0], 10)
+    assert np.allclose(np.column_stack(image.wcs.all_pix2world(x, y, 0)),
+                       np.column_stack(true_wcs.all_pix2world(x, y, 0)), atol=1 / 3600)
+    # WCS has been written in the file, as solve-field would
+    assert WCS(fits.getheader(image.fits_file)).has_celestial
+    assert duration < 2
+
+    # Somewhere else in the sky, nothing matches
+    data, _ = render(make_wcs(160., 40.), make_sky(rng, 160., 40.), rng)
+    lost = Image(write_frame(tmp_path / "pointing02.fits", data, 160., 40.), location=LOCATION)
+    with pytest.raises(error.AstrometrySolverError):
+        lost.refine_wcs(reference)
@@ -0,0 +1,117 @@
+# Basic stuff
+import logging
+import time
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Astropy stuff
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
+from astropy.time import Time
+
+# Astroplan stuff
+from astroplan import FixedTarget
+from astroplan import Observer
+from astroplan import ObservingBlock
+
+# Local stuff
+from ObservationPlanner.DefaultScheduler import DefaultScheduler
+from ObservationPlanner.LocalHorizonConstraint import LocalHorizonConstraint
+from Service.HostTimeService import HostTimeService
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class _Observatory:
+    """ Minimal observatory: only what the scheduler needs """
+    def getAstropyEarthLocation(self):
+        return EarthLocation(lat=43.56*u.deg, lon=5.43*u.deg, height=150*u.m)
+
+    def getAstroplanObserver(self):
+        return Observer(location=self.getAstropyEarthLocation(),
+                        pressure=1*u.bar, relative_humidity=0.2, temperature=15*u.deg_C)
+
+    def get_horizon(self):
+        return {0: 10, 90: 20, 180: 5, 270: 15}
+
+
+def make_scheduler(nb_targets):
+    config = dict(constraints=dict(atnight="astronomical",
+                                   maxairmass=2.5,
+                                   minmoonseparationdeg=10))
+    scheduler = DefaultScheduler(ntpServ=HostTimeService(), obs=_Observatory(), config=config)
+    rng = np.random.default_rng(42)
+    ras = rng.uniform(0, 360, nb_targets)
+    decs = np.degrees(np.arcsin(rng.uniform(-0.5, 1, nb_targets)))
+    for i, (ra, dec) in enumerate(zip(ras, decs)):
+        target = FixedTarget(name=f"target_{i}", coord=SkyCoord(ra=ra*u.deg, dec=dec*u.deg, frame='icrs'))
+        block = ObservingBlock.from_exposures(target, i % 3, 60*u.second, 10, 1*u.second,
+                                              configuration={}, constraints=scheduler.constraints)
+        scheduler.add_observation(block)
+    return scheduler
+
+
+def legacy_ranking(scheduler, time, observer):
+    """ Former DefaultScheduler.get_scheduling loop, every constraint evaluated target per target
+
+    astroplan constraints return numpy booleans, that fail the isinstance(score, bool) test: they
+    are added to the score as 0/1.
+    """
+    valid_obs = {obs: 1.0 for obs, obs_def in scheduler.observations.items() if not obs_def.is_done}
+    for constraint in scheduler.constraints:
+        for obs_key, observation in scheduler.observations.items():
+            if obs_key in valid_obs:
+                score = constraint.compute_constraint(time, observer, observation.target.coord)
+                if isinstance(score, bool):
+                    if not score:
+                        del valid_obs[obs_key]
+                else:
+                    valid_obs[obs_key] += score
+    for obs_key, score in valid_obs.items():
+        valid_obs[obs_key] = score + scheduler.observations[obs_key].priority
+    return sorted(valid_obs.items(), key=lambda x: x[1])[::-1]
+
+
+@pytest.mark.parametrize("nb_targets", [10, pytest.param(100, marks=pytest.mark.slow),
+                                        pytest.param(1000, marks=pytest.mark.slow)])
+def test_rank_observations_benchmark(nb_targets):
+    t = Time("2024-01-10 22:00:00")
+    scheduler = make_scheduler(nb_targets)
+    # Nightly ephemeris are built once with the target list, not at each scheduling pass
+    scheduler.ephemeris.refresh(t)
+    scheduler.ephemeris.add_targets([obs.target for obs in scheduler.observations.values()])
+
+    observer = scheduler.obs.getAstroplanObserver()
+    start = time.perf_counter()
+    reference = legacy_ranking(scheduler, t, observer)
+    legacy_sec = time.perf_counter() - start
+
+    observer = scheduler.obs.getAstroplanObserver()
+    start = time.perf_counter()
+    ranking = scheduler.rank_observations(t, observer)
+    batched_sec = time.perf_counter() - start
+
+    logging.info(f"{nb_targets} targets: per target {legacy_sec:.3f}s, batched {batched_sec:.3f}s, "
+                 f"speedup x{legacy_sec/batched_sec:.1f}")
+    assert len(ranking) == nb_targets
+    # Same ranking as the per target evaluation
+    assert [k for k, _ in ranking] == [k for k, _ in reference]
+    assert np.allclose([s for _, s in ranking], [float(np.squeeze(s)) for _, s in reference])
+
+
+def test_local_horizon_altaz():
+    t = Time("2024-01-10 22:00:00")
+    scheduler = make_scheduler(20)
+    observer = scheduler.obs.getAstroplanObserver()
+    coords = [obs.target.coord for obs in scheduler.observations.values()]
+    targets = SkyCoord(coords)
+    constraint = LocalHorizonConstraint(horizon=scheduler.obs.get_horizon())
+    # Exact alt/az, given or not, as when targets are evaluated one by one
+    expected = [bool(constraint.compute_constraint(t, observer, coord)) for coord in coords]
+    assert 0 < sum(expected) < len(coords)
+    assert list(constraint.compute_constraint(t, observer, targets)) == expected
+    altaz = observer.altaz(t, targets)
+    assert list(constraint.compute_constraint(t, observer, targets, target_altaz=altaz)) == expected
@@ -0,0 +1,69 @@
+# Basic stuff
+import logging
+import time
+
+# Numerical stuff
+import numpy as np
+
+# Astropy stuff
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
+from astropy.coordinates import get_body
+from astropy.time import Time
+
+# Astroplan stuff
+from astroplan import Observer
+
+# Local stuff
+from ObservationPlanner.EphemerisCache import EphemerisCache
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class _Observatory:
+    def getAstropyEarthLocation(self):
+        return EarthLocation(lat=43.56*u.deg, lon=5.43*u.deg, height=150*u.m)
+
+    def getAstroplanObserver(self):
+        return Observer(location=self.getAstropyEarthLocation(), timezone='Europe/Paris',
+                        pressure=1*u.bar, relative_humidity=0.2, temperature=15*u.deg_C)
+
+
+class _TimeService:
+    def get_astropy_time_from_utc(self):
+        return Time("2024-01-10 21:00:00")
+
+
+def test_ephemeris_cache():
+    obs = _Observatory()
+    observer = obs.getAstroplanObserver()
+    cache = EphemerisCache(obs, _TimeService())
+    rng = np.random.default_rng(0)
+    coords = SkyCoord(ra=rng.uniform(0, 360, 50)*u.deg, dec=rng.uniform(-30, 80, 50)*u.deg)
+    cache.add_targets([coords[i] for i in range(len(coords))])
+    # Night starts at local noon (CET is UTC+1)
+    assert abs((cache.night_start - Time("2024-01-10 11:00:00")).sec) < 1
+
+    t = Time("2024-01-10 23:17:42")
+    alt, az = cache.get_target_altaz(t, coords)
+    reference = observer.altaz(t, coords)
+    assert np.abs(alt - reference.alt.deg).max() < 0.02
+    assert np.abs((az - reference.az.deg + 180) % 360 - 180).max() < 0.1
+    assert abs(cache.get_moon_alt(t) - observer.moon_altaz(t).alt.deg) < 0.02
+    assert abs(cache.get_moon_illumination(t) - observer.moon_illumination(t)) < 1e-3
+    moon = get_body("moon", t, location=observer.location)
+    assert abs(cache.get_moon_separation(t, coords[0]) - moon.separation(coords[0]).deg) < 0.02
+    events = cache.get_night_events(t)
+    assert events['sun_set_time'] < events['evening_astro_time'] < t < events['morning_astro_time']
+
+    start = time.perf_counter()
+    for _ in range(100):
+        cache.get_target_airmass(t, coords[0])
+        cache.get_moon_illumination(t)
+    logging.info(f"Cached lookup: {(time.perf_counter()-start)*1e4:.1f}us")
+
+    # After local noon, the cache expires and is rebuilt with the same targets
+    cache.get_target_altaz(Time("2024-01-11 12:00:00"), coords[0])
+    assert abs((cache.night_start - Time("2024-01-11 11:00:00")).sec) < 1
+    assert len(cache._target_index) == len(coords)
@@ -0,0 +1,141 @@
+# Basic stuff
+import logging
+import time
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Astropy stuff
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+from astropy.coordinates import SkyCoord
+from astropy.coordinates.name_resolve import NameResolveError
+from astropy.time import Time
+
+# Astroplan stuff
+from astroplan import Observer
+
+# Local stuff
+from ObservationPlanner.DefaultScheduler import DefaultScheduler
+from ObservationPlanner.TargetNameCache import SesameResolver
+from ObservationPlanner.TargetNameCache import TargetNameCache
+from ObservationPlanner.TargetNameCache import TargetResolver
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class LocalResolver(TargetResolver):
+    """ Local stand-in for an online resolver: target_<i> names only """
+    name = "local"
+
+    def __init__(self, online=True):
+        self.online = online
+        self.nb_queries = 0
+
+    def resolve(self, target_name):
+        self.nb_queries += 1
+        if not self.online:
+            raise ConnectionError("Site is offline")
+        if not target_name.startswith("target_"):
+            raise LookupError(f"Unknown target {target_name}")
+        i = int(target_name.split("_")[1])
+        return dict(ra=(i * 7.3) % 360, dec=(i * 1.7) % 80, spinfo=dict(MAIN_ID=target_name))
+
+
+class _Observatory:
+    def getAstropyEarthLocation(self):
+        return EarthLocation(lat=43.56*u.deg, lon=5.43*u.deg, height=150*u.m)
+
+    def getAstroplanObserver(self):
+        return Observer(location=self.getAstropyEarthLocation(), timezone='Europe/Paris')
+
+
+class _TimeService:
+    def get_astropy_time_from_utc(self):
+        return Time("2024-01-10 21:00:00")
+
+    def flat_time(self):
+        return "20240110T210000"
+
+
+def test_target_name_cache(tmp_path):
+    cache_file = str(tmp_path / "names.json")
+    resolver = LocalResolver()
+    cache = TargetNameCache(resolver=resolver, cache_file=cache_file, ttl_days=1)
+    assert cache.prefetch(["target_1", "target_2", "unknown"]) == ["unknown"]
+    assert resolver.nb_queries == 3
+    assert cache.get("target_2")["spinfo"]["MAIN_ID"] == "target_2"
+    with pytest.raises(LookupError):
+        cache.get("unknown")
+    # Everything is fresh, including unknown names: no more queries
+    assert resolver.nb_queries == 3
+
+    # Reloaded from disk, offline: no network needed
+    offline = LocalResolver(online=False)
+    cache = TargetNameCache(resolver=offline, cache_file=cache_file, ttl_days=1)
+    assert cache.get_coord("target_1").ra.deg == pytest.approx(7.3)
+    assert offline.nb_queries == 0
+    with pytest.raises(RuntimeError):
+        cache.get("target_3")
+
+    # Expired entries are still served when the resolver is offline
+    cache = TargetNameCache(resolver=offline, cache_file=cache_file, ttl_days=0)
+    assert cache.get_coord("target_1").ra.deg == pytest.approx(7.3)
+    assert offline.nb_queries == 2
+
+
+def test_sesame_offline(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "names.json")
+    known = dict(M31=SkyCoord(ra=10.68*u.deg, dec=41.27*u.deg, frame="icrs"))
+
+    def online(name, frame="icrs"):
+        if name not in known:
+            raise NameResolveError(f"Unable to find coordinates for name '{name}' using http://sesame")
+        return known[name]
+
+    def offline(name, frame="icrs"):
+        raise NameResolveError("All Sesame queries failed. Unable to retrieve coordinates. See errors per URL "
+                               "below: \n http://sesame: [Errno -3] Temporary failure in name resolution")
+
+    monkeypatch.setattr(SkyCoord, "from_name", online)
+    cache = TargetNameCache(resolver=SesameResolver(), cache_file=cache_file, ttl_days=0)
+    assert cache.prefetch(["M31", "unknown"]) == ["unknown"]
+
+    # Offline, the expired entry is served and kept on disk
+    monkeypatch.setattr(SkyCoord, "from_name", offline)
+    cache = TargetNameCache(resolver=SesameResolver(), cache_file=cache_file, ttl_days=0)
+    assert cache.get_coord("M31").ra.deg == pytest.approx(10.68)
+    with pytest.raises(RuntimeError):
+        cache.get("M33")
+    # Even if the name is not known anymore, the resolved entry is not replaced
+    known.clear()
+    monkeypatch.setattr(SkyCoord, "from_name", online)
+    cache = TargetNameCache(resolver=SesameResolver(), cache_file=cache_file, ttl_days=0)
+    assert cache.get_coord("M31").dec.deg == pytest.approx(41.27)
+    cache = TargetNameCache(resolver=SesameResolver(), cache_file=cache_file, ttl_days=1)
+    assert cache.get("M31")["ra"] == pytest.approx(10.68)
+
+
+def test_scheduler_startup_with_warm_cache(tmp_path):
+    cache_file = str(tmp_path / "names.json")
+    exposure = dict(count=5, temperature=-10, gain=100, offset=10, exp_time_sec=60)
+    config = dict(targets={f"target_{i}": dict(Luminance=exposure) for i in range(200)})
+    config['targets']["5h12m43.2s +31d12m43s"] = dict(Luminance=exposure)
+
+    # First startup fills in the caches
+    resolver = LocalResolver()
+    DefaultScheduler(ntpServ=_TimeService(), obs=_Observatory(), config=config,
+                     name_cache=TargetNameCache(resolver=resolver, cache_file=cache_file))
+    assert resolver.nb_queries == 200
+
+    # Next startups are served from disk, without network
+    offline = LocalResolver(online=False)
+    start = time.perf_counter()
+    scheduler = DefaultScheduler(ntpServ=_TimeService(), obs=_Observatory(), config=config,
+                                 name_cache=TargetNameCache(resolver=offline, cache_file=cache_file))
+    startup_sec = time.perf_counter() - start
+    logging.info(f"Scheduler startup with 200 cached targets: {startup_sec:.3f}s")
+    assert offline.nb_queries == 0
+    assert len(scheduler.observations) == 201
+    assert startup_sec < 1
@@ -0,0 +1,141 @@
+# Basic stuff
+import logging
+import threading
+
+# Numerical stuff
+import numpy as np
+
+# Astropy
+from astropy import units as u
+from astropy.coordinates import SkyCoord
+from astropy.io import fits
+from astropy.wcs import WCS
+
+# Local stuff
+from Imaging.Image import Image
+from Pointer.IterativeSync import IterativeSync
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+SHAPE = (1024, 1024)
+TARGET = SkyCoord(ra=150 * u.deg, dec=30 * u.deg)
+
+
+def make_wcs(center):
+    w = WCS(naxis=2)
+    w.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    w.wcs.crpix = [SHAPE[1] / 2 + 0.5, SHAPE[0] / 2 + 0.5]
+    w.wcs.crval = [center.ra.deg, center.dec.deg]
+    w.wcs.cd = np.diag([-1.5 / 3600, 1.5 / 3600])
+    return w
+
+
+class FakeMount:
+    """ Each slew to target divides the pointing error by ten """
+    def __init__(self, error_arcsec=300):
+        self.error_arcsec = error_arcsec
+        self.synced = []
+
+    @property
+    def true_pointing(self):
+        return TARGET.spherical_offsets_by(self.error_arcsec * u.arcsec, -self.error_arcsec / 2 * u.arcsec)
+
+    def slew_to_target(self):
+        self.error_arcsec /= 10
+
+    def sync_to_coord(self, coord):
+        self.synced.append(coord)
+
+
+class FakeObservation:
+    last_pointing = None
+    pointing_image = None
+
+
+class FakeCamera:
+    """ Renders the stars seen at the true mount pointing, headers have the target """
+    name = "camera"
+    pointing_seconds = 5
+    sampling_arcsec = 1.5
+    subsample_astrometry = 1
+
+    def __init__(self, mount, tmp_path):
+        self.mount = mount
+        self.tmp_path = tmp_path
+        self.true_wcs = {}
+        rng = np.random.default_rng(0)
+        self.sky = SkyCoord(ra=TARGET.ra + rng.uniform(-0.5, 0.5, 300) * u.deg,
+                            dec=TARGET.dec + rng.uniform(-0.4, 0.4, 300) * u.deg)
+        self.flux = rng.lognormal(9, 1, 300)
+        self.rng = rng
+
+    def take_observation(self, observation, headers, filename, exp_time):
+        w = make_wcs(self.mount.true_pointing)
+        data = 1000 + self.rng.normal(0, 10, SHAPE)
+        x, y = w.all_world2pix(self.sky.ra.deg, self.sky.dec.deg, 0)
+        yy, xx = np.mgrid[-6:7, -6:7]
+        for sx, sy, flux in zip(x, y, self.flux):
+            ix, iy = int(round(sx)), int(round(sy))
+            if 6 <= ix < SHAPE[1] - 6 and 6 <= iy < SHAPE[0] - 6:
+                psf = np.exp(-((xx + ix - sx) ** 2 + (yy + iy - sy) ** 2) / 4.5)
+                data[iy - 6:iy + 7, ix - 6:ix + 7] += flux * psf / psf.sum()
+        header = fits.Header(dict(headers))
+        header['DATE-OBS'] = '2024-04-23T21:34:03'
+        header['EXPTIME'] = exp_time.to_value(u.second)
+        header['RA-FIELD'] = TARGET.ra.deg
+        header['DEC-FIELD'] = TARGET.dec.deg
+        path = str(self.tmp_path / f"{filename}.fits")
+        fits.writeto(path, data.astype(np.uint16), header, overwrite=True)
+        self.true_wcs[path] = w
+        observation.last_pointing = (filename, path)
+        event = threading.Event()
+        event.set()
+        return event
+
+
+def test_iterations_refine_previous_wcs(tmp_path, monkeypatch):
+    mount = FakeMount()
+    camera = FakeCamera(mount, tmp_path)
+    solved = []
+
+    def solve_field(image, **kwargs):
+        """ As astrometry.net would do, with the true WCS """
+        solved.append(image.fits_file)
+        with fits.open(image.fits_file, 'update') as hdu:
+            hdu[0].header.update(camera.true_wcs[image.fits_file].to_header())
+        image.wcs_file = image.fits_file
+        image.get_wcs_pointing()
+        return {}
+    monkeypatch.setattr(Image, "solve_field", solve_field)
+
+    pointer = IterativeSync(config=dict(gen_hips=False, timeout_seconds=10, max_iterations=5,
+                                        max_pointing_error_seconds=5))
+    pointing_event, pointing_status = pointer.points(mount, camera, FakeObservation(), {})
+    assert pointing_event.wait(timeout=60)
+    assert pointing_status[0]
+    # 300", then 30" and 3" errors, only the first image was solved
+    assert solved == [str(tmp_path / "pointing00.fits")]
+    assert len(mount.synced) == 3
+    for path, coord in zip(sorted(camera.true_wcs), mount.synced):
+        true_center = SkyCoord(*camera.true_wcs[path].all_pix2world(SHAPE[1] / 2 - 0.5, SHAPE[0] / 2 - 0.5, 0),
+                               unit='deg')
+        assert coord.separation(true_center) < 0.5 * u.arcsec
+
+    # Without refinement, every image is solved
+    mount, solved[:] = FakeMount(), []
+    camera.mount = mount
+    pointer.refine_with_previous_wcs = False
+    pointing_event, pointing_status = pointer.points(mount, camera, FakeObservation(), {})
+    assert pointing_event.wait(timeout=60)
+    assert len(solved) == 3
+
+    # Refinement falls back to solving when stars are not where expected
+    mount, solved[:] = FakeMount(), []
+    camera.mount = mount
+    pointer.refine_with_previous_wcs = True
+    pointer.refine_params = dict(search_radius_px=5)
+    pointing_event, pointing_status = pointer.points(mount, camera, FakeObservation(), {})
+    assert pointing_event.wait(timeout=60)
+    assert pointing_status[0]
+    # Second image is 20 pixels away from its predicted position, third one only 2
+    assert solved == [str(tmp_path / "pointing00.fits"), str(tmp_path / "pointing01.fits")]
@@ -0,0 +1,99 @@
+# Basic stuff
+import gzip
+import logging
+import os
+import shutil
+import time
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Local stuff
+from ScopeSimulator import Catalogs
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+CATALOG = os.path.join(os.path.dirname(Catalogs.__file__), 'data', 'bsc5.dat.gz')
+
+
+def legacy_load_bright_star_5(filename):
+    """ Former line by line parser of load_bright_star_5 """
+    catalog = []
+    with gzip.GzipFile(filename) as f:
+        for l in f:
+            bscstar = dict()
+            try:
+                for fdesc, fuple in Catalogs.BSC_FIELDS.items():
+                    bscstar[fdesc] = fuple[2](l[fuple[0]-1:fuple[0]+fuple[1]-1])
+            except ValueError:
+                continue
+            star = dict()
+            star['nom'] = 'HR'+str(bscstar['hr'])
+            star['mag'] = bscstar['vmag']
+            star['ra_degres'] = bscstar['rahour']*15.0 + (
+                (bscstar['ramin']*60.0+bscstar['rasec'])*15.0) / 3600.0
+            star['de_degres'] = bscstar['dedeg'] + (
+                (bscstar['demin']*60.0 + bscstar['desec'])/3600.0)
+            if bscstar['design'] == b'-':
+                star['de_degres'] = -star['de_degres']
+            star['ra'] = np.deg2rad(star['ra_degres'])
+            if star['ra'] > np.pi:
+                star['ra'] = star['ra'] - 2.0 * np.pi
+            star['de'] = np.deg2rad(star['de_degres'])
+            catalog.append(star)
+    return catalog
+
+
+@pytest.fixture
+def catalog_file(tmp_path):
+    path = tmp_path / 'bsc5.dat.gz'
+    shutil.copy(CATALOG, path)
+    return str(path)
+
+
+def test_same_as_legacy(catalog_file):
+    legacy = legacy_load_bright_star_5(catalog_file)
+    stars = Catalogs.load_bright_star_5(catalog_file)
+    assert len(stars) == len(legacy) > 9000
+    assert [s['nom'] for s in stars] == [s['nom'] for s in legacy]
+    for key in ('mag', 'ra_degres', 'de_degres', 'ra', 'de'):
+        np.testing.assert_allclose([s[key] for s in stars], [s[key] for s in legacy],
+                                   rtol=1e-6, err_msg=key)
+
+
+def test_cache(catalog_file):
+    catalog = Catalogs.load_bright_star_5_array(catalog_file)
+    assert os.path.exists(catalog_file + '.npy')
+    assert catalog.dtype == Catalogs.BSC_DTYPE
+    np.testing.assert_array_equal(Catalogs.load_bright_star_5_array(catalog_file), catalog)
+
+    # A modified catalog invalidates the cache
+    with gzip.GzipFile(catalog_file) as f:
+        lines = f.readlines()
+    with gzip.GzipFile(catalog_file, 'wb') as f:
+        f.writelines(lines[:100])
+    os.utime(catalog_file, ns=(0, 0))
+    assert len(Catalogs.load_bright_star_5_array(catalog_file)) < 100
+
+    # A corrupted cache is ignored
+    with open(catalog_file + '.npy', 'wb') as f:
+        f.write(b'garbage')
+    assert len(Catalogs.load_bright_star_5_array(catalog_file)) < 100
+
+
+@pytest.mark.slow
+def test_benchmark_load(catalog_file):
+    start = time.perf_counter()
+    legacy_load_bright_star_5(catalog_file)
+    legacy_time = time.perf_counter() - start
+    start = time.perf_counter()
+    Catalogs.load_bright_star_5_array(catalog_file, cache=False)
+    parse_time = time.perf_counter() - start
+    Catalogs.load_bright_star_5_array(catalog_file)
+    start = time.perf_counter()
+    Catalogs.load_bright_star_5_array(catalog_file)
+    cached_time = time.perf_counter() - start
+    logging.info(f"legacy {legacy_time * 1e3:.1f}ms, vectorized {parse_time * 1e3:.1f}ms, "
+                 f"cached {cached_time * 1e3:.1f}ms")
+    assert cached_time < legacy_time
@@ -0,0 +1,166 @@
+# Basic stuff
+import copy
+import datetime
+import json
+import logging
+import time
+
+# Numerical stuff
+from bson import ObjectId
+import numpy as np
+import pytest
+
+# Astropy
+from astropy import units as u
+from astropy.coordinates import Angle
+from astropy.time import Time
+
+# Local stuff
+from Service import MessageSerializer
+from Service.PanMessaging import PanMessaging
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def legacy_scrub_message(message):
+    """ Former PanMessaging.scrub_message, that modified message in place """
+    for k, v in message.items():
+        if isinstance(v, dict):
+            v = legacy_scrub_message(v)
+        if isinstance(v, u.Quantity):
+            v = v.value
+        if isinstance(v, datetime.datetime):
+            v = v.isoformat()
+        if isinstance(v, ObjectId):
+            v = str(v)
+        if isinstance(v, Time):
+            v = str(v.isot).split('.')[0].replace('T', ' ')
+        if k.endswith('_time'):
+            v = str(v).split(' ')[-1]
+        if isinstance(v, float):
+            v = round(v, 3)
+        message[k] = v
+    return message
+
+
+def status_payload():
+    """ Looks like Manager.status() """
+    t = Time("2024-04-23T21:34:03.266")
+    return {
+        'mount': {'current_ra': 123.4567 * u.deg, 'current_dec': Angle(-12.3456, u.deg),
+                  'tracking_rate': 1.0027, 'is_parked': False, 'state': 'Tracking'},
+        'observatory': {'name': 'Remote1', 'latitude': 45.67891 * u.deg, 'altitude': 650. * u.m,
+                        'dome_opened': True, 'last_update_time': datetime.datetime(2024, 4, 23, 21, 34, 3)},
+        'scheduler': {'nb_targets': 12, 'current_target': 'M51', 'id': ObjectId('5f1d7f1e2a3b4c5d6e7f8091')},
+        'observation': {'exp_time': 300. * u.s, 'current_exp': 4, 'min_nexp': 10, 'merit': 12.34567,
+                        'filter': 'Luminance', 'seq_time': t},
+        'observer': {
+            'siderealtime': '14h12m11.23s',
+            'utctime': t,
+            'localtime': '2024-04-23 23:34:03.266000+02:00',
+            'local_evening_astro_time': t + 1 * u.hour,
+            'local_morning_astro_time': t + 7 * u.hour,
+            'local_sun_set_time': t - 1 * u.hour,
+            'local_sun_rise_time': t + 9 * u.hour,
+            'local_moon_alt': 23.45678 * u.deg,
+            'local_moon_illumination': 0.8765432,
+            'local_moon_phase': 1.234567 * u.rad}}
+
+
+def guide_step_payload():
+    return {"Event": "GuideStep", "Timestamp": 1745440443.266, "Host": "fake", "Inst": 1,
+            "Frame": 1234, "Time": 2468.123456, "Mount": "Simulator", "dx": 0.1234, "dy": -0.2345,
+            "RADistanceRaw": 0.15678, "DECDistanceRaw": -0.05678, "RADistanceGuide": 0.1,
+            "DECDistanceGuide": 0.0, "StarMass": 5000, "SNR": 40.2345, "AvgDist": 0.2345}
+
+
+@pytest.mark.parametrize("payload", [status_payload, guide_step_payload])
+def test_scrub_same_as_legacy(payload):
+    message = payload()
+    reference = copy.deepcopy(message)
+    scrubbed = MessageSerializer.scrub(message)
+    # Input is left untouched
+    assert message.keys() == reference.keys()
+    if payload is status_payload:
+        assert isinstance(message['observer']['utctime'], Time)
+        assert message['mount']['current_ra'].unit == u.deg
+    else:
+        assert message == reference
+    assert scrubbed == legacy_scrub_message(copy.deepcopy(reference))
+    assert json.loads(json.dumps(scrubbed)) == scrubbed
+
+
+def test_scrub_numpy_and_containers():
+    message = {'values': np.arange(3, dtype=np.int64), 'mean': np.float64(1.23456),
+               'flag': np.bool_(True), 'nb': np.int32(4), 'positions': [1.23456 * u.deg, (2, 3.45678)],
+               'times': Time(["2024-04-23T21:34:03", "2024-04-24T01:00:00.5"]), 'tags': {'a'},
+               ('not', 'a', 'key'): 1, 'sub_time': "2024-04-23 21:34:03"}
+    scrubbed = MessageSerializer.scrub(message)
+    assert scrubbed == {'values': [0, 1, 2], 'mean': 1.235, 'flag': True, 'nb': 4,
+                        'positions': [1.235, [2, 3.457]],
+                        'times': ["2024-04-23 21:34:03", "2024-04-24 01:00:00"], 'tags': ['a'],
+                        'sub_time': "21:34:03"}
+    assert type(scrubbed['nb']) is int
+
+
+def test_register_encoder():
+    class Weather:
+        def __init__(self, safe):
+            self.safe = safe
+
+    class SubWeather(Weather):
+        pass
+
+    assert MessageSerializer.scrub({'w': 1}) == {'w': 1}
+    MessageSerializer.register_encoder(Weather, lambda w: {'safe': w.safe, 'temp': 12.34567 * u.deg_C})
+    assert MessageSerializer.scrub({'w': SubWeather(True)}) == {'w': {'safe': True, 'temp': 12.346}}
+
+
+@pytest.mark.parametrize("name", ["json", "orjson", "msgpack"])
+def test_wire_formats(name):
+    try:
+        wire_format = MessageSerializer.get_wire_format(name)
+    except RuntimeError:
+        pytest.skip(f"{name} is not installed")
+    messaging = PanMessaging(config={'wire_format': name})
+    payload = messaging.encode_message(status_payload())
+    assert isinstance(payload, bytes)
+    assert messaging.decode_message(payload) == MessageSerializer.scrub(status_payload())
+    assert wire_format.loads(messaging.encode_message("hello"))["message"] == "hello"
+
+
+def test_unknown_wire_format():
+    with pytest.raises(ValueError):
+        MessageSerializer.get_wire_format("xml")
+
+
+def test_decode_yaml_fallback():
+    assert PanMessaging().decode_message(b"{action: park, delay: 3}") == {"action": "park", "delay": 3}
+
+
+@pytest.mark.slow
+def test_benchmark_serialization():
+    """ Legacy scrub_message + json.dumps against the serializer, on a status
+        and a GuideStep payload
+    """
+    nb_messages = 2000
+    results = {}
+    for name, payload in (("status", status_payload()), ("GuideStep", guide_step_payload())):
+        messages = [copy.deepcopy(payload) for _ in range(nb_messages)]
+        start = time.perf_counter()
+        for message in messages:
+            json.dumps(legacy_scrub_message(message), skipkeys=True)
+        legacy = (time.perf_counter() - start) / nb_messages
+        results[name] = {"legacy": legacy}
+        for wire_format_name in ("json", "orjson", "msgpack"):
+            try:
+                messaging = PanMessaging(config={'wire_format': wire_format_name})
+            except RuntimeError:
+                continue
+            start = time.perf_counter()
+            for _ in range(nb_messages):
+                messaging.encode_message(payload)
+            results[name][wire_format_name] = (time.perf_counter() - start) / nb_messages
+        logging.info(f"{name}: " + ", ".join(f"{k} {v * 1e6:.1f}us (x{legacy / v:.1f})"
+                                             for k, v in results[name].items()))
+    assert results["status"]["json"] < results["status"]["legacy"]
@@ -0,0 +1,97 @@
+# Basic stuff
+import logging
+import socket
+import threading
+import time
+
+# Time stuff
+import ntplib
+
+# Local stuff
+from Service.NTPTimeService import NTPTimeService
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class LocalNTPServer:
+    """ Minimal NTP responder on localhost, whose clock is ahead of the
+        local clock by offset seconds
+    """
+    def __init__(self, offset=0.0):
+        self.offset = offset
+        self.outliers = 0
+        self.online = True
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(("127.0.0.1", 0))
+        self.socket.settimeout(0.05)
+        self.port = self.socket.getsockname()[1]
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+
+    def _serve(self):
+        while not self._stop.is_set():
+            try:
+                data, address = self.socket.recvfrom(256)
+            except socket.timeout:
+                continue
+            recv_timestamp = ntplib.system_to_ntp_time(time.time() + self.offset)
+            if not self.online:
+                continue
+            offset = self.offset
+            if self.outliers > 0:
+                self.outliers -= 1
+                offset += 100
+            query = ntplib.NTPPacket()
+            query.from_data(data)
+            answer = ntplib.NTPPacket(version=3, mode=4,
+                                      tx_timestamp=ntplib.system_to_ntp_time(time.time() + offset))
+            answer.stratum = 2
+            answer.orig_timestamp = query.tx_timestamp
+            answer.recv_timestamp = recv_timestamp
+            self.socket.sendto(answer.to_data(), address)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.socket.close()
+
+
+def wait_for(predicate, timeout=5):
+    start = time.time()
+    while not predicate() and time.time() - start < timeout:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_ntp_time_service():
+    server = LocalNTPServer(offset=2.5)
+    config = dict(ntp=dict(ntpserver="127.0.0.1", port=server.port,
+                           timeout_sec=0.2, sync_period_sec=0.05, nb_samples=8))
+    serv_time = NTPTimeService(config=config)
+    try:
+        assert wait_for(lambda: serv_time.get_clock_status()["nb_samples"] >= 4)
+        status = serv_time.get_clock_status()
+        assert status["synchronized"]
+        assert abs(status["offset_sec"] - 2.5) < 0.01
+        assert abs(serv_time.get_utc().timestamp() - time.time() - 2.5) < 0.01
+
+        # A single bogus answer does not move the clock
+        server.outliers = 1
+        assert wait_for(lambda: server.outliers == 0)
+        time.sleep(0.2)
+        assert abs(serv_time.get_clock_status()["offset_sec"] - 2.5) < 0.01
+
+        # Server unreachable: get_utc does not block and keeps the offset
+        server.online = False
+        nb_failures = serv_time.get_clock_status()["nb_failures"]
+        assert wait_for(lambda: serv_time.get_clock_status()["nb_failures"] > nb_failures + 1)
+        start = time.perf_counter()
+        for _ in range(1000):
+            utc = serv_time.get_utc()
+        assert time.perf_counter() - start < 0.1
+        assert abs(utc.timestamp() - time.time() - 2.5) < 0.01
+        assert serv_time.get_clock_status()["last_error"] is not None
+    finally:
+        serv_time.stop()
+        server.close()
@@ -0,0 +1,371 @@
+# Basic stuff
+import logging
+import random
+import socket
+import threading
+import time
+
+# MQTT
+import paho.mqtt.subscribe as mqttsubscribe
+import pytest
+
+# Local stuff
+from Service.PanMessagingMQTT import PanMessagingMQTT
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s;%(levelname)s:%(message)s')
+
+CONNECT, CONNACK, PUBLISH, SUBSCRIBE, SUBACK = 1, 2, 3, 8, 9
+UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 10, 11, 12, 13, 14
+
+
+def encode_length(length):
+    data = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        data.append(byte | (0x80 if length else 0))
+        if not length:
+            return bytes(data)
+
+
+def decode_length(data, position):
+    """ Decode an MQTT variable byte integer, return value and next position """
+    value, multiplier = 0, 1
+    while True:
+        byte = data[position]
+        position += 1
+        value += (byte & 0x7F) * multiplier
+        multiplier *= 128
+        if not byte & 0x80:
+            return value, position
+
+
+def read_string(data, position):
+    length = int.from_bytes(data[position:position + 2], "big")
+    return data[position + 2:position + 2 + length].decode(), position + 2 + length
+
+
+def encode_string(value):
+    value = value.encode()
+    return len(value).to_bytes(2, "big") + value
+
+
+def topic_matches(topic_filter, topic):
+    filter_levels, topic_levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class _Session:
+    def __init__(self, conn):
+        self.conn = conn
+        self.version = 4
+        self.filters = set()
+        self.lock = threading.Lock()
+
+    def send(self, packet_type, body, flags=0):
+        with self.lock:
+            self.conn.sendall(bytes([packet_type << 4 | flags]) + encode_length(len(body)) + body)
+
+    def properties(self):
+        """ Empty property list, only exists in MQTT v5 """
+        return b"\x00" if self.version == 5 else b""
+
+
+class FakeMQTTBroker:
+    """ Minimal in-process MQTT v3.1.1 / v5 broker on localhost: QoS 0
+        publish, subscriptions with + and # wildcards, keepalive, and a way to
+        drop all client connections to test reconnection
+    """
+    def __init__(self):
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(("127.0.0.1", 0))
+        self.server.listen(16)
+        self.port = self.server.getsockname()[1]
+        self.sessions = []
+        self.nb_connections = 0
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._accept, daemon=True)
+        self._thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                conn, _ = self.server.accept()
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = _Session(conn)
+            threading.Thread(target=self._serve, args=(session,), daemon=True).start()
+
+    def _read_packet(self, conn, buffer):
+        while True:
+            if len(buffer) >= 2:
+                try:
+                    length, position = decode_length(buffer, 1)
+                except IndexError:
+                    length = None
+                if length is not None and len(buffer) >= position + length:
+                    packet = bytes(buffer[:position + length])
+                    del buffer[:position + length]
+                    return packet[0] >> 4, packet[0] & 0x0F, packet[position:]
+            data = conn.recv(65536)
+            if not data:
+                raise ConnectionError("Client closed the connection")
+            buffer += data
+
+    def _serve(self, session):
+        buffer = bytearray()
+        try:
+            while True:
+                packet_type, flags, body = self._read_packet(session.conn, buffer)
+                if packet_type == CONNECT:
+                    _, position = read_string(body, 0)
+                    session.version = body[position]
+                    session.send(CONNACK, b"\x00\x00" + session.properties())
+                    with self._lock:
+                        self.sessions.append(session)
+                        self.nb_connections += 1
+                elif packet_type == SUBSCRIBE:
+                    packet_id, position = body[:2], 2
+                    if session.version == 5:
+                        length, position = decode_length(body, position)
+                        position += length
+                    codes = b""
+                    while position < len(body):
+                        topic_filter, position = read_string(body, position)
+                        position += 1
+                        session.filters.add(topic_filter)
+                        codes += b"\x00"
+                    session.send(SUBACK, packet_id + session.properties() + codes, )
+                elif packet_type == UNSUBSCRIBE:
+                    packet_id, position = body[:2], 2
+                    if session.version == 5:
+                        length, position = decode_length(body, position)
+                        position += length
+                    codes = b""
+                    while position < len(body):
+                        topic_filter, position = read_string(body, position)
+                        session.filters.discard(topic_filter)
+                        codes += b"\x00"
+                    session.send(UNSUBACK, packet_id + session.properties()
+                                 + (codes if session.version == 5 else b""))
+                elif packet_type == PUBLISH:
+                    topic, position = read_string(body, 0)
+                    if (flags >> 1) & 0x03:
+                        position += 2
+                    if session.version == 5:
+                        length, position = decode_length(body, position)
+                        position += length
+                    self._forward(topic, body[position:])
+                elif packet_type == PINGREQ:
+                    session.send(PINGRESP, b"")
+                elif packet_type == DISCONNECT:
+                    break
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            with self._lock:
+                if session in self.sessions:
+                    self.sessions.remove(session)
+            session.conn.close()
+
+    def _forward(self, topic, payload):
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            if any(topic_matches(f, topic) for f in session.filters):
+                try:
+                    session.send(PUBLISH, encode_string(topic) + session.properties() + payload)
+                except OSError:
+                    pass
+
+    def nb_subscribers(self, topic):
+        with self._lock:
+            return sum(any(topic_matches(f, topic) for f in s.filters) for s in self.sessions)
+
+    def wait_subscribers(self, topic, count, timeout=5):
+        end = time.monotonic() + timeout
+        while self.nb_subscribers(topic) < count:
+            assert time.monotonic() < end, f"Timeout waiting for {count} subscribers on {topic}"
+            time.sleep(0.01)
+
+    def disconnect_all(self):
+        with self._lock:
+            sessions = list(self.sessions)
+        for session in sessions:
+            try:
+                session.conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def close(self):
+        self.disconnect_all()
+        self.server.close()
+
+
+def make_messaging(broker, com_mode, **kwargs):
+    config = dict(mqtt_host="127.0.0.1", mqtt_port=broker.port, com_mode=com_mode,
+                  reconnect_min_delay_sec=0.05, reconnect_max_delay_sec=0.5)
+    config.update(kwargs)
+    return PanMessagingMQTT(config=config)
+
+
+@pytest.fixture
+def broker():
+    broker = FakeMQTTBroker()
+    yield broker
+    broker.close()
+
+
+def test_receive_message(broker):
+    subscriber = make_messaging(broker, "subscriber")
+    publisher = make_messaging(broker, "publisher")
+    try:
+        broker.wait_subscribers("observatory/WEATHER", 1)
+        assert subscriber.receive_message(blocking=False) == (None, None)
+        assert subscriber.receive_message(timeout=0.05) == (None, None)
+
+        publisher.send_message("WEATHER", {"safe": True, "temperature": 12.1234})
+        msg_type, msg_data = subscriber.receive_message(blocking=True, timeout=5)
+        assert msg_type == "WEATHER"
+        assert msg_data == {"safe": True, "temperature": 12.123}
+
+        # Publishers can receive as well
+        assert publisher.receive_message(blocking=False) == (None, None)
+        broker.wait_subscribers("observatory/WEATHER", 2)
+        subscriber.send_message("STATUS", "ready")
+        msg_type, msg_data = publisher.receive_message(timeout=5)
+        assert msg_type == "STATUS"
+        assert msg_data["message"] == "ready"
+    finally:
+        subscriber.close_connection()
+        publisher.close_connection()
+
+
+def test_bounded_queue(broker):
+    subscriber = make_messaging(broker, "subscriber", receive_queue_size=10)
+    publisher = make_messaging(broker, "publisher")
+    try:
+        broker.wait_subscribers("observatory/DATA", 1)
+        for i in range(50):
+            publisher.send_message("DATA", {"index": i})
+        end = time.monotonic() + 5
+        while subscriber.nb_dropped_messages < 40:
+            assert time.monotonic() < end
+            time.sleep(0.01)
+        # Oldest messages have been dropped
+        indices = [subscriber.receive_message(timeout=1)[1]["index"] for _ in range(10)]
+        assert indices == list(range(40, 50))
+        assert subscriber.receive_message(blocking=False) == (None, None)
+    finally:
+        subscriber.close_connection()
+        publisher.close_connection()
+
+
+def test_topic_dispatch(broker):
+    subscriber = make_messaging(broker, "subscriber")
+    publisher = make_messaging(broker, "publisher")
+    commands = []
+    try:
+        subscriber.register_callback(lambda t, d: commands.append((t, d)), cmd_type="CMD", do_parsing=True)
+        broker.wait_subscribers("observatory/CMD", 1)
+        publisher.send_message("CMD", {"action": "park"})
+        publisher.send_message("WEATHER", {"safe": False})
+        # Messages handled by a callback do not go to the queue
+        assert subscriber.receive_message(timeout=5) == ("WEATHER", {"safe": False})
+        assert commands == [("CMD", {"action": "park"})]
+        assert subscriber.receive_message(blocking=False) == (None, None)
+    finally:
+        subscriber.close_connection()
+        publisher.close_connection()
+
+
+def test_reconnect(broker):
+    subscriber = make_messaging(broker, "subscriber")
+    publisher = make_messaging(broker, "publisher")
+    try:
+        broker.wait_subscribers("observatory/WEATHER", 1)
+        broker.disconnect_all()
+        # Both clients reconnect, the subscription is renewed
+        end = time.monotonic() + 5
+        while broker.nb_connections < 4 or not publisher.client.is_connected():
+            assert time.monotonic() < end, "Clients did not reconnect"
+            time.sleep(0.01)
+        broker.wait_subscribers("observatory/WEATHER", 1)
+        publisher.send_message("WEATHER", {"safe": True})
+        assert subscriber.receive_message(timeout=5) == ("WEATHER", {"safe": True})
+    finally:
+        subscriber.close_connection()
+        publisher.close_connection()
+
+
+@pytest.mark.slow
+def test_benchmark_receive(broker):
+    """ Compare the persistent subscriber with the former implementation, that
+        connected a new client with paho.mqtt.subscribe.simple for each message.
+        Throughput is measured with a publisher sending as fast as possible,
+        latency with a publisher paced every 2ms
+    """
+    nb_messages = 500
+    publisher = make_messaging(broker, "publisher")
+    stop = threading.Event()
+
+    def publish(run_id, period_sec):
+        index = 0
+        while not stop.is_set():
+            publisher.send_message("BENCH", {"run": run_id, "index": index, "sent_ns": time.perf_counter_ns()})
+            index += 1
+            time.sleep(period_sec)
+
+    def run(receive, period_sec):
+        received, latencies = [], []
+        run_id = random.getrandbits(32)
+        thread = threading.Thread(target=publish, args=(run_id, period_sec), daemon=True)
+        stop.clear()
+        start = time.perf_counter()
+        thread.start()
+        try:
+            while len(received) < nb_messages:
+                msg_type, msg_data = receive()
+                # Skip the backlog of a previous run
+                if msg_data["run"] != run_id:
+                    continue
+                latencies.append((time.perf_counter_ns() - msg_data["sent_ns"]) * 1e-6)
+                received.append(msg_data["index"])
+        finally:
+            stop.set()
+            thread.join()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return dict(rate=len(received) / elapsed,
+                    missed=received[-1] - received[0] + 1 - len(received),
+                    median_ms=latencies[len(latencies) // 2],
+                    p99_ms=latencies[int(len(latencies) * 0.99)])
+
+    def legacy_receive():
+        msg = mqttsubscribe.simple(topics="observatory/#", qos=0, msg_count=1, retained=False,
+                                   hostname="127.0.0.1", port=broker.port)
+        return publisher.parse_msg(msg)
+
+    results = {}
+    subscriber = make_messaging(broker, "subscriber", receive_queue_size=100000)
+    try:
+        broker.wait_subscribers("observatory/BENCH", 1)
+        persistent_receive = lambda: subscriber.receive_message(timeout=5)
+        results["persistent"] = run(persistent_receive, 0), run(persistent_receive, 0.002)
+    finally:
+        subscriber.close_connection()
+    results["subscribe.simple"] = run(legacy_receive, 0), run(legacy_receive, 0.002)
+    publisher.close_connection()
+
+    for name, (throughput, latency) in results.items():
+        logging.info(f"{name:>16}: {throughput['rate']:.0f} msg/s, {throughput['missed']} messages missed, "
+                     f"latency median {latency['median_ms']:.2f}ms p99 {latency['p99_ms']:.2f}ms")
+    assert results["persistent"][0]["missed"] == 0
+    assert results["persistent"][1]["missed"] == 0
+    assert results["persistent"][0]["rate"] > results["subscribe.simple"][0]["rate"]
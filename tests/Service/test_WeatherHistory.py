@@ -0,0 +1,156 @@
+# Basic stuff
+import datetime
+import importlib.util
+import logging
+import os
+import time
+from types import SimpleNamespace
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+# Local stuff
+from Service.WeatherHistory import WeatherHistory
+from Service.WeatherHistory import to_timestamp
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+T0 = datetime.datetime(2024, 4, 23, 20, tzinfo=datetime.timezone.utc)
+
+
+def make_samples(n, period_sec=20, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'date': T0 + datetime.timedelta(seconds=i * period_sec),
+             'weather_sensor_name': 'Weather Simulator',
+             'state': 'OK' if i % 7 else 'NOK',
+             'WEATHER_TEMPERATURE': 10 + rng.normal(),
+             'WEATHER_WIND_SPEED': abs(rng.normal(10, 5)),
+             'WEATHER_RAIN_HOUR': 0,
+             'safe': bool(i % 7)}
+            for i in range(n)]
+
+
+def test_weather_history():
+    samples = make_samples(3 * 24 * 180)
+    history = WeatherHistory(capacity=1000, minute_capacity=24 * 60, hour_capacity=24)
+    for sample in samples[:1000]:
+        history.append(sample)
+    nbytes = history.nbytes
+    for sample in samples[1000:]:
+        history.append(sample)
+    # Memory does not grow with uptime
+    assert history.nbytes == nbytes
+    assert len(history) == 1000
+
+    latest = history.latest()
+    assert latest['date'] == samples[-1]['date']
+    assert latest['state'] == samples[-1]['state']
+    assert latest['WEATHER_TEMPERATURE'] == pytest.approx(samples[-1]['WEATHER_TEMPERATURE'])
+    assert history.is_safe(stale_sec=180, now=samples[-1]['date']) == samples[-1]['safe']
+    assert not history.is_safe(stale_sec=180, now=samples[-1]['date'] + datetime.timedelta(minutes=10))
+
+    # Raw samples of the last hour
+    end = samples[-1]['date']
+    start = end - datetime.timedelta(hours=1)
+    recent = history.get_samples(start, end)
+    window = [s for s in samples if start <= s['date'] <= end]
+    assert len(recent['date']) == len(window) == 181
+    np.testing.assert_allclose(recent['WEATHER_WIND_SPEED'], [s['WEATHER_WIND_SPEED'] for s in window])
+    assert list(recent['state']) == [s['state'] for s in window]
+
+    # Per minute aggregates, beyond the raw samples
+    minutes = history.get_aggregates('minute')
+    assert len(minutes['date']) == 24 * 60
+    first = minutes['date'][0]
+    bucket = [s for s in samples if first <= s['date'].timestamp() < first + 60]
+    temperatures = [s['WEATHER_TEMPERATURE'] for s in bucket]
+    assert minutes['WEATHER_TEMPERATURE_count'][0] == 3
+    assert minutes['WEATHER_TEMPERATURE_min'][0] == pytest.approx(min(temperatures))
+    assert minutes['WEATHER_TEMPERATURE_max'][0] == pytest.approx(max(temperatures))
+    assert minutes['WEATHER_TEMPERATURE_mean'][0] == pytest.approx(np.mean(temperatures))
+
+    # Per hour aggregates: the mean of safe is the fraction of safe samples
+    hours = history.get_aggregates('hour')
+    assert len(hours['date']) == 24
+    assert np.all(np.diff(hours['date']) == 3600)
+    last_hour = [s for s in samples if s['date'].timestamp() >= hours['date'][-1]]
+    assert hours['safe_mean'][-1] == pytest.approx(np.mean([s['safe'] for s in last_hour]))
+    assert 'state_mean' not in hours
+
+    table = history.as_table(start, end)
+    assert len(table) == 181 and table['date'][0] == window[0]['date']
+    assert len(history.as_table(resolution='hour')) == 24
+
+
+def test_late_and_missing_samples():
+    history = WeatherHistory(capacity=10)
+    assert history.latest() is None
+    assert not history.is_safe()
+    history.append({'date': T0, 'WEATHER_TEMPERATURE': 10., 'safe': True})
+    history.append({'date': T0 + datetime.timedelta(seconds=30), 'safe': False, 'errors': 'no error'})
+    # Late sample: kept in the aggregates only
+    history.append({'date': T0 + datetime.timedelta(seconds=10), 'WEATHER_TEMPERATURE': 20., 'safe': True})
+    assert len(history) == 2
+    latest = history.latest()
+    assert 'WEATHER_TEMPERATURE' not in latest and latest['safe'] is False
+    minutes = history.get_aggregates('minute')
+    assert minutes['WEATHER_TEMPERATURE_mean'][0] == 15.
+    assert minutes['safe_count'][0] == 3
+    assert history.get_samples(features=['errors'])['errors'].tolist() == [None, 'no error']
+
+
+def test_naive_and_aware_dates():
+    naive = T0.replace(tzinfo=None)
+    assert to_timestamp(naive) == to_timestamp(T0) == T0.timestamp()
+    history = WeatherHistory(capacity=10)
+    history.append({'date': naive, 'safe': True})
+    assert history.latest()['date'] == T0
+    assert history.is_safe(stale_sec=180, now=naive + datetime.timedelta(seconds=60))
+    assert not history.is_safe(stale_sec=180, now=T0 + datetime.timedelta(seconds=600))
+
+
+def test_remote_observatory_weather_safety():
+    pytest.importorskip("PyIndi")
+    pytest.importorskip("pygraphviz")
+    spec = importlib.util.spec_from_file_location(
+        "launch_remote_observatory",
+        os.path.join(os.path.dirname(__file__), "..", "..", "apps", "launch_remote_observatory.py"))
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+
+    history = WeatherHistory(capacity=10)
+    history.append({'date': T0, 'safe': True})
+    now = T0.replace(tzinfo=None)
+    fsm = SimpleNamespace(
+        logger=logging.getLogger(__name__),
+        simulation_mode=False,
+        db=None,
+        manager=SimpleNamespace(
+            serv_weather=SimpleNamespace(weather_history=history),
+            # NTPTimeService returns naive UTC datetimes
+            serv_time=SimpleNamespace(get_utc=lambda: now)))
+    now += datetime.timedelta(seconds=60)
+    assert app.RemoteObservatoryFSM.is_weather_safe(fsm, stale=180)
+    # Stale in memory sample
+    now += datetime.timedelta(seconds=600)
+    assert not app.RemoteObservatoryFSM.is_weather_safe(fsm, stale=180)
+
+
+@pytest.mark.slow
+def test_benchmark_weather_history():
+    samples = make_samples(200000, period_sec=5)
+    history = WeatherHistory()
+    start = time.perf_counter()
+    for sample in samples:
+        history.append(sample)
+    append_time = (time.perf_counter() - start) / len(samples)
+    start = time.perf_counter()
+    for _ in range(1000):
+        history.is_safe(now=samples[-1]['date'])
+    safe_time = (time.perf_counter() - start) / 1000
+    start = time.perf_counter()
+    table = history.as_table(samples[-1]['date'] - datetime.timedelta(days=1), samples[-1]['date'])
+    table_time = time.perf_counter() - start
+    logging.info(f"append {append_time * 1e6:.1f}us, is_safe {safe_time * 1e6:.1f}us, "
+                 f"{len(table)} samples table in {table_time * 1e3:.1f}ms, {history.nbytes / 2**20:.1f}MB")
@@ -0,0 +1,66 @@
+# Basic stuff
+import importlib.util
+import logging
+import os
+
+# Numerical stuff
+import numpy as np
+import pytest
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def load_ampglow_detector():
+    pytest.importorskip("skimage")
+    spec = importlib.util.spec_from_file_location(
+        "ampglow_detector",
+        os.path.join(os.path.dirname(__file__), "..", "..", "apps", "calibration_utilities", "ampglow_detector.py"))
+    ampglow_detector = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ampglow_detector)
+    return ampglow_detector
+
+
+def legacy_heatmap(ampglow_detector, image):
+    """ Former multiscale_variance_analysis loop, one chi2 test per patch, without the plots """
+    global_variance = image.var()
+    shape = image.shape
+    histogram_patch_size = []
+    histogram_freq_problem = []
+    max_freq_image = np.zeros_like(image, dtype=np.float32)
+    total_nb_image = 0
+    while min(shape) >= 4:
+        min_ok_size = min(shape)
+        histogram_patch_size.append(min_ok_size)
+        histogram_freq_problem.append(0)
+        total_nb_patch = 0
+        for idx in ampglow_detector.patch_index_generator(image.shape, min_ok_size):
+            patch = image[idx[0]:idx[1], idx[2]:idx[3]]
+            p_value = ampglow_detector.variance_test(global_variance, patch.flatten())
+            max_freq_image[idx[0]:idx[1], idx[2]:idx[3]] += p_value
+            if p_value < 0.05:
+                histogram_freq_problem[-1] += 1
+            total_nb_patch += 1
+        histogram_freq_problem[-1] /= total_nb_patch
+        shape = tuple(np.array(shape)//2)
+        total_nb_image += 1
+    return max_freq_image/total_nb_image, histogram_patch_size, histogram_freq_problem
+
+
+def test_heatmap_matches_legacy_loop():
+    ampglow_detector = load_ampglow_detector()
+    # Dark with uneven dyadic splits, and amplifier glow in one corner
+    rng = np.random.default_rng(0)
+    image = rng.normal(1000, 10, (90, 70))
+    x, y = np.mgrid[:90, :70]
+    image += 200*np.exp(-(x**2 + y**2)/200)
+    image = image.astype(np.uint16)
+
+    heatmap, patch_sizes, freq_problem = ampglow_detector.ampglow_heatmap(image)
+    legacy, legacy_patch_sizes, legacy_freq_problem = legacy_heatmap(ampglow_detector, image)
+    assert heatmap.shape == image.shape
+    np.testing.assert_allclose(heatmap, legacy, rtol=1e-5, atol=1e-6)
+    assert patch_sizes == legacy_patch_sizes
+    assert freq_problem == pytest.approx(legacy_freq_problem)
+    # The glow is detected
+    assert max(freq_problem) > 0
+    assert heatmap[:8, :8].mean() < heatmap[-8:, -8:].mean()
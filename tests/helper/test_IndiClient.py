@@ -1,12 +1,20 @@
 # Basic stuff
+import io
 import logging
 import random
 import threading
 import time
 
+# Numerical stuff
+import numpy as np
+
+# Astropy
+from astropy.io import fits
+
 #PyIndi
 import PyIndi
 # local includes
+from helper.IndiClient import BLOB
 from helper.IndiClient import IndiClient
 from Service.NTPTimeService import HostTimeService
 
@@ -49,4 +57,19 @@ def test_indiClient():
 
     for t in tlist:
         # Wait (block) until the thread is done
-        t.join()
\ No newline at end of file
+        t.join()
+
+
+def test_blob_unsigned_fits(tmp_path):
+    data = (np.arange(64 * 64) * 13 % 65536).astype(np.uint16).reshape(64, 64)
+    content = io.BytesIO()
+    fits.PrimaryHDU(data).writeto(content)
+    buffer = bytearray(content.getvalue())
+    blob = BLOB("CCD1", "Image", ".fits", len(buffer), len(buffer), buffer)
+    # Pixels are converted in place only once
+    for _ in range(3):
+        hdul = blob.get_fits()
+        assert hdul[0].data.dtype.kind == 'u'
+        assert np.array_equal(hdul[0].data, data)
+    blob.save(str(tmp_path / "blob.fits"))
+    assert np.array_equal(fits.getdata(str(tmp_path / "blob.fits")), data)
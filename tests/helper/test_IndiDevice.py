@@ -0,0 +1,57 @@
+# Basic stuff
+import logging
+import statistics
+import time
+
+#PyIndi
+import PyIndi
+
+# local includes
+from helper.IndiDevice import IndiDevice
+
+logging.basicConfig(level=logging.DEBUG, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def polling_set_number(device, number_name, value_vector, timeout=30):
+    """ Reproduces the former 10ms sleep-polling implementation of IndiDevice.set_number(..., sync=True) """
+    pv = device.get_prop(number_name, "number")
+    for p in pv:
+        if p.getName() in value_vector:
+            p.value = value_vector[p.getName()]
+    device.indi_client.sendNewNumber(pv)
+    started = time.time()
+    while pv.getState() not in [PyIndi.IPS_ALERT, PyIndi.IPS_OK]:
+        if 0 < timeout < time.time() - started:
+            raise RuntimeError(f"Timeout error while changing property {pv.getName()}")
+        time.sleep(0.01)
+
+
+def test_set_number_round_trip_latency():
+    """
+    Micro-benchmark of set_number(..., sync=True) against the CCD simulator driver,
+    comparing event-driven waits with the former sleep-polling
+    """
+    config = dict(
+        indi_host="localhost",
+        indi_port="7624")
+    device = IndiDevice(device_name="CCD Simulator", indi_client_config=config)
+    device.connect(connect_device=True)
+    roi = {'X': 0, 'Y': 0, 'WIDTH': 640, 'HEIGHT': 480}
+    nb_iter = 100
+
+    def measure(setter):
+        durations = []
+        for i in range(nb_iter):
+            roi['X'] = i % 2
+            started = time.perf_counter()
+            setter(device, 'CCD_FRAME', roi)
+            durations.append(time.perf_counter() - started)
+        return durations
+
+    polling = measure(polling_set_number)
+    event_driven = measure(lambda d, name, values: d.set_number(name, values, sync=True))
+    for label, durations in (("sleep-polling", polling), ("event-driven", event_driven)):
+        logging.info(f"set_number round trip with {label}: median {1e3*statistics.median(durations):.2f}ms, "
+                     f"max {1e3*max(durations):.2f}ms over {nb_iter} iterations")
+    assert statistics.median(event_driven) <= statistics.median(polling)
+    device.disconnect()
@@ -0,0 +1,230 @@
+# Basic stuff
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.parse
+
+# Numerical stuff
+import pytest
+import requests
+
+# Local stuff
+from helper.IndiWebManagerClient import IndiWebManagerClient
+from utils import error
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class FakeIndiWebManager(ThreadingHTTPServer):
+    """ Local stand-in for the indi web manager API
+
+    Each request takes latency_s, a started driver shows up in the running
+    list start_lag_s later. Records requests and opened connections.
+    """
+    daemon_threads = True
+
+    def __init__(self, latency_s=0., start_lag_s=0., failing_drivers=()):
+        self.latency_s = latency_s
+        self.start_lag_s = start_lag_s
+        self.failing_drivers = set(failing_drivers)
+        self.server_running = False
+        self.drivers = {}  # name: time at which it is running
+        self.requests = []
+        self.nb_connections = 0
+        self.lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeIndiWebManagerHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def count(self, method, prefix):
+        with self.lock:
+            return len([r for r in self.requests if r[0] == method and r[1].startswith(prefix)])
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeIndiWebManagerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.nb_connections += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, code, body=""):
+        body = body.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(("GET", self.path))
+        time.sleep(server.latency_s)
+        if self.path == "/api/server/status":
+            self.reply(200, json.dumps([{"status": str(server.server_running),
+                                         "active_profile": "test"}]))
+        elif self.path == "/api/server/drivers":
+            now = time.monotonic()
+            with server.lock:
+                running = [{"name": name} for name, t in server.drivers.items() if t <= now]
+            self.reply(200, json.dumps(running))
+        else:
+            self.reply(404)
+
+    def do_POST(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(("POST", self.path))
+        time.sleep(server.latency_s)
+        action, _, name = self.path.rpartition("/")
+        name = urllib.parse.unquote(name)
+        if action == "/api/server/start":
+            server.server_running = True
+            self.reply(200)
+        elif self.path == "/api/server/stop":
+            server.server_running = False
+            self.reply(200)
+        elif action in ("/api/drivers/start", "/api/drivers/start_remote", "/api/drivers/restart"):
+            if name in server.failing_drivers:
+                self.reply(500)
+                return
+            with server.lock:
+                server.drivers.setdefault(name, time.monotonic() + server.start_lag_s)
+            self.reply(200)
+        elif action in ("/api/drivers/stop", "/api/drivers/stop_remote"):
+            with server.lock:
+                server.drivers.pop(name, None)
+            self.reply(200)
+        else:
+            self.reply(404)
+
+
+def make_client(server, **kwargs):
+    config = dict(host="127.0.0.1", port=server.port, profile_name="test")
+    config.update(kwargs)
+    return IndiWebManagerClient(config)
+
+
+DRIVERS = [f"Driver {i}" for i in range(12)]
+
+
+@pytest.fixture
+def server():
+    server = FakeIndiWebManager()
+    yield server
+    server.close()
+
+
+def test_keep_alive_and_cache(server):
+    client = make_client(server, driver_list_ttl_s=60)
+    # Connections opened by other tests may still be pooled
+    client.session.close()
+    client.start_driver("CCD Simulator")
+    for _ in range(20):
+        assert client.is_driver_started("CCD Simulator")
+        assert not client.is_driver_started("Telescope Simulator")
+    # Start invalidated the cache, then a single query was enough
+    assert server.count("GET", "/api/server/drivers") == 2
+    client.stop_driver("CCD Simulator")
+    assert not client.is_driver_started("CCD Simulator")
+    assert server.count("GET", "/api/server/drivers") == 3
+    # All requests went through the same connection
+    assert server.nb_connections == 1
+
+
+def test_ensure_drivers(server):
+    client = make_client(server)
+    client.start_driver(DRIVERS[0])
+    server.start_lag_s = 0.2
+    start = time.monotonic()
+    started = client.ensure_drivers(DRIVERS + [None, DRIVERS[1]])
+    assert time.monotonic() - start >= server.start_lag_s
+    assert started == DRIVERS[1:]
+    assert server.count("POST", "/api/drivers/start/") == len(DRIVERS)
+    assert set(client.get_running_driver_list(max_age_s=0)) == set(DRIVERS)
+    # Nothing left to start
+    assert client.ensure_drivers(DRIVERS) == []
+    assert server.count("POST", "/api/drivers/start/") == len(DRIVERS)
+
+
+def test_ensure_drivers_errors():
+    server = FakeIndiWebManager(failing_drivers=[DRIVERS[3]])
+    try:
+        client = make_client(server)
+        with pytest.raises(RuntimeError):
+            client.ensure_drivers(DRIVERS)
+        server.failing_drivers.clear()
+        server.start_lag_s = 10
+        start = time.monotonic()
+        with pytest.raises(error.Timeout):
+            client.ensure_drivers(DRIVERS, timeout_s=0.3)
+        assert time.monotonic() - start < 1
+    finally:
+        server.close()
+
+
+def test_start_server_waits_for_indiserver(server):
+    master = FakeIndiWebManager()
+    indiserver = socket.socket()
+    try:
+        indiserver.bind(("127.0.0.1", 0))
+        indi_config = dict(indi_host="127.0.0.1", indi_port=indiserver.getsockname()[1])
+        client = IndiWebManagerClient(dict(host="127.0.0.1", port=server.port, profile_name="test",
+                                           master_host="127.0.0.1", master_port=master.port),
+                                      indi_config=indi_config)
+        # indiserver starts listening a while after the web manager started it
+        threading.Timer(0.3, indiserver.listen).start()
+        start = time.monotonic()
+        client.start_server(device_name="CCD Simulator")
+        assert 0.3 <= time.monotonic() - start < 2
+        remote_name = f'"CCD Simulator"@127.0.0.1:{indi_config["indi_port"]}'
+        assert client.is_driver_started(remote_name, master=True)
+        client.stop_server(device_name="CCD Simulator")
+        assert not client.is_driver_started(remote_name, master=True)
+        assert not server.server_running
+    finally:
+        indiserver.close()
+        master.close()
+
+
+def legacy_start_drivers(host, port, driver_names):
+    """ Former unpark: one check and one start per driver, each on a new connection """
+    base_url = f"http://{host}:{port}"
+    for driver_name in driver_names:
+        running = [d["name"] for d in json.loads(requests.get(f"{base_url}/api/server/drivers").text)]
+        if driver_name not in running:
+            response = requests.post(f"{base_url}/api/drivers/start/{urllib.parse.quote(driver_name)}")
+            assert response.status_code == 200
+    # Drivers were then expected to be ready after a fixed delay
+    time.sleep(5)
+
+
+@pytest.mark.slow
+def test_benchmark_start_drivers():
+    results = {}
+    for name in ("legacy", "current"):
+        server = FakeIndiWebManager(latency_s=0.05, start_lag_s=0.5)
+        try:
+            start = time.monotonic()
+            if name == "legacy":
+                legacy_start_drivers("127.0.0.1", server.port, DRIVERS)
+            else:
+                make_client(server).ensure_drivers(DRIVERS)
+            results[name] = (time.monotonic() - start, server.nb_connections)
+        finally:
+            server.close()
+    logging.info(", ".join(f"{name}: {len(DRIVERS)} drivers in {t:.2f}s, {n} connections"
+                           for name, (t, n) in results.items()))
+    assert results["current"][0] < results["legacy"][0]
@@ -0,0 +1,172 @@
+# Basic stuff
+import asyncio
+import base64
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+
+# Numerical stuff
+import pytest
+
+# Local stuff
+from helper.device import device
+from helper.IndiClientMMTO import IndiClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+DEVICE_NAME = "CCD Simulator"
+
+DEF_TRAFFIC = f"""<defSwitchVector device="{DEVICE_NAME}" name="CONNECTION" label="Connection" group="Main Control" state="Idle" perm="rw" rule="OneOfMany" timeout="60" timestamp="2024-04-23T21:34:03">
+    <defSwitch name="CONNECT" label="Connect">
+Off
+    </defSwitch>
+    <defSwitch name="DISCONNECT" label="Disconnect">
+On
+    </defSwitch>
+</defSwitchVector>
+<defNumberVector device="{DEVICE_NAME}" name="CCD_EXPOSURE" label="Expose" group="Main Control" state="Idle" perm="rw" timeout="60" timestamp="2024-04-23T21:34:03">
+    <defNumber name="CCD_EXPOSURE_VALUE" label="Duration (s)" format="%5.2f" min="0.01" max="3600" step="1">
+1
+    </defNumber>
+</defNumberVector>
+<defBLOBVector device="{DEVICE_NAME}" name="CCD1" label="Image Data" group="Image Info" state="Idle" perm="ro" timeout="60" timestamp="2024-04-23T21:34:03">
+    <defBLOB name="CCD1" label="Image"/>
+</defBLOBVector>
+"""
+
+
+def blob_traffic(raw_size):
+    """ setBLOBVector as sent by indiserver, base64 with a newline every 72 chars """
+    encoded = base64.encodebytes(os.urandom(raw_size))
+    return (f'<setBLOBVector device="{DEVICE_NAME}" name="CCD1" state="Ok" timeout="60" '
+            f'timestamp="2024-04-23T21:34:04">\n    <oneBLOB name="CCD1" size="{raw_size}" '
+            f'format=".fits" len="{len(encoded)}">\n').encode() + encoded + \
+        b'    </oneBLOB>\n</setBLOBVector>\n'
+
+
+class FakeIndiServer(socketserver.ThreadingTCPServer):
+    """ Replays captured traffic to each client, after its getProperties,
+        and records what clients send
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, traffic):
+        self.traffic = traffic
+        self.received = bytearray()
+        self.received_lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), FakeIndiHandler)
+        self.port = self.server_address[1]
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def received_count(self, pattern):
+        with self.received_lock:
+            return self.received.count(pattern)
+
+
+class FakeIndiHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        replayed = False
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            data = self.request.recv(65536)
+            if not data:
+                return
+            with self.server.received_lock:
+                self.server.received += data
+            if not replayed and b"getProperties" in data:
+                replayed = True
+                for chunk in self.server.traffic:
+                    self.request.sendall(chunk)
+
+
+class RecordingDevice(device):
+    """ Records the size of received BLOBs """
+    def __init__(self, client):
+        super().__init__(name=DEVICE_NAME)
+        self.indi_client = client
+        self.blob_sizes = []
+        self.all_blobs_received = threading.Event()
+        self.expected_blobs = 0
+        self.blob_def_handler = self.record_blob
+
+    def record_blob(self, blob_vector, indi):
+        if blob_vector.tag.get_transfertype().__name__ != "iset":
+            return
+        self.blob_sizes.append(len(blob_vector.get_first_element().get_data()))
+        if len(self.blob_sizes) == self.expected_blobs:
+            self.all_blobs_received.set()
+
+
+class LegacyRecordingDevice(RecordingDevice):
+    """ Former parse_xml_str, that slept after each chunk """
+    async def parse_xml_str(self, xml_str):
+        await super().parse_xml_str(xml_str)
+        await asyncio.sleep(0.1)
+
+
+def connect(server, device_class=RecordingDevice, expected_blobs=0):
+    client = IndiClient(config=dict(indi_host="127.0.0.1", indi_port=server.port,
+                                    use_unique_client=True))
+    indi_device = device_class(client)
+    indi_device.expected_blobs = expected_blobs
+    client.device_subscriptions[DEVICE_NAME] = indi_device.parse_xml_str
+    client.connect_to_server(sync=True, timeout=5)
+    return client, indi_device
+
+
+def test_replay_and_stop():
+    blob = blob_traffic(1024 * 1024)
+    server = FakeIndiServer([DEF_TRAFFIC.encode(), blob[:1000], blob[1000:], blob])
+    client, indi_device = connect(server, expected_blobs=2)
+    try:
+        assert indi_device.all_blobs_received.wait(timeout=10)
+        assert indi_device._get_vector("CONNECTION") is not None
+        assert indi_device.blob_sizes == [1024 * 1024] * 2
+
+        # Synchronous API, from many threads
+        def send():
+            for _ in range(100):
+                client.xml_to_indiserver('<newSwitchVector device="CCD Simulator" name="CONNECTION">'
+                                         '<oneSwitch name="CONNECT">On</oneSwitch></newSwitchVector>')
+        threads = [threading.Thread(target=send) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        end = time.monotonic() + 5
+        while server.received_count(b"<newSwitchVector") < 800:
+            assert time.monotonic() < end, "Messages were not all sent"
+            time.sleep(0.01)
+    finally:
+        start = time.monotonic()
+        client.stop()
+        # The idle writer is woken up, instead of polling the queue
+        assert time.monotonic() - start < 5
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.mark.slow
+def test_benchmark_blob_throughput():
+    nb_blobs, raw_size = 3, 8 * 1024 * 1024
+    blob = blob_traffic(raw_size)
+    results = {}
+    for name, device_class in (("legacy", LegacyRecordingDevice), ("current", RecordingDevice)):
+        server = FakeIndiServer([DEF_TRAFFIC.encode()] + [blob] * nb_blobs)
+        start = time.monotonic()
+        client, indi_device = connect(server, device_class=device_class, expected_blobs=nb_blobs)
+        try:
+            assert indi_device.all_blobs_received.wait(timeout=300)
+            results[name] = time.monotonic() - start
+        finally:
+            client.stop()
+            server.shutdown()
+            server.server_close()
+    size_mb = nb_blobs * len(blob) / 2**20
+    logging.info(", ".join(f"{name}: {size_mb:.0f}MB in {t:.2f}s ({size_mb / t:.0f}MB/s)"
+                           for name, t in results.items()))
+    assert results["current"] < results["legacy"]
@@ -0,0 +1,138 @@
+# Basic stuff
+import asyncio
+import base64
+import gc
+import logging
+import os
+import time
+import tracemalloc
+import types
+import xml.parsers.expat
+import zlib
+
+# Numerical stuff
+import pytest
+
+# Local stuff
+from helper.device import device
+from helper.device import indiblob
+from helper.device import inditransfertypes
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+DEVICE_NAME = "CCD Simulator"
+
+
+class BlobDevice(device):
+    """ Keeps the received BLOB vectors """
+    def __init__(self):
+        super().__init__(name=DEVICE_NAME)
+        self.indi_client = types.SimpleNamespace(host="localhost", port=7624)
+        self.blobs = []
+        self.blob_def_handler = lambda vector, indi: self.blobs.append(vector)
+
+
+def set_blob_xml(payload, format=".fits", size=None):
+    encoded = base64.encodebytes(zlib.compress(payload) if format.endswith(".z") else payload)
+    size = len(payload) if size is None else size
+    return (f'<setBLOBVector device="{DEVICE_NAME}" name="CCD1" state="Ok" timeout="60" '
+            f'timestamp="2024-04-23T21:34:04">\n<oneBLOB name="CCD1" size="{size}" '
+            f'format="{format}" len="{len(encoded)}">\n').encode() + encoded + \
+        b'</oneBLOB>\n</setBLOBVector>\n'
+
+
+def feed(indi_device, data, chunk_size):
+    async def parse():
+        for i in range(0, len(data), chunk_size):
+            await indi_device.parse_xml_str(data[i:i + chunk_size])
+    asyncio.run(parse())
+
+
+@pytest.mark.parametrize("format", [".fits", ".fits.z"])
+@pytest.mark.parametrize("chunk_size", [1, 1000, 65537])
+@pytest.mark.parametrize("size_offset", [0, -100])
+def test_streamed_blob(format, chunk_size, size_offset):
+    payload = os.urandom(10000) + bytes(10000)
+    if chunk_size == 1:
+        payload = payload[:1500]
+    indi_device = BlobDevice()
+    # A wrong size attribute only costs a buffer resize
+    feed(indi_device, set_blob_xml(payload, format, len(payload) + size_offset) * 2, chunk_size)
+    assert len(indi_device.blobs) == 2
+    blob = indi_device.blobs[-1].get_first_element()
+    data = blob.get_data()
+    assert isinstance(data, memoryview)
+    assert data == payload
+    assert blob.get_plain_format() == ".fits"
+    assert blob._value == ''
+    assert blob.get_size() == len(base64.b64encode(zlib.compress(payload) if format.endswith(".z") else payload))
+
+
+def test_text_elements_and_encoding():
+    indi_device = BlobDevice()
+    feed(indi_device, f"""<defTextVector device="{DEVICE_NAME}" name="DRIVER_INFO" state="Idle" perm="ro">
+<defText name="DRIVER_NAME">
+  CCD Simulator
+</defText>
+</defTextVector>""".encode(), 7)
+    assert indi_device._get_vector("DRIVER_INFO").get_element("DRIVER_NAME").get_text() == "CCD Simulator"
+
+    tag = indi_device._factory.tagfactory.create_tag("oneBLOB")
+    for format in (".fits", ".fits.z"):
+        blob = indiblob({"name": "CCD1"}, tag)
+        blob.set_from_string(b"SIMPLE  =  T", format)
+        assert blob.get_data() == b"SIMPLE  =  T"
+        assert f'format="{format}"' in blob.get_xml(inditransfertypes.inew)
+
+
+def test_truncated_blob(caplog):
+    indi_device = BlobDevice()
+    payload = os.urandom(3000)
+    xml = set_blob_xml(payload).replace(b"\n</oneBLOB>", b"A</oneBLOB>")
+    # The stream can still be parsed after a bad BLOB
+    feed(indi_device, xml + set_blob_xml(payload), 1000)
+    assert "Truncated base64 BLOB data" in caplog.text
+    assert [b.get_first_element().get_data() == payload for b in indi_device.blobs] == [True, True]
+
+
+@pytest.mark.slow
+def test_benchmark_blob_decoding():
+    """ Peak memory and time to decode a large BLOB, against the former
+        accumulate, join and decode
+    """
+    payload = os.urandom(32 * 1024 * 1024)
+    blob_xml = set_blob_xml(payload)
+    chunks = [blob_xml[i:i + 1024 * 1024] for i in range(0, len(blob_xml), 1024 * 1024)]
+    del payload
+
+    def legacy_decode(chunks):
+        text = []
+        parser = xml.parsers.expat.ParserCreate()
+        parser.CharacterDataHandler = text.append
+        for chunk in chunks:
+            parser.Parse(chunk, 0)
+        return base64.b64decode("".join(text).replace('\\n', '').strip().encode("utf8"))
+
+    # Former path: every text callback, as str, joined then decoded
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    legacy = legacy_decode(chunks)
+    legacy_time = time.perf_counter() - start
+    legacy_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del legacy
+
+    indi_device = BlobDevice()
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    feed(indi_device, blob_xml, 1024 * 1024)
+    data = indi_device.blobs[0].get_first_element().get_data()
+    stream_time = time.perf_counter() - start
+    stream_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    size = len(data)
+    logging.info(f"{size / 2**20:.0f}MB BLOB: legacy {legacy_time:.2f}s peak {legacy_peak / size:.1f}x, "
+                 f"streamed {stream_time:.2f}s peak {stream_peak / size:.2f}x")
+    assert stream_peak < 1.3 * size < legacy_peak
@@ -0,0 +1,65 @@
+# Basic stuff
+from concurrent.futures import Future
+import logging
+import threading
+import time
+
+# Local stuff
+from utils import EventWaiter
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+def test_timeout():
+    waiter = EventWaiter()
+    start = time.monotonic()
+    assert not waiter.wait(timeout=0.1)
+    assert time.monotonic() - start >= 0.1
+    # Negative timeouts do not block
+    assert not waiter.wait(timeout=-1)
+
+
+def test_notifications():
+    waiter = EventWaiter()
+    # A notification sent before wait is not lost, and is consumed by wait
+    waiter.notify()
+    assert waiter.wait(timeout=0)
+    assert not waiter.wait(timeout=0)
+
+    # Notification from another thread wakes the waiter up early
+    timer = threading.Timer(0.05, waiter.notify)
+    start = time.monotonic()
+    timer.start()
+    assert waiter.wait(timeout=5)
+    assert time.monotonic() - start < 1
+    timer.join()
+
+    # Can be used as a future callback
+    future = Future()
+    future.add_done_callback(waiter.notify)
+    threading.Timer(0.05, future.set_result, args=(None,)).start()
+    assert waiter.wait(timeout=5)
+
+
+def test_several_producers():
+    waiter = EventWaiter()
+    events = [threading.Event() for _ in range(5)]
+
+    def produce(event, delay_s):
+        time.sleep(delay_s)
+        event.set()
+        waiter.notify()
+
+    threads = [threading.Thread(target=produce, args=(event, 0.02 * i))
+               for i, event in enumerate(events)]
+    for thread in threads:
+        thread.start()
+    nb_wake_ups = 0
+    deadline = time.monotonic() + 5
+    while not all(event.is_set() for event in events):
+        assert time.monotonic() < deadline
+        if waiter.wait(timeout=deadline - time.monotonic()):
+            nb_wake_ups += 1
+    assert 1 <= nb_wake_ups <= len(events)
+    for thread in threads:
+        thread.join()
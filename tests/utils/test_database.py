@@ -0,0 +1,249 @@
+# Basic stuff
+import datetime
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+# Numerical stuff
+import pytest
+
+# Local stuff
+from utils import database
+from utils import serializers as json_util
+from utils.database import FileDB
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+COLLECTIONS = ['observations', 'state', 'weather']
+
+
+class FixedTimeService:
+    """ Returns increasing dates, one minute apart, starting yesterday """
+    def __init__(self):
+        self.date = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=1)
+
+    def get_utc(self):
+        self.date += datetime.timedelta(minutes=1)
+        return self.date
+
+
+def make_db(path, **kwargs):
+    return FileDB(db_name=str(path), collection_names=COLLECTIONS, **kwargs)
+
+
+def reload(db):
+    """ Forget the shared collection state, like a new process would """
+    with database._file_collections_lock:
+        for key in [k for k in database._file_collections if k[0] == os.path.abspath(db.db_folder)]:
+            database._file_collections.pop(key).forget()
+
+
+@pytest.fixture
+def dated(monkeypatch):
+    time_service = FixedTimeService()
+    monkeypatch.setattr(database, "create_storage_obj",
+                        lambda collection, data, obj_id=None, serv_time=None: dict(
+                            data=data, type=collection, date=time_service.get_utc(), _id=obj_id))
+    return time_service
+
+
+def test_insert_find(tmp_path, dated):
+    db = make_db(tmp_path, flush_interval_sec=60)
+    ids = [db.insert('weather', {'index': i}) for i in range(100)]
+    state_id = db.insert_current('state', {'source': 'ready', 'dest': 'scheduling'})
+    # Buffered records are visible before they are written
+    assert not os.path.exists(db.get_file('weather'))
+    assert db.find('weather', ids[42])['data'] == {'index': 42}
+    assert db.get_current('state')['data']['dest'] == 'scheduling'
+
+    # Other FileDB instances share the same buffer
+    other = make_db(tmp_path)
+    assert other.find('state', state_id)['data']['source'] == 'ready'
+
+    db.flush()
+    assert db.find('weather', ids[42])['data'] == {'index': 42}
+    assert db.find('weather', 'unknown') is None
+    reload(db)
+    db = make_db(tmp_path)
+    assert [db.find('weather', i)['data']['index'] for i in ids] == list(range(100))
+    assert db.find('state', state_id)['_id'] == state_id
+
+
+def test_find_range(tmp_path, dated):
+    db = make_db(tmp_path, flush_interval_sec=60)
+    start = dated.date
+    for i in range(50):
+        db.insert('weather', {'index': i})
+    db.flush()
+    for i in range(50, 60):
+        db.insert('weather', {'index': i})
+    records = db.find_range('weather', start + datetime.timedelta(minutes=45),
+                            start + datetime.timedelta(minutes=55))
+    # Written and buffered records, sorted by date
+    assert [r['data']['index'] for r in records] == list(range(44, 55))
+    assert db.find_range('weather', start - datetime.timedelta(days=1), start) == []
+    # Dates read back from records, that only keep milliseconds, are valid bounds
+    db.insert_current('weather', {'index': 60})
+    end = db.get_current('weather')['date']
+    assert db.find_range('weather', end, end)[-1]['data']['index'] == 60
+
+
+def test_flush_interval(tmp_path, dated):
+    db = make_db(tmp_path, flush_interval_sec=0.05)
+    obj_id = db.insert('state', {'source': 'parked'})
+    end = time.monotonic() + 5
+    while not os.path.exists(db.get_file('state')):
+        assert time.monotonic() < end, "Buffered record never written"
+        time.sleep(0.01)
+    with open(db.get_file('state')) as f:
+        assert json_util.loads(f.readline())['_id'] == obj_id
+
+
+def test_rebuild_index(tmp_path, dated):
+    # Collection written by the former FileDB, without index
+    legacy_ids = []
+    for i in range(20):
+        obj = database.create_storage_obj('weather', {'index': i}, obj_id=f"legacy-{i}")
+        json_util.dumps_file(os.path.join(tmp_path, 'weather.json'), obj)
+        legacy_ids.append(obj['_id'])
+    db = make_db(tmp_path, flush_interval_sec=0)
+    assert db.find('weather', 'legacy-7')['data'] == {'index': 7}
+    new_id = db.insert('weather', {'index': 20})
+
+    # Records written after the last index update are indexed at load
+    with open(os.path.join(tmp_path, 'weather.index')) as f:
+        lines = f.readlines()
+    with open(os.path.join(tmp_path, 'weather.index'), 'w') as f:
+        f.writelines(lines[:10])
+    # and a truncated record, from an interrupted write, is ignored
+    with open(db.get_file('weather'), 'a') as f:
+        f.write('{"_id": "trunc')
+    reload(db)
+    db = make_db(tmp_path)
+    assert db.find('weather', 'legacy-15')['data'] == {'index': 15}
+    assert db.find('weather', new_id)['data'] == {'index': 20}
+
+    # An index that does not match the segments is rebuilt
+    os.remove(os.path.join(tmp_path, 'weather.json'))
+    obj = database.create_storage_obj('weather', {'index': 0}, obj_id="fresh")
+    json_util.dumps_file(os.path.join(tmp_path, 'weather.json'), obj)
+    reload(db)
+    db = make_db(tmp_path)
+    assert db.find('weather', 'legacy-15') is None
+    assert db.find('weather', 'fresh')['data'] == {'index': 0}
+
+
+def test_rotation(tmp_path, dated):
+    # About 10 records per segment
+    db = make_db(tmp_path, flush_interval_sec=0, max_segment_size_mb=1000 / 2**20)
+    start = dated.date
+    ids = [db.insert('observations', {'index': i}) for i in range(100)]
+    segments = sorted(f for f in os.listdir(tmp_path) if f.startswith('observations.'))
+    assert len(segments) > 5
+    assert all(os.path.getsize(os.path.join(tmp_path, s)) < 2000 for s in segments if s.endswith('.json'))
+    assert [db.find('observations', i)['data']['index'] for i in ids] == list(range(100))
+    records = db.find_range('observations', start, start + datetime.timedelta(minutes=100))
+    assert [r['data']['index'] for r in records] == list(range(100))
+
+    # The compacted index is used by a new process
+    reload(db)
+    db = make_db(tmp_path, retention_days=0)
+    assert db.find('observations', ids[3])['data'] == {'index': 3}
+
+    # Rotated segments past retention are removed
+    db.insert('observations', {'index': 100})
+    db.rotate('observations')
+    assert db.find('observations', ids[3]) is None
+    assert [f for f in os.listdir(tmp_path) if f.startswith('observations.')] == ['observations.index']
+
+
+def test_concurrent_writers(tmp_path):
+    db = make_db(tmp_path, flush_interval_sec=0.01, max_pending=50)
+    ids = {collection: [] for collection in COLLECTIONS}
+
+    def writer(collection):
+        for i in range(200):
+            ids[collection].append(make_db(tmp_path).insert(collection, {'index': i}))
+
+    threads = [threading.Thread(target=writer, args=(c,)) for c in COLLECTIONS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    db.flush()
+    reload(db)
+    db = make_db(tmp_path)
+    for collection in COLLECTIONS:
+        assert [db.find(collection, i)['data']['index'] for i in ids[collection]] == list(range(200))
+
+
+def write_records(path, first, last, rotate=False):
+    """ Writer process of test_other_process_writes """
+    db = make_db(path, flush_interval_sec=0)
+    for i in range(first, last):
+        db.insert('weather', {'index': i})
+    if rotate:
+        db.rotate('weather')
+
+
+def test_other_process_writes(tmp_path):
+    context = multiprocessing.get_context('spawn')
+
+    def write(*args):
+        process = context.Process(target=write_records, args=(tmp_path,) + args)
+        process.start()
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    def records():
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return db.find_range('weather', now - datetime.timedelta(days=1), now)
+
+    def indexes():
+        return sorted(r['data']['index'] for r in records())
+
+    write(0, 5)
+    db = make_db(tmp_path)
+    assert indexes() == list(range(5))
+    # Appended after the reader loaded the collection
+    write(5, 10)
+    assert indexes() == list(range(10))
+    last = records()[-1]
+    assert db.find('weather', last['_id']) == last
+    # Rotated, and appended to the new active segment
+    write(10, 15, True)
+    write(15, 20)
+    assert indexes() == list(range(20))
+
+
+@pytest.mark.slow
+def test_benchmark_find(tmp_path):
+    """ Indexed find against the former linear scan of the collection """
+    nb_records = 20000
+    db = make_db(tmp_path, flush_interval_sec=60, max_pending=nb_records)
+    start = time.perf_counter()
+    ids = [db.insert('weather', {'index': i, 'safe': True, 'sky_temp_C': -12.5}) for i in range(nb_records)]
+    db.flush()
+    insert_time = (time.perf_counter() - start) / nb_records
+
+    def legacy_find(obj_id):
+        with open(db.get_file('weather'), 'r') as f:
+            for line in f:
+                obj = json_util.loads(line)
+                if obj['_id'] == obj_id:
+                    return obj
+
+    targets = ids[-50:]
+    start = time.perf_counter()
+    for obj_id in targets:
+        legacy_find(obj_id)
+    legacy_time = (time.perf_counter() - start) / len(targets)
+    start = time.perf_counter()
+    for obj_id in targets:
+        db.find('weather', obj_id)
+    find_time = (time.perf_counter() - start) / len(targets)
+    logging.info(f"{nb_records} records: insert {insert_time * 1e6:.1f}us, find {find_time * 1e6:.1f}us, "
+                 f"legacy find {legacy_time * 1e3:.1f}ms")
+    assert find_time * 100 < legacy_time
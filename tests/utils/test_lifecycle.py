@@ -0,0 +1,114 @@
+# Basic stuff
+import logging
+import threading
+import time
+
+# Numerical stuff
+import pytest
+
+# Local stuff
+from utils import lifecycle
+from utils.lifecycle import LifecycleGraph
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s;%(levelname)s:%(message)s')
+
+
+class FakeDevice:
+    """ Records when it was parked, parking takes delay_s """
+    def __init__(self, name, delay_s=0.1, fail=False):
+        self.name = name
+        self.delay_s = delay_s
+        self.fail = fail
+        self.start = None
+        self.end = None
+
+    def park(self):
+        self.start = time.monotonic()
+        time.sleep(self.delay_s)
+        self.end = time.monotonic()
+        if self.fail:
+            raise RuntimeError(f"{self.name} failed")
+
+
+def park_graph(devices, continue_on_failure=True, mount_timeout_s=5):
+    graph = LifecycleGraph("park", continue_on_failure=continue_on_failure)
+    graph.add("guider", devices["guider"].park)
+    graph.add("camera", devices["camera"].park)
+    graph.add("mount", devices["mount"].park, timeout_s=mount_timeout_s)
+    graph.add("observatory", devices["observatory"].park,
+              depends_on=["guider", "camera", "mount"])
+    return graph
+
+
+def make_devices(**kwargs):
+    devices = {name: FakeDevice(name) for name in ("guider", "camera", "mount", "observatory")}
+    devices["mount"].delay_s = 0.3
+    for name, device in kwargs.items():
+        devices[name] = device
+    return devices
+
+
+def test_parallel_branches():
+    devices = make_devices()
+    report = park_graph(devices).run()
+    assert report.succeeded
+    # Independent branches overlap, observatory waits for all of them
+    assert devices["guider"].start < devices["mount"].end
+    assert devices["camera"].start < devices["mount"].end
+    assert devices["observatory"].start >= max(devices[n].end for n in ("guider", "camera", "mount"))
+    assert report.duration_s < 0.3 + 0.1 + 0.15
+    assert report.critical_path == ["mount", "observatory"]
+    assert "critical path: mount -> observatory" in str(report)
+
+
+def test_failure_policies():
+    devices = make_devices(camera=FakeDevice("camera", fail=True))
+    # Shutdown goes on after a failure
+    report = park_graph(devices).run()
+    assert not report.succeeded
+    assert report.steps["camera"].status == lifecycle.FAILED
+    assert report.steps["observatory"].status == lifecycle.DONE
+
+    # Startup skips what depends on a failed node
+    devices = make_devices(camera=FakeDevice("camera", fail=True))
+    report = park_graph(devices, continue_on_failure=False).run()
+    assert report.failed_steps == ["camera", "observatory"]
+    assert report.steps["observatory"].status == lifecycle.SKIPPED
+    assert devices["observatory"].start is None
+
+
+def test_timeout():
+    devices = make_devices(mount=FakeDevice("mount", delay_s=2))
+    start = time.monotonic()
+    report = park_graph(devices, mount_timeout_s=0.2).run()
+    assert time.monotonic() - start < 1
+    assert report.steps["mount"].status == lifecycle.TIMEOUT
+    assert report.steps["observatory"].status == lifecycle.DONE
+
+
+def test_readiness():
+    ready = threading.Event()
+    graph = LifecycleGraph("unpark")
+    graph.add("power", lambda: threading.Timer(0.2, ready.set).start(),
+              ready=ready.is_set, poll_interval_s=0.01)
+    graph.add("camera", lambda: None, depends_on=["power"])
+    report = graph.run()
+    assert report.succeeded
+    assert report.steps["camera"].start - report.steps["power"].start >= 0.2
+
+    graph = LifecycleGraph("unpark")
+    graph.add("power", lambda: None, ready=lambda: False, timeout_s=0.2)
+    report = graph.run()
+    assert report.steps["power"].status == lifecycle.TIMEOUT
+
+
+def test_invalid_graphs():
+    graph = LifecycleGraph("unpark")
+    graph.add("a", lambda: None, depends_on=["b"])
+    with pytest.raises(ValueError):
+        graph.run()
+    graph.add("b", lambda: None, depends_on=["a"])
+    with pytest.raises(ValueError):
+        graph.run()
+    with pytest.raises(ValueError):
+        graph.add("a", lambda: None)
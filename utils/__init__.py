@@ -5,6 +5,7 @@ import os
 import re
 import shutil
 import subprocess
+import threading
 import time
 
 # Astropy stuff
@@ -69,6 +70,46 @@ class Timeout(object):
         """Restart the timed duration."""
         self.target_time = time.monotonic() + self.duration
 
+
+class EventWaiter(object):
+    """Block until a producer notifies, or a timeout.
+
+    The standard library cannot wait on more than one event at once, so the
+    producers (camera processing, guider reader thread, ...) are given the
+    waiter and call `notify` explicitly, from any thread, once they changed
+    something the waiting thread should look at.
+
+    Usage:
+        waiter = EventWaiter()
+        start_producers(notifier=waiter)
+        while not all(event.is_set() for event in events):
+            waiter.wait(timeout=next_timer - time.monotonic())
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._notified = False
+
+    def notify(self, *args, **kwargs):
+        """Wake up the waiter, arguments are ignored so that it can be used as a callback."""
+        with self._condition:
+            self._notified = True
+            self._condition.notify_all()
+
+    def wait(self, timeout=None):
+        """Wait for a notification, return False if timeout expired first.
+
+        Pending notifications are consumed, so the caller should check the
+        state of all sources after each call.
+        """
+        if timeout is not None:
+            timeout = max(0, timeout)
+        with self._condition:
+            notified = self._condition.wait_for(lambda: self._notified, timeout)
+            self._notified = False
+        return notified
+
+
 def listify(obj):
     """ Given an object, return a list
 
@@ -1,10 +1,15 @@
 # Generic
 import abc
+import atexit
+import bisect
+import datetime
 from glob import glob
 import logging
 import os
 import pymongo
+import re
 import threading
+import time
 from uuid import uuid4
 from warnings import warn
 import weakref
@@ -115,6 +120,19 @@ class AbstractDB(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    def find_range(self, collection, start_date, end_date):
+        """Find the objects inserted between two dates.
+
+        Args:
+            collection (str): Collection to search for objects.
+            start_date, end_date (datetime.datetime): Inclusive bounds of the
+                `date` of the records, naive datetimes are UTC.
+
+        Returns:
+            list of dict: Objects sorted by date.
+        """
+        raise NotImplementedError
+
     @abc.abstractclassmethod
     def clear_current(self, type):
         """Clear the current record of a certain type
@@ -320,6 +338,8 @@ class DB():
             'mount',         # useles
             'observations',
             'offset_info',   # Legacy: Used to be there to store guiding delta info
+            'processing',    # Exposure processing pool metrics
+            'plate_solve',   # Plate solver metrics
             'state',
             'weather',
         ]
@@ -454,6 +474,11 @@ class MongoDB(AbstractDB):
         collection = getattr(self, collection)
         return collection.find_one({'_id': obj_id})
 
+    def find_range(self, collection, start_date, end_date):
+        collection = getattr(self, collection)
+        return list(collection.find(
+            {'date': {'$gte': start_date, '$lte': end_date}}).sort('date', 1))
+
     def clear_current(self, type):
         self.current.remove({'type': type})
 
@@ -463,18 +488,463 @@ class MongoDB(AbstractDB):
         pass
 
 
-class FileDB(AbstractDB):
-    """Stores collections as files of JSON records."""
+###############################################################################
+#    File implementation
+###############################################################################
+
+# (storage_dir, collection) -> _FileCollection, shared by all FileDB instances
+# as each Base object gets its own FileDB
+_file_collections = {}
+_file_collections_lock = threading.Lock()
+_flusher_thread = None
+_flusher_wakeup = threading.Event()
+
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def _date_to_timestamp(date):
+    """ Unix timestamp of a record date, naive datetimes are UTC
+
+    Serialized dates only keep milliseconds, so does the timestamp: the date of
+    a record read back from its file gives the same timestamp as when it was
+    inserted.
+    """
+    if isinstance(date, (int, float)):
+        return float(date)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=datetime.timezone.utc)
+    return ((date - _EPOCH) // datetime.timedelta(milliseconds=1)) / 1000
+
+
+def _get_file_collection(storage_dir, collection, **kwargs):
+    global _flusher_thread
+    key = (os.path.abspath(storage_dir), collection)
+    with _file_collections_lock:
+        file_collection = _file_collections.get(key)
+        if file_collection is None:
+            file_collection = _FileCollection(*key, **kwargs)
+            _file_collections[key] = file_collection
+            # The flush period might be shorter now
+            _flusher_wakeup.set()
+        if _flusher_thread is None:
+            _flusher_thread = threading.Thread(target=_flusher_loop,
+                                               name='FileDBFlusher',
+                                               daemon=True)
+            _flusher_thread.start()
+    return file_collection
+
+
+def _flusher_loop():
+    """ Periodically write the buffered records of all the collections """
+    while True:
+        with _file_collections_lock:
+            file_collections = list(_file_collections.values())
+        period = min([c.flush_interval_sec for c in file_collections
+                      if c.flush_interval_sec > 0], default=1.0)
+        _flusher_wakeup.wait(period)
+        _flusher_wakeup.clear()
+        for file_collection in file_collections:
+            try:
+                file_collection.flush(only_if_due=True)
+            except Exception as e:
+                file_collection.logger.warning(
+                    f"Problem writing collection {file_collection.name}: {e}")
 
-    __db_thread_lock = threading.Lock()
 
-    def thread_safe(func):
-        def function_wrapper(*args, **kwargs):
-            with FileDB.__db_thread_lock:
-                return func(*args, **kwargs)
-        return function_wrapper
+def flush_file_collections():
+    """ Write the buffered records of all the FileDB collections """
+    with _file_collections_lock:
+        file_collections = list(_file_collections.values())
+    for file_collection in file_collections:
+        file_collection.flush()
 
-    def __init__(self, db_name='remote_observatory_file_db', **kwargs):
+
+atexit.register(flush_file_collections)
+
+
+class _FileCollection:
+    """ Append only JSON lines log of a collection, with a sidecar index
+
+    Records are buffered in memory and written in batches, followed by an
+    fsync, either every flush_interval_sec by a background thread or as soon as
+    max_pending records are waiting. Buffered records are visible to find.
+
+    The active segment is <collection>.json. It is rotated to
+    <collection>.<first record date>.json when it gets bigger than
+    max_segment_size_mb or older than max_segment_age_days. Segments older
+    than retention_days, if set, are deleted at rotation.
+
+    The sidecar <collection>.index has one line per record:
+        obj_id<TAB>segment<TAB>offset<TAB>length<TAB>date timestamp
+    It is only appended to after the records are written, and rewritten
+    (compacted) at rotation. It is rebuilt from the segments when it is
+    missing or does not match them, and records written after the last index
+    update are indexed again when the collection is loaded.
+
+    A collection must only be written by a single process: record offsets
+    come from f.tell() of this process, so records appended by another one
+    in the meantime corrupt the index. Other processes may read the
+    collection: before each find, records appended to the active segment since
+    it was indexed are indexed, and the collection is loaded again when it was
+    rotated or its index rewritten.
+    """
+
+    def __init__(self, storage_dir, name, flush_interval_sec=1.0,
+                 max_pending=1000, fsync=True, max_segment_size_mb=64,
+                 max_segment_age_days=30, retention_days=None, logger=None):
+        self.storage_dir = storage_dir
+        self.name = name
+        self.flush_interval_sec = flush_interval_sec
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.max_segment_size = max_segment_size_mb * 1024 * 1024
+        self.max_segment_age_sec = max_segment_age_days * 86400
+        self.retention_sec = (retention_days * 86400
+                              if retention_days is not None else None)
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.RLock()
+
+        self.active_segment = f"{name}.json"
+        self.index_path = os.path.join(storage_dir, f"{name}.index")
+        # obj_id -> (segment, offset, length)
+        self._index = {}
+        # Sorted record dates, and matching (segment, offset, length)
+        self._dates = []
+        self._date_entries = []
+        # Indexed size of the active segment, and date of its first record
+        self._active_size = 0
+        self._active_first_date = None
+        # Inodes of the active segment and of the index, to detect rotations
+        self._active_ino = None
+        self._index_ino = None
+        # Records waiting to be written: obj_id -> (line, date timestamp)
+        self._pending = {}
+        self._oldest_pending_time = None
+        with self.lock:
+            self._load()
+
+    def insert(self, obj_id, line, date):
+        """ Buffer a serialized record (str without end of line) """
+        with self.lock:
+            if not self._pending:
+                self._oldest_pending_time = time.monotonic()
+            self._pending[obj_id] = (line.encode() + b"\n",
+                                     _date_to_timestamp(date))
+            if (self.flush_interval_sec <= 0 or
+                    len(self._pending) >= self.max_pending):
+                self.flush()
+
+    def find(self, obj_id):
+        with self.lock:
+            self._refresh()
+            pending = self._pending.get(obj_id)
+            if pending is not None:
+                return json_util.loads(pending[0])
+            entry = self._index.get(obj_id)
+            if entry is None:
+                return None
+            return self._read_entries([entry])[0]
+
+    def find_range(self, start, end):
+        """ Records with start <= date <= end, sorted by date """
+        start, end = _date_to_timestamp(start), _date_to_timestamp(end)
+        with self.lock:
+            self._refresh()
+            first = bisect.bisect_left(self._dates, start)
+            last = bisect.bisect_right(self._dates, end)
+            records = self._read_entries(self._date_entries[first:last])
+            pending = sorted((date, line) for line, date in
+                             self._pending.values() if start <= date <= end)
+        records.extend(json_util.loads(line) for _, line in pending)
+        return records
+
+    def flush(self, only_if_due=False):
+        with self.lock:
+            if not self._pending:
+                return
+            if only_if_due and (time.monotonic() - self._oldest_pending_time
+                                < self.flush_interval_sec):
+                return
+            segment_path = os.path.join(self.storage_dir, self.active_segment)
+            index_lines = []
+            with open(segment_path, 'ab') as f:
+                offset = f.tell()
+                for obj_id, (line, date) in self._pending.items():
+                    f.write(line)
+                    self._add_entry(obj_id, self.active_segment, offset,
+                                    len(line), date)
+                    index_lines.append(self._index_line(
+                        obj_id, self.active_segment, offset, len(line), date))
+                    offset += len(line)
+                f.flush()
+                if self.fsync:
+                    os.fsync(f.fileno())
+                self._active_ino = os.fstat(f.fileno()).st_ino
+            self._active_size = offset
+            with open(self.index_path, 'a') as f:
+                f.write(''.join(index_lines))
+                self._index_ino = os.fstat(f.fileno()).st_ino
+            self._pending = {}
+            if self._rotation_due():
+                self.rotate()
+
+    def rotate(self):
+        """ Close the active segment, and compact the index """
+        with self.lock:
+            if self._active_size == 0:
+                return
+            stamp = datetime.datetime.fromtimestamp(
+                self._active_first_date, datetime.timezone.utc)
+            segment = f"{self.name}.{stamp:%Y%m%dT%H%M%S}.json"
+            count = 0
+            while os.path.exists(os.path.join(self.storage_dir, segment)):
+                count += 1
+                segment = f"{self.name}.{stamp:%Y%m%dT%H%M%S}_{count}.json"
+            os.replace(os.path.join(self.storage_dir, self.active_segment),
+                       os.path.join(self.storage_dir, segment))
+            self.logger.debug(f"Rotated collection {self.name} to {segment}")
+            self._active_size = 0
+            self._active_first_date = None
+            self._active_ino = None
+            self._rename_segment(self.active_segment, segment)
+            if self.retention_sec is not None:
+                self._drop_segments_before(time.time() - self.retention_sec)
+            self._write_index()
+
+    def segments(self):
+        """ Segment file names, oldest first, the active one last """
+        pattern = re.compile(rf"^{re.escape(self.name)}\.(\d{{8}}T\d{{6}})(?:_(\d+))?\.json$")
+        rotated = []
+        for f in os.listdir(self.storage_dir):
+            match = pattern.match(f)
+            if match:
+                rotated.append((match.group(1), int(match.group(2) or 0), f))
+        return [f for _, _, f in sorted(rotated)] + [self.active_segment]
+
+    def forget(self):
+        """ Drop the buffered records and the in-memory index """
+        with self.lock:
+            self._pending = {}
+            self._index = {}
+            self._dates, self._date_entries = [], []
+
+    def _rotation_due(self):
+        if self._active_size >= self.max_segment_size:
+            return True
+        return (self._active_first_date is not None and
+                time.time() - self._active_first_date >=
+                self.max_segment_age_sec)
+
+    def _add_entry(self, obj_id, segment, offset, length, date):
+        entry = (segment, offset, length)
+        self._index[obj_id] = entry
+        # Records are mostly appended in chronological order
+        if not self._dates or date >= self._dates[-1]:
+            self._dates.append(date)
+            self._date_entries.append(entry)
+        else:
+            position = bisect.bisect_right(self._dates, date)
+            self._dates.insert(position, date)
+            self._date_entries.insert(position, entry)
+        if segment == self.active_segment and (
+                self._active_first_date is None or
+                date < self._active_first_date):
+            self._active_first_date = date
+
+    def _read_entries(self, entries):
+        records = []
+        handles = {}
+        try:
+            for segment, offset, length in entries:
+                f = handles.get(segment)
+                if f is None:
+                    f = open(os.path.join(self.storage_dir, segment), 'rb')
+                    handles[segment] = f
+                f.seek(offset)
+                records.append(json_util.loads(f.read(length)))
+        finally:
+            for f in handles.values():
+                f.close()
+        return records
+
+    @staticmethod
+    def _index_line(obj_id, segment, offset, length, date):
+        return f"{obj_id}\t{segment}\t{offset}\t{length}\t{date!r}\n"
+
+    def _write_index(self):
+        entries = sorted(
+            ((segment, offset, length, obj_id) for obj_id, (segment, offset, length)
+             in self._index.items()))
+        dates = {entry: date for date, entry
+                 in zip(self._dates, self._date_entries)}
+        part_path = self.index_path + '.part'
+        with open(part_path, 'w') as f:
+            for segment, offset, length, obj_id in entries:
+                f.write(self._index_line(obj_id, segment, offset, length,
+                                         dates[(segment, offset, length)]))
+        os.replace(part_path, self.index_path)
+        self._index_ino = os.stat(self.index_path).st_ino
+
+    def _rename_segment(self, old, new):
+        rename = lambda entry: (new,) + entry[1:] if entry[0] == old else entry
+        self._index = {k: rename(v) for k, v in self._index.items()}
+        self._date_entries = [rename(e) for e in self._date_entries]
+
+    def _drop_segments_before(self, limit):
+        """ Delete the rotated segments whose records are all older than limit """
+        last_dates = {}
+        for date, (segment, _, _) in zip(self._dates, self._date_entries):
+            last_dates[segment] = date
+        expired = {segment for segment, date in last_dates.items()
+                   if date < limit and segment != self.active_segment}
+        if not expired:
+            return
+        for segment in expired:
+            os.remove(os.path.join(self.storage_dir, segment))
+            self.logger.debug(f"Removed expired segment {segment}")
+        self._index = {k: v for k, v in self._index.items()
+                       if v[0] not in expired}
+        kept = [(d, e) for d, e in zip(self._dates, self._date_entries)
+                if e[0] not in expired]
+        self._dates = [d for d, _ in kept]
+        self._date_entries = [e for _, e in kept]
+
+    def _refresh(self):
+        """ Index the records written by another process since the last load """
+        active_ino, active_size = self._file_stat(self.active_segment)
+        index_ino, _ = self._file_stat(self.index_path)
+        if (index_ino != self._index_ino or active_size < self._active_size or
+                (active_ino != self._active_ino and self._active_size > 0)):
+            # Rotated, or index rebuilt
+            self._index = {}
+            self._dates, self._date_entries = [], []
+            self._active_first_date = None
+            self._load(update_index=False)
+        elif active_size > self._active_size:
+            # Records appended, the last one might still be being written
+            _, self._active_size = self._scan_segment(
+                self.active_segment, self._active_size, partial=True)
+            self._active_ino = active_ino
+
+    def _file_stat(self, name):
+        """ Inode and size of a file of the collection, None and 0 if missing """
+        try:
+            stat = os.stat(os.path.join(self.storage_dir, name))
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def _load(self, update_index=True):
+        """ Load the sidecar index, and index records that are missing
+
+        The new index lines are only written if update_index is set.
+        """
+        self._index_ino, _ = self._file_stat(self.index_path)
+        self._active_ino, _ = self._file_stat(self.active_segment)
+        segments = self.segments()
+        sizes = {}
+        for segment in segments:
+            try:
+                sizes[segment] = os.path.getsize(
+                    os.path.join(self.storage_dir, segment))
+            except FileNotFoundError:
+                sizes[segment] = 0
+        indexed_ends = {}
+        consistent = True
+        try:
+            with open(self.index_path, 'r') as f:
+                for line in f:
+                    try:
+                        obj_id, segment, offset, length, date = \
+                            line.rstrip('\n').split('\t')
+                        offset, length = int(offset), int(length)
+                        date = float(date)
+                    except ValueError:
+                        # Partially written last line
+                        continue
+                    end = offset + length
+                    if end > sizes.get(segment, 0):
+                        consistent = False
+                        break
+                    self._add_entry(obj_id, segment, offset, length, date)
+                    indexed_ends[segment] = max(indexed_ends.get(segment, 0),
+                                                end)
+        except FileNotFoundError:
+            consistent = not any(sizes.values())
+        if not consistent:
+            self.logger.warning(f"Rebuilding index of collection {self.name}")
+            self.forget()
+            self._active_first_date = None
+            indexed_ends = {}
+        # Index the records that are not referenced by the index yet
+        index_lines = []
+        for segment in segments:
+            if indexed_ends.get(segment, 0) < sizes[segment]:
+                lines, indexed_ends[segment] = self._scan_segment(
+                    segment, indexed_ends.get(segment, 0))
+                index_lines += lines
+        self._active_size = indexed_ends.get(self.active_segment, 0)
+        if not update_index:
+            return
+        if not consistent:
+            self._write_index()
+        elif index_lines:
+            with open(self.index_path, 'a') as f:
+                f.write(''.join(index_lines))
+
+    def _scan_segment(self, segment, offset, partial=False):
+        """ Index the records of segment, starting at byte offset
+
+        Returns the index lines, and the offset after the last complete
+        record. A truncated last record is expected if partial is set.
+        """
+        index_lines = []
+        path = os.path.join(self.storage_dir, segment)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    if not partial:
+                        # Truncated record, from an interrupted write
+                        self.logger.warning(f"Ignoring truncated record at "
+                                            f"{path}:{offset}")
+                    break
+                try:
+                    obj = json_util.loads(line)
+                    obj_id, date = str(obj['_id']), _date_to_timestamp(obj['date'])
+                except Exception as e:
+                    self.logger.warning(f"Ignoring invalid record at {path}:"
+                                        f"{offset}: {e}")
+                else:
+                    self._add_entry(obj_id, segment, offset, len(line), date)
+                    index_lines.append(self._index_line(
+                        obj_id, segment, offset, len(line), date))
+                offset += len(line)
+        return index_lines, offset
+
+
+class FileDB(AbstractDB):
+    """Stores collections as files of JSON records.
+
+    Collections are append only logs, see _FileCollection. The state of each
+    collection (lock, write buffer and index) is shared by all the FileDB
+    instances of the same storage directory, within one process: a collection
+    must not be written from several processes. Optional settings, from the `db`
+    section of the configuration:
+        flush_interval_sec: 1, delay before buffered records are written, 0
+            to write them synchronously
+        max_pending: 1000, number of buffered records that triggers a write
+        fsync: true
+        max_segment_size_mb: 64
+        max_segment_age_days: 30
+        retention_days: null, delete rotated segments older than that
+    """
+
+    def __init__(self, db_name='remote_observatory_file_db',
+                 flush_interval_sec=1.0, max_pending=1000, fsync=True,
+                 max_segment_size_mb=64, max_segment_age_days=30,
+                 retention_days=None, **kwargs):
         """Flat file storage for json records
 
         This will simply store each json record inside a file corresponding
@@ -491,73 +961,97 @@ class FileDB(AbstractDB):
         # Set up storage directory.
         self._storage_dir = self.db_folder
         os.makedirs(self._storage_dir, exist_ok=True)
+        self._collection_options = dict(
+            flush_interval_sec=flush_interval_sec,
+            max_pending=max_pending,
+            fsync=fsync,
+            max_segment_size_mb=max_segment_size_mb,
+            max_segment_age_days=max_segment_age_days,
+            retention_days=retention_days,
+            logger=self.logger)
+
+    def get_collection(self, collection):
+        """ Shared _FileCollection storing collection """
+        return _get_file_collection(self._storage_dir, collection,
+                                    **self._collection_options)
 
-    @thread_safe
     def insert_current(self, collection, obj, store_permanently=True):
         self.validate_collection(collection)
         obj_id = self._make_id()
         obj = create_storage_obj(collection, obj, obj_id=obj_id)
-        current_fn = self.get_file(collection, permanent=False)
-        result = obj_id
+        file_collection = self.get_collection(collection)
         try:
-            # Overwrite current collection file with obj.
-            json_util.dumps_file(current_fn, obj, clobber=True)
+            line = json_util.dumps(obj)
         except Exception as e:
             self._warn(f"Problem inserting object into current collection: "
                        f"{e}, {obj}")
-            result = None
+            return None
+        current_fn = self.get_file(collection, permanent=False)
+        result = obj_id
+        with file_collection.lock:
+            try:
+                # Overwrite current collection file with obj.
+                part_fn = current_fn + '.part'
+                with open(part_fn, 'w') as f:
+                    f.write(line + "\n")
+                os.replace(part_fn, current_fn)
+            except Exception as e:
+                self._warn(f"Problem inserting object into current collection: "
+                           f"{e}, {obj}")
+                result = None
 
-        if not store_permanently:
-            return result
+            if not store_permanently:
+                return result
 
-        collection_fn = self.get_file(collection)
-        try:
-            # Append obj to collection file.
-            json_util.dumps_file(collection_fn, obj)
-            return obj_id
-        except Exception as e:
-            self._warn('Problem inserting object into collection: '
-                       '{}, {!r}'.format(e, obj))
-            return None
+            try:
+                # Append obj to collection file.
+                file_collection.insert(obj_id, line, obj['date'])
+                return obj_id
+            except Exception as e:
+                self._warn('Problem inserting object into collection: '
+                           '{}, {!r}'.format(e, obj))
+                return None
 
-    @thread_safe
     def insert(self, collection, obj):
         self.validate_collection(collection)
         obj_id = self._make_id()
         obj = create_storage_obj(collection, obj, obj_id=obj_id)
-        collection_fn = self.get_file(collection)
         try:
             # Insert record into file
-            json_util.dumps_file(collection_fn, obj)
+            self.get_collection(collection).insert(
+                obj_id, json_util.dumps(obj), obj['date'])
             return obj_id
         except Exception as e:
             self._warn(f"Problem inserting object {obj} into collection: {collection}: {e}")
             return None
 
-    @thread_safe
     def get_current(self, collection):
         current_fn = self.get_file(collection, permanent=False)
-        try:
-            return json_util.loads_file(current_fn)
-        except FileNotFoundError as e:
-            self._warn(f"No record found for collection {collection}")
-            return None
+        with self.get_collection(collection).lock:
+            try:
+                return json_util.loads_file(current_fn)
+            except FileNotFoundError as e:
+                self._warn(f"No record found for collection {collection}")
+                return None
 
-    @thread_safe
     def find(self, collection, obj_id):
-        collection_fn = self.get_file(collection)
-        with open(collection_fn, 'r') as f:
-            for line in f:
-                # Note: We can speed this up for the case where the obj_id
-                # doesn't contain any characters that json would need to escape
-                # first check if the line contains the obj_id; if not skip.
-                # Else, parse as json, and then check for the _id match.
-                obj = json_util.loads(line)
-                if obj['_id'] == obj_id:
-                    return obj
-        return None
+        return self.get_collection(collection).find(obj_id)
+
+    def find_range(self, collection, start_date, end_date):
+        return self.get_collection(collection).find_range(start_date, end_date)
+
+    def flush(self):
+        """Write the buffered records of all collections to disk."""
+        for collection in self.collection_names:
+            self.get_collection(collection).flush()
+
+    def rotate(self, collection):
+        """Force the rotation of the active segment of collection."""
+        file_collection = self.get_collection(collection)
+        with file_collection.lock:
+            file_collection.flush()
+            file_collection.rotate()
 
-    @thread_safe
     def clear_current(self, type):
         current_f = os.path.join(self._storage_dir, f"current_{type}.json")
         try:
@@ -577,11 +1071,16 @@ class FileDB(AbstractDB):
 
     @classmethod
     def permanently_erase_database(cls, db_name):
-        with cls.__db_thread_lock:
-            # Clear out any .json files.
-            storage_dir = os.path.join(os.environ['PANDIR'], 'json_store', db_name)
-            for f in glob(os.path.join(storage_dir, '*.json')):
-                os.remove(f)
+        # Clear out any .json files.
+        storage_dir = os.path.join(os.environ['PANDIR'], 'json_store', db_name)
+        with _file_collections_lock:
+            for key in [k for k in _file_collections
+                        if k[0] == os.path.abspath(storage_dir)]:
+                _file_collections.pop(key).forget()
+        for f in glob(os.path.join(storage_dir, '*.json')):
+            os.remove(f)
+        for f in glob(os.path.join(storage_dir, '*.index')):
+            os.remove(f)
 
 
 class MemoryDB(AbstractDB):
@@ -661,6 +1160,15 @@ class MemoryDB(AbstractDB):
             obj = json_util.loads(obj)
         return obj
 
+    def find_range(self, collection, start_date, end_date):
+        start, end = _date_to_timestamp(start_date), _date_to_timestamp(end_date)
+        with self.lock:
+            objs = list(self.collections.get(collection, {}).values())
+        objs = [json_util.loads(obj) for obj in objs]
+        objs = [obj for obj in objs
+                if start <= _date_to_timestamp(obj['date']) <= end]
+        return sorted(objs, key=lambda obj: _date_to_timestamp(obj['date']))
+
     def clear_current(self, type):
         try:
             del self.current['type']
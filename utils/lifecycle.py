@@ -0,0 +1,225 @@
+# Generic stuff
+import logging
+import time
+
+# Asynchronous stuff
+import threading
+
+# Local
+from utils import error
+
+DONE = 'done'
+FAILED = 'failed'
+TIMEOUT = 'timeout'
+SKIPPED = 'skipped'
+
+
+def wait_until(predicate, timeout_s, poll_interval_s=0.1, max_poll_interval_s=2):
+    """ Poll predicate, with exponential backoff, until it returns True
+
+    Raises:
+        error.Timeout: predicate did not become True within timeout_s
+    """
+    deadline = time.monotonic() + timeout_s
+    interval = poll_interval_s
+    while not predicate():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise error.Timeout(f"Not ready after {timeout_s}s")
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_poll_interval_s)
+
+
+class LifecycleStep:
+    """ Result of one node of a LifecycleGraph run """
+
+    def __init__(self, name):
+        self.name = name
+        self.status = None
+        self.error = None
+        self.start = None
+        self.end = None
+        # dependency whose completion allowed this step to start
+        self.gated_by = None
+
+    @property
+    def duration_s(self):
+        if self.start is None or self.end is None:
+            return 0.
+        return self.end - self.start
+
+    def __repr__(self):
+        return f"LifecycleStep({self.name}, {self.status}, {self.duration_s:.2f}s)"
+
+
+class LifecycleReport:
+    """ Timing report of a LifecycleGraph run """
+
+    def __init__(self, name, steps, start, end):
+        self.name = name
+        self.steps = steps
+        self.start = start
+        self.end = end
+
+    @property
+    def duration_s(self):
+        return self.end - self.start
+
+    @property
+    def succeeded(self):
+        return all(step.status == DONE for step in self.steps.values())
+
+    @property
+    def failed_steps(self):
+        return [name for name, step in self.steps.items() if step.status != DONE]
+
+    @property
+    def critical_path(self):
+        """ Chain of steps that ended last, each one gated by the previous """
+        ended = [step for step in self.steps.values() if step.end is not None]
+        if not ended:
+            return []
+        path = [max(ended, key=lambda step: step.end)]
+        while path[-1].gated_by is not None:
+            path.append(self.steps[path[-1].gated_by])
+        return [step.name for step in reversed(path)]
+
+    def __str__(self):
+        lines = [f"{self.name} took {self.duration_s:.2f}s, critical path: "
+                 f"{' -> '.join(self.critical_path)}"]
+        for step in sorted(self.steps.values(), key=lambda s: (s.start is None, s.start)):
+            offset = 0. if step.start is None else step.start - self.start
+            lines.append(f"  {step.name:<30} {step.status:<8} start +{offset:6.2f}s "
+                         f"duration {step.duration_s:6.2f}s"
+                         + (f" ({step.error})" if step.error else ""))
+        return "\n".join(lines)
+
+
+class LifecycleGraph:
+    """
+    Runs device startup or shutdown actions as a dependency graph
+
+    Each node is an action that starts, in its own thread, as soon as all of
+    the nodes it depends on are over, so that independent branches run in
+    parallel. A node can also declare a readiness predicate, polled after
+    the action returns, instead of sleeping a fixed delay. Action and
+    readiness check must be over within the node timeout.
+
+    With continue_on_failure, a failed node still releases its dependents,
+    which is what we want when shutting down. Otherwise, the dependents of a
+    failed node are skipped.
+    """
+
+    def __init__(self, name, continue_on_failure=False):
+        self.name = name
+        self.continue_on_failure = continue_on_failure
+        self.logger = logging.getLogger(__name__)
+        self._nodes = {}
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def add(self, name, action, depends_on=(), timeout_s=60, ready=None,
+            poll_interval_s=0.1):
+        """ Add a node
+
+        Args:
+            name (str): unique node name
+            action (callable): called without arguments
+            depends_on (iterable): names of the nodes to wait for, they may be
+                added later
+            timeout_s (float): maximum time for the action and readiness check
+            ready (callable): predicate polled once action returned
+        """
+        if name in self._nodes:
+            raise ValueError(f"Node {name} already in {self.name}")
+        self._nodes[name] = dict(action=action, depends_on=tuple(depends_on),
+                                 timeout_s=timeout_s, ready=ready,
+                                 poll_interval_s=poll_interval_s)
+
+    def _check(self):
+        for name, node in self._nodes.items():
+            unknown = [d for d in node['depends_on'] if d not in self._nodes]
+            if unknown:
+                raise ValueError(f"Node {name} depends on unknown nodes {unknown}")
+        # Kahn's algorithm, anything left has a cycle
+        remaining = {name: set(node['depends_on']) for name, node in self._nodes.items()}
+        while remaining:
+            roots = [name for name, deps in remaining.items() if not deps]
+            if not roots:
+                raise ValueError(f"Dependency cycle between {sorted(remaining)}")
+            for name in roots:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(roots)
+
+    def _run_node(self, name, step, condition):
+        node = self._nodes[name]
+        status, err = DONE, None
+        try:
+            node['action']()
+            if node['ready'] is not None:
+                remaining = node['timeout_s'] - (time.monotonic() - step.start)
+                wait_until(node['ready'], max(remaining, 0),
+                           poll_interval_s=node['poll_interval_s'])
+        except error.Timeout as e:
+            status, err = TIMEOUT, e
+        except Exception as e:
+            status, err = FAILED, e
+        with condition:
+            # A node that timed out is already over for the scheduler
+            if step.status is None:
+                step.status, step.error, step.end = status, err, time.monotonic()
+                condition.notify_all()
+
+    def run(self):
+        """ Run all nodes, returns when all are over or timed out
+
+        Returns:
+            LifecycleReport
+        """
+        self._check()
+        condition = threading.Condition()
+        steps = {name: LifecycleStep(name) for name in self._nodes}
+        pending = dict(self._nodes)
+        running = {}
+        start = time.monotonic()
+
+        with condition:
+            while pending or running:
+                now = time.monotonic()
+                for name, deadline in list(running.items()):
+                    step = steps[name]
+                    if step.status is None and now >= deadline:
+                        step.status, step.end = TIMEOUT, now
+                        step.error = f"timeout after {self._nodes[name]['timeout_s']}s"
+                    if step.status is not None:
+                        del running[name]
+                        if step.status != DONE:
+                            self.logger.error(f"{self.name}: {name} {step.status}: {step.error}")
+                for name, node in list(pending.items()):
+                    deps = [steps[d] for d in node['depends_on']]
+                    if any(dep.status is None for dep in deps):
+                        continue
+                    del pending[name]
+                    step = steps[name]
+                    step.gated_by = max(deps, key=lambda d: d.end).name if deps else None
+                    if not self.continue_on_failure and any(d.status != DONE for d in deps):
+                        step.status, step.start = SKIPPED, now
+                        step.end = now
+                        step.error = "dependency failed"
+                        continue
+                    step.start = now
+                    running[name] = now + node['timeout_s']
+                    threading.Thread(target=self._run_node, args=(name, step, condition),
+                                     name=f"{self.name}-{name}", daemon=True).start()
+                if any(steps[name].status is not None for name in running):
+                    continue
+                if not running:
+                    # Only skipped nodes were released, schedule again
+                    continue
+                condition.wait(timeout=max(min(running.values()) - time.monotonic(), 0))
+
+        report = LifecycleReport(self.name, steps, start, time.monotonic())
+        self.logger.info(str(report))
+        return report